@@ -0,0 +1,410 @@
+#!/usr/bin/env python
+"""End-to-end benchmarks of pyipmi against the local emulator.
+
+Starts a virtual BMC of `pyipmi.simulator` on loopback and measures the
+main operations through the `Rmcp` interface: session establishment,
+sensor sweep, SDR dump, FRU read, SEL read and HPM upload. The `Message`
+encode and decode micro benchmarks run without the emulator.
+
+The emulated data is generated with fixed sizes and constant sensor
+readings, so the results of different commits can be compared. The
+results are written as JSON with --output; --compare checks them against
+the results of an earlier run and fails if a benchmark got slower by more
+than --threshold:
+
+    python benchmarks/emulator_suite.py --output base.json
+    python benchmarks/emulator_suite.py --compare base.json
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import platform
+import struct
+import subprocess
+import sys
+import threading
+import time
+from collections import OrderedDict
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+from pyipmi.fleet import Fleet  # noqa: E402
+from pyipmi.hpm import UPLOAD_BLOCK_OVERHEAD  # noqa: E402
+from pyipmi.msgs import (create_request_by_name,  # noqa: E402
+                         create_response_by_name, decode_message,
+                         encode_message)
+from pyipmi.sdr import SdrCommon  # noqa: E402
+from pyipmi.sensorsim import Constant  # noqa: E402
+from pyipmi.simulator import BmcData, FleetSimulator  # noqa: E402
+from pyipmi.sweep import SensorSweeper  # noqa: E402
+
+FRU_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..',
+                        'tests', 'fru_bin', 'kontron_am4010.bin')
+
+SCHEMA_VERSION = 1
+
+
+def full_sensor_record(record_id, number):
+    """Return a temperature sensor with upper thresholds."""
+    name = ('Temp %d' % number).encode()
+    data = bytearray(48)
+    data[0:5] = (record_id & 0xff, record_id >> 8, 0x51, 0x01,
+                 43 + len(name))
+    data[5] = 0x20                  # owner id
+    data[7] = number
+    data[11] = 0x48                 # thresholds readable
+    data[12] = 0x01                 # temperature
+    data[13] = 0x01                 # threshold based
+    data[18] = 0x18                 # unc and ucr readable
+    data[24] = 1                    # M
+    data[34] = 0xff                 # sensor maximum reading
+    data[37] = 110                  # ucr
+    data[38] = 100                  # unc
+    data[47] = 0xc0 | len(name)
+    return SdrCommon.from_data(bytes(data) + name)
+
+
+def sel_record(record_id):
+    return struct.pack('<HBIHBBBBBBB', record_id, 0x02, 0x5b000000 + record_id,
+                       0x0020, 0x04, 0x01, record_id & 0xff, 0x01, 0x57,
+                       0x70, 0x6e)
+
+
+def create_data(sensors, sel_entries):
+    data = BmcData()
+    for record_id in range(1, sensors + 1):
+        data.sdr_list[record_id] = full_sensor_record(record_id, record_id)
+    for record_id in range(1, sel_entries + 1):
+        data.sel_list[record_id] = sel_record(record_id)
+    with open(FRU_FILE, 'rb') as f:
+        data.fru_data[0] = f.read()
+    return data
+
+
+class SimulatorThread(object):
+    """Run the simulator in an event loop of its own thread."""
+
+    def __init__(self, simulator):
+        self.simulator = simulator
+        self.loop = asyncio.new_event_loop()
+        self.started = threading.Event()
+        self.thread = threading.Thread(target=self._run)
+        self.thread.daemon = True
+        self.thread.start()
+        self.started.wait(5)
+
+    def _run(self):
+        asyncio.set_event_loop(self.loop)
+        self.loop.run_until_complete(self.simulator.start())
+        self.started.set()
+        self.loop.run_forever()
+
+    def stop(self):
+        async def stop():
+            self.simulator.stop()
+            await asyncio.sleep(0.01)
+        asyncio.run_coroutine_threadsafe(stop(), self.loop).result(5)
+        self.loop.call_soon_threadsafe(self.loop.stop)
+        self.thread.join(5)
+
+
+def percentile(samples, fraction):
+    samples = sorted(samples)
+    index = min(len(samples) - 1, int(round(fraction * (len(samples) - 1))))
+    return samples[index]
+
+
+def measure(fn, min_time, min_rounds, loops=1):
+    """Call `fn` `loops` times per round until both `min_time` seconds and
+    `min_rounds` rounds have passed. Return the seconds per call of each
+    round."""
+    samples = []
+    start = time.perf_counter()
+    while len(samples) < min_rounds or \
+            time.perf_counter() - start < min_time:
+        t = time.perf_counter()
+        for _ in range(loops):
+            fn()
+        samples.append((time.perf_counter() - t) / loops)
+    return samples
+
+
+def calibrate(fn, target=0.01):
+    """Return the loops of `fn` taking about `target` seconds."""
+    loops = 1
+    while True:
+        t = time.perf_counter()
+        for _ in range(loops):
+            fn()
+        if time.perf_counter() - t >= target:
+            return loops
+        loops *= 2
+
+
+def summarize(samples, items=1, requests=None):
+    """Return the statistics of the samples in seconds per operation.
+
+    `items` are the processed units per operation (sensors, bytes, ...),
+    `requests` the IPMI requests sent per operation.
+    """
+    mean = sum(samples) / len(samples)
+    median = percentile(samples, 0.5)
+    result = OrderedDict([
+        ('rounds', len(samples)),
+        ('mean', mean),
+        ('median', median),
+        ('min', min(samples)),
+        ('p95', percentile(samples, 0.95)),
+        ('ops_per_second', 1.0 / median if median else 0.0),
+        ('items', items),
+        ('items_per_second', items / median if median else 0.0),
+    ])
+    if requests is not None:
+        result['requests'] = requests
+        result['requests_per_second'] = \
+            requests / median if median else 0.0
+    return result
+
+
+class EmulatorBenchmarks(object):
+    """The end-to-end benchmarks, each returns `(fn, items)`."""
+
+    def __init__(self, args):
+        self.args = args
+        data = create_data(args.sensors, args.sel_entries)
+        # constant readings don't add SEL entries while measuring
+        waveforms = dict((number, Constant(50))
+                         for number in data.sdr_list)
+        self.simulator = FleetSimulator()
+        self.simulator.add_bmc('127.0.0.1', 0, data=data,
+                               sensors=dict(waveforms=waveforms))
+        self.runner = SimulatorThread(self.simulator)
+        (self.endpoint,) = self.simulator.endpoints()
+        self.fleet = Fleet([self.endpoint], timeout=args.timeout)
+        self.ipmi = self.fleet.connect(self.endpoint)
+
+    def close(self):
+        self.fleet.disconnect(self.ipmi)
+        self.runner.stop()
+
+    def handled(self):
+        return self.simulator.statistics()['handled']
+
+    def session(self):
+        def fn():
+            self.fleet.disconnect(self.fleet.connect(self.endpoint))
+        return (fn, 1)
+
+    def sensor_sweep(self):
+        sweeper = SensorSweeper(self.ipmi,
+                                self.ipmi.get_repository_sdr_list())
+        return (sweeper.sweep, len(sweeper.numbers))
+
+    def sdr_dump(self):
+        return (self.ipmi.get_repository_sdr_list, self.args.sensors)
+
+    def fru_read(self):
+        size = len(self.ipmi.read_fru_data(fru_id=0))
+        return (lambda: self.ipmi.get_fru_inventory(0), size)
+
+    def sel_read(self):
+        return (self.ipmi.get_sel_entries, self.args.sel_entries)
+
+    def hpm_upload(self):
+        binary = bytes(bytearray(n & 0xff
+                                 for n in range(self.args.upload_size)))
+        block_size = self.ipmi.interface.max_request_data_size \
+            - UPLOAD_BLOCK_OVERHEAD
+        # without pipelining every block is one round trip, the window
+        # keeps several blocks outstanding
+        return (lambda: self.ipmi.upload_binary(
+            binary, block_size=block_size, window=self.args.window),
+            len(binary))
+
+    BENCHMARKS = ('session', 'sensor_sweep', 'sdr_dump', 'fru_read',
+                  'sel_read', 'hpm_upload')
+
+    def run(self, name):
+        (fn, items) = getattr(self, name)()
+        # the first call warms up the caches of the emulator
+        handled = self.handled()
+        fn()
+        requests = self.handled() - handled
+        samples = measure(fn, self.args.min_time, self.args.min_rounds)
+        return summarize(samples, items, requests)
+
+
+def codec_benchmarks():
+    """Return the `Message` encode and decode benchmarks as
+    `(name, fn)` pairs."""
+    benchmarks = []
+
+    req = create_request_by_name('GetDeviceId')
+    benchmarks.append(('encode_get_device_id_req',
+                       lambda: encode_message(req)))
+
+    req = create_request_by_name('GetSensorReading')
+    req.sensor_number = 4
+    benchmarks.append(('encode_get_sensor_reading_req',
+                       lambda: encode_message(req)))
+
+    req = create_request_by_name('UploadFirmwareBlock')
+    req.number = 1
+    req.data = list(range(100))
+    benchmarks.append(('encode_upload_firmware_block_req',
+                       lambda: encode_message(req)))
+
+    data = b'\x00\x0c\x89\x00\x02\x3f\x98\x3a\x00\x01\x23\x01\x02\x03\x04'
+    rsp = create_response_by_name('GetDeviceId')
+    benchmarks.append(('decode_get_device_id_rsp',
+                       lambda: decode_message(rsp, data)))
+
+    reading = b'\x00\x32\xc0\x00'
+    rsp = create_response_by_name('GetSensorReading')
+    benchmarks.append(('decode_get_sensor_reading_rsp',
+                       lambda: decode_message(rsp, reading)))
+
+    record = bytes(full_sensor_record(1, 1).data)
+    sdr = b'\x00\x02\x00' + record
+    rsp = create_response_by_name('GetSdr')
+    benchmarks.append(('decode_get_sdr_rsp',
+                       lambda: decode_message(rsp, sdr)))
+
+    fru = b'\x00\x80' + bytes(bytearray(128))
+    rsp = create_response_by_name('ReadFruData')
+    benchmarks.append(('decode_read_fru_data_rsp',
+                       lambda: decode_message(rsp, fru)))
+
+    sel = b'\x00\x02\x00' + sel_record(1)
+    rsp = create_response_by_name('GetSelEntry')
+    benchmarks.append(('decode_get_sel_entry_rsp',
+                       lambda: decode_message(rsp, sel)))
+
+    return benchmarks
+
+
+def git_revision():
+    try:
+        return subprocess.check_output(
+            ['git', 'describe', '--always', '--dirty'],
+            cwd=os.path.dirname(os.path.abspath(__file__)),
+            stderr=subprocess.DEVNULL).decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def metadata(args):
+    return OrderedDict([
+        ('schema', SCHEMA_VERSION),
+        ('revision', git_revision()),
+        ('time', time.strftime('%Y-%m-%dT%H:%M:%SZ', time.gmtime())),
+        ('python', platform.python_version()),
+        ('implementation', platform.python_implementation()),
+        ('platform', platform.platform()),
+        ('parameters', OrderedDict([
+            ('sensors', args.sensors),
+            ('sel_entries', args.sel_entries),
+            ('upload_size', args.upload_size),
+            ('window', args.window),
+        ])),
+    ])
+
+
+def run(args):
+    results = OrderedDict()
+    selected = [n for n in EmulatorBenchmarks.BENCHMARKS
+                if not args.filter or args.filter in n]
+    if selected:
+        benchmarks = EmulatorBenchmarks(args)
+        try:
+            for name in selected:
+                results[name] = benchmarks.run(name)
+                report(name, results[name])
+        finally:
+            benchmarks.close()
+
+    for (name, fn) in codec_benchmarks():
+        if args.filter and args.filter not in name:
+            continue
+        loops = calibrate(fn)
+        results[name] = summarize(measure(fn, args.min_time,
+                                          args.min_rounds, loops))
+        report(name, results[name])
+    return results
+
+
+def report(name, result):
+    line = '%-34s %12.1f us  p95 %12.1f us  %10.0f ops/s' % (
+        name, result['median'] * 1e6, result['p95'] * 1e6,
+        result['ops_per_second'])
+    if 'requests' in result:
+        line += '  %6d req/op' % result['requests']
+    print(line)
+
+
+def compare(results, baseline, threshold):
+    """Print the change of the median of each benchmark against the
+    baseline and return the names of the regressed benchmarks."""
+    regressions = []
+    for (name, result) in results.items():
+        base = baseline.get(name)
+        if base is None or not base['median']:
+            continue
+        change = result['median'] / base['median'] - 1
+        regressed = change > threshold
+        print('%-34s %+7.1f%%%s' % (name, change * 100,
+                                    '  REGRESSION' if regressed else ''))
+        if regressed:
+            regressions.append(name)
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--output', help='write the results as JSON')
+    parser.add_argument('--compare', metavar='BASELINE',
+                        help='compare to the JSON results of an earlier run')
+    parser.add_argument('--threshold', type=float, default=0.1,
+                        help='allowed slowdown of the median (default 0.1)')
+    parser.add_argument('--filter', help='run benchmarks containing FILTER')
+    parser.add_argument('--quick', action='store_true',
+                        help='fewer rounds, for a smoke test')
+    parser.add_argument('--min-time', type=float, default=2.0,
+                        help='seconds per benchmark')
+    parser.add_argument('--min-rounds', type=int, default=10)
+    parser.add_argument('--sensors', type=int, default=64)
+    parser.add_argument('--sel-entries', type=int, default=256)
+    parser.add_argument('--upload-size', type=int, default=64 * 1024)
+    parser.add_argument('--window', type=int, default=8,
+                        help='HPM blocks in flight')
+    parser.add_argument('--timeout', type=float, default=2.0)
+    args = parser.parse_args()
+    if args.quick:
+        args.min_time = 0.1
+        args.min_rounds = 3
+
+    results = run(args)
+    document = OrderedDict([('metadata', metadata(args)),
+                            ('benchmarks', results)])
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(document, f, indent=2)
+            f.write('\n')
+
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+        if baseline['metadata']['parameters'] != \
+                document['metadata']['parameters']:
+            print('the parameters differ from the baseline')
+        regressions = compare(results, baseline['benchmarks'],
+                              args.threshold)
+        if regressions:
+            return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,192 @@
+#!/usr/bin/env python
+"""Resource usage of many RMCP sessions with and without multiplexer.
+
+Creates N `Rmcp` interfaces, each with its own socket or attached to one
+`RmcpMultiplexer`, and reports the number of open file descriptors, the
+threads, the resident memory and the UDP sockets of the system. Each
+variant runs in its own process. With --requests every session sends
+GetSensorReading requests to a local UDP responder, with --keep-alive the
+sessions start their keep alive timers like established v1.5 sessions.
+
+    python benchmarks/rmcp_multiplexer.py --sessions 10000 --requests 2
+"""
+
+import argparse
+import os
+import resource
+import socket
+import struct
+import subprocess
+import sys
+import threading
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+from pyipmi import Target  # noqa: E402
+from pyipmi.session import Session  # noqa: E402
+from pyipmi.interfaces.rmcp import (Rmcp, RmcpMsg, RMCP_CLASS_IPMI,  # noqa: E402
+                                    call_repeatedly)
+from pyipmi.interfaces.rmcpmux import RmcpMultiplexer  # noqa: E402
+from pyipmi.interfaces.ipmb import (IpmbHeaderReq, IpmbHeaderRsp,  # noqa: E402
+                                    encode_ipmb_msg)
+from pyipmi.msgs import create_request_by_name  # noqa: E402
+
+
+def open_fds():
+    try:
+        return len(os.listdir('/proc/self/fd'))
+    except OSError:
+        return -1
+
+
+def rss_kib():
+    try:
+        with open('/proc/self/status') as f:
+            for line in f:
+                if line.startswith('VmRSS:'):
+                    return int(line.split()[1])
+    except IOError:
+        pass
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+
+def udp_sockets():
+    """Return the UDP sockets in use on the system."""
+    try:
+        with open('/proc/net/sockstat') as f:
+            for line in f:
+                if line.startswith('UDP:'):
+                    return int(line.split()[2])
+    except IOError:
+        pass
+    return -1
+
+
+class Responder(object):
+    """IPMI v1.5 responder echoing the session ID."""
+
+    def __init__(self):
+        self.sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self.sock.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, 1 << 22)
+        self.sock.bind(('127.0.0.1', 0))
+        self.address = self.sock.getsockname()
+        thread = threading.Thread(target=self.run)
+        thread.daemon = True
+        thread.start()
+
+    def run(self):
+        while True:
+            (pdu, address) = self.sock.recvfrom(1024)
+            sdu = pdu[4:]
+            tx_data = sdu[10:]
+            req_header = IpmbHeaderReq(data=tx_data)
+            rsp_header = IpmbHeaderRsp()
+            rsp_header.from_req_header(req_header)
+            rsp_header.netfn = req_header.netfn + 1
+            rx_data = encode_ipmb_msg(rsp_header, b'\x00\x10\xc0')
+            rsp = (b'\x00\x00\x00\x00\x00' + sdu[5:9]
+                   + struct.pack('B', len(rx_data)) + rx_data)
+            self.sock.sendto(RmcpMsg(RMCP_CLASS_IPMI).pack(rsp, 0xff),
+                             address)
+
+
+def create_sessions(count, address, mux, keep_alive):
+    interfaces = []
+    for sid in range(1, count + 1):
+        rmcp = Rmcp(multiplexer=mux, timeout=5.0)
+        (rmcp.host, rmcp.port) = address
+        session = Session()
+        session.sid = sid
+        session.activated = True
+        rmcp._session = session
+        if mux is not None:
+            with rmcp._channel.establishing(*address):
+                rmcp._channel.bind_session(struct.pack('<I', sid))
+        if keep_alive and mux is not None:
+            rmcp._stop_keep_alive = mux.call_repeatedly(60, rmcp._keep_alive)
+        elif keep_alive:
+            rmcp._stop_keep_alive = call_repeatedly(60, rmcp._keep_alive)
+        interfaces.append(rmcp)
+    return interfaces
+
+
+def run_requests(interfaces, requests, workers):
+    def worker(chunk):
+        for rmcp in chunk:
+            for _ in range(requests):
+                req = create_request_by_name('GetSensorReading')
+                req.target = Target(0x20)
+                req.sensor_number = 1
+                rmcp.send_and_receive(req)
+
+    chunks = [interfaces[n::workers] for n in range(workers)]
+    threads = [threading.Thread(target=worker, args=(c,)) for c in chunks]
+    start = time.time()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return time.time() - start
+
+
+def measure(name, count, address, requests, workers, shards, keep_alive):
+    fds = open_fds()
+    rss = rss_kib()
+    udp = udp_sockets()
+    mux = RmcpMultiplexer(shards=shards) if shards else None
+    interfaces = create_sessions(count, address, mux, keep_alive)
+    duration = None
+    if requests:
+        duration = run_requests(interfaces, requests, workers)
+
+    print('%-12s sessions=%-6d fds=+%-6d udp=+%-6d threads=%-6d '
+          'rss=+%d KiB%s' % (
+              name, count, open_fds() - fds, udp_sockets() - udp,
+              threading.active_count(), rss_kib() - rss,
+              '' if duration is None else
+              ' %.0f req/s' % (count * requests / duration)))
+
+    for rmcp in interfaces:
+        rmcp.close()
+    if mux is not None:
+        mux.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--sessions', type=int, default=10000)
+    parser.add_argument('--requests', type=int, default=0,
+                        help='requests per session')
+    parser.add_argument('--workers', type=int, default=16,
+                        help='threads sending the requests')
+    parser.add_argument('--shards', type=int, default=1,
+                        help='sockets of the multiplexer')
+    parser.add_argument('--keep-alive', action='store_true',
+                        help='start the keep alive timers')
+    parser.add_argument('--mode', choices=('socket', 'multiplexer'))
+    args = parser.parse_args()
+
+    if args.mode is None:
+        for mode in ('socket', 'multiplexer'):
+            subprocess.check_call([sys.executable, __file__,
+                                   '--mode', mode] + sys.argv[1:])
+        return 0
+
+    (_, hard) = resource.getrlimit(resource.RLIMIT_NOFILE)
+    needed = args.sessions + 256
+    if hard != resource.RLIM_INFINITY and hard < needed:
+        print('RLIMIT_NOFILE hard limit %d is too low for %d sessions' %
+              (hard, args.sessions))
+        return 1
+    resource.setrlimit(resource.RLIMIT_NOFILE, (needed, hard))
+
+    responder = Responder()
+    shards = args.shards if args.mode == 'multiplexer' else 0
+    measure(args.mode, args.sessions, responder.address, args.requests,
+            args.workers, shards, args.keep_alive)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -35,6 +35,7 @@ from . import sensor
 from . import msgs
 
 from .errors import IpmiTimeoutError, CompletionCodeError, RetryError
+from .instrumentation import send_and_notify, send_many_and_notify
 from .msgs.registry import create_request_by_name, create_message
 from .session import Session
 from .utils import check_completion_code, is_string
@@ -153,7 +154,10 @@ class Target(object):
         self.routing = [Routing(*route) for route in routing]
 
     def __str__(self):
-        string = 'Target: IPMB: 0x%02x\n' % self.ipmb_address
+        if self.ipmb_address is None:
+            string = 'Target: IPMB: None\n'
+        else:
+            string = 'Target: IPMB: 0x%02x\n' % self.ipmb_address
         if self.routing:
             for route in self.routing:
                 string += ' %s\n' % route
@@ -168,10 +172,22 @@ class Ipmi(bmc.Bmc, chassis.Chassis, dcmi.Dcmi, fru.Fru, picmg.Picmg, hpm.Hpm,
         self._interface = None
         self._session = None
         self._target = None
+        self._hooks = ()
 
         for base in Ipmi.__bases__:
             base.__init__(self)
 
+    def add_hook(self, hook):
+        """Call `hook` with a `RequestEvent` after every request, see
+        `pyipmi.instrumentation`."""
+        # replaced, not modified, while other threads might send
+        self._hooks = self._hooks + (hook,)
+
+    def remove_hook(self, hook):
+        hooks = list(self._hooks)
+        hooks.remove(hook)
+        self._hooks = tuple(hooks)
+
     def is_ipmc_accessible(self):
         return self.interface.is_ipmc_accessible(self.target)
 
@@ -188,14 +204,29 @@ class Ipmi(bmc.Bmc, chassis.Chassis, dcmi.Dcmi, fru.Fru, picmg.Picmg, hpm.Hpm,
     def send_message(self, req, retry=3):
         req.target = self.target
         req.requester = self.requester
+        return self._send_message(req, retry)
+
+    def _send_message(self, req, retry=3, event=None):
+        """Send the request, repeating it while the node is busy.
+
+        `event` is the `RequestEvent` of the hooks, filled with the
+        attempts and the last completion code.
+        """
+        if event is None and self._hooks:
+            return send_and_notify(self._hooks, self._send_message, req,
+                                   retry)
         rsp = None
 
         while retry > 0:
             retry -= 1
+            if event is not None:
+                event.attempts += 1
             try:
                 rsp = self.interface.send_and_receive(req)
                 break
             except CompletionCodeError as e:
+                if event is not None:
+                    event.completion_code = e.cc
                 if e.cc == msgs.constants.CC_NODE_BUSY:
                     continue
         else:
@@ -203,6 +234,31 @@ class Ipmi(bmc.Bmc, chassis.Chassis, dcmi.Dcmi, fru.Fru, picmg.Picmg, hpm.Hpm,
 
         return rsp
 
+    def send_many(self, reqs, targets=None):
+        """Send several requests and return the responses in order.
+
+        Interfaces supporting pipelining (`send_and_receive_many`) keep
+        multiple requests in flight, otherwise the requests are sent one
+        after another.
+
+        `targets` is an optional list with the target of each request,
+        by default all requests are sent to `target`.
+        """
+        reqs = list(reqs)
+        if targets is None:
+            targets = [self.target] * len(reqs)
+
+        for (req, target) in zip(reqs, targets):
+            req.target = target
+            req.requester = self.requester
+
+        if not hasattr(self.interface, 'send_and_receive_many'):
+            return [self._send_message(req) for req in reqs]
+        if self._hooks:
+            return send_many_and_notify(
+                self._hooks, self.interface.send_and_receive_many, reqs)
+        return self.interface.send_and_receive_many(reqs)
+
     def send_message_with_name(self, name, *args, **kwargs):
         req = create_request_by_name(name)
 
@@ -0,0 +1,411 @@
+# Copyright (c) 2014  Kontron Europe GmbH
+#
+# This library is free software; you can redistribute it and/or
+# modify it under the terms of the GNU Lesser General Public
+# License as published by the Free Software Foundation; either
+# version 2.1 of the License, or (at your option) any later version.
+#
+# This library is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# Lesser General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public
+# License along with this library; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301 USA
+
+"""Coroutine based IPMI access.
+
+`AsyncIpmi` mirrors the most used functions of `Ipmi` (BMC, chassis,
+sensor, SDR, SEL and FRU) as coroutines. It is used together with an
+asyncio interface like `AsyncRmcp`, so that a single event loop can serve
+many sessions:
+
+    interface = pyipmi.interfaces.create_interface('aiormcp')
+    ipmi = pyipmi.aio.create_connection(interface)
+    ipmi.session.set_session_type_rmcp('10.0.0.1')
+    ipmi.session.set_auth_type_user('admin', 'admin')
+    ipmi.target = pyipmi.Target(0x20)
+    await ipmi.session_establish()
+    (reading, states) = await ipmi.get_sensor_reading(4)
+
+Every `AsyncRmcp` opens its own socket. For more sessions than the
+process may open file descriptors, let them share an
+`aiormcp.AsyncRmcpEndpoint`.
+"""
+
+import asyncio
+
+from . import NullRequester
+from .bmc import DeviceId, Watchdog
+from .chassis import ChassisStatus
+from .errors import CompletionCodeError, RetryError
+from .fru import FruInventory, FruReadSize, fru_data_steps
+from .helper import SdrReadSize, sdr_chunk_steps, sdr_data_steps
+from .instrumentation import send_and_notify_async
+from .msgs import constants
+from .msgs.registry import create_request_by_name
+from .msgs.chassis import (CONTROL_POWER_DOWN, CONTROL_POWER_UP,
+                           CONTROL_POWER_CYCLE, CONTROL_HARD_RESET,
+                           CONTROL_DIAGNOSTIC_INTERRUPT,
+                           CONTROL_SOFT_SHUTDOWN)
+from .sdr import SdrCommon, SdrRepositoryInfo
+from .sel import SelInfo, sel_entry_steps
+from .session import Session
+from .utils import check_completion_code
+
+
+def run(main):
+    """Run the coroutine `main` in a new event loop and return its result.
+
+    The same as `asyncio.run`, which is missing in Python 3.6.
+    """
+    loop = asyncio.new_event_loop()
+    asyncio.set_event_loop(loop)
+    try:
+        return loop.run_until_complete(main)
+    finally:
+        try:
+            all_tasks = getattr(asyncio, 'all_tasks', None) or \
+                asyncio.Task.all_tasks
+            tasks = [task for task in all_tasks(loop) if not task.done()]
+            for task in tasks:
+                task.cancel()
+            if tasks:
+                loop.run_until_complete(
+                    asyncio.gather(*tasks, return_exceptions=True))
+            loop.run_until_complete(loop.shutdown_asyncgens())
+        finally:
+            asyncio.set_event_loop(None)
+            loop.close()
+
+
+async def run_steps(steps, **operations):
+    """The coroutine counterpart of `helper.run_steps`, the operations
+    are coroutine functions."""
+    (result, error) = (None, None)
+    while True:
+        try:
+            if error is None:
+                step = steps.send(result)
+            else:
+                step = steps.throw(error)
+        except StopIteration as e:
+            return e.value
+
+        try:
+            (result, error) = (await operations[step[0]](*step[1:]), None)
+        except Exception as e:
+            (result, error) = (None, e)
+
+
+def create_connection(interface):
+    session = Session()
+    session.interface = interface
+    ipmi = AsyncIpmi()
+    ipmi.interface = interface
+    ipmi.session = session
+    ipmi.requester = NullRequester()
+    return ipmi
+
+
+class AsyncIpmi(object):
+    """The coroutine counterpart of `Ipmi`."""
+
+    def __init__(self):
+        self.interface = None
+        self.session = None
+        self.target = None
+        self.requester = None
+        self._sdr_read_sizes = {}
+        self._fru_read_sizes = {}
+        # the GetSelEntry length accepted by each target
+        self.max_req_len = {}
+        self._hooks = ()
+
+    def add_hook(self, hook):
+        """Call `hook` with a `RequestEvent` after every request."""
+        self._hooks = self._hooks + (hook,)
+
+    def remove_hook(self, hook):
+        hooks = list(self._hooks)
+        hooks.remove(hook)
+        self._hooks = tuple(hooks)
+
+    async def session_establish(self):
+        await self.interface.establish_session(self.session)
+
+    async def session_close(self):
+        await self.interface.close_session()
+
+    async def send_message(self, req, retry=3):
+        req.target = self.target
+        req.requester = self.requester
+        if self._hooks:
+            return await send_and_notify_async(
+                self._hooks, self._send_message, req, retry)
+        return await self._send_message(req, retry)
+
+    async def _send_message(self, req, retry=3, event=None):
+        rsp = None
+
+        while retry > 0:
+            retry -= 1
+            if event is not None:
+                event.attempts += 1
+            try:
+                rsp = await self.interface.send_and_receive(req)
+                break
+            except CompletionCodeError as e:
+                if event is not None:
+                    event.completion_code = e.cc
+                if e.cc == constants.CC_NODE_BUSY:
+                    continue
+        else:
+            raise RetryError()
+
+        return rsp
+
+    async def send_many(self, reqs):
+        """Send several requests concurrently.
+
+        The number of requests in flight is limited by the window of the
+        interface. Returns the responses in order.
+        """
+        return await asyncio.gather(*[self.send_message(req) for req in reqs])
+
+    async def send_message_with_name(self, name, *args, **kwargs):
+        req = create_request_by_name(name)
+
+        for key, value in kwargs.items():
+            setattr(req, key, value)
+
+        rsp = await self.send_message(req)
+        check_completion_code(rsp.completion_code)
+        return rsp
+
+    async def raw_command(self, lun, netfn, raw_bytes):
+        return await self.interface.send_and_receive_raw(self.target, lun,
+                                                         netfn, raw_bytes)
+
+    # BMC
+    async def get_device_id(self):
+        return DeviceId(await self.send_message_with_name('GetDeviceId'))
+
+    async def cold_reset(self):
+        await self.send_message_with_name('ColdReset')
+
+    async def warm_reset(self):
+        await self.send_message_with_name('WarmReset')
+
+    async def get_watchdog_timer(self):
+        return Watchdog(await self.send_message_with_name('GetWatchdogTimer'))
+
+    async def reset_watchdog_timer(self):
+        await self.send_message_with_name('ResetWatchdogTimer')
+
+    # Chassis
+    async def get_chassis_status(self):
+        return ChassisStatus(
+                await self.send_message_with_name('GetChassisStatus'))
+
+    async def chassis_control(self, option):
+        req = create_request_by_name('ChassisControl')
+        req.control.option = option
+        rsp = await self.send_message(req)
+        check_completion_code(rsp.completion_code)
+
+    async def chassis_control_power_down(self):
+        await self.chassis_control(CONTROL_POWER_DOWN)
+
+    async def chassis_control_power_up(self):
+        await self.chassis_control(CONTROL_POWER_UP)
+
+    async def chassis_control_power_cycle(self):
+        await self.chassis_control(CONTROL_POWER_CYCLE)
+
+    async def chassis_control_hard_reset(self):
+        await self.chassis_control(CONTROL_HARD_RESET)
+
+    async def chassis_control_diagnostic_interrupt(self):
+        await self.chassis_control(CONTROL_DIAGNOSTIC_INTERRUPT)
+
+    async def chassis_control_soft_shutdown(self):
+        await self.chassis_control(CONTROL_SOFT_SHUTDOWN)
+
+    # Sensor
+    async def get_sensor_reading(self, sensor_number, lun=0):
+        """Return the sensor reading at the assertion states.
+
+        Returns a tuple with `raw reading`and `assertion states`.
+        """
+        rsp = await self.send_message_with_name('GetSensorReading',
+                                                sensor_number=sensor_number,
+                                                lun=lun)
+
+        reading = rsp.sensor_reading
+        if rsp.config.initial_update_in_progress:
+            reading = None
+
+        states = None
+        if rsp.states1 is not None:
+            states = rsp.states1
+            if rsp.states2 is not None:
+                states |= (rsp.states2 << 8)
+        return (reading, states)
+
+    async def get_sensor_thresholds(self, sensor_number, lun=0):
+        rsp = await self.send_message_with_name('GetSensorThresholds',
+                                                sensor_number=sensor_number,
+                                                lun=lun)
+
+        thresholds = {}
+        threshold_list = ('unr', 'ucr', 'unc', 'lnc', 'lcr', 'lnr')
+        for threshold in threshold_list:
+            if hasattr(rsp.readable_mask, threshold):
+                if getattr(rsp.readable_mask, threshold):
+                    thresholds[threshold] = getattr(rsp.threshold, threshold)
+        return thresholds
+
+    async def rearm_sensor_events(self, sensor_number):
+        await self.send_message_with_name('RearmSensorEvents',
+                                          sensor_number=sensor_number)
+
+    async def reserve_device_sdr_repository(self):
+        rsp = await self.send_message_with_name('ReserveDeviceSdrRepository')
+        return rsp.reservation_id
+
+    async def get_device_sdr(self, record_id, reservation_id=None):
+        if reservation_id is None:
+            reservation_id = await self.reserve_device_sdr_repository()
+        return await self._get_sdr('GetDeviceSdr',
+                                   self.reserve_device_sdr_repository,
+                                   record_id, reservation_id, 'device')
+
+    async def get_device_sdr_list(self, reservation_id=None):
+        return await self._get_sdr_list(self.get_device_sdr,
+                                        self.reserve_device_sdr_repository,
+                                        reservation_id)
+
+    # SDR repository
+    async def get_sdr_repository_info(self):
+        return SdrRepositoryInfo(
+                await self.send_message_with_name('GetSdrRepositoryInfo'))
+
+    async def reserve_sdr_repository(self):
+        rsp = await self.send_message_with_name('ReserveSdrRepository')
+        return rsp.reservation_id
+
+    async def get_repository_sdr(self, record_id, reservation_id=None):
+        if reservation_id is None:
+            reservation_id = await self.reserve_sdr_repository()
+        return await self._get_sdr('GetSdr', self.reserve_sdr_repository,
+                                   record_id, reservation_id, 'repository')
+
+    async def get_repository_sdr_list(self, reservation_id=None):
+        return await self._get_sdr_list(self.get_repository_sdr,
+                                        self.reserve_sdr_repository,
+                                        reservation_id)
+
+    async def _get_sdr_list(self, get_fn, reserve_fn, reservation_id=None):
+        if reservation_id is None:
+            reservation_id = await reserve_fn()
+        record_id = 0
+        records = []
+
+        while True:
+            record = await get_fn(record_id, reservation_id)
+            records.append(record)
+            if record.next_id == 0xffff:
+                break
+            record_id = record.next_id
+        return records
+
+    def _get_sdr_read_size(self, repository):
+        key = (repository, str(self.target))
+        if key not in self._sdr_read_sizes:
+            self._sdr_read_sizes[key] = SdrReadSize()
+        return self._sdr_read_sizes[key]
+
+    async def _get_sdr(self, name, reserve_fn, record_id, reservation_id,
+                       repository):
+        """See `helper.get_sdr_data_helper`."""
+        async def read(record_id, offset, length):
+            req = create_request_by_name(name)
+            req.reservation_id = reservation_id
+            req.record_id = record_id
+            req.offset = offset
+            req.bytes_to_read = length
+            rsp = await run_steps(sdr_chunk_steps(req),
+                                  send=self.send_message, reserve=reserve_fn,
+                                  sleep=asyncio.sleep)
+            return (rsp.next_record_id, rsp.record_data)
+
+        (next_id, record_data) = await run_steps(
+                sdr_data_steps(record_id, self._get_sdr_read_size(repository)),
+                read=read)
+        return SdrCommon.from_data(record_data, next_id)
+
+    # SEL
+    async def get_sel_info(self):
+        return SelInfo(await self.send_message_with_name('GetSelInfo'))
+
+    async def get_sel_entries_count(self):
+        return (await self.get_sel_info()).entries
+
+    async def get_sel_reservation_id(self):
+        rsp = await self.send_message_with_name('ReserveSel')
+        return rsp.reservation_id
+
+    async def get_sel_entry(self, record_id, reservation=0):
+        return await run_steps(
+                sel_entry_steps(record_id, reservation, self.max_req_len,
+                                str(self.target)),
+                send=self.send_message)
+
+    async def get_sel_entries(self):
+        """Return all SEL entries as a list."""
+        START_SEL_RECORD_ID = 0
+        END_SEL_RECORD_ID = 0xffff
+        entries = []
+        if await self.get_sel_entries_count() == 0:
+            return entries
+
+        reservation_id = await self.get_sel_reservation_id()
+        next_record_id = START_SEL_RECORD_ID
+        while True:
+            (sel_entry, next_record_id) = \
+                await self.get_sel_entry(next_record_id, reservation_id)
+            entries.append(sel_entry)
+            if next_record_id == END_SEL_RECORD_ID:
+                break
+        return entries
+
+    # FRU
+    async def get_fru_inventory_area_info(self, fru_id=0):
+        rsp = await self.send_message_with_name('GetFruInventoryAreaInfo',
+                                                fru_id=fru_id)
+        return rsp.area_size
+
+    def _get_fru_read_size(self, fru_id):
+        key = (str(self.target), fru_id)
+        if key not in self._fru_read_sizes:
+            self._fru_read_sizes[key] = FruReadSize()
+        return self._fru_read_sizes[key]
+
+    async def read_fru_data(self, offset=None, count=None, fru_id=0):
+        if offset is None:
+            area_size = await self.get_fru_inventory_area_info(fru_id)
+            off = 0
+        else:
+            area_size = offset + count
+            off = offset
+
+        return await run_steps(
+                fru_data_steps(fru_id, off, area_size,
+                               self._get_fru_read_size(fru_id),
+                               pipelining=True),
+                send=self.send_message, send_many=self.send_many)
+
+    async def get_fru_inventory(self, fru_id=0):
+        return FruInventory(await self.read_fru_data(fru_id=fru_id))
@@ -15,6 +15,7 @@
 # Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301 USA
 
 from .msgs import create_request_by_name
+from .errors import CompletionCodeError
 from .utils import check_completion_code
 from .state import State
 from .fields import VersionField
@@ -24,6 +25,24 @@ class Bmc(object):
     def get_device_id(self):
         return DeviceId(self.send_message_with_name('GetDeviceId'))
 
+    def get_device_guid(self):
+        """Return the device GUID as 16 bytes (least significant first)."""
+        rsp = self.send_message_with_name('GetDeviceGuide')
+        return bytes(rsp.device_guid)
+
+    def _cache_identity(self):
+        """Return what identifies the BMC in the SDR and FRU caches."""
+        device_id = self.get_device_id()
+        try:
+            guid = self.get_device_guid()
+        except CompletionCodeError:
+            guid = None
+        return (getattr(self.interface, 'host', None),
+                getattr(self.interface, 'port', None), str(self.target),
+                device_id.device_id, device_id.revision,
+                str(device_id.fw_revision), device_id.manufacturer_id,
+                device_id.product_id, guid)
+
     def cold_reset(self):
         self.send_message_with_name('ColdReset')
 
@@ -0,0 +1,155 @@
+# Copyright (c) 2018  Kontron Europe GmbH
+#
+# This library is free software; you can redistribute it and/or
+# modify it under the terms of the GNU Lesser General Public
+# License as published by the Free Software Foundation; either
+# version 2.1 of the License, or (at your option) any later version.
+#
+# This library is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# Lesser General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public
+# License along with this library; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301 USA
+
+import binascii
+import hashlib
+import json
+import os
+import tempfile
+import threading
+
+from .logger import log
+
+
+def _encode(value):
+    if isinstance(value, (bytes, bytearray)):
+        return binascii.hexlify(value).decode('ascii')
+    if isinstance(value, (tuple, list)):
+        return [_encode(v) for v in value]
+    return value
+
+
+class FileCache(object):
+    """Directory with one JSON file per BMC.
+
+    A BMC is identified by a tuple (address, device ID, GUID, ...), each
+    file holds several named entries. An entry is valid as long as the
+    stamp it was stored with matches.
+    """
+
+    VERSION = 1
+
+    def __init__(self, directory):
+        self.directory = directory
+        self._lock = threading.Lock()
+        if not os.path.isdir(directory):
+            os.makedirs(directory)
+
+    def _path(self, identity):
+        digest = hashlib.sha1(
+            json.dumps(_encode(identity)).encode('utf-8')).hexdigest()
+        return os.path.join(self.directory, digest + '.json')
+
+    def _read(self, path):
+        try:
+            with open(path) as f:
+                content = json.load(f)
+        except (IOError, OSError, ValueError):
+            return {}
+        if content.get('version') != self.VERSION:
+            return {}
+        return content
+
+    def _write(self, path, content):
+        (fd, tmp) = tempfile.mkstemp(dir=self.directory, suffix='.tmp')
+        try:
+            with os.fdopen(fd, 'w') as f:
+                json.dump(content, f)
+            os.replace(tmp, path)
+        except Exception:
+            os.unlink(tmp)
+            raise
+
+    def get(self, identity, name, stamp):
+        """Return the entry `name` or None if missing or stale."""
+        path = self._path(identity)
+        with self._lock:
+            content = self._read(path)
+        entry = content.get('entries', {}).get(name)
+        if entry is None or entry['stamp'] != _encode(stamp):
+            return None
+        return entry['value']
+
+    def put(self, identity, name, stamp, value):
+        path = self._path(identity)
+        with self._lock:
+            content = self._read(path)
+            content['version'] = self.VERSION
+            content['identity'] = _encode(identity)
+            content.setdefault('entries', {})[name] = {
+                'stamp': _encode(stamp),
+                'value': value,
+            }
+            try:
+                self._write(path, content)
+            except (IOError, OSError) as e:
+                log().warning('cannot write cache %s: %s', path, e)
+
+    def invalidate(self, identity):
+        with self._lock:
+            try:
+                os.unlink(self._path(identity))
+            except OSError:
+                pass
+
+
+class SdrCache(FileCache):
+    """On-disk cache of the SDR records.
+
+    The records of the SDR repository and of the device SDR repository are
+    stored separately, so that only the changed one is read again.
+
+    Example:
+        ipmi.sdr_cache = SdrCache('/var/cache/pyipmi')
+        sdrs = ipmi.get_repository_sdr_list()
+    """
+
+    def load(self, identity, repository, stamp):
+        """Return the list of (next_id, data) or None."""
+        records = self.get(identity, repository, stamp)
+        if records is None:
+            log().debug('SDR cache miss for %s', repository)
+            return None
+        return [(next_id, binascii.unhexlify(data))
+                for (next_id, data) in records]
+
+    def store(self, identity, repository, stamp, records):
+        self.put(identity, repository, stamp,
+                 [(next_id, _encode(data)) for (next_id, data) in records])
+
+
+class FruCache(FileCache):
+    """On-disk cache of the FRU data.
+
+    The cached data is validated against the common header, the area
+    checksums and the multirecord headers on every use, so that only
+    changed areas are read again.
+
+    Example:
+        ipmi.fru_cache = FruCache('/var/cache/pyipmi')
+        inventory = ipmi.get_fru_inventory()
+    """
+
+    def load(self, identity, fru_id):
+        """Return the cached FRU data or None."""
+        data = self.get(identity, 'fru%d' % fru_id, None)
+        if data is None:
+            log().debug('FRU cache miss for FRU %d', fru_id)
+            return None
+        return binascii.unhexlify(data)
+
+    def store(self, identity, fru_id, data):
+        self.put(identity, 'fru%d' % fru_id, None, _encode(bytes(data)))
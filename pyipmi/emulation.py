@@ -1,16 +1,19 @@
 import argparse
+import asyncio
+import inspect
 import logging
 import os
 import random
 import socket
 import sys
-import threading
+import time
 import yaml
 
 from array import array
-from collections import OrderedDict
+from collections import OrderedDict, deque
 
 import pyipmi
+import pyipmi.aio
 
 from pyipmi.logger import log
 
@@ -19,6 +22,7 @@ from pyipmi.interfaces import ipmb
 from pyipmi.msgs import (create_message, decode_message, encode_message,
                          create_response_message, create_request_by_name)
 from pyipmi.msgs import constants
+from pyipmi.sensorsim import SensorEngine
 from pyipmi.session import Session
 from pyipmi.utils import ByteBuffer
 
@@ -26,18 +30,27 @@ UDP_IP = "127.0.0.1"
 UDP_PORT = 1623
 
 sdr_list = OrderedDict()
+sel_list = OrderedDict()
 handler_registry = {}
+# request types whose response only depends on the request data
+cacheable_requests = set()
 
+RESPONSE_CACHE_SIZE = 1024
+# the most FRU data returned by one ReadFruData
+MAX_FRU_READ_COUNT = 128
 
-def register_message_handler(msg_name):
+
+def register_message_handler(msg_name, cacheable=False):
     def reg(fn):
         msg_type = type(create_request_by_name(msg_name))
         handler_registry[msg_type] = fn
+        if cacheable:
+            cacheable_requests.add(msg_type)
         return fn
     return reg
 
 
-@register_message_handler("GetChannelAuthenticationCapabilities")
+@register_message_handler("GetChannelAuthenticationCapabilities", cacheable=True)
 def handle_channel_auth_caps(context, req):
     rsp = create_response_message(req)
     rsp.support.straight = 1
@@ -63,6 +76,7 @@ def handle_activate_session(context, req):
     session.session_id = rsp.session_id
     session.set_auth_type_user('admin', 'admin')
     session.auth_type = Session.AUTH_TYPE_PASSWORD
+    context.state = ConnectionContext.STATE_ACTIVE
     return rsp
 
 
@@ -72,13 +86,13 @@ def handle_close_session(context, req):
     return rsp
 
 
-@register_message_handler("SetSessionPrivilegeLevel")
+@register_message_handler("SetSessionPrivilegeLevel", cacheable=True)
 def handle_set_session_priv_level(context, req):
     rsp = create_response_message(req)
     return rsp
 
 
-@register_message_handler("GetDeviceId")
+@register_message_handler("GetDeviceId", cacheable=True)
 def handle_get_device_id(context, req):
     rsp = create_response_message(req)
     return rsp
@@ -89,6 +103,13 @@ def handle_fru_inventory_are_info(context, req):
     rsp = create_response_message(req)
     fru_file_name = None
 
+    if context.fru_data is not None:
+        try:
+            rsp.area_size = len(context.fru_data[req.fru_id])
+        except KeyError:
+            rsp.completion_code = constants.CC_PARAM_OUT_OF_RANGE
+        return rsp
+
     cfg = context.config
 
     try:
@@ -119,6 +140,20 @@ def handle_fru_read(context, req):
     rsp = create_response_message(req)
     fru_file_name = None
 
+    if req.count > MAX_FRU_READ_COUNT:
+        rsp.completion_code = constants.CC_CANT_RET_NUM_REQ_BYTES
+        return rsp
+
+    if context.fru_data is not None:
+        try:
+            d = context.fru_data[req.fru_id][req.offset:req.offset+req.count]
+        except KeyError:
+            rsp.completion_code = constants.CC_PARAM_OUT_OF_RANGE
+            return rsp
+        rsp.count = len(d)
+        rsp.data = d
+        return rsp
+
     cfg = context.config
 
     try:
@@ -143,10 +178,10 @@ def handle_fru_read(context, req):
     return rsp
 
 
-@register_message_handler("GetSdrRepositoryInfo")
+@register_message_handler("GetSdrRepositoryInfo", cacheable=True)
 def handle_sdr_repository_info(context, req):
     rsp = create_response_message(req)
-    rsp.count = 0
+    rsp.record_count = len(context.sdr_list)
     return rsp
 
 
@@ -166,25 +201,142 @@ def handle_clear_sdr_repositry(context, req):
 @register_message_handler("GetSdr")
 def handle_get_sdr(context, req):
     rsp = create_response_message(req)
+    sdrs = context.sdr_list
 
-    if len(sdr_list) == 0:
+    if len(sdrs) == 0:
         log().warning('no SDR present')
         rsp.completion_code = constants.CC_REQ_DATA_NOT_PRESENT
         return rsp
 
-    next_index = list(sdr_list.keys()).index(req.record_id) + 1
+    (record_id, next_record_id) = _get_record_ids(sdrs, req.record_id)
+    if record_id is None:
+        rsp.completion_code = constants.CC_REQ_DATA_NOT_PRESENT
+        return rsp
+    rsp.next_record_id = next_record_id
+
+    sdr = sdrs[record_id]
+    rsp.record_data = sdr.data[req.offset:req.offset+req.bytes_to_read]
+    return rsp
+
+
+def _get_record_ids(records, record_id):
+    """Return the ID of the requested record and of the next record.
+
+    Record ID 0 requests the first record.
+    """
+    ids = list(records)
+    if record_id == 0:
+        record_id = ids[0]
     try:
-        next_record_id = list(sdr_list)[next_index]
+        next_index = ids.index(record_id) + 1
+    except ValueError:
+        return (None, None)
+    try:
+        next_record_id = ids[next_index]
     except IndexError:
         next_record_id = 0xffff
+    return (record_id, next_record_id)
+
+
+@register_message_handler("GetSensorReading")
+def handle_get_sensor_reading(context, req):
+    rsp = create_response_message(req)
+    if context.sensors is None:
+        rsp.completion_code = constants.CC_INV_CMD
+        return rsp
+
+    try:
+        (raw, states) = context.sensors.reading(req.sensor_number)
+    except KeyError:
+        rsp.completion_code = constants.CC_REQ_DATA_NOT_PRESENT
+        return rsp
+    rsp.sensor_reading = raw
+    rsp.states1 = states
+    return rsp
+
+
+@register_message_handler("GetSensorThresholds")
+def handle_get_sensor_thresholds(context, req):
+    rsp = create_response_message(req)
+    if context.sensors is None:
+        rsp.completion_code = constants.CC_INV_CMD
+        return rsp
+
+    try:
+        thresholds = context.sensors.thresholds(req.sensor_number)
+    except KeyError:
+        rsp.completion_code = constants.CC_REQ_DATA_NOT_PRESENT
+        return rsp
+    for (name, raw) in thresholds.items():
+        setattr(rsp.readable_mask, name, 1)
+        setattr(rsp.threshold, name, raw)
+    return rsp
+
+
+@register_message_handler("GetSelInfo")
+def handle_sel_info(context, req):
+    rsp = create_response_message(req)
+    if context.sensors is not None:
+        # add the events of the threshold crossings since the last call
+        context.sensors.update()
+        rsp.most_recent_addition = context.sensors.most_recent_addition
+    rsp.entries = len(context.sel_list)
+    rsp.operation_support.reserve_sel = 1
+    return rsp
+
+
+@register_message_handler("ReserveSel")
+def handle_reserve_sel(context, req):
+    rsp = create_response_message(req)
+    rsp.reservation_id = 1
+    return rsp
+
+
+@register_message_handler("GetSelEntry")
+def handle_get_sel_entry(context, req):
+    rsp = create_response_message(req)
+    sels = context.sel_list
+
+    if len(sels) == 0:
+        rsp.completion_code = constants.CC_REQ_DATA_NOT_PRESENT
+        return rsp
+
+    (record_id, next_record_id) = _get_record_ids(sels, req.record_id)
+    if record_id is None:
+        rsp.completion_code = constants.CC_REQ_DATA_NOT_PRESENT
+        return rsp
     rsp.next_record_id = next_record_id
 
-    sdr = sdr_list[req.record_id]
-    rsp.record_data = sdr.data[req.offset:req.offset+req.bytes_to_read]
+    data = sels[record_id]
+    if req.length == 0xff:
+        rsp.record_data = data[req.offset:]
+    else:
+        rsp.record_data = data[req.offset:req.offset+req.length]
+    return rsp
+
+
+@register_message_handler("UploadFirmwareBlock")
+def handle_upload_firmware_block(context, req):
+    # the blocks are accepted and dropped, the emulator has no components
+    rsp = create_response_message(req)
+    return rsp
+
+
+@register_message_handler("FinishFirmwareUpload")
+def handle_finish_firmware_upload(context, req):
+    rsp = create_response_message(req)
+    return rsp
+
+
+@register_message_handler("GetUpgradeStatus")
+def handle_get_upgrade_status(context, req):
+    rsp = create_response_message(req)
+    rsp.command_in_progress = 0
+    rsp.last_completion_code = constants.CC_OK
     return rsp
 
 
-@register_message_handler("GetDeviceSdrInfo")
+@register_message_handler("GetDeviceSdrInfo", cacheable=True)
 def handle_device_sdr_info(context, req):
     rsp = create_response_message(req)
     rsp.number_of_sensors = 0
@@ -211,6 +363,13 @@ def handle_send_message(context, req):
 
 
 def handle_ipmi_request_msg(context, req):
+    if context.fault_injector is not None:
+        cc = context.fault_injector(req)
+        if cc is not None:
+            rsp = create_response_message(req)
+            rsp.completion_code = cc
+            return rsp
+
     try:
         fct = handler_registry[type(req)]
     except KeyError:
@@ -230,12 +389,28 @@ def handle_rmcp_asf_msg(context, sdu):
     if asf.asf_type == rmcp.AsfMsg.ASF_TYPE_PRESENCE_PING:
         log().debug(f'ASF RX: ping: {asf}')
     pong = rmcp.AsfPong()
-    pdu = pong.pack()
+    # AsfPong.pack() only returns the data, add the ASF header
+    pong.iana_enterprise_number = asf.iana_enterprise_number
+    pong.tag = asf.tag
+    pong.data = pong.pack()
+    pdu = rmcp.AsfMsg.pack(pong)
     log().debug(f'ASF TX: pong: {asf}')
     return pdu
 
 
-def handle_rmcp_ipmi_msg(context, sdu):
+def _encode_ipmi_response_data(req_header, data):
+    rsp_header = ipmb.IpmbHeaderRsp()
+    rsp_header.from_req_header(req_header)
+    rsp_header.netfn = req_header.netfn + 1
+    return ipmb.encode_ipmb_msg(rsp_header, data)
+
+
+def _decode_rmcp_ipmi_msg(context, sdu):
+    """Return the request, its header and its response cache key.
+
+    Requests answered from the response cache or that cannot be decoded
+    are returned as `(None, None, None, pdu)`.
+    """
 
     def _get_group_id(ipmi_sdu):
         group_id = None
@@ -274,26 +449,78 @@ def handle_rmcp_ipmi_msg(context, sdu):
     ipmi_sdu = ipmi_rx.unpack(sdu)
 
     req_header = ipmb.IpmbHeaderReq(data=ipmi_sdu)
+
     group_id = _get_group_id(ipmi_sdu)
 
+    key = None
+    if context.response_cache is not None:
+        key = (req_header.netfn, req_header.cmdid, bytes(ipmi_sdu[6:-1]))
+        data = context.response_cache.get(key)
+        if data is not None:
+            tx_data = _encode_ipmi_response_data(req_header, data)
+            # decode the messages only when they are logged
+            if log().isEnabledFor(logging.DEBUG):
+                req = create_message(req_header.netfn, req_header.cmdid,
+                                     group_id)
+                _log_ipmi_msg('RX', req, ipmi_sdu)
+                rsp = create_message(req_header.netfn + 1, req_header.cmdid,
+                                     group_id)
+                decode_message(rsp, data)
+                _log_ipmi_msg('TX', rsp, tx_data)
+            return (None, None, None, rmcp.IpmiMsg(session).pack(tx_data))
+
     try:
         req = create_message(req_header.netfn, req_header.cmdid, group_id)
     except KeyError:
-        return _create_invalid_response(ipmi_sdu)
+        return (None, None, None, _create_invalid_response(ipmi_sdu))
 
-    log().debug('IPMI RX: {}: {:s}'.format(req,
-            ' '.join('%02x' % b for b in array('B', ipmi_sdu))))
+    if log().isEnabledFor(logging.DEBUG):
+        _log_ipmi_msg('RX', req, ipmi_sdu)
     decode_message(req, ipmi_sdu[6:-1])
+    return (req, req_header, key, None)
+
+
+def _log_ipmi_msg(direction, msg, data):
+    # formatting the hex dump is expensive, only call it when it is logged
+    log().debug('IPMI {}: {}: {:s}'.format(direction, msg,
+                ' '.join('%02x' % b for b in array('B', data))))
+
+
+def handle_rmcp_ipmi_msg(context, sdu):
+    (req, req_header, key, pdu) = _decode_rmcp_ipmi_msg(context, sdu)
+    if req is None:
+        return pdu
+
+    rsp = handle_ipmi_request_msg(context, req)
+    return _encode_ipmi_response(context, req, req_header, key, rsp)
+
+
+async def handle_rmcp_ipmi_msg_async(context, sdu):
+    """Like `handle_rmcp_ipmi_msg` but message handlers may also be
+    coroutine functions."""
+    (req, req_header, key, pdu) = _decode_rmcp_ipmi_msg(context, sdu)
+    if req is None:
+        return pdu
 
     rsp = handle_ipmi_request_msg(context, req)
+    if inspect.isawaitable(rsp):
+        rsp = await rsp
+    return _encode_ipmi_response(context, req, req_header, key, rsp)
+
+
+def _encode_ipmi_response(context, req, req_header, key, rsp):
+    session = context.session
     data = encode_message(rsp)
 
-    rsp_header = ipmb.IpmbHeaderRsp()
-    rsp_header.from_req_header(req_header)
+    cache = context.response_cache
+    if (key is not None and type(req) in cacheable_requests
+            and rsp.completion_code == constants.CC_OK
+            and len(cache) < RESPONSE_CACHE_SIZE):
+        cache[key] = data
 
-    tx_data = ipmb.encode_ipmb_msg(rsp_header, data)
-    log().debug('IPMI TX: {}: {:s}'.format(rsp,
-            ' '.join('%02x' % b for b in array('B', tx_data))))
+    tx_data = _encode_ipmi_response_data(req_header, data)
+    if log().isEnabledFor(logging.DEBUG):
+        _log_ipmi_msg('TX', rsp, tx_data)
 
     # rmcp ipmi rsp msg
     ipmi_tx = rmcp.IpmiMsg(context.session)
@@ -309,7 +536,11 @@ def handle_rmcp_ipmi_msg(context, sdu):
     return pdu
 
 
-def load_sdr_dump(dump_file):
+def load_sdr_dump(dump_file, sdrs=None):
+    """Load the SDRs of a dump file into `sdrs`, by default the SDRs of
+    the emulated BMC."""
+    if sdrs is None:
+        sdrs = sdr_list
     with open(dump_file, 'rb') as f:
         while True:
             h = f.read(5)
@@ -318,10 +549,38 @@ def load_sdr_dump(dump_file):
             t = pyipmi.sdr.SdrCommon(h)
             b = f.read(t.length)
             sdr = pyipmi.sdr.SdrCommon().from_data(h + b)
-            sdr_list[sdr.id] = sdr
+            sdrs[sdr.id] = sdr
+
+
+def load_sel_dump(dump_file, sels=None):
+    """Load the 16 byte SEL records of a dump file into `sels`, by
+    default the SEL of the emulated BMC."""
+    if sels is None:
+        sels = sel_list
+    with open(dump_file, 'rb') as f:
+        while True:
+            record = f.read(16)
+            if len(record) < 16:
+                break
+            sels[record[0] | record[1] << 8] = record
 
 
 class ConnectionContext():
+    """The state of one client connection.
+
+    The state goes from `STATE_IDLE` to `STATE_ACTIVE` when a session is
+    activated and to `STATE_CLOSED` when the session is closed. `pending`
+    holds the PDUs not yet handled by the asyncio server, they are handled
+    in order by one worker at a time.
+
+    The SDRs and SEL entries are those of the emulated BMC, the FRU data
+    is read from the files in the config unless `fru_data` maps the FRU
+    IDs to their data. `fault_injector` is called with each request and
+    returns a completion code to answer with instead, or None. `sensors`
+    is the `SensorEngine` simulating the sensor readings, it also keeps
+    the SEL.
+    """
+
     STATE_IDLE = 0
     STATE_ACTIVE = 1
     STATE_CLOSED = 2
@@ -332,31 +591,234 @@ class ConnectionContext():
         self.sock = sock
         self.addr = addr
         self.session = Session()
+        self.sdr_list = sdr_list
+        self.sel_list = sel_list
+        self.fru_data = None
+        self.fault_injector = None
+        self.sensors = None
+        # encoded responses of cacheable requests, shared by the
+        # connections of the asyncio server
+        self.response_cache = None
+        self.pending = deque()
+        self.scheduled = False
+        self.last_seen = time.monotonic()
+
+
+def _get_rmcp_handler(handlers, pdu):
+    msg = rmcp.RmcpMsg()
+    sdu = msg.unpack(pdu)
+    try:
+        handler = handlers[msg.class_of_msg]
+    except KeyError:
+        log().warning('unknown class_of_msg {}'.format(msg.class_of_msg))
+        return (msg, None, sdu)
+    return (msg, handler, sdu)
+
+
+def _pack_rmcp_msg(context, msg, tx_data):
+    rmcp_msg = rmcp.RmcpMsg(msg.class_of_msg)
+    return rmcp_msg.pack(tx_data, context.session.sequence_number)
+
+
+def handle_rmcp_msg(context, pdu):
+    """Return the response PDU to a RMCP message or None."""
+    (msg, handler, sdu) = _get_rmcp_handler({
+        rmcp.RMCP_CLASS_ASF: handle_rmcp_asf_msg,
+        rmcp.RMCP_CLASS_IPMI: handle_rmcp_ipmi_msg,
+    }, pdu)
+    if handler is None:
+        return None
+    return _pack_rmcp_msg(context, msg, handler(context, sdu))
+
+
+async def handle_rmcp_msg_async(context, pdu):
+    """Coroutine version of `handle_rmcp_msg`."""
+    (msg, handler, sdu) = _get_rmcp_handler({
+        rmcp.RMCP_CLASS_ASF: handle_rmcp_asf_msg,
+        rmcp.RMCP_CLASS_IPMI: handle_rmcp_ipmi_msg_async,
+    }, pdu)
+    if handler is None:
+        return None
+    tx_data = handler(context, sdu)
+    if inspect.isawaitable(tx_data):
+        tx_data = await tx_data
+    return _pack_rmcp_msg(context, msg, tx_data)
 
 
 def handle_thread(context, pdu):
+    pdu = handle_rmcp_msg(context, pdu)
+    if pdu is not None:
+        context.sock.sendto(pdu, context.addr)
 
-    msg = rmcp.RmcpMsg()
-    sdu = msg.unpack(pdu)
 
+class EmulatorStatistics(object):
+    """Counters of the asyncio emulator server."""
+
+    def __init__(self):
+        self.received = 0
+        self.handled = 0
+        self.dropped = 0
+        self.errors = 0
+        self._last_time = time.monotonic()
+        self._last_handled = 0
+
+    def rate(self):
+        """Return the handled requests per second since the last call."""
+        now = time.monotonic()
+        elapsed = now - self._last_time
+        rate = (self.handled - self._last_handled) / elapsed if elapsed else 0
+        self._last_time = now
+        self._last_handled = self.handled
+        return rate
+
+
+class EmulatorProtocol(asyncio.DatagramProtocol):
+    """Serve the RMCP clients from an asyncio event loop.
+
+    Every client address gets a `ConnectionContext`. The received PDUs are
+    queued on their connection and the connections with pending PDUs are
+    handled by up to `workers` worker tasks. At most `max_pending` PDUs
+    are queued, further PDUs are dropped like an overloaded BMC would.
+    Responses of requests registered as cacheable are encoded once and
+    then answered from the response cache.
+    Connections are removed when their session is closed or after
+    `connection_timeout` seconds without a message. `sensors` is an
+    optional `SensorEngine` shared by all connections.
+    """
+
+    def __init__(self, config=None, workers=4, max_pending=4096,
+                 connection_timeout=60, sensors=None):
+        self.config = config
+        self.sensors = sensors
+        self.workers = workers
+        self.max_pending = max_pending
+        self.connection_timeout = connection_timeout
+        self.connections = {}
+        self.response_cache = {}
+        self.statistics = EmulatorStatistics()
+        self.transport = None
+        self._ready = None
+        self._pending = 0
+        self._tasks = []
+
+    def connection_made(self, transport):
+        self.transport = transport
+        self._ready = asyncio.Queue()
+        loop = asyncio.get_event_loop()
+        self._tasks = [loop.create_task(self._worker())
+                       for _ in range(self.workers)]
+
+    def connection_lost(self, exc):
+        for task in self._tasks:
+            task.cancel()
+        self._tasks = []
+
+    def datagram_received(self, pdu, addr):
+        self.statistics.received += 1
+        if self._pending >= self.max_pending:
+            self.statistics.dropped += 1
+            return
+
+        context = self.connections.get(addr)
+        if context is None:
+            context = self.create_context(addr)
+            self.connections[addr] = context
+
+        context.last_seen = time.monotonic()
+        context.pending.append(pdu)
+        self._pending += 1
+        if not context.scheduled:
+            context.scheduled = True
+            self._ready.put_nowait(context)
+
+    def create_context(self, addr):
+        context = ConnectionContext(self.config, self.transport, addr)
+        context.response_cache = self.response_cache
+        if self.sensors is not None:
+            context.sensors = self.sensors
+            context.sel_list = self.sensors.sel_list
+        return context
+
+    async def _worker(self):
+        while True:
+            context = await self._ready.get()
+            while context.pending:
+                pdu = context.pending.popleft()
+                self._pending -= 1
+                try:
+                    rsp = await handle_rmcp_msg_async(context, pdu)
+                except Exception:
+                    self.statistics.errors += 1
+                    log().exception('cannot handle message from {}'.format(
+                        context.addr))
+                    continue
+                self.statistics.handled += 1
+                if context.state == context.STATE_CLOSED:
+                    self.connections.pop(context.addr, None)
+                if rsp is not None:
+                    self.send_response(context, rsp)
+            context.scheduled = False
+
+    def send_response(self, context, pdu):
+        self.transport.sendto(pdu, context.addr)
+
+    def expire_connections(self):
+        """Remove the connections idle for longer than the timeout."""
+        deadline = time.monotonic() - self.connection_timeout
+        for (addr, context) in list(self.connections.items()):
+            if context.last_seen < deadline and not context.scheduled:
+                del self.connections[addr]
+
+
+async def start_server(config=None, host=UDP_IP, port=UDP_PORT,
+                       receive_buffer_size=4 * 1024 * 1024,
+                       protocol_factory=None, **kwargs):
+    """Start the emulator and return the `(transport, protocol)` pair.
+
+    The keyword arguments are passed to `EmulatorProtocol` or the
+    `protocol_factory`.
+    """
+    if protocol_factory is None:
+        protocol_factory = EmulatorProtocol
+    loop = asyncio.get_event_loop()
+    (transport, protocol) = await loop.create_datagram_endpoint(
+        lambda: protocol_factory(config, **kwargs), local_addr=(host, port))
+    sock = transport.get_extra_info('socket')
+    # absorb bursts of requests
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, receive_buffer_size)
+    return (transport, protocol)
+
+
+async def serve(config=None, host=UDP_IP, port=UDP_PORT, report_interval=10,
+                **kwargs):
+    """Run the emulator until cancelled.
+
+    Every `report_interval` seconds the throughput is logged and idle
+    connections are removed.
+    """
+    (transport, protocol) = await start_server(config, host, port, **kwargs)
+    stats = protocol.statistics
     try:
-        handler = {
-                    rmcp.RMCP_CLASS_ASF: handle_rmcp_asf_msg,
-                    rmcp.RMCP_CLASS_IPMI: handle_rmcp_ipmi_msg,
-                  }[msg.class_of_msg]
-
-        tx_data = handler(context, sdu)
-        rmcp_msg = rmcp.RmcpMsg(msg.class_of_msg)
-        pdu = rmcp_msg.pack(tx_data, context.session.sequence_number)
-        context.sock.sendto(pdu, context.addr)
-    except IndexError:
-        print('unknown class_of_msg {}'.format(msg.class_of_msg))
+        while True:
+            await asyncio.sleep(report_interval)
+            protocol.expire_connections()
+            log().info('{:.0f} requests/s, {} connections, {} received, '
+                       '{} dropped, {} errors'.format(
+                           stats.rate(), len(protocol.connections),
+                           stats.received, stats.dropped, stats.errors))
+    finally:
+        transport.close()
 
 
 def main(args=None):
     parser = argparse.ArgumentParser(description="IPMI server emulation.")
     parser.add_argument("-p", "--port", type=int, dest="port", help="RMCP port", default=623)
     parser.add_argument("-c", "--config", type=str, dest="config", help="Config file")
+    parser.add_argument("-w", "--workers", type=int, dest="workers",
+                        help="number of concurrent workers", default=4)
+    parser.add_argument("-r", "--report-interval", type=float,
+                        dest="report_interval",
+                        help="seconds between throughput reports", default=10)
     parser.add_argument(
         "-v", action="store_true", dest="verbose", help="be more verbose"
     )
@@ -366,42 +828,33 @@ def main(args=None):
     handler = logging.StreamHandler()
     if args.verbose:
         handler.setLevel(logging.DEBUG)
+        pyipmi.logger.set_log_level(logging.DEBUG)
     else:
         handler.setLevel(logging.INFO)
+        pyipmi.logger.set_log_level(logging.INFO)
     pyipmi.logger.add_log_handler(handler)
-    pyipmi.logger.set_log_level(logging.DEBUG)
 
     config = None
+    sensors = None
     if args.config:
         with open(args.config, 'r') as stream:
             config = yaml.safe_load(stream)
 
         if 'sdr' in config:
             load_sdr_dump(config['sdr'])
+        if 'sel' in config:
+            load_sel_dump(config['sel'])
+        if 'sensors' in config:
+            # simulate the sensor readings and their SEL events
+            sensors = SensorEngine(sdr_list, sel_list,
+                                   **(config['sensors'] or {}))
 
-    sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
-    sock.bind((UDP_IP, args.port))
-
-    connections = {}
-
-    while True:
-        pdu, addr = sock.recvfrom(1024) # buffer size is 1024 bytes
-
-        # create new connection
-        if addr not in connections:
-            connections[addr] = ConnectionContext(config, sock, addr)
-
-        # remove for closed connections from dict
-        connections = {
-            key: value
-            for key, value in connections.items()
-            if value.state != value.STATE_CLOSED
-        }
-
-        thread = threading.Thread(target=handle_thread,
-                                  args=(connections[addr], pdu))
-        thread.daemon = True
-        thread.start()
+    try:
+        pyipmi.aio.run(serve(config, UDP_IP, args.port,
+                             report_interval=args.report_interval,
+                             workers=args.workers, sensors=sensors))
+    except KeyboardInterrupt:
+        pass
 
 
 if __name__ == '__main__':
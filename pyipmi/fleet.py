@@ -0,0 +1,197 @@
+# Copyright (c) 2018  Kontron Europe GmbH
+#
+# This library is free software; you can redistribute it and/or
+# modify it under the terms of the GNU Lesser General Public
+# License as published by the Free Software Foundation; either
+# version 2.1 of the License, or (at your option) any later version.
+#
+# This library is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# Lesser General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public
+# License along with this library; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301 USA
+
+"""Run an operation on many BMCs concurrently.
+
+    endpoints = [Endpoint(host, 'admin', 'secret') for host in hosts]
+    fleet = Fleet(endpoints, max_workers=64, retries=1)
+    for result in fleet.map(lambda ipmi: ipmi.get_chassis_status()):
+        if result.ok:
+            print(result.endpoint.host, result.value.power_on)
+        else:
+            print(result.endpoint.host, 'failed:', result.error)
+"""
+
+import socket
+import time
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+
+from . import create_connection, Target
+from .errors import IpmiTimeoutError
+from .interfaces import create_interface
+from .logger import log
+
+
+class Endpoint(object):
+    """A BMC reachable over the network."""
+
+    def __init__(self, host, username='', password='', port=623,
+                 target=0x20, routing=None, interface='rmcp',
+                 **interface_options):
+        self.host = host
+        self.port = port
+        self.username = username
+        self.password = password
+        self.target = target
+        self.routing = routing
+        self.interface = interface
+        self.interface_options = interface_options
+
+    def __str__(self):
+        return '%s:%d' % (self.host, self.port)
+
+
+class FleetResult(object):
+    """The outcome of the operation on one endpoint.
+
+    Either `value` is the return value of the operation or `error` is the
+    exception raised by it. Timeouts are always reported as
+    `IpmiTimeoutError`.
+    """
+
+    def __init__(self, endpoint, value=None, error=None, attempts=1,
+                 duration=0):
+        self.endpoint = endpoint
+        self.value = value
+        self.error = error
+        self.attempts = attempts
+        self.duration = duration
+
+    @property
+    def ok(self):
+        return self.error is None
+
+    def __str__(self):
+        if self.ok:
+            return '%s: %s' % (self.endpoint, self.value)
+        return '%s: %s: %s' % (self.endpoint, type(self.error).__name__,
+                               self.error)
+
+
+class Fleet(object):
+    """Execute functions taking an `Ipmi` object on many endpoints.
+
+    `max_workers` limits the number of endpoints handled at once.
+    `timeout` is the response timeout of the interfaces.
+    `retries` is the number of additional attempts after a timeout, each
+    with a new session.
+    `budget` limits the total time in seconds spent on one endpoint, no
+    further attempt is started once it is used up.
+    `multiplexer` is an optional `RmcpMultiplexer` shared by the RMCP
+    interfaces of all endpoints.
+    `hooks` are added to the `Ipmi` object of every endpoint, see
+    `pyipmi.instrumentation`.
+    """
+
+    def __init__(self, endpoints, max_workers=32, timeout=2.0, retries=0,
+                 budget=None, multiplexer=None, hooks=()):
+        self.endpoints = list(endpoints)
+        self.max_workers = max_workers
+        self.timeout = timeout
+        self.retries = retries
+        self.budget = budget
+        self.multiplexer = multiplexer
+        self.hooks = tuple(hooks)
+
+    def connect(self, endpoint):
+        """Return an `Ipmi` object with an established session."""
+        options = dict(endpoint.interface_options)
+        if endpoint.interface == 'rmcp':
+            options.setdefault('timeout', self.timeout)
+            options.setdefault('keep_alive_interval', 0)
+            if self.multiplexer is not None:
+                options.setdefault('multiplexer', self.multiplexer)
+        interface = create_interface(endpoint.interface, **options)
+
+        ipmi = create_connection(interface)
+        ipmi.session.set_session_type_rmcp(endpoint.host, endpoint.port)
+        ipmi.session.set_auth_type_user(endpoint.username, endpoint.password)
+        ipmi.target = Target(endpoint.target, endpoint.routing)
+        for hook in self.hooks:
+            ipmi.add_hook(hook)
+        try:
+            ipmi.session.establish()
+        except Exception:
+            self.disconnect(ipmi)
+            raise
+        return ipmi
+
+    def disconnect(self, ipmi):
+        try:
+            if ipmi.session.activated:
+                ipmi.session.close()
+        except Exception as e:
+            log().debug('close session failed: %s', e)
+        if hasattr(ipmi.interface, 'close'):
+            ipmi.interface.close()
+
+    def _attempt(self, endpoint, fn):
+        ipmi = self.connect(endpoint)
+        try:
+            return fn(ipmi)
+        finally:
+            self.disconnect(ipmi)
+
+    def execute(self, endpoint, fn):
+        """Run `fn` on a single endpoint and return a `FleetResult`."""
+        start = time.time()
+        attempts = 0
+        while True:
+            attempts += 1
+            try:
+                value = self._attempt(endpoint, fn)
+                return FleetResult(endpoint, value, None, attempts,
+                                   time.time() - start)
+            except (IpmiTimeoutError, socket.timeout) as e:
+                error = IpmiTimeoutError(str(e) or 'timeout')
+            except Exception as e:
+                return FleetResult(endpoint, None, e, attempts,
+                                   time.time() - start)
+
+            elapsed = time.time() - start
+            if attempts > self.retries:
+                break
+            if self.budget is not None and elapsed + self.timeout > self.budget:
+                break
+            log().debug('%s: retry after timeout', endpoint)
+
+        return FleetResult(endpoint, None, error, attempts, elapsed)
+
+    def map(self, fn):
+        """Run `fn(ipmi)` on all endpoints.
+
+        Returns a generator of `FleetResult` in the order of completion.
+        At most `max_workers` endpoints are handled at the same time.
+        """
+        endpoints = iter(self.endpoints)
+        with ThreadPoolExecutor(self.max_workers) as executor:
+            pending = set()
+            while True:
+                for endpoint in endpoints:
+                    pending.add(executor.submit(self.execute, endpoint, fn))
+                    if len(pending) >= self.max_workers:
+                        break
+                if not pending:
+                    break
+                (done, pending) = wait(pending, return_when=FIRST_COMPLETED)
+                for future in done:
+                    yield future.result()
+
+    def run(self, fn):
+        """Run `fn(ipmi)` on all endpoints and return the results in the
+        order of the endpoints."""
+        results = dict((id(r.endpoint), r) for r in self.map(fn))
+        return [results[id(endpoint)] for endpoint in self.endpoints]
@@ -18,17 +18,176 @@ import array
 import codecs
 import datetime
 import os
+import socket
 
-from .errors import DecodingError, CompletionCodeError
-from .msgs import constants
-from .utils import bcd_search, chunks, py3_array_tobytes
+from .errors import (DecodingError, CompletionCodeError, IpmiTimeoutError,
+                     RetryError)
+from .logger import log
+from .msgs import constants, create_request_by_name
+from .helper import run_steps
+from .utils import bcd_search, byte_view, check_completion_code, chunks
 
 codecs.register(bcd_search)
 
 
+class FruReadSize(object):
+    """The number of bytes a FRU device returns with one read.
+
+    Starts with 32 bytes. After a few successful reads a bigger size is
+    probed, doubling until a size is rejected and then bisecting between
+    the working and the rejected size. Devices
+    returning less than requested set the size to what they returned.
+    """
+
+    INITIAL_SIZE = 32
+    # the count of ReadFruData is a single byte
+    MAX_SIZE = 255
+    PROBE_AFTER = 2
+
+    def __init__(self, size=INITIAL_SIZE):
+        self.size = size
+        self.good = 0
+        self.ceiling = self.MAX_SIZE + 1
+        self.successes = 0
+
+    def length(self, remaining):
+        return min(self.size, remaining)
+
+    # stop probing when the next probe would gain less
+    MIN_PROBE_STEP = 8
+
+    def _probe_size(self):
+        if self.ceiling > self.MAX_SIZE:
+            probe = min(self.size * 2, self.MAX_SIZE)
+        else:
+            # bisect between the size that works and the one that failed
+            probe = (self.size + self.ceiling) // 2
+        if probe - self.size < self.MIN_PROBE_STEP:
+            return self.size
+        return probe
+
+    @property
+    def settled(self):
+        """True if the size works and no bigger size will be probed."""
+        return self.good >= self.size and self._probe_size() <= self.size
+
+    def probing(self, length):
+        """True if a read of `length` bytes is a probe beyond a size
+        known to work. Without such a size a timeout can't be blamed on
+        the length."""
+        return 0 < self.good < length
+
+    def succeeded(self, length, count):
+        if count < length:
+            self.size = count
+            self.good = count
+            self.ceiling = count + 1
+            return
+        if length < self.size:
+            # end of the area
+            return
+        self.good = max(self.good, length)
+        self.successes += 1
+        if self.successes >= self.PROBE_AFTER:
+            self.successes = 0
+            probe = self._probe_size()
+            if probe > self.size:
+                log().debug('probing FRU read size %d', probe)
+                self.size = probe
+
+    def failed(self, length):
+        """A read of `length` bytes was not possible."""
+        self.ceiling = min(self.ceiling, length)
+        self.successes = 0
+        if self.good and self.good < length:
+            # the probe failed, go back to what worked
+            self.size = self.good
+            return
+        if length <= 1:
+            raise RetryError()
+        size = min(self.size, length)
+        self.size = max(1, size - max(2, size // 4))
+        self.good = min(self.good, self.size)
+
+
+def fru_data_steps(fru_id, off, area_size, read_size, pipelining=False):
+    """The steps of reading the FRU data from `off` to `area_size`.
+
+    Yields ('send', req) and, with `pipelining` once the read size
+    settled, ('send_many', reqs) for the remaining chunks. Returns the
+    data.
+    """
+    start = off
+    buf = bytearray(area_size - off)
+
+    while off < area_size:
+        length = read_size.length(area_size - off)
+
+        if pipelining and read_size.settled and area_size - off > length:
+            reqs = []
+            for chunk_off in range(off, area_size, length):
+                req = create_request_by_name('ReadFruData')
+                req.fru_id = fru_id
+                req.offset = chunk_off
+                req.count = min(length, area_size - chunk_off)
+                reqs.append(req)
+
+            # continue with single reads at the first chunk not read
+            off = area_size
+            try:
+                rsps = yield ('send_many', reqs)
+            except (IpmiTimeoutError, socket.timeout):
+                # read the chunks one by one
+                (rsps, off) = ([], reqs[0].offset)
+            for (req, rsp) in zip(reqs, rsps):
+                if rsp.completion_code != constants.CC_OK \
+                        or rsp.count != req.count:
+                    off = req.offset
+                    break
+                buf[req.offset - start:req.offset - start + rsp.count] = \
+                    rsp.data
+            if off >= area_size:
+                break
+            length = read_size.length(area_size - off)
+
+        req = create_request_by_name('ReadFruData')
+        req.fru_id = fru_id
+        req.offset = off
+        req.count = length
+        try:
+            rsp = yield ('send', req)
+            check_completion_code(rsp.completion_code)
+        except CompletionCodeError as ex:
+            if ex.cc in (constants.CC_CANT_RET_NUM_REQ_BYTES,
+                         constants.CC_REQ_DATA_FIELD_EXCEED,
+                         constants.CC_PARAM_OUT_OF_RANGE):
+                read_size.failed(length)
+                continue
+            else:
+                raise
+        except (IpmiTimeoutError, socket.timeout):
+            # a device might not answer a probe bigger than it supports,
+            # Rmcp raises socket.timeout
+            if not read_size.probing(length):
+                raise
+            read_size.failed(length)
+            continue
+
+        if rsp.count == 0:
+            raise DecodingError('no FRU data returned at offset %d' % off)
+        buf[off - start:off - start + rsp.count] = rsp.data[:rsp.count]
+        read_size.succeeded(length, rsp.count)
+        off += rsp.count
+
+    return bytes(buf)
+
+
 class Fru(object):
     def __init__(self):
         self.write_length = 16
+        # optional `FruCache`
+        self.fru_cache = None
+        self._fru_read_sizes = {}
 
     def get_fru_inventory_area_info(self, fru_id=0):
         rsp = self.send_message_with_name('GetFruInventoryAreaInfo',
@@ -49,10 +208,14 @@ class Fru(object):
 
             offset += len(chunk)
 
-    def read_fru_data(self, offset=None, count=None, fru_id=0):
-        req_size = 32
-        data = array.array('B')
+    def _get_fru_read_size(self, fru_id):
+        """Return the learned FRU read size of the current target."""
+        key = (str(self.target), fru_id)
+        if key not in self._fru_read_sizes:
+            self._fru_read_sizes[key] = FruReadSize()
+        return self._fru_read_sizes[key]
 
+    def read_fru_data(self, offset=None, count=None, fru_id=0):
         # first check for maximum area size
         if offset is None:
             area_size = self.get_fru_inventory_area_info(fru_id)
@@ -61,31 +224,96 @@ class Fru(object):
             area_size = offset + count
             off = offset
 
-        while off < area_size:
-            if (off + req_size) > area_size:
-                req_size = area_size - off
+        pipelining = hasattr(self.interface, 'send_and_receive_many')
+        return run_steps(
+                fru_data_steps(fru_id, off, area_size,
+                               self._get_fru_read_size(fru_id), pipelining),
+                send=self.send_message, send_many=self.send_many)
 
+    def get_fru_inventory(self, fru_id=0):
+        if self.fru_cache is None:
+            return FruInventory(self.read_fru_data(fru_id=fru_id))
+        return FruInventory(self._cached_fru_data(fru_id))
+
+    def _cached_fru_data(self, fru_id):
+        identity = self._cache_identity()
+        cached = self.fru_cache.load(identity, fru_id)
+
+        data = None
+        if cached is not None:
             try:
-                rsp = self.send_message_with_name('ReadFruData', fru_id=fru_id,
-                                                  offset=off, count=req_size)
-            except CompletionCodeError as ex:
-                if ex.cc in (constants.CC_CANT_RET_NUM_REQ_BYTES,
-                             constants.CC_REQ_DATA_FIELD_EXCEED,
-                             constants.CC_PARAM_OUT_OF_RANGE):
-                    req_size -= 2
-                    if req_size <= 0:
-                        raise
-                    continue
-                else:
-                    raise
-
-            data.extend(rsp.data)
-            off += rsp.count
-
-        return py3_array_tobytes(data)
+                data = self._refresh_fru_data(cached, fru_id)
+            except DecodingError:
+                data = None
+        if data is None:
+            data = self.read_fru_data(fru_id=fru_id)
+
+        if data != cached:
+            self.fru_cache.store(identity, fru_id, data)
+        return data
+
+    def _refresh_fru_data(self, cached, fru_id=0):
+        """Bring the cached FRU data up to date.
+
+        Only the common header, the headers and checksums of the info
+        areas and the multirecord headers are read. Areas and records
+        whose length or checksum differs are read again.
+
+        Returns None if the layout changed and everything has to be read.
+        """
+        area_size = self.get_fru_inventory_area_info(fru_id)
+        if area_size != len(cached):
+            return None
+        header = self.read_fru_data(0, 8, fru_id)
+        if header != cached[:8]:
+            return None
+        common_header = InventoryCommonHeader(byte_view(header))
+
+        data = bytearray(cached)
+
+        def update(offset, count):
+            data[offset:offset + count] = \
+                self.read_fru_data(offset, count, fru_id)
+
+        internal_use_offset = common_header.internal_use_area_offset
+        if internal_use_offset:
+            # no length and checksum, it ends where the next area starts
+            end = min([o for o in (common_header.chassis_info_area_offset,
+                                   common_header.board_info_area_offset,
+                                   common_header.product_info_area_offset,
+                                   common_header.multirecord_area_offset)
+                       if o and o > internal_use_offset] + [area_size])
+            update(internal_use_offset, end - internal_use_offset)
+
+        for offset in (common_header.chassis_info_area_offset,
+                       common_header.board_info_area_offset,
+                       common_header.product_info_area_offset):
+            if not offset:
+                continue
+            area_header = self.read_fru_data(offset, 2, fru_id)
+            length = bytearray(area_header)[1] * 8
+            if length == 0 or offset + length > area_size:
+                return None
+            checksum = self.read_fru_data(offset + length - 1, 1, fru_id)
+            if area_header != bytes(data[offset:offset + 2]) or \
+                    checksum != bytes(data[offset + length - 1:
+                                           offset + length]):
+                update(offset, length)
+
+        offset = common_header.multirecord_area_offset
+        while offset:
+            if offset + 5 > area_size:
+                return None
+            record_header = self.read_fru_data(offset, 5, fru_id)
+            (_, end_of_list, length) = bytearray(record_header)[:3]
+            if record_header != bytes(data[offset:offset + 5]):
+                data[offset:offset + 5] = record_header
+                update(offset + 5, length)
+            offset += 5 + length
+            if end_of_list & 0x80:
+                break
 
-    def get_fru_inventory(self, fru_id=0):
-        return FruInventory(self.read_fru_data(fru_id=fru_id))
+        return bytes(data)
 
 
 def get_fru_inventory_from_file(filename):
@@ -110,6 +338,9 @@ class FruDataField(object):
     TYPE_ASCII_OR_UTF16 = 3
 
     def __init__(self, data=None, offset=0, force_lang_english=False):
+        self._data = None
+        self._raw = None
+        self._value = None
         if data:
             self._from_data(data, offset, force_lang_english)
 
@@ -120,19 +351,41 @@ class FruDataField(object):
             return self.value.replace('\x00', '')
 
     def _from_data(self, data, offset=0, force_lang_english=False):
+        # only the type/length byte is decoded here, `raw` and `value`
+        # are taken from `data` on first access
+        self._data = data
         self.offset = offset
         self.field_type = data[offset] >> 6 & 0x3
         self.length = data[offset] & 0x3f
 
-        self.raw = data[offset+1:offset+1+self.length]
-
-        chr_data = ''.join([chr(c) for c in self.raw])
-        if self.field_type == self.TYPE_BCD_PLUS:
-            self.value = chr_data.decode('bcd+')
-        elif self.field_type == self.TYPE_6BIT_ASCII:
-            self.value = chr_data.decode('6bitascii')
-        else:
-            self.value = chr_data
+    @property
+    def raw(self):
+        if self._raw is None and self._data is not None:
+            raw = self._data[self.offset+1:self.offset+1+self.length]
+            if isinstance(raw, memoryview):
+                raw = raw.tobytes()
+            self._raw = raw
+        return self._raw
+
+    @raw.setter
+    def raw(self, raw):
+        self._raw = raw
+
+    @property
+    def value(self):
+        if self._value is None and self.raw is not None:
+            chr_data = ''.join([chr(c) for c in self.raw])
+            if self.field_type == self.TYPE_BCD_PLUS:
+                self._value = chr_data.decode('bcd+')
+            elif self.field_type == self.TYPE_6BIT_ASCII:
+                self._value = chr_data.decode('6bitascii')
+            else:
+                self._value = chr_data
+        return self._value
+
+    @value.setter
+    def value(self, value):
+        self._value = value
 
 
 CUSTOM_FIELD_END = 0xc1
@@ -287,6 +540,8 @@ class FruDataMultiRecord(FruData):
         if sum(data[:5]) % 256 != 0:
             raise DecodingError('FruDataMultiRecord header checksum failed')
         self.raw = data[5:5+self.length]
+        if isinstance(self.raw, memoryview):
+            self.raw = self.raw.tobytes()
         if (sum(self.raw) + data[3]) % 256 != 0:
             raise DecodingError('FruDataMultiRecord record checksum failed')
 
@@ -348,7 +603,7 @@ class FruPicmgRecord(FruDataMultiRecord):
     def _from_data(self, data):
         if len(data) < 10:
             raise DecodingError('data too short')
-        data = array.array('B', data)
+        data = array.array('B', data[:5 + data[2]])
         FruDataMultiRecord._from_data(self, data)
         self.manufacturer_id = \
             data[5] | data[6] << 8 | data[7] << 16
@@ -371,6 +626,7 @@ class InventoryMultiRecordArea(object):
             self._from_data(data)
 
     def _from_data(self, data):
+        data = byte_view(data)
         self.records = list()
         offset = 0
         while True:
@@ -381,32 +637,60 @@ class InventoryMultiRecordArea(object):
                 break
 
 
+class _LazyArea(object):
+    """Decode an area of the `FruInventory` on first access."""
+
+    def __init__(self, offset_name, area_class):
+        self.offset_name = offset_name
+        self.area_class = area_class
+
+    def __set_name__(self, owner, name):
+        self.name = name
+
+    def __get__(self, inventory, owner=None):
+        if inventory is None:
+            return self
+        areas = inventory._areas
+        if self.name not in areas:
+            area = None
+            header = inventory.common_header
+            offset = getattr(header, self.offset_name) if header else None
+            if offset:
+                area = self.area_class(inventory._view[offset:])
+            areas[self.name] = area
+        return areas[self.name]
+
+    def __set__(self, inventory, area):
+        inventory._areas[self.name] = area
+
+
 class FruInventory(object):
+    """The FRU inventory.
+
+    Only the common header is decoded on creation. The areas are decoded
+    from views into the shared data on first access.
+    """
+
+    chassis_info_area = _LazyArea('chassis_info_area_offset',
+                                  InventoryChassisInfoArea)
+    board_info_area = _LazyArea('board_info_area_offset',
+                                InventoryBoardInfoArea)
+    product_info_area = _LazyArea('product_info_area_offset',
+                                  InventoryProductInfoArea)
+    multirecord_area = _LazyArea('multirecord_area_offset',
+                                 InventoryMultiRecordArea)
+
     def __init__(self, data=None):
-        self.chassis_info_area = None
-        self.board_info_area = None
-        self.product_info_area = None
-        self.multirecord_area = None
+        self._areas = {}
+        self._view = None
+        self.common_header = None
 
         if data:
             self._from_data(data)
 
     def _from_data(self, data):
         self.raw = data
-        self.common_header = InventoryCommonHeader(data[:8])
-
-        if self.common_header.chassis_info_area_offset:
-            self.chassis_info_area = InventoryChassisInfoArea(
-                data[self.common_header.chassis_info_area_offset:])
-
-        if self.common_header.board_info_area_offset:
-            self.board_info_area = InventoryBoardInfoArea(
-                data[self.common_header.board_info_area_offset:])
-
-        if self.common_header.product_info_area_offset:
-            self.product_info_area = InventoryProductInfoArea(
-                data[self.common_header.product_info_area_offset:])
-
-        if self.common_header.multirecord_area_offset:
-            self.multirecord_area = InventoryMultiRecordArea(
-                data[self.common_header.multirecord_area_offset:])
+        # areas are decoded from views sharing the memory of `data`
+        self._view = byte_view(data)
+        self.common_header = InventoryCommonHeader(self._view[:8])
+        self._areas = {}
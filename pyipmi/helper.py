@@ -17,28 +17,59 @@
 import time
 
 from .errors import CompletionCodeError, RetryError
-from .utils import check_completion_code, ByteBuffer
+from .utils import check_completion_code, ByteReader, ByteWriter
 from .msgs import constants
 
 
-def get_sdr_chunk_helper(send_fn, req, reserve_fn, retry=5):
+def run_steps(steps, **operations):
+    """Run the requests of a read state machine with blocking calls.
+
+    `steps` is a generator yielding `(operation, arg, ...)` tuples. The
+    result of `operations[operation](arg, ...)` is sent back to it, an
+    exception is thrown into it. Returns the return value of the
+    generator.
+
+    The state machines are shared with `aio`, which runs them with
+    coroutines.
+    """
+    (result, error) = (None, None)
+    while True:
+        try:
+            if error is None:
+                step = steps.send(result)
+            else:
+                step = steps.throw(error)
+        except StopIteration as e:
+            return e.value
+
+        try:
+            (result, error) = (operations[step[0]](*step[1:]), None)
+        except Exception as e:
+            (result, error) = (None, e)
+
 
+def sdr_chunk_steps(req, retry=5):
+    """The steps of sending a GetSdr or GetDeviceSdr request.
+
+    Yields ('send', req), ('reserve',) and ('sleep', seconds), returns
+    the response.
+    """
     while True:
         retry -= 1
         if retry == 0:
             raise RetryError()
-        rsp = send_fn(req)
+        rsp = yield ('send', req)
         if rsp.completion_code == constants.CC_OK:
             break
         elif rsp.completion_code == constants.CC_RES_CANCELED:
-            req.reservation_id = reserve_fn()
-            time.sleep(0.1)
+            req.reservation_id = yield ('reserve',)
+            yield ('sleep', 0.1)
             continue
         elif rsp.completion_code == constants.CC_TIMEOUT:
-            time.sleep(0.1)
+            yield ('sleep', 0.1)
             continue
         elif rsp.completion_code == constants.CC_RESP_COULD_NOT_BE_PRV:
-            time.sleep(0.1 * retry)
+            yield ('sleep', 0.1 * retry)
             continue
         else:
             check_completion_code(rsp.completion_code)
@@ -46,58 +77,174 @@ def get_sdr_chunk_helper(send_fn, req, reserve_fn, retry=5):
     return rsp
 
 
-def get_sdr_data_helper(reserve_fn, get_fn, record_id, reservation_id=None):
-    """Helper function to retrieve the sdr data.
+def get_sdr_chunk_helper(send_fn, req, reserve_fn, retry=5):
+    return run_steps(sdr_chunk_steps(req, retry), send=send_fn,
+                     reserve=reserve_fn, sleep=time.sleep)
 
-    A specified helper function is used to retrieve the chunks.
 
-    This can be used for SDRs from the Sensor Device or form the SDR
-    repository.
+SDR_HEADER_LENGTH = 5
+SDR_READ_ENTIRE_RECORD = 0xff
+
+# completion codes of devices rejecting the length of a read
+READ_LENGTH_ERRORS = (constants.CC_CANT_RET_NUM_REQ_BYTES,
+                      constants.CC_REQ_DATA_INV_LENGTH,
+                      constants.CC_REQ_DATA_FIELD_EXCEED,
+                      constants.CC_PARAM_OUT_OF_RANGE,
+                      constants.CC_INV_DATA_FIELD_IN_REQ)
+
+
+class SdrReadSize(object):
+    """The number of bytes a device returns with one SDR read.
+
+    Starts with reading the entire record, header and body at once. If
+    the device can not return that many bytes, the size is reduced and
+    remembered for the following records. After a few successful reads a
+    bigger size is probed again, bisecting between the size that works
+    and the smallest one that failed.
     """
-    if reservation_id is None:
-        reservation_id = reserve_fn()
 
-    (next_id, data) = get_fn(reservation_id, record_id, 0, 5)
+    PROBE_LENGTH = 64
+    PROBE_AFTER = 8
+    # stop probing when the next probe would gain less
+    MIN_PROBE_STEP = 4
+
+    def __init__(self, size=SDR_READ_ENTIRE_RECORD):
+        self.size = size
+        self.combined = True
+        self.good = 0
+        self.ceiling = SDR_READ_ENTIRE_RECORD + 1
+        self.successes = 0
+
+    def first_length(self):
+        """Return the length of the first read of a record."""
+        if self.combined:
+            return self.size
+        return SDR_HEADER_LENGTH
+
+    def _probe_failed(self, length):
+        """Go back to the size that worked if `length` was a probe."""
+        self.ceiling = min(self.ceiling, length)
+        self.successes = 0
+        if self.good and length > self.good:
+            self.size = self.good
+            return True
+        return False
+
+    def first_failed(self, length):
+        """The first read of `length` bytes was not possible."""
+        if self._probe_failed(length):
+            return
+        if length == SDR_READ_ENTIRE_RECORD:
+            self.size = self.PROBE_LENGTH
+        else:
+            # probably beyond the end of the record, read the header first
+            self.combined = False
+
+    def next_length(self, remaining):
+        return min(self.size, remaining)
+
+    def succeeded(self, length):
+        """A read of `length` bytes worked."""
+        if length < self.size:
+            # the end of a record
+            return
+        self.good = max(self.good, length)
+        self.successes += 1
+        if self.successes < self.PROBE_AFTER:
+            return
+        self.successes = 0
+        probe = (self.size + self.ceiling) // 2
+        if probe - self.size >= self.MIN_PROBE_STEP:
+            self.size = probe
+
+    def reduce(self, length):
+        """A read of `length` bytes was not possible."""
+        if self._probe_failed(length):
+            return
+        if length <= 1:
+            raise RetryError()
+        size = min(self.size, length)
+        self.size = max(1, size - max(4, size // 4))
+        self.good = min(self.good, self.size)
+
+
+def sdr_data_steps(record_id, read_size):
+    """The steps of reading a SDR record.
+
+    Yields ('read', record_id, offset, length) which returns the
+    `(next_id, data)` of the chunk. Returns `(next_id, record_data)`.
+    """
+    data = None
+    length = read_size.first_length()
+    if length != SDR_HEADER_LENGTH:
+        try:
+            (next_id, data) = yield ('read', record_id, 0, length)
+            read_size.succeeded(length)
+        except CompletionCodeError as e:
+            if e.cc not in READ_LENGTH_ERRORS:
+                raise
+            read_size.first_failed(length)
+            data = None
+
+    if data is None or len(data) < SDR_HEADER_LENGTH:
+        (next_id, data) = yield ('read', record_id, 0, SDR_HEADER_LENGTH)
 
-    header = ByteBuffer(data)
+    header = ByteReader(data)
     record_id = header.pop_unsigned_int(2)
     record_version = header.pop_unsigned_int(1)
     record_type = header.pop_unsigned_int(1)
     record_payload_length = header.pop_unsigned_int(1)
-    record_length = record_payload_length + 5
-    record_data = ByteBuffer(data)
+    record_length = record_payload_length + SDR_HEADER_LENGTH
+    record_data = ByteWriter(record_length)
+    record_data.extend(data)
 
-    offset = len(record_data)
-    max_req_len = 20
     retry = 20
 
     # now get the other record data
-    while True:
-        retry -= 1
-        if retry == 0:
-            raise RetryError()
-
-        length = max_req_len
-        if (offset + length) > record_length:
-            length = record_length - offset
+    while len(record_data) < record_length:
+        offset = len(record_data)
+        length = read_size.next_length(record_length - offset)
 
         try:
-            (next_id, data) = get_fn(reservation_id, record_id, offset, length)
+            (next_id, data) = yield ('read', record_id, offset, length)
         except CompletionCodeError as e:
-            if e.cc == constants.CC_CANT_RET_NUM_REQ_BYTES:
-                # reduce max lenght
-                max_req_len -= 4
-                if max_req_len <= 0:
-                    retry = 0
-            else:
-                raise CompletionCodeError(e.cc)
+            retry -= 1
+            if retry == 0:
+                raise RetryError()
+            if e.cc in READ_LENGTH_ERRORS:
+                read_size.reduce(length)
+                continue
+            raise CompletionCodeError(e.cc)
 
-        record_data.extend(data[:])
-        offset = len(record_data)
-        if len(record_data) >= record_length:
-            break
+        if len(data) == 0:
+            raise RetryError()
+        read_size.succeeded(length)
+        record_data.extend(data)
+
+    return (next_id, record_data.tobytes()[:record_length])
+
+
+def get_sdr_data_helper(reserve_fn, get_fn, record_id, reservation_id=None,
+                        read_size=None):
+    """Helper function to retrieve the sdr data.
+
+    A specified helper function is used to retrieve the chunks.
+
+    This can be used for SDRs from the Sensor Device or form the SDR
+    repository.
+
+    `read_size` is a `SdrReadSize` that is kept between the records of a
+    device to learn how many bytes can be read at once.
+    """
+    if reservation_id is None:
+        reservation_id = reserve_fn()
+    if read_size is None:
+        read_size = SdrReadSize()
+
+    def read(record_id, offset, length):
+        return get_fn(reservation_id, record_id, offset, length)
 
-    return (next_id, record_data)
+    return run_steps(sdr_data_steps(record_id, read_size), read=read)
 
 
 def _clear_repository(reserve_fn, clear_fn, ctrl, retry, reservation):
@@ -16,11 +16,12 @@
 
 from __future__ import print_function
 
-import os
 import codecs
 import struct
 import collections
 import hashlib
+import mmap
+import socket
 import time
 
 from array import array
@@ -28,7 +29,8 @@ from array import array
 from .errors import CompletionCodeError, HpmError, IpmiTimeoutError
 from .msgs import create_request_by_name
 from .msgs import constants
-from .utils import check_completion_code, bcd_search, chunks
+from .logger import log
+from .utils import check_completion_code, bcd_search
 from .utils import py3dec_unic_bytes_fix, py3_array_tobytes
 from .state import State
 from .fields import VersionField
@@ -60,6 +62,14 @@ CC_QUERY_SELFTEST_IN_PROGRESS = 0x80
 CC_QUERY_SELFTEST_UPGRADE_NOT_SUPPORTED_OVER_INTF = 0x81
 CC_QUERY_SELFTEST_NO_RESULTS_AVAILABLE = 0xD5
 
+# PICMG identifier and block number
+UPLOAD_BLOCK_OVERHEAD = 2
+# fits into a bridged IPMB message
+IPMB_UPLOAD_BLOCK_SIZE = 22
+UPLOAD_LENGTH_ERRORS = (constants.CC_REQ_DATA_INV_LENGTH,
+                        constants.CC_REQ_DATA_FIELD_EXCEED,
+                        constants.CC_REQ_DATA_TRUNC)
+
 CC_ABORT_UPGRADE_CANNOT_ABORT = 0x80
 CC_ABORT_UPGRADE_CANNOT_RESUME_OPERATION = 0x81
 
@@ -139,34 +149,158 @@ class Hpm(object):
                 raise HpmError('initiate_upgrade_action CC=0x%02x' % e.cc)
 
     def upload_firmware_block(self, block_number, data):
-        data = [ord(c) for c in data]
+        data = array('B', data).tolist()
         self.send_message_with_name('UploadFirmwareBlock', number=block_number,
                                     data=data)
 
-    @staticmethod
-    def _determine_max_block_size():
-        return 22
+    def _determine_max_block_size(self):
+        """Return the largest firmware block size for the current target.
 
-    def upload_binary(self, binary, timeout=2, interval=0.1, retry=3):
-        """Upload all firmware blocks from a binary."""
-        block_number = 0
-        block_size = self._determine_max_block_size()
+        Interfaces announce the request data they can carry with
+        `max_request_data_size`. Bridged targets are limited by IPMB.
+        """
+        size = getattr(self.interface, 'max_request_data_size', None)
+        if size is None or self.target.routing:
+            return IPMB_UPLOAD_BLOCK_SIZE
+        return max(IPMB_UPLOAD_BLOCK_SIZE, size - UPLOAD_BLOCK_OVERHEAD)
+
+    def _create_upload_request(self, block_number, data):
+        req = create_request_by_name('UploadFirmwareBlock')
+        req.number = block_number
+        req.data = array('B', data).tolist()
+        return req
+
+    def _upload_window(self, data, offsets, block_size):
+        """Send the blocks at `offsets` pipelined.
+
+        Returns the number of blocks accepted by the target.
+        """
+        reqs = []
+        for offset in offsets:
+            block_number = (offset // block_size) & 0xff
+            reqs.append(self._create_upload_request(
+                block_number, data[offset:offset + block_size]))
+        try:
+            rsps = self.send_many(reqs)
+        except (IpmiTimeoutError, socket.timeout):
+            return 0
+        for (accepted, rsp) in enumerate(rsps):
+            if rsp.completion_code != constants.CC_OK:
+                return accepted
+        return len(rsps)
+
+    def upload_binary(self, binary, timeout=2, interval=0.1, retry=3,
+                      block_size=None, window=1, progress=None):
+        """Upload all firmware blocks from a binary.
+
+        `block_size` defaults to the largest size the interface can carry
+        (see `_determine_max_block_size`). If the target rejects the
+        first block because of its length, or doesn't answer, the size is
+        reduced until the target accepts it.
+
+        `window` > 1 keeps up to `window` blocks outstanding, for
+        interfaces supporting pipelining. Only use it for targets
+        detecting retransmitted blocks by their block number: on any
+        error the upload continues block by block from the first block
+        not accepted.
+
+        `progress` is called with (uploaded bytes, total bytes) after every
+        block or window.
+
+        Returns the `UploadStatistics`.
+        """
+        try:
+            data = memoryview(binary)
+        except TypeError:
+            data = binary
+        total = len(data)
+        if block_size is None:
+            block_size = self._determine_max_block_size()
+        stats = UploadStatistics(block_size)
+        offset = 0
+        retries = retry
+
+        while offset < total:
+            if window > 1:
+                offsets = list(range(offset, min(total, offset +
+                                                 window * block_size),
+                                     block_size))
+                accepted = self._upload_window(data, offsets, block_size)
+                offset += sum(len(data[o:o + block_size])
+                              for o in offsets[:accepted])
+                stats.blocks += accepted
+                if accepted < len(offsets):
+                    log().debug('windowed upload failed at offset %d, '
+                                'continue block by block', offset)
+                    window = 1
+                    stats.retries += 1
+                stats.update(offset, progress, total)
+                continue
 
-        for chunk in chunks(binary, block_size):
+            block_number = (offset // block_size) & 0xff
+            chunk = data[offset:offset + block_size]
             try:
                 self.upload_firmware_block(block_number, chunk)
             except CompletionCodeError as e:
                 if e.cc == CC_LONG_DURATION_CMD_IN_PROGRESS:
-
                     self.wait_for_long_duration_command(
                             constants.CMDID_HPM_UPLOAD_FIRMWARE_BLOCK,
                             timeout, interval)
+                elif offset == 0 and e.cc in UPLOAD_LENGTH_ERRORS \
+                        and block_size > IPMB_UPLOAD_BLOCK_SIZE:
+                    block_size = self._reduce_block_size(block_size)
+                    stats.block_size = block_size
+                    continue
                 else:
                     raise HpmError('upload_firmware_block CC=0x%02x' % e.cc)
-            except IpmiTimeoutError:
-                retry -= 1
-                if retry == 0:
+            except (IpmiTimeoutError, socket.timeout):
+                # Rmcp raises socket.timeout
+                stats.retries += 1
+                if offset == 0 and block_size > IPMB_UPLOAD_BLOCK_SIZE:
+                    # the target might drop requests it can't handle
+                    block_size = self._reduce_block_size(block_size)
+                    stats.block_size = block_size
+                    continue
+                retries -= 1
+                if retries == 0:
                     raise IpmiTimeoutError()
+                continue
+
+            offset += len(chunk)
+            stats.blocks += 1
+            stats.update(offset, progress, total)
+
+        stats.finish()
+        return stats
+
+    @staticmethod
+    def _reduce_block_size(block_size):
+        block_size = max(IPMB_UPLOAD_BLOCK_SIZE, block_size // 2)
+        log().debug('reduce firmware block size to %d', block_size)
+        return block_size
+
+    def upload_blocks(self, blocks, timeout=2, interval=0.1, retry=3):
+        """Upload the firmware blocks of an iterator."""
+        block_number = 0
+
+        for chunk in blocks:
+            while True:
+                try:
+                    self.upload_firmware_block(block_number, chunk)
+                except CompletionCodeError as e:
+                    if e.cc == CC_LONG_DURATION_CMD_IN_PROGRESS:
+                        self.wait_for_long_duration_command(
+                                constants.CMDID_HPM_UPLOAD_FIRMWARE_BLOCK,
+                                timeout, interval)
+                    else:
+                        raise HpmError('upload_firmware_block CC=0x%02x' %
+                                       e.cc)
+                except IpmiTimeoutError:
+                    retry -= 1
+                    if retry == 0:
+                        raise IpmiTimeoutError()
+                    continue
+                break
 
             block_number += 1
             block_number &= 0xff
@@ -267,10 +401,10 @@ class Hpm(object):
 
     @staticmethod
     def get_upgrade_version_from_file(filename):
-        image = UpgradeImage(filename)
-        for action in image.actions:
-            if isinstance(action, UpgradeActionRecordUploadForUpgrade):
-                return action.firmware_version
+        with UpgradeImage(filename) as image:
+            for action in image.actions:
+                if isinstance(action, UpgradeActionRecordUploadForUpgrade):
+                    return action.firmware_version
         return None
 
     @staticmethod
@@ -326,15 +460,22 @@ class Hpm(object):
         if support is not True:
             raise HpmError('no supported component in image')
 
-    def upgrade_stage(self, image, component):
+    def upgrade_stage(self, image, component, **upload_args):
+        """Run the upgrade actions of the component.
+
+        Returns the `UploadStatistics` of the firmware upload or None.
+        """
+        statistics = None
         for action in image.actions:
             if action.components & (1 << component) == 0:
                 continue
             self.initiate_upgrade_action_and_wait(1 << component,
                                                   action.action_type)
             if isinstance(action, UpgradeActionRecordUploadForUpgrade):
-                self.upload_binary(action.firmware_image_data)
+                statistics = self.upload_binary(action.firmware_image_data,
+                                                **upload_args)
                 self.finish_upload_and_wait(component, action.firmware_length)
+        return statistics
 
     def _activation_state_do_self_testing(self):
         pass
@@ -358,17 +499,18 @@ class Hpm(object):
             image.header.inaccessibility_timeout, 1)
         self._activation_state_do_self_testing()
 
-    def install_component_from_image(self, image, component):
+    def install_component_from_image(self, image, component, **upload_args):
         self.abort_firmware_upgrade()
         if component not in image.header.components:
             raise HpmError('component=%d not in image' % component)
         self.preparation_stage(image)
-        self.upgrade_stage(image, component)
+        self.upgrade_stage(image, component, **upload_args)
         self.activation_stage(image, component)
 
-    def install_component_from_file(self, filename, component):
-        image = UpgradeImage(filename)
-        self.install_component_from_image(image, component)
+    def install_component_from_file(self, filename, component, **upload_args):
+        with UpgradeImage(filename) as image:
+            self.install_component_from_image(image, component,
+                                              **upload_args)
 
 
 class UpgradeStatus(State):
@@ -530,6 +672,40 @@ image_header = collections.namedtuple('image_header',
                                       ['field_name', 'format', 'start', 'len'])
 
 
+class UploadStatistics(object):
+    """Statistics of a firmware upload."""
+
+    def __init__(self, block_size):
+        self.block_size = block_size
+        self.blocks = 0
+        self.bytes = 0
+        self.retries = 0
+        self.start = time.time()
+        self.duration = 0
+
+    def update(self, uploaded, progress=None, total=None):
+        self.bytes = uploaded
+        self.duration = time.time() - self.start
+        if progress is not None:
+            progress(uploaded, total)
+
+    def finish(self):
+        self.duration = time.time() - self.start
+
+    @property
+    def throughput(self):
+        """Uploaded bytes per second."""
+        if not self.duration:
+            return 0
+        return self.bytes / self.duration
+
+    def __str__(self):
+        return ('%d bytes in %d blocks of %d bytes, %.1fs, %.1f kB/s, '
+                '%d retries' % (self.bytes, self.blocks, self.block_size,
+                                self.duration, self.throughput / 1000,
+                                self.retries))
+
+
 class UpgradeImageHeaderRecord(object):
     FORMAT = [
         image_header('format_version', 'B', 8, 1),
@@ -551,7 +727,7 @@ class UpgradeImageHeaderRecord(object):
             self._from_data(data)
 
     def _from_data(self, data):
-        self.signature = data[0:8]
+        self.signature = bytes(data[0:8])
 
         for a in self.FORMAT:
             setattr(self, a.field_name, struct.unpack(
@@ -571,7 +747,7 @@ class UpgradeImageHeaderRecord(object):
             VersionField(data[26:26 + VersionField.VERSION_WITH_AUX_FIELD_LEN])
 
         if self.oem_data_length:
-            self.oem_data = data[34:-1]
+            self.oem_data = bytes(data[34:34 + self.oem_data_length])
         # XXX checksum check
         self.checksum = data[34 + self.oem_data_length]
         self.length = 34 + self.oem_data_length+1
@@ -605,24 +781,29 @@ class UpgradeActionRecord(object):
         "Upload for Compare"
     )
 
-    def __init__(self, data=None):
-        self.action_type = array('B', data)[0]
+    def __init__(self, data=None, offset=0):
         if data:
             (self.action, self.components, self.checksum) \
-                = struct.unpack('BBB', data[0:3])
+                = struct.unpack('BBB', bytes(data[offset:offset + 3]))
+            self.action_type = self.action
             self.length = 3
 
     @staticmethod
-    def create_from_data(data):
-        action_type = array('B', data)[0]
+    def create_from_data(data, offset=0):
+        """Create the action record starting at `offset` of `data`.
+
+        `data` can be a `memoryview`, the records only keep offsets into it
+        and no copy of the firmware image is made.
+        """
+        action_type = array('B', data[offset:offset + 1])[0]
         if action_type == ACTION_BACKUP_COMPONENT:
-            return UpgradeActionRecordBackup(data)
+            return UpgradeActionRecordBackup(data, offset)
         elif action_type == ACTION_PREPARE_COMPONENT:
-            return UpgradeActionRecordPrepare(data)
+            return UpgradeActionRecordPrepare(data, offset)
         elif action_type == ACTION_UPLOAD_FOR_UPGRADE:
-            return UpgradeActionRecordUploadForUpgrade(data)
+            return UpgradeActionRecordUploadForUpgrade(data, offset)
         elif action_type == ACTION_UPLOAD_FOR_COMPARE:
-            return UpgradeActionRecordUploadForCompare(data)
+            return UpgradeActionRecordUploadForCompare(data, offset)
         else:
             raise HpmError('unsupported ActionRecord')
 
@@ -643,18 +824,31 @@ class UpgradeActionRecordPrepare(UpgradeActionRecord):
 
 
 class UpgradeActionRecordUploadForUpgrade(UpgradeActionRecord):
-    def __init__(self, data=None):
-        UpgradeActionRecord.__init__(self, data)
+    def __init__(self, data=None, offset=0):
+        UpgradeActionRecord.__init__(self, data, offset)
+        self._data = data
         if data:
+            header = bytes(data[offset:offset + 34])
             self.firmware_version = \
                 VersionField(
-                    data[3:3 + VersionField.VERSION_WITH_AUX_FIELD_LEN])
+                    header[3:3 + VersionField.VERSION_WITH_AUX_FIELD_LEN])
             self.firmware_description_string \
-                = py3dec_unic_bytes_fix(data[9:30])
-            self.firmware_length = struct.unpack('<L', data[30:34])[0]
-            self.firmware_image_data = data[34:(34 + self.firmware_length)]
+                = py3dec_unic_bytes_fix(header[9:30])
+            self.firmware_length = struct.unpack('<L', header[30:34])[0]
+            self.firmware_offset = offset + 34
             self.length += 31 + self.firmware_length
 
+    @property
+    def firmware_image_data(self):
+        return self._data[self.firmware_offset:
+                          self.firmware_offset + self.firmware_length]
+
+    def firmware_blocks(self, block_size):
+        """Return an iterator over the firmware image in upload blocks."""
+        end = self.firmware_offset + self.firmware_length
+        for start in range(self.firmware_offset, end, block_size):
+            yield self._data[start:min(start + block_size, end)]
+
 
 class UpgradeActionRecordUploadForCompare(UpgradeActionRecord):
     pass
@@ -666,15 +860,27 @@ class ImageChecksumRecord(object):
             self._from_data(data)
 
     def _from_data(self, data):
-        self.data = data[0:16]
+        self.data = bytes(data[0:16])
 
 
 HPM_IMAGE_CHECKSUM_SIZE = 16
 
 
 class UpgradeImage(object):
+    """An HPM.1 upgrade image.
+
+    The file is mapped into memory and only read when needed, so several
+    large images can be handled at the same time. Call `close` (or use
+    the image as context manager) to unmap the file.
+    """
+
+    MD5_CHUNK_SIZE = 1024 * 1024
+
     def __init__(self, filename=None):
         self.actions = None
+        self._file = None
+        self._mmap = None
+        self._data = None
 
         if filename:
             self._from_file(filename)
@@ -683,28 +889,39 @@ class UpgradeImage(object):
         str = []
         return "\n".join(str)
 
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
     def _check_md5_sum(self, filedata):
         summer = hashlib.md5()
-        self.checksum_actual \
-            = summer.update(filedata[:-HPM_IMAGE_CHECKSUM_SIZE])
-        self.checksum_expected = filedata[-HPM_IMAGE_CHECKSUM_SIZE:]
+        end = len(filedata) - HPM_IMAGE_CHECKSUM_SIZE
+        for start in range(0, end, self.MD5_CHUNK_SIZE):
+            summer.update(filedata[start:min(start + self.MD5_CHUNK_SIZE,
+                                             end)])
+        self.checksum_actual = summer.digest()
+        self.checksum_expected = bytes(filedata[end:])
 
-    def _from_file(self, filename):
+    @property
+    def checksum_valid(self):
+        return self.checksum_actual == self.checksum_expected
 
+    def _from_file(self, filename):
+        self._file = open(filename, "rb")
         try:
-            file = open(filename, "rb")
-        except IOError:
-            print('Error open file "%s"' % filename)
-
-        ################################
-        # get file size
-        file_size = os.stat(filename).st_size
-        file_data = file.read(file_size)
+            self._mmap = mmap.mmap(self._file.fileno(), 0,
+                                   access=mmap.ACCESS_READ)
+        except ValueError:
+            self._file.close()
+            raise HpmError('empty upgrade image "%s"' % filename)
+        self._data = memoryview(self._mmap)
+        file_data = self._data
 
         ################################
         # get image checksum
         self._check_md5_sum(file_data)
-        # XXX verify checksum
 
         ################################
         # Upgrade Image Header
@@ -715,12 +932,29 @@ class UpgradeImage(object):
         # Upgrade Actions
         self.actions = []
         while (off + HPM_IMAGE_CHECKSUM_SIZE) < len(file_data):
-            action = UpgradeActionRecord.create_from_data(file_data[off:])
+            action = UpgradeActionRecord.create_from_data(file_data, off)
             self.actions.append(action)
             off += action.length
 
         ################################
         # Image checksum
-        self.checksum = ImageChecksumRecord(file_data[off:file_size])
+        self.checksum = ImageChecksumRecord(file_data[off:])
+
+    def close(self):
+        """Unmap the file.
 
-        file.close()
+        The firmware data of the action records is not accessible
+        afterwards.
+        """
+        if self._mmap is None:
+            return
+        self._data.release()
+        try:
+            self._mmap.close()
+        except BufferError:
+            # views into the image are still in use, the mapping is
+            # closed when they are gone
+            pass
+        self._file.close()
+        self._mmap = None
+        self._data = None
@@ -0,0 +1,318 @@
+# Copyright (c) 2018  Kontron Europe GmbH
+#
+# This library is free software; you can redistribute it and/or
+# modify it under the terms of the GNU Lesser General Public
+# License as published by the Free Software Foundation; either
+# version 2.1 of the License, or (at your option) any later version.
+#
+# This library is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# Lesser General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public
+# License along with this library; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301 USA
+
+"""Observe the requests sent by `Ipmi.send_message`.
+
+Hooks are callables getting a `RequestEvent` after every request. The
+`HistogramCollector` hook keeps latency histograms and counters in
+memory, `prometheus_text` exports them in the Prometheus text format:
+
+    collector = HistogramCollector()
+    ipmi.add_hook(collector)
+    ipmi.get_device_id()
+    print(prometheus_text(collector))
+
+Without hooks `send_message` only checks for them, the events are not
+created at all.
+"""
+
+import threading
+import time
+from bisect import bisect_left
+
+from .logger import log
+from .msgs import encode_message
+
+# seconds, from a local emulator to a BMC behind a slow IPMB bridge
+DEFAULT_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1,
+                   0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+
+class RequestEvent(object):
+    """A request sent by `Ipmi`, passed to the hooks when it is done.
+
+    `attempts` counts the sends including the retries after
+    CC_NODE_BUSY and the retransmits of pipelined requests, `duration` is
+    the wall time in seconds of all attempts.
+    `completion_code` is that of the response or of the last
+    `CompletionCodeError`, `error` is the exception raised to the caller
+    or None.
+
+    `request_bytes` and `response_bytes` are the lengths of the IPMI
+    message data (without the session and IPMB headers), computed when
+    read.
+    """
+
+    __slots__ = ('req', 'rsp', 'target', 'attempts', 'duration',
+                 'completion_code', 'error', '_start')
+
+    def __init__(self, req):
+        self.req = req
+        self.rsp = None
+        self.target = req.target
+        self.attempts = 0
+        self.duration = None
+        self.completion_code = None
+        self.error = None
+        self._start = time.perf_counter()
+
+    @property
+    def name(self):
+        name = type(self.req).__name__
+        return name[:-3] if name.endswith('Req') else name
+
+    @property
+    def netfn(self):
+        return self.req.__netfn__
+
+    @property
+    def cmdid(self):
+        return self.req.__cmdid__
+
+    @property
+    def request_bytes(self):
+        return len(encode_message(self.req))
+
+    @property
+    def response_bytes(self):
+        if self.rsp is None:
+            return 0
+        return len(encode_message(self.rsp))
+
+    def finish(self, rsp=None, error=None):
+        self.duration = time.perf_counter() - self._start
+        self.rsp = rsp
+        self.error = error
+        if rsp is not None:
+            self.completion_code = rsp.completion_code
+
+    def __str__(self):
+        return '{} netfn=0x{:02x} cmd=0x{:02x} attempts={} {:.6f}s'.format(
+            self.name, self.netfn, self.cmdid, self.attempts,
+            self.duration or 0)
+
+
+def notify(hooks, event):
+    """Pass the event to all hooks. A failing hook is logged and doesn't
+    affect the request or the other hooks."""
+    for hook in hooks:
+        try:
+            hook(event)
+        except Exception:
+            log().exception('instrumentation hook %r failed', hook)
+
+
+def send_and_notify(hooks, send, req, retry=3):
+    """Send the request with `send(req, retry, event)`, which fills the
+    `RequestEvent`, and notify the hooks."""
+    event = RequestEvent(req)
+    try:
+        rsp = send(req, retry, event)
+    except Exception as e:
+        event.finish(error=e)
+        notify(hooks, event)
+        raise
+
+    event.finish(rsp)
+    notify(hooks, event)
+    return rsp
+
+
+async def send_and_notify_async(hooks, send, req, retry=3):
+    """The coroutine counterpart of `send_and_notify`."""
+    event = RequestEvent(req)
+    try:
+        rsp = await send(req, retry, event)
+    except Exception as e:
+        event.finish(error=e)
+        notify(hooks, event)
+        raise
+
+    event.finish(rsp)
+    notify(hooks, event)
+    return rsp
+
+
+def send_many_and_notify(hooks, send_many, reqs):
+    """Send pipelined requests with `send_many(reqs, attempts)` and notify
+    the hooks.
+
+    `send_many` sets `attempts` to the number of sends of each request.
+    The responses of a pipeline arrive together, so the `duration` of
+    each event is that of the whole pipeline.
+    """
+    events = [RequestEvent(req) for req in reqs]
+    attempts = [1] * len(reqs)
+    try:
+        rsps = send_many(reqs, attempts)
+    except Exception as e:
+        for (event, count) in zip(events, attempts):
+            event.attempts = count
+            event.finish(error=e)
+            notify(hooks, event)
+        raise
+
+    for (event, rsp, count) in zip(events, rsps, attempts):
+        event.attempts = count
+        event.finish(rsp)
+        notify(hooks, event)
+    return rsps
+
+
+class Histogram(object):
+    """A latency histogram with the upper bounds `buckets`."""
+
+    def __init__(self, buckets):
+        self.buckets = buckets
+        # the last count is that of the +Inf bucket
+        self.counts = [0] * (len(buckets) + 1)
+        self.count = 0
+        self.sum = 0.0
+
+    def observe(self, value):
+        self.counts[bisect_left(self.buckets, value)] += 1
+        self.count += 1
+        self.sum += value
+
+    def cumulative_counts(self):
+        total = 0
+        for count in self.counts:
+            total += count
+            yield total
+
+
+class HistogramCollector(object):
+    """A hook keeping the request statistics per command in memory.
+
+    `durations` maps the command names to their `Histogram`,
+    `requests` counts the responses per (command, completion code),
+    `retries` the attempts after the first per command, `errors` the
+    exceptions per (command, exception name) and `bytes_sent` and
+    `bytes_received` the message data per command.
+
+    The byte counts encode the messages again, the collector is a few
+    times faster without them (`count_bytes=False`). It can be shared by
+    the `Ipmi` objects of several threads.
+    """
+
+    def __init__(self, buckets=DEFAULT_BUCKETS, count_bytes=True):
+        self.buckets = tuple(sorted(buckets))
+        self.count_bytes = count_bytes
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        with self._lock:
+            self.durations = {}
+            self.requests = {}
+            self.retries = {}
+            self.errors = {}
+            self.bytes_sent = {}
+            self.bytes_received = {}
+
+    def __call__(self, event):
+        name = event.name
+        if self.count_bytes:
+            sent = event.request_bytes
+            received = event.response_bytes
+
+        with self._lock:
+            histogram = self.durations.get(name)
+            if histogram is None:
+                histogram = self.durations[name] = Histogram(self.buckets)
+            histogram.observe(event.duration)
+
+            if event.completion_code is not None:
+                key = (name, event.completion_code)
+                self.requests[key] = self.requests.get(key, 0) + 1
+            if event.attempts > 1:
+                self.retries[name] = \
+                    self.retries.get(name, 0) + event.attempts - 1
+            if event.error is not None:
+                key = (name, type(event.error).__name__)
+                self.errors[key] = self.errors.get(key, 0) + 1
+            if self.count_bytes:
+                self.bytes_sent[name] = self.bytes_sent.get(name, 0) + sent
+                self.bytes_received[name] = \
+                    self.bytes_received.get(name, 0) + received
+
+
+def _labels(**labels):
+    return '{%s}' % ','.join(
+        '%s="%s"' % (key, str(value).replace('\\', '\\\\')
+                     .replace('"', '\\"').replace('\n', '\\n'))
+        for (key, value) in sorted(labels.items()))
+
+
+def _format_bound(value):
+    return repr(float(value))
+
+
+def prometheus_text(collector, prefix='pyipmi'):
+    """Return the statistics of a `HistogramCollector` in the
+    Prometheus text exposition format."""
+    lines = []
+
+    def metric(name, kind, doc):
+        lines.append('# HELP %s_%s %s' % (prefix, name, doc))
+        lines.append('# TYPE %s_%s %s' % (prefix, name, kind))
+
+    def sample(name, labels, value):
+        lines.append('%s_%s%s %s' % (prefix, name, _labels(**labels),
+                                     value))
+
+    with collector._lock:
+        metric('request_duration_seconds', 'histogram',
+               'Time of the IPMI requests including retries.')
+        for (command, histogram) in sorted(collector.durations.items()):
+            bounds = [_format_bound(b) for b in histogram.buckets] + ['+Inf']
+            for (bound, count) in zip(bounds,
+                                      histogram.cumulative_counts()):
+                sample('request_duration_seconds_bucket',
+                       dict(command=command, le=bound), count)
+            sample('request_duration_seconds_sum', dict(command=command),
+                   repr(histogram.sum))
+            sample('request_duration_seconds_count', dict(command=command),
+                   histogram.count)
+
+        metric('requests_total', 'counter',
+               'IPMI requests by completion code.')
+        for ((command, cc), count) in sorted(collector.requests.items()):
+            sample('requests_total',
+                   dict(command=command, completion_code='0x%02x' % cc),
+                   count)
+
+        metric('request_retries_total', 'counter',
+               'Repeated sends of IPMI requests.')
+        for (command, count) in sorted(collector.retries.items()):
+            sample('request_retries_total', dict(command=command), count)
+
+        metric('request_errors_total', 'counter',
+               'IPMI requests failed with an exception.')
+        for ((command, error), count) in sorted(collector.errors.items()):
+            sample('request_errors_total',
+                   dict(command=command, error=error), count)
+
+        metric('request_bytes_total', 'counter',
+               'IPMI message data sent and received.')
+        for (command, count) in sorted(collector.bytes_sent.items()):
+            sample('request_bytes_total',
+                   dict(command=command, direction='sent'), count)
+        for (command, count) in sorted(collector.bytes_received.items()):
+            sample('request_bytes_total',
+                   dict(command=command, direction='received'), count)
+
+    return '\n'.join(lines) + '\n'
@@ -19,6 +19,8 @@ from .aardvark import Aardvark
 from .ipmbdev import IpmbDev
 from .mock import Mock
 from .rmcp import Rmcp
+from .aiormcp import AsyncRmcp
+from .pool import Pool
 
 INTERFACES = [
     Ipmitool,
@@ -26,6 +28,8 @@ INTERFACES = [
     IpmbDev,
     Mock,
     Rmcp,
+    AsyncRmcp,
+    Pool,
 ]
 
 
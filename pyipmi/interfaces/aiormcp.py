@@ -0,0 +1,582 @@
+# Copyright (c) 2018  Kontron Europe GmbH
+#
+# This library is free software; you can redistribute it and/or
+# modify it under the terms of the GNU Lesser General Public
+# License as published by the Free Software Foundation; either
+# version 2.1 of the License, or (at your option) any later version.
+#
+# This library is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# Lesser General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public
+# License along with this library; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301 USA
+
+import asyncio
+import random
+import socket
+import struct
+from array import array
+
+from .. import Target
+from ..session import Session
+from ..msgs import (create_message, create_request_by_name,
+                    encode_message, decode_message, constants)
+from ..messaging import ChannelAuthenticationCapabilities
+from ..errors import (DecodingError, NotSupportedError, IpmiTimeoutError,
+                      IpmiConnectionError)
+from ..logger import log
+from ..interfaces.ipmb import decode_bridged_message, rx_filter
+from ..utils import check_completion_code
+from .rmcp import (Rmcp, RmcpMsg, IpmiMsg, Ipmi20Msg, AsfPing, AsfPong,
+                   RMCP_CLASS_ASF, RMCP_CLASS_IPMI, open_session_exchange)
+
+
+class _RmcpProtocol(asyncio.DatagramProtocol):
+    """Datagram protocol passing the received PDUs to the interface."""
+
+    def __init__(self, interface):
+        self.interface = interface
+
+    def datagram_received(self, data, addr):
+        self.interface._datagram_received(data)
+
+    def error_received(self, exc):
+        log().debug('RMCP error received: %s', exc)
+
+    def connection_lost(self, exc):
+        self.interface._connection_lost(exc)
+
+
+class _EndpointProtocol(asyncio.DatagramProtocol):
+    """Datagram protocol passing the received PDUs to the endpoint."""
+
+    def __init__(self, endpoint):
+        self.endpoint = endpoint
+
+    def datagram_received(self, data, addr):
+        self.endpoint._datagram_received(data, addr)
+
+    def error_received(self, exc):
+        log().debug('RMCP error received: %s', exc)
+
+    def connection_lost(self, exc):
+        self.endpoint._connection_lost(exc)
+
+
+class _EndpointTransport(object):
+    """The part of an `AsyncRmcpEndpoint` used by a single session."""
+
+    def __init__(self, endpoint, address, interface):
+        self.endpoint = endpoint
+        self.address = address
+        self.interface = interface
+
+    def sendto(self, pdu):
+        if self.endpoint._transport is None:
+            raise IpmiConnectionError('endpoint is closed')
+        self.endpoint._transport.sendto(pdu, self.address)
+
+    def close(self):
+        self.endpoint.detach(self)
+
+
+class AsyncRmcpEndpoint(object):
+    """A datagram endpoint shared by the `AsyncRmcp` sessions of many BMCs.
+
+    Without an endpoint every session opens its own socket, so the number
+    of sessions is limited by the file descriptors of the process (often
+    1024). The received datagrams are passed to the session by the
+    address of the BMC, therefore only one session per BMC address can
+    use an endpoint.
+
+    Example:
+        endpoint = AsyncRmcpEndpoint()
+        interface = pyipmi.interfaces.create_interface('aiormcp',
+                                                       endpoint=endpoint)
+    """
+
+    def __init__(self, local_addr=('0.0.0.0', 0)):
+        self.local_addr = local_addr
+        self._transport = None
+        self._opening = None
+        self._sessions = {}
+
+    async def _open(self):
+        if self._opening is None:
+            self._opening = asyncio.Lock()
+        async with self._opening:
+            if self._transport is None:
+                loop = asyncio.get_event_loop()
+                (self._transport, _) = await loop.create_datagram_endpoint(
+                    lambda: _EndpointProtocol(self),
+                    local_addr=self.local_addr)
+
+    async def attach(self, interface, host, port):
+        """Route the datagrams of `host`:`port` to `interface`.
+
+        Returns the transport used by the interface.
+        """
+        await self._open()
+        loop = asyncio.get_event_loop()
+        infos = await loop.getaddrinfo(host, port, family=socket.AF_INET,
+                                       type=socket.SOCK_DGRAM)
+        address = infos[0][4][:2]
+        transport = self._sessions.get(address)
+        if transport is not None and transport.interface is not interface:
+            raise IpmiConnectionError(
+                    '%s:%d has already a session on the endpoint' % address)
+        transport = _EndpointTransport(self, address, interface)
+        self._sessions[address] = transport
+        return transport
+
+    def detach(self, transport):
+        if self._sessions.get(transport.address) is transport:
+            del self._sessions[transport.address]
+
+    def close(self):
+        if self._transport is not None:
+            self._transport.close()
+            self._transport = None
+
+    def _datagram_received(self, pdu, addr):
+        transport = self._sessions.get(addr[:2])
+        if transport is None:
+            log().debug('drop datagram from %s:%d', *addr[:2])
+            return
+        transport.interface._datagram_received(pdu)
+
+    def _connection_lost(self, exc):
+        self._transport = None
+        for transport in list(self._sessions.values()):
+            transport.interface._connection_lost(exc)
+
+
+class AsyncRmcp(object):
+    """RMCP/RMCP+ interface for asyncio.
+
+    The interface does not own a thread or a blocking socket. All sessions
+    share the event loop, the responses are dispatched from the datagram
+    protocol to the waiting requests by the IPMB sequence number.
+
+    Each interface opens its own datagram endpoint, unless an
+    `AsyncRmcpEndpoint` is given. Use one for more sessions than the
+    process may open file descriptors.
+    """
+
+    NAME = 'aiormcp'
+
+    MAX_WINDOW = Rmcp.MAX_WINDOW
+
+    _session = None
+    _transport = None
+
+    def __init__(self, slave_address=0x81, host_target_address=0x20,
+                 keep_alive_interval=1, timeout=2.0, window=1,
+                 endpoint=None):
+        self.host = None
+        self.endpoint = endpoint
+        self.port = None
+        self.seq_number = 0xff
+        self.slave_address = slave_address
+        self.host_target = Target(host_target_address)
+        self.set_timeout(timeout)
+        self.next_sequence_number = 0
+        self.keep_alive_interval = keep_alive_interval
+        self._keep_alive_task = None
+        self._pending = {}
+        self._asf_waiter = None
+        self._rmcp2_waiter = None
+        self._rmcp2_lock = None
+        self._slots = None
+        self.set_window(window)
+
+    def set_window(self, window):
+        """Set the number of requests kept in flight in the session."""
+        if not 1 <= window <= self.MAX_WINDOW:
+            raise ValueError('window must be between 1 and %d' %
+                             self.MAX_WINDOW)
+        self.window = window
+        self._slots = None
+
+    def set_timeout(self, timeout):
+        self.timeout = timeout
+
+    # the IPMB request encoding is the same as for the blocking interface
+    _inc_sequence_number = Rmcp._inc_sequence_number
+    _encode_request = Rmcp._encode_request
+
+    async def open(self, host, port=623):
+        """Create the datagram endpoint for `host`."""
+        self.host = host
+        self.port = port
+        if self.endpoint is not None:
+            self._transport = await self.endpoint.attach(self, host, port)
+            return
+        loop = asyncio.get_event_loop()
+        (self._transport, _) = await loop.create_datagram_endpoint(
+            lambda: _RmcpProtocol(self), remote_addr=(host, port))
+
+    def close(self):
+        """Close the datagram endpoint and fail all waiting requests."""
+        if self._keep_alive_task is not None:
+            self._keep_alive_task.cancel()
+            self._keep_alive_task = None
+        if self._transport is not None:
+            self._transport.close()
+            self._transport = None
+        self._connection_lost(None)
+
+    def _connection_lost(self, exc):
+        waiters = [future for (_, future) in self._pending.values()]
+        waiters += [self._asf_waiter, self._rmcp2_waiter]
+        for future in waiters:
+            if future is not None and not future.done():
+                future.set_exception(IpmiConnectionError('connection lost'))
+        self._pending = {}
+
+    @property
+    def _is_rmcp_plus(self):
+        return (self._session is not None
+                and self._session.auth_type == Session.AUTH_TYPE_RMCP_PLUS)
+
+    def _get_slots(self):
+        if self._slots is None:
+            self._slots = asyncio.Semaphore(self.window)
+        return self._slots
+
+    def _get_rmcp2_lock(self):
+        if self._rmcp2_lock is None:
+            self._rmcp2_lock = asyncio.Lock()
+        return self._rmcp2_lock
+
+    async def _wait(self, future):
+        try:
+            return await asyncio.wait_for(future, self.timeout)
+        except asyncio.TimeoutError:
+            raise IpmiTimeoutError()
+
+    def _send_rmcp_msg(self, sdu, class_of_msg):
+        if self._transport is None:
+            raise IpmiConnectionError('interface is not open')
+        rmcp = RmcpMsg(class_of_msg)
+        pdu = rmcp.pack(sdu, self.seq_number)
+        self._transport.sendto(pdu)
+        if self.seq_number != 255:
+            self.seq_number = (self.seq_number + 1) % 254
+
+    def _send_ipmi_msg(self, data):
+        log().debug('IPMI TX: {:s}'.format(
+            ' '.join('%02x' % b for b in array('B', data))))
+        if self._is_rmcp_plus:
+            ipmi = Ipmi20Msg(self._session)
+            tx_data = ipmi.pack(data, constants.PAYLOAD_TYPE_IPMI)
+        else:
+            ipmi = IpmiMsg(self._session)
+            tx_data = ipmi.pack(data)
+        self._send_rmcp_msg(tx_data, RMCP_CLASS_IPMI)
+
+    def _send_ipmi2_msg(self, data, payload_type):
+        log().debug('IPMI2.0 TX: {:s}'.format(
+            ' '.join('%02x' % b for b in array('B', data))))
+        ipmi = Ipmi20Msg(self._session)
+        tx_data = ipmi.pack(data, payload_type)
+        self._send_rmcp_msg(tx_data, RMCP_CLASS_IPMI)
+
+    def _datagram_received(self, pdu):
+        try:
+            rmcp = RmcpMsg()
+            sdu = rmcp.unpack(pdu)
+            if rmcp.class_of_msg == RMCP_CLASS_ASF:
+                self._asf_msg_received(sdu)
+            elif rmcp.class_of_msg == RMCP_CLASS_IPMI:
+                self._ipmi_msg_received(sdu)
+            else:
+                log().debug('drop RMCP message with class 0x%02x',
+                            rmcp.class_of_msg)
+        except (DecodingError, struct.error) as e:
+            log().debug('drop invalid RMCP message: %s', e)
+
+    def _asf_msg_received(self, sdu):
+        log().debug('ASF RX: msg')
+        waiter = self._asf_waiter
+        if waiter is None or waiter.done():
+            return
+        pong = AsfPong()
+        try:
+            pong.unpack(sdu)
+        except DecodingError as e:
+            waiter.set_exception(e)
+        else:
+            waiter.set_result(pong)
+
+    def _ipmi_msg_received(self, sdu):
+        sdu = array('B', sdu)
+        if sdu[0] == Session.AUTH_TYPE_RMCP_PLUS:
+            payload_type = sdu[1] & 0x3f
+            data = Ipmi20Msg(self._session).unpack(sdu.tobytes())
+            if data is not None:
+                log().debug('IPMI2.0 RX: {:s}'.format(
+                    ' '.join('%02x' % b for b in array('B', data))))
+            if payload_type != constants.PAYLOAD_TYPE_IPMI:
+                waiter = self._rmcp2_waiter
+                if waiter is not None and not waiter.done():
+                    waiter.set_result(data)
+                return
+        else:
+            data = IpmiMsg().unpack(sdu.tobytes())
+            if data is not None:
+                log().debug('IPMI RX: {:s}'.format(
+                    ' '.join('%02x' % b for b in array('B', data))))
+
+        if data is None or len(data) < 7:
+            return
+
+        if array('B', data)[5] == constants.CMDID_SEND_MESSAGE:
+            try:
+                data = decode_bridged_message(data)
+            except Exception as e:
+                log().debug('drop bridged response: %s', e)
+                return
+            if not data:
+                # the forwarded reply is expected in another packet
+                return
+
+        rq_seq = array('B', data)[4] >> 2
+        try:
+            (header, future) = self._pending[rq_seq]
+        except KeyError:
+            log().debug('drop response with unknown sequence number %d',
+                        rq_seq)
+            return
+
+        if not rx_filter(header, data):
+            return
+
+        del self._pending[rq_seq]
+        if not future.done():
+            future.set_result(data[6:-1])
+
+    async def _send_and_receive(self, target, lun, netfn, cmdid, payload):
+        """Send and receive data using the RMCP interface.
+
+        Up to `window` requests of concurrent tasks are outstanding in
+        the session.
+
+        Returns the received data as bytestring.
+        """
+        async with self._get_slots():
+            # skip sequence numbers still used by outstanding requests
+            while (self.next_sequence_number + 1) % 64 in self._pending:
+                self._inc_sequence_number()
+            (header, tx_data) = self._encode_request(target, lun, netfn,
+                                                     cmdid, payload)
+
+            future = asyncio.get_event_loop().create_future()
+            self._pending[header.rq_seq] = (header, future)
+            try:
+                self._send_ipmi_msg(tx_data)
+                return await self._wait(future)
+            finally:
+                if self._pending.get(header.rq_seq, (None, None))[1] is future:
+                    del self._pending[header.rq_seq]
+
+    async def _send_and_receive_rmcp2(self, payload, payload_type):
+        async with self._get_rmcp2_lock():
+            self._rmcp2_waiter = asyncio.get_event_loop().create_future()
+            try:
+                self._send_ipmi2_msg(payload, payload_type)
+                return await self._wait(self._rmcp2_waiter)
+            finally:
+                self._rmcp2_waiter = None
+
+    async def _run_exchange(self, exchange):
+        """Drive an exchange generator with the asynchronous transport."""
+        try:
+            request = next(exchange)
+            while True:
+                rx_data = await self._send_and_receive_rmcp2(*request)
+                request = exchange.send(rx_data)
+        except StopIteration as e:
+            return e.value
+
+    async def ping(self):
+        self._asf_waiter = asyncio.get_event_loop().create_future()
+        try:
+            log().debug('ASF TX: msg')
+            self._send_rmcp_msg(AsfPing().pack(), RMCP_CLASS_ASF)
+            await self._wait(self._asf_waiter)
+        finally:
+            self._asf_waiter = None
+
+    async def _get_channel_auth_cap(self):
+        CHANNEL_NUMBER_FOR_THIS = 0xe
+        req = create_request_by_name('GetChannelAuthenticationCapabilities')
+        req.target = self.host_target
+        req.channel.number = CHANNEL_NUMBER_FOR_THIS
+        req.privilege_level.requested = Session.PRIV_LEVEL_ADMINISTRATOR
+        rsp = await self.send_and_receive(req)
+        check_completion_code(rsp.completion_code)
+        return ChannelAuthenticationCapabilities(rsp)
+
+    async def _get_session_challenge(self, session):
+        req = create_request_by_name('GetSessionChallenge')
+        req.target = self.host_target
+        req.authentication.type = session.auth_type
+        if session._auth_username:
+            req.user_name = session._auth_username.ljust(16, '\x00')
+        rsp = await self.send_and_receive(req)
+        check_completion_code(rsp.completion_code)
+        return rsp
+
+    async def _activate_session(self, session, challenge):
+        req = create_request_by_name('ActivateSession')
+        req.target = self.host_target
+        req.authentication.type = session.auth_type
+        req.privilege_level.maximum_requested = session.privilege_level
+        req.challenge_string = challenge
+        req.session_id = self._session.sid
+        req.initial_outbound_sequence_number = random.randrange(1, 0xffffffff)
+        rsp = await self.send_and_receive(req)
+        check_completion_code(rsp.completion_code)
+        return rsp
+
+    async def _set_session_privilege_level(self, level):
+        req = create_request_by_name('SetSessionPrivilegeLevel')
+        req.target = self.host_target
+        req.privilege_level.requested = level
+        rsp = await self.send_and_receive(req)
+        check_completion_code(rsp.completion_code)
+        return rsp
+
+    async def _get_device_id(self):
+        req = create_request_by_name('GetDeviceId')
+        req.target = self.host_target
+        rsp = await self.send_and_receive(req)
+        check_completion_code(rsp.completion_code)
+
+    async def _keep_alive(self):
+        while True:
+            await asyncio.sleep(self.keep_alive_interval)
+            try:
+                await self._get_device_id()
+            except IpmiTimeoutError:
+                pass
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                log().warning('keep alive failed: %s', e)
+
+    async def establish_session(self, session):
+        self._session = None
+        if self._transport is None:
+            await self.open(session._rmcp_host, session._rmcp_port)
+
+        # 0 - Ping
+        await self.ping()
+
+        # 1 - Get Channel Authentication Capabilities
+        log().debug('Get Channel Authentication Capabilities')
+        caps = await self._get_channel_auth_cap()
+        log().debug('%s' % caps)
+
+        session.auth_type = caps.get_max_auth_type()
+        if caps.ipmi_2_0 is True:
+            log().debug("Open Session Request")
+            exchange = open_session_exchange(
+                    session,
+                    constants.AUTH_ALGO_RAKP_HMAC_SHA1,
+                    constants.INTEGRITY_ALGO_HMAC_SHA1_96,
+                    constants.CONFIDENTIALITY_ALGO_AES_CBC_128)
+            (sik, session_id) = await self._run_exchange(exchange)
+            session.sid = session_id
+            session.sequence_number = 0x02
+            session.activated = True
+            session.is_encrypted = True
+            session.is_authenticated = True
+            session.confidentiality_algorithm = \
+                constants.CONFIDENTIALITY_ALGO_AES_CBC_128
+            session.generate_additional_encryption_keys(sik)
+            self._session = session
+        elif caps.ipmi_1_5 is True:
+            # 2 - Get Session Challenge
+            log().debug('Get Session Challenge')
+            rsp = await self._get_session_challenge(session)
+            session_challenge = rsp.challenge_string
+            session.sid = rsp.temporary_session_id
+            self._session = session
+            # 3 - Activate Session
+            log().debug('Activate Session')
+            rsp = await self._activate_session(session, session_challenge)
+            self._session.sid = rsp.session_id
+            self._session.sequence_number = \
+                rsp.initial_inbound_sequence_number
+            self._session.activated = True
+
+            # 4 - Set Session Privilege Level
+            log().debug('Set Session Privilege Level')
+            await self._set_session_privilege_level(
+                    session.privilege_level)
+
+            log().debug('Session opened')
+
+            if self.keep_alive_interval:
+                self._keep_alive_task = \
+                    asyncio.ensure_future(self._keep_alive())
+        else:
+            raise NotSupportedError(
+                    'Neither IPMI 2.0 nor IPMI 1.5 is supported by the BMC')
+
+    async def close_session(self):
+        if self._keep_alive_task is not None:
+            self._keep_alive_task.cancel()
+            self._keep_alive_task = None
+
+        if self._session is None or self._session.activated is False:
+            log().debug('Session already closed')
+            return
+
+        log().debug('Close Session %s' % self._session)
+        req = create_request_by_name('CloseSession')
+        req.target = self.host_target
+        req.session_id = self._session.sid
+        if isinstance(req.session_id, bytes):
+            # RMCP+ session IDs are kept as received
+            req.session_id = int.from_bytes(req.session_id, 'little')
+        rsp = await self.send_and_receive(req)
+        check_completion_code(rsp.completion_code)
+        self._session.activated = False
+
+    async def send_and_receive_raw(self, target, lun, netfn, raw_bytes):
+        """Interface function to send and receive raw message.
+
+        target: IPMI target
+        lun: logical unit number
+        netfn: network function
+        raw_bytes: RAW bytes as bytestring
+
+        Returns the IPMI message response bytestring.
+        """
+        return await self._send_and_receive(target=target,
+                                            lun=lun,
+                                            netfn=netfn,
+                                            cmdid=array('B', raw_bytes)[0],
+                                            payload=raw_bytes[1:])
+
+    async def send_and_receive(self, req):
+        """Interface function to send and receive an IPMI message.
+
+        req: IPMI message request
+
+        Returns the IPMI message response.
+        """
+        rx_data = await self._send_and_receive(target=req.target,
+                                               lun=req.lun,
+                                               netfn=req.netfn,
+                                               cmdid=req.cmdid,
+                                               payload=encode_message(req))
+        rsp = create_message(req.netfn + 1, req.cmdid, req.group_extension)
+        decode_message(rsp, rx_data)
+        return rsp
@@ -15,7 +15,13 @@
 # Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301 USA
 
 
+import os
 import re
+import select
+import tempfile
+import threading
+
+from collections import OrderedDict
 
 from subprocess import Popen, PIPE
 from array import array
@@ -36,13 +42,17 @@ class Ipmitool(object):
     It uses the session information to assemble the correct ipmitool
     parameters. Therefore, a session has to be established before any request
     can be sent.
+
+    With `coprocess=True` the ipmitool processes are kept running, see
+    `IpmitoolCoprocess`.
     """
 
     NAME = 'ipmitool'
     IPMITOOL_PATH = 'ipmitool'
     supported_interfaces = ['lan', 'lanplus', 'serial-terminal', 'open']
 
-    def __init__(self, interface_type='lan'):
+    def __init__(self, interface_type='lan', coprocess=False,
+                 coprocess_timeout=30):
         if interface_type in self.supported_interfaces:
             self._interface_type = interface_type
         else:
@@ -55,9 +65,20 @@ class Ipmitool(object):
                 r"Unable to send RAW command \(.*cmd=0x[0-9a-f]+\)")
         self.re_unable_establish = re.compile(
                 r".*Unable to establish.*")
+        self.re_raw_error = re.compile(
+                r"Unable to send RAW command "
+                r"\(.*netfn=(0x[0-9a-f]+) .*cmd=(0x[0-9a-f]+)")
 
         self._session = None
 
+        # In coprocess mode one `ipmitool shell` is kept running per target
+        # and the raw commands are fed over stdin. This saves the process
+        # start and the session setup of every command.
+        self.coprocess = coprocess
+        self.coprocess_timeout = coprocess_timeout
+        self._coprocesses = {}
+        self._coprocesses_lock = threading.Lock()
+
     def establish_session(self, session):
         # just remember session parameters here
         self._session = session
@@ -128,6 +149,12 @@ class Ipmitool(object):
         return cc, rsp
 
     def send_and_receive_raw(self, target, lun, netfn, raw_bytes):
+        if self.coprocess:
+            coprocess = self._get_coprocess(target, lun)
+            output, rc = coprocess.execute(
+                    self._build_ipmitool_raw_command(netfn, raw_bytes))
+            return self._create_raw_response(output, rc)
+
         if self._interface_type in ['lan', 'lanplus']:
             cmd = self._build_ipmitool_cmd(target, lun, netfn, raw_bytes)
         elif self._interface_type in ['open']:
@@ -140,7 +167,17 @@ class Ipmitool(object):
                                self._interface_type)
 
         output, rc = self._run_ipmitool(cmd)
-        cc, rsp = self._parse_output(output)
+        return self._create_raw_response(output, rc)
+
+    def _create_raw_response(self, output, rc):
+        try:
+            cc, rsp = self._parse_output(output)
+        except ValueError:
+            if rc == 0:
+                raise
+            # an error message without a completion code
+            raise RuntimeError('ipmitool failed with rc=%d: %s' % (
+                rc, py3dec_unic_bytes_fix(output).strip()))
 
         data = array('B')
 
@@ -159,6 +196,117 @@ class Ipmitool(object):
 
         return py3_array_tobytes(data)
 
+    def _run_batch(self, target, lun, requests):
+        """Run the raw commands in a single ipmitool process and return
+        the output and return code of each command.
+
+        requests: list of (netfn, raw_bytes) tuples
+
+        The output on stdout is split at the echoed markers. The error
+        messages are read from stderr, which isn't synchronized with the
+        buffered stdout. They are assigned to the failed commands by their
+        order and the netfn and command in the message. A failed command
+        prints nothing on stdout, a successful one at least a newline.
+        """
+        markers = ['__pyipmi_%d__' % n for n in range(len(requests))]
+        (fd, path) = tempfile.mkstemp(prefix='pyipmi-', suffix='.batch')
+        try:
+            with os.fdopen(fd, 'w') as f:
+                for ((netfn, raw_bytes), marker) in zip(requests, markers):
+                    f.write('%s\necho %s\n' % (
+                        self._build_ipmitool_raw_command(netfn, raw_bytes),
+                        marker))
+            output, errors, rc = self._run_ipmitool_with_stderr(
+                    self._build_exec_cmd(target, lun, path))
+        finally:
+            os.unlink(path)
+
+        outputs = []
+        for marker in markers:
+            marker = marker.encode()
+            if marker not in output:
+                # ipmitool stopped, e.g. no session could be established
+                self._parse_output(errors + output)
+                raise RuntimeError('ipmitool failed with rc=%d' % rc)
+            (command_output, output) = output.split(marker, 1)
+            outputs.append([command_output, 0])
+            output = output.split(b'\n', 1)[-1]
+
+        index = 0
+        for line in py3dec_unic_bytes_fix(errors).split('\n'):
+            match = self.re_raw_error.match(line)
+            if not match:
+                if line.strip():
+                    log().debug('ipmitool: %s', line)
+                continue
+            netfn = int(match.group(1), 16)
+            cmdid = int(match.group(2), 16)
+            while index < len(requests):
+                (req_netfn, raw_bytes) = requests[index]
+                index += 1
+                if (req_netfn == netfn
+                        and array('B', raw_bytes)[0] == cmdid
+                        and not outputs[index - 1][0]):
+                    outputs[index - 1] = [line.encode(), 1]
+                    break
+            else:
+                log().warning('ipmitool error without command: %s', line)
+        return [tuple(output) for output in outputs]
+
+    def send_and_receive_raw_many(self, requests):
+        """Send several raw messages with a single ipmitool invocation.
+
+        requests: list of (target, lun, netfn, raw_bytes) tuples
+
+        The commands are written to a batch file which is run with
+        `ipmitool exec`, so only one session is set up for all of them.
+        The requests are grouped by target and LUN, as those are command
+        line options of ipmitool. In coprocess mode the commands are sent
+        to the running processes instead.
+
+        Returns the list of raw responses (completion code and data) in the
+        order of `requests`.
+        """
+        requests = list(requests)
+        if self.coprocess:
+            return [self.send_and_receive_raw(*request)
+                    for request in requests]
+
+        groups = OrderedDict()
+        for (index, (target, lun, netfn, raw_bytes)) in enumerate(requests):
+            key = self._build_interface_options(target), lun
+            group = groups.setdefault(key, (target, lun, [], []))
+            group[2].append(index)
+            group[3].append((netfn, raw_bytes))
+
+        rsps = [None] * len(requests)
+        for (target, lun, indices, batch) in groups.values():
+            outputs = self._run_batch(target, lun, batch)
+            for (index, (output, rc)) in zip(indices, outputs):
+                rsps[index] = self._create_raw_response(output, rc)
+        return rsps
+
+    def send_and_receive_many(self, reqs, attempts=None):
+        if attempts is not None:
+            attempts[:] = [1] * len(reqs)
+        requests = []
+        for req in reqs:
+            log().debug('IPMI Request [%s]', req)
+            req_data = ByteBuffer((req.cmdid,))
+            req_data.push_string(encode_message(req))
+            requests.append((req.target, req.lun, req.netfn,
+                             py3_array_tobytes(req_data)))
+
+        rsps = []
+        for (req, rsp_data) in zip(reqs,
+                                   self.send_and_receive_raw_many(requests)):
+            rsp = create_message(req.netfn + 1, req.cmdid,
+                                 req.group_extension)
+            decode_message(rsp, rsp_data)
+            log().debug('IPMI Response [%s])', rsp)
+            rsps.append(rsp)
+        return rsps
+
     def send_and_receive(self, req):
         log().debug('IPMI Request [%s]', req)
 
@@ -176,7 +324,13 @@ class Ipmitool(object):
 
     @staticmethod
     def _build_ipmitool_raw_data(lun, netfn, raw):
-        cmd = ' -l {:d} raw '.format(lun)
+        cmd = ' -l {:d} '.format(lun)
+        cmd += Ipmitool._build_ipmitool_raw_command(netfn, raw)
+        return cmd
+
+    @staticmethod
+    def _build_ipmitool_raw_command(netfn, raw):
+        cmd = 'raw '
         cmd += ' '.join(['0x%02x' % (d)
                          for d in [netfn] + array('B', raw).tolist()])
         return cmd
@@ -206,7 +360,7 @@ class Ipmitool(object):
 
         return cmd
 
-    def _build_ipmitool_cmd(self, target, lun, netfn, raw_bytes):
+    def _build_ipmitool_options(self, target):
         if not hasattr(self, '_session'):
             raise RuntimeError('Session needs to be set')
 
@@ -225,12 +379,16 @@ class Ipmitool(object):
                                self._session.auth_type)
 
         cmd += self._build_ipmitool_target(target)
+        return cmd
+
+    def _build_ipmitool_cmd(self, target, lun, netfn, raw_bytes):
+        cmd = self._build_ipmitool_options(target)
         cmd += self._build_ipmitool_raw_data(lun, netfn, raw_bytes)
         cmd += (' 2>&1')
 
         return cmd
 
-    def _build_serial_ipmitool_cmd(self, target, lun, netfn, raw_bytes):
+    def _build_serial_ipmitool_options(self, target):
         if not hasattr(self, '_session'):
             raise RuntimeError('Session needs to be set')
 
@@ -243,11 +401,15 @@ class Ipmitool(object):
             )
 
         cmd += self._build_ipmitool_target(target)
+        return cmd
+
+    def _build_serial_ipmitool_cmd(self, target, lun, netfn, raw_bytes):
+        cmd = self._build_serial_ipmitool_options(target)
         cmd += self._build_ipmitool_raw_data(lun, netfn, raw_bytes)
 
         return cmd
 
-    def _build_open_ipmitool_cmd(self, target, lun, netfn, raw_bytes):
+    def _build_open_ipmitool_options(self, target):
         if not hasattr(self, '_session'):
             raise RuntimeError('Session needs to be set')
 
@@ -255,11 +417,49 @@ class Ipmitool(object):
         cmd += (' -I %s' % self._interface_type)
 
         cmd += self._build_ipmitool_target(target)
+        return cmd
+
+    def _build_open_ipmitool_cmd(self, target, lun, netfn, raw_bytes):
+        cmd = self._build_open_ipmitool_options(target)
         cmd += self._build_ipmitool_raw_data(lun, netfn, raw_bytes)
         cmd += (' 2>&1')
 
         return cmd
 
+    def _build_interface_options(self, target):
+        if self._interface_type in ['lan', 'lanplus']:
+            return self._build_ipmitool_options(target)
+        elif self._interface_type in ['open']:
+            return self._build_open_ipmitool_options(target)
+        elif self._interface_type in ['serial-terminal']:
+            return self._build_serial_ipmitool_options(target)
+        raise RuntimeError('interface type %s not supported' %
+                           self._interface_type)
+
+    def _build_coprocess_cmd(self, target, lun):
+        cmd = self._build_interface_options(target)
+        return cmd + ' -l {:d} shell'.format(lun)
+
+    def _build_exec_cmd(self, target, lun, path):
+        cmd = self._build_interface_options(target)
+        cmd += ' -l {:d} exec {:s}'.format(lun, path)
+        return cmd
+
+    def _get_coprocess(self, target, lun):
+        cmd = self._build_coprocess_cmd(target, lun)
+        with self._coprocesses_lock:
+            coprocess = self._coprocesses.get(cmd)
+            if coprocess is None:
+                coprocess = IpmitoolCoprocess(cmd, self.coprocess_timeout)
+                self._coprocesses[cmd] = coprocess
+        return coprocess
+
+    def close_session(self):
+        with self._coprocesses_lock:
+            coprocesses = list(self._coprocesses.values())
+            self._coprocesses = {}
+        for coprocess in coprocesses:
+            coprocess.close()
 
     @staticmethod
     def _run_ipmitool(cmd):
@@ -277,3 +477,154 @@ class Ipmitool(object):
             raise RuntimeError('ipmitool command not found')
 
         return output, child.returncode
+
+    @staticmethod
+    def _run_ipmitool_with_stderr(cmd):
+        """Call ipmitool and return its stdout, stderr and return code."""
+        log().debug('Running ipmitool "%s"', cmd)
+
+        child = Popen(cmd, shell=True, stdout=PIPE, stderr=PIPE)
+        (output, errors) = child.communicate()
+
+        log().debug('return with rc=%d, output was:\n%s\nerrors:\n%s',
+                    child.returncode, output, errors)
+
+        if child.returncode == 127:
+            raise RuntimeError('ipmitool command not found')
+
+        return output, errors, child.returncode
+
+
+class IpmitoolCoprocess(object):
+    """A long running `ipmitool shell` process.
+
+    The commands are written to stdin, each followed by an `echo` of a
+    unique marker. The output up to the marker is the output of the
+    command, the errors are read from stderr. If the process died before
+    a command was written, it is restarted. If it died while running a
+    command, `IpmiConnectionError` is raised and the command isn't sent
+    again, it might have been executed already.
+    """
+
+    PROMPT = b'ipmitool> '
+
+    def __init__(self, cmd, timeout=30):
+        self.cmd = cmd
+        self.timeout = timeout
+        self._child = None
+        self._buffer = b''
+        self._errors = b''
+        self._sequence = 0
+        self._lock = threading.Lock()
+
+    def _start(self):
+        log().debug('Starting ipmitool coprocess "%s"', self.cmd)
+        self._child = Popen('exec ' + self.cmd, shell=True, stdin=PIPE,
+                            stdout=PIPE, stderr=PIPE)
+        self._buffer = b''
+        self._errors = b''
+
+    def _stop(self):
+        child = self._child
+        self._child = None
+        if child is None:
+            return
+        try:
+            child.stdin.write(b'exit\n')
+            child.stdin.close()
+        except (IOError, OSError):
+            pass
+        try:
+            child.wait(timeout=1)
+        except Exception:
+            child.kill()
+            child.wait()
+        child.stdout.close()
+        child.stderr.close()
+
+    def _read_until(self, marker):
+        stdout = self._child.stdout.fileno()
+        stderr = self._child.stderr.fileno()
+        while marker not in self._buffer:
+            (readable, _, _) = select.select([stdout, stderr], [], [],
+                                             self.timeout)
+            if not readable:
+                raise IpmiTimeoutError()
+            if stderr in readable:
+                self._errors += os.read(stderr, 4096)
+            if stdout in readable:
+                data = os.read(stdout, 4096)
+                if not data:
+                    return None
+                self._buffer += data
+
+        # stderr is unbuffered, the errors of the command were written
+        # before the marker
+        while select.select([stderr], [], [], 0)[0]:
+            data = os.read(stderr, 4096)
+            if not data:
+                break
+            self._errors += data
+
+        (output, self._buffer) = self._buffer.split(marker, 1)
+        # drop the rest of the marker line
+        self._buffer = self._buffer.split(b'\n', 1)[-1]
+        return output.replace(self.PROMPT, b'')
+
+    def _send(self, command, marker):
+        try:
+            self._child.stdin.write(command.encode() + b'\n')
+            self._child.stdin.write(b'echo ' + marker + b'\n')
+            self._child.stdin.flush()
+        except (IOError, OSError):
+            return False
+        return True
+
+    def execute(self, command):
+        """Run a command and return its output and return code.
+
+        The return code is 1 if the command printed an error on stderr,
+        the error is appended to the output.
+        """
+        with self._lock:
+            self._sequence += 1
+            marker = b'__pyipmi_%d__' % self._sequence
+            for attempt in range(2):
+                if self._child is None:
+                    self._start()
+                if self._send(command, marker):
+                    break
+                if attempt:
+                    return self._died()
+                # died before the command was sent, it is safe to restart
+                self._stop()
+
+            try:
+                output = self._read_until(marker)
+            except IpmiTimeoutError:
+                self._stop()
+                raise
+            if output is None:
+                return self._died()
+
+            (errors, self._errors) = (self._errors, b'')
+            log().debug('ipmitool coprocess output:\n%s', output + errors)
+            if errors.strip():
+                return output + errors, 1
+            return output, 0
+
+    def _died(self):
+        rc = self._child.wait()
+        output = (self._errors + self._child.stderr.read() +
+                  self._buffer + self._child.stdout.read())
+        self._stop()
+        log().warning('ipmitool coprocess died with rc=%s', rc)
+
+        if rc == 127:
+            raise RuntimeError('ipmitool command not found')
+        raise IpmiConnectionError('ipmitool exited with rc={}: {}'.format(
+                rc, py3dec_unic_bytes_fix(output).strip()))
+
+    def close(self):
+        with self._lock:
+            self._stop()
@@ -0,0 +1,133 @@
+# Copyright (c) 2018  Kontron Europe GmbH
+#
+# This library is free software; you can redistribute it and/or
+# modify it under the terms of the GNU Lesser General Public
+# License as published by the Free Software Foundation; either
+# version 2.1 of the License, or (at your option) any later version.
+#
+# This library is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# Lesser General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public
+# License along with this library; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301 USA
+
+import binascii
+import json
+import socket
+
+from ..errors import IpmiTimeoutError, IpmiConnectionError
+from ..logger import log
+from ..msgs import encode_message, decode_message, create_message
+from ..utils import ByteBuffer, py3_array_tobytes
+
+DEFAULT_POOL_PATH = '/tmp/pyipmi-pool.sock'
+
+
+class Pool(object):
+    """This interface sends the requests through a session pool daemon.
+
+    The daemon (see `pyipmi.pool`) keeps the RMCP sessions open, so
+    short lived processes don't have to establish a new session for every
+    invocation.
+    """
+
+    NAME = 'pool'
+
+    # the requests are sent by the Rmcp interface of the pool
+    max_request_data_size = 128
+
+    def __init__(self, path=DEFAULT_POOL_PATH, timeout=10.0):
+        self.path = path
+        self.timeout = timeout
+        self._session = None
+        self._sock = None
+        self._file = None
+
+    def establish_session(self, session):
+        # the session is established by the pool on the first request
+        self._session = session
+
+    def close_session(self):
+        # the session stays open in the pool
+        self._session = None
+
+    def close(self):
+        if self._sock is not None:
+            self._file.close()
+            self._sock.close()
+            self._sock = None
+            self._file = None
+
+    def _connect(self):
+        if self._sock is None:
+            sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+            sock.settimeout(self.timeout)
+            try:
+                sock.connect(self.path)
+            except socket.error as e:
+                sock.close()
+                raise IpmiConnectionError('cannot connect to pool %s: %s'
+                                          % (self.path, e))
+            self._sock = sock
+            self._file = sock.makefile('rwb')
+
+    def _request(self, request):
+        self._connect()
+        try:
+            self._file.write(json.dumps(request).encode('utf-8') + b'\n')
+            self._file.flush()
+            line = self._file.readline()
+        except socket.timeout:
+            self.close()
+            raise IpmiTimeoutError()
+        if not line:
+            self.close()
+            raise IpmiConnectionError('pool closed the connection')
+        return json.loads(line.decode('utf-8'))
+
+    def send_and_receive_raw(self, target, lun, netfn, raw_bytes):
+        if self._session is None:
+            raise IpmiConnectionError('no session established')
+
+        routing = None
+        if target.routing:
+            routing = [(r.rq_sa, r.rs_sa, r.channel) for r in target.routing]
+
+        request = {
+            'host': self._session.rmcp_host,
+            'port': self._session.rmcp_port,
+            'username': self._session.auth_username,
+            'password': self._session.auth_password,
+            'privilege_level': self._session.privilege_level,
+            'target': target.ipmb_address,
+            'routing': routing,
+            'lun': lun,
+            'netfn': netfn,
+            'data': binascii.hexlify(bytes(raw_bytes)).decode('ascii'),
+        }
+        reply = self._request(request)
+
+        if 'error' in reply:
+            if reply.get('type') == 'IpmiTimeoutError':
+                raise IpmiTimeoutError(reply['error'])
+            raise IpmiConnectionError('%s: %s' % (reply.get('type'),
+                                                  reply['error']))
+        return binascii.unhexlify(reply['data'])
+
+    def send_and_receive(self, req):
+        log().debug('IPMI Request [%s]', req)
+
+        req_data = ByteBuffer((req.cmdid,))
+        req_data.push_string(encode_message(req))
+
+        rsp_data = self.send_and_receive_raw(req.target, req.lun, req.netfn,
+                                             py3_array_tobytes(req_data))
+
+        rsp = create_message(req.netfn + 1, req.cmdid, req.group_extension)
+        decode_message(rsp, rsp_data)
+        log().debug('IPMI Response [%s])', rsp)
+
+        return rsp
@@ -21,6 +21,7 @@ import hashlib
 import hmac
 import random
 import threading
+import time
 from array import array
 from queue import Queue
 from cryptography.hazmat.primitives.ciphers import Cipher, algorithms, modes
@@ -743,16 +744,115 @@ class IpmiMsg(object):
         pass
 
 
+def open_session_exchange(session, auth_algo, integrity_algo,
+                          confidentiality_algo, console_session_id=None):
+    """Generator running the RMCP+ open session and RAKP handshake.
+
+    Yields (payload, payload_type) tuples to send and expects the received
+    data to be sent back in. Returns the tuple (sik, managed system session
+    id) when the handshake is done.
+    """
+    req = OpenSessionReq(auth_algo, integrity_algo, confidentiality_algo)
+    if console_session_id is not None:
+        req.console_session_id = console_session_id
+    req.maximum_privilege.privilege_level = session.privilege_level
+    rx_data = yield (encode_message(req),
+                     constants.PAYLOAD_TYPE_OPEN_SESSION_REQUEST)
+    rsp = OpenSessionRsp()
+    decode_message(rsp, rx_data)
+
+    # TODO: Use proper exceptions
+    if rsp.message_status_code != constants.MSC_OK:
+        raise Exception("Open Session response failed")
+    # TODO: Check if authentication algorithm matches with what we asked for
+    rakp1 = RAKP1Message()
+    rakp1.message_tag = req.message_tag
+    rakp1.managed_system_session_id = rsp.managed_system_session_id
+    rakp1.user_name = session._auth_username
+    rakp1.user_name_length = len(session._auth_username)
+    rakp1.role.privilege_level = session.privilege_level
+    rx_data = yield (encode_message(rakp1),
+                     constants.PAYLOAD_TYPE_RAKP_MESSAGE_1)
+    rakp2 = RAKP2Message(req.authentication.algorithm)
+    decode_message(rakp2, rx_data)
+    # TODO: Use proper exceptions
+    if rakp2.message_status_code != constants.MSC_OK:
+        raise Exception("Open RAKP2 response failed")
+
+    if rakp2.console_session_id != req.console_session_id:
+        raise Exception(f"Invalid Console session id in RAKP2 packet: {rakp2.console_session_id}")
+    auth_code = b"".join([c.to_bytes(1, 'big') for c in rakp2.ke_auth_code])
+    sid_m = rakp2.console_session_id
+    sid_c = rsp.managed_system_session_id
+    r_m = rakp1.console_random_number
+    r_c = rakp2.managed_system_random_number
+    guid_c = rakp2.managed_system_guid
+    role_m = rakp1.role._value.to_bytes(1, 'big')
+    ulength_m = rakp1.user_name_length.to_bytes(1, 'big')
+    uname_m = rakp1.user_name.encode()
+    unencrypted_string = sid_m + sid_c + r_m + r_c + guid_c + role_m + ulength_m + uname_m
+    key = session._auth_password.encode()
+    expected_auth_code = hmac.new(key, unencrypted_string, hashlib.sha1).digest()
+    if expected_auth_code != auth_code:
+        raise Exception("Auth code mismatch")
+    rakp3 = RAKP3Message(req.authentication.algorithm)
+    rakp3.managed_system_session_id = sid_c
+    rakp3.ke_auth_code = hmac.new(key, r_c + sid_m + role_m + ulength_m + uname_m, hashlib.sha1).digest()
+    rx_data = yield (encode_message(rakp3),
+                     constants.PAYLOAD_TYPE_RAKP_MESSAGE_3)
+    rakp4 = RAKP4Message(req.authentication.algorithm)
+    decode_message(rakp4, rx_data)
+    sik = hmac.new(key, r_m + r_c + role_m + ulength_m + uname_m, hashlib.sha1).digest()
+    expected_integrity_check_value = hmac.new(sik, r_m + sid_c + guid_c, hashlib.sha1).digest()
+    expected_integrity_check_value = expected_integrity_check_value[:12]
+    integrity_check_value = b"".join([c.to_bytes(1, 'big') for c in rakp4.integrity_check_value])
+    if expected_integrity_check_value != integrity_check_value:
+        raise Exception(f"Integrity check value mismatch: {expected_integrity_check_value} vs {integrity_check_value}")
+    return (sik, sid_c)
+
+
+def run_exchange(exchange, send_and_receive_fn):
+    """Drive an exchange generator with a blocking send and receive."""
+    try:
+        request = next(exchange)
+        while True:
+            request = exchange.send(send_and_receive_fn(*request))
+    except StopIteration as e:
+        return e.value
+
+
 class Rmcp(object):
     NAME = 'rmcp'
 
+    # the IPMB rq_seq field is 6 bits wide
+    MAX_WINDOW = 63
+
+    # request data (without netfn and command) sent in a single message to
+    # the BMC, users can lower it for BMCs with smaller receive buffers
+    max_request_data_size = 128
+    # lost datagrams of pipelined requests are sent again this often
+    max_retransmits = 2
+    # pipelined requests answered with CC_NODE_BUSY are sent again after
+    # `busy_backoff` seconds
+    busy_retries = 2
+    busy_backoff = 0.01
+
     _session = None
+    _console_session_id = None
 
     def __init__(self, slave_address=0x81, host_target_address=0x20,
-                 keep_alive_interval=1, timeout=2.0):
+                 keep_alive_interval=1, timeout=2.0, window=1,
+                 multiplexer=None):
         self.host = None
         self.port = None
-        self._sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self._multiplexer = multiplexer
+        if multiplexer is not None:
+            # share the sockets and threads of the multiplexer
+            self._sock = None
+            self._channel = multiplexer.attach()
+        else:
+            self._sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+            self._channel = None
         self.seq_number = 0xff
         self.slave_address = slave_address
         self.host_target = Target(host_target_address)
@@ -762,22 +862,52 @@ class Rmcp(object):
         self._stop_keep_alive = None
         self._q = Queue()
         self.transaction_lock = threading.Lock()
+        self.set_window(window)
+
+    def set_window(self, window):
+        """Set the number of requests kept in flight by send_and_receive_many.
+
+        Responses are matched to their requests by the IPMB `rq_seq`, so at
+        most MAX_WINDOW requests can be outstanding.
+        """
+        if not 1 <= window <= self.MAX_WINDOW:
+            raise ValueError('window must be between 1 and %d' %
+                             self.MAX_WINDOW)
+        self.window = window
 
     def _send_rmcp_msg(self, sdu, class_of_msg):
         rmcp = RmcpMsg(class_of_msg)
         pdu = rmcp.pack(sdu, self.seq_number)
-        self._sock.sendto(pdu, (self.host, self.port))
+        if self._channel is not None:
+            self._channel.sendto(pdu, (self.host, self.port))
+        else:
+            self._sock.sendto(pdu, (self.host, self.port))
         if self.seq_number != 255:
             self.seq_number = (self.seq_number + 1) % 254
 
     def _receive_rmcp_msg(self):
-        (pdu, _) = self._sock.recvfrom(4096)
+        if self._channel is not None:
+            pdu = self._channel.recv(self._timeout)
+        else:
+            (pdu, _) = self._sock.recvfrom(4096)
         rmcp = RmcpMsg()
         sdu = rmcp.unpack(pdu)
         return (rmcp.seq_number, rmcp.class_of_msg, sdu)
 
     def set_timeout(self, timeout):
-        self._sock.settimeout(timeout)
+        self._timeout = timeout
+        if self._sock is not None:
+            self._sock.settimeout(timeout)
+
+    def close(self):
+        """Release the socket or detach from the multiplexer."""
+        if self._stop_keep_alive:
+            self._stop_keep_alive()
+            self._stop_keep_alive = None
+        if self._channel is not None:
+            self._channel.close()
+        else:
+            self._sock.close()
 
     def _send_ipmi_msg(self, data):
         log().debug('IPMI TX: {:s}'.format(
@@ -855,68 +985,21 @@ class Rmcp(object):
         return rsp
 
     def _open_session(self, session, auth_algo, integrity_algo, confidentiality_algo):
-        req = OpenSessionReq(auth_algo, integrity_algo, confidentiality_algo)
-        req.maximum_privilege.privilege_level = Session.PRIV_LEVEL_ADMINISTRATOR
-        rx_data = self._send_and_receive_rmcp2(encode_message(req),
-                                           constants.PAYLOAD_TYPE_OPEN_SESSION_REQUEST)
-        rsp = OpenSessionRsp()
-        decode_message(rsp, rx_data)
-
-        # TODO: Use proper exceptions
-        if rsp.message_status_code != constants.MSC_OK:
-            raise Exception("Open Session response failed")
-        # TODO: Check if authentication algorithm matches with what we asked for
-        rakp1 = RAKP1Message()
-        rakp1.message_tag = req.message_tag
-        rakp1.managed_system_session_id = rsp.managed_system_session_id
-        rakp1.user_name = session._auth_username
-        rakp1.user_name_length = len(session._auth_username)
-        rx_data = self._send_and_receive_rmcp2(encode_message(rakp1),
-                                               constants.PAYLOAD_TYPE_RAKP_MESSAGE_1)
-        rakp2 = RAKP2Message(req.authentication.algorithm)
-        decode_message(rakp2, rx_data)
-        # TODO: Use proper exceptions
-        if rakp2.message_status_code != constants.MSC_OK:
-            raise Exception("Open RAKP2 response failed")
-
-        if rakp2.console_session_id != req.console_session_id:
-            raise Exception(f"Invalid Console session id in RAKP2 packet: {rakp2.console_session_id}")
-        auth_code = b"".join([c.to_bytes(1, 'big') for c in rakp2.ke_auth_code])
-        sid_m = rakp2.console_session_id
-        sid_c = rsp.managed_system_session_id
-        r_m = rakp1.console_random_number
-        r_c = rakp2.managed_system_random_number
-        guid_c = rakp2.managed_system_guid
-        role_m = rakp1.role._value.to_bytes(1, 'big')
-        ulength_m = rakp1.user_name_length.to_bytes(1, 'big')
-        uname_m = rakp1.user_name.encode()
-        unencrypted_string = sid_m + sid_c + r_m + r_c + guid_c + role_m + ulength_m + uname_m
-        key = session._auth_password.encode()
-        expected_auth_code = hmac.new(key, unencrypted_string, hashlib.sha1).digest()
-        if expected_auth_code != auth_code:
-            raise Exception("Auth code mismatch")
-        rakp3 = RAKP3Message(req.authentication.algorithm)
-        rakp3.managed_system_session_id = sid_c
-        rakp3.ke_auth_code = hmac.new(key, r_c + sid_m + role_m + ulength_m + uname_m, hashlib.sha1).digest()
-        rx_data = self._send_and_receive_rmcp2(encode_message(rakp3),
-                                               constants.PAYLOAD_TYPE_RAKP_MESSAGE_3)
-        rakp4 = RAKP4Message(req.authentication.algorithm)
-        decode_message(rakp4, rx_data)
-        sik = hmac.new(key, r_m + r_c + role_m + ulength_m + uname_m, hashlib.sha1).digest()
-        expected_integrity_check_value = hmac.new(sik, r_m + sid_c + guid_c, hashlib.sha1).digest()
-        expected_integrity_check_value = expected_integrity_check_value[:12]
-        integrity_check_value = b"".join([c.to_bytes(1, 'big') for c in rakp4.integrity_check_value])
-        if expected_integrity_check_value != integrity_check_value:
-            raise Exception(f"Integrity check value mismatch: {expected_integrity_check_value} vs {integrity_check_value}")
-        return (sik, sid_c)
+        self._console_session_id = None
+        if self._channel is not None:
+            self._console_session_id = \
+                self._channel.allocate_console_session_id()
+        exchange = open_session_exchange(session, auth_algo, integrity_algo,
+                                         confidentiality_algo,
+                                         self._console_session_id)
+        return run_exchange(exchange, self._send_and_receive_rmcp2)
 
     def _activate_session(self, session, challenge):
         # activate session
         req = create_request_by_name('ActivateSession')
         req.target = self.host_target
         req.authentication.type = session.auth_type
-        req.privilege_level.maximum_requested =\
-            Session.PRIV_LEVEL_ADMINISTRATOR
+        req.privilege_level.maximum_requested = session.privilege_level
         req.challenge_string = challenge
         req.session_id = self._session.sid
         req.initial_outbound_sequence_number = random.randrange(1, 0xffffffff)
@@ -938,6 +1021,13 @@ class Rmcp(object):
         rsp = self.send_and_receive(req)
         check_completion_code(rsp.completion_code)
 
+    def _keep_alive(self):
+        # a running transaction keeps the session alive anyway, don't block
+        # the shared keep alive thread of the multiplexer
+        if self.transaction_lock.locked():
+            return
+        self._get_device_id()
+
     def start_sol(self):
         if self._session is None or self._session.activated is not True:
             raise Exception("Session is not activated")
@@ -1001,6 +1091,21 @@ class Rmcp(object):
         self.host = session._rmcp_host
         self.port = session._rmcp_port
 
+        if self._channel is None:
+            self._establish_session(session)
+            return
+
+        # the multiplexer routes the datagrams without session ID to us
+        # until the session is set up
+        with self._channel.establishing(self.host, self.port):
+            self._establish_session(session)
+            if session.auth_type == Session.AUTH_TYPE_RMCP_PLUS:
+                key = self._console_session_id
+            else:
+                key = struct.pack('<I', session.sid)
+            self._channel.bind_session(key)
+
+    def _establish_session(self, session):
         # 0 - Ping
         self.ping()
 
@@ -1042,11 +1147,14 @@ class Rmcp(object):
 
             log().debug('Set Session Privilege Level')
             # 4 - Set Session Privilege Level
-            self._set_session_privilege_level(Session.PRIV_LEVEL_ADMINISTRATOR)
+            self._set_session_privilege_level(session.privilege_level)
 
             log().debug('Session opened')
 
-            if self.keep_alive_interval:
+            if self.keep_alive_interval and self._multiplexer is not None:
+                self._stop_keep_alive = self._multiplexer.call_repeatedly(
+                        self.keep_alive_interval, self._keep_alive)
+            elif self.keep_alive_interval:
                 self._stop_keep_alive = call_repeatedly(
                         self.keep_alive_interval, self._get_device_id)
         else:
@@ -1070,6 +1178,9 @@ class Rmcp(object):
         check_completion_code(rsp.completion_code)
         self._session.activated = False
 
+        if self._channel is not None:
+            self._channel.unbind_session()
+
 #        self._q.join()
 
     def _inc_sequence_number(self):
@@ -1080,16 +1191,10 @@ class Rmcp(object):
             self._send_ipmi2_msg(payload, payload_type)
             return self._receive_ipmi2_msg()
 
-    def _send_and_receive(self, target, lun, netfn, cmdid, payload):
-        """Send and receive data using RMCP interface.
-
-        target:
-        lun:
-        netfn:
-        cmdid:
-        raw_bytes: IPMI message payload as bytestring
+    def _encode_request(self, target, lun, netfn, cmdid, payload):
+        """Encode the IPMB request with the next sequence number.
 
-        Returns the received data as array.
+        Returns the request header and the data to send.
         """
         self._inc_sequence_number()
 
@@ -1109,6 +1214,22 @@ class Rmcp(object):
         else:
             tx_data = encode_ipmb_msg(header, payload)
 
+        return (header, tx_data)
+
+    def _send_and_receive(self, target, lun, netfn, cmdid, payload):
+        """Send and receive data using RMCP interface.
+
+        target:
+        lun:
+        netfn:
+        cmdid:
+        raw_bytes: IPMI message payload as bytestring
+
+        Returns the received data as array.
+        """
+        (header, tx_data) = self._encode_request(target, lun, netfn, cmdid,
+                                                 payload)
+
         with self.transaction_lock:
             self._send_ipmi_msg(tx_data)
 
@@ -1132,6 +1253,141 @@ class Rmcp(object):
 
         return rx_data[6:-1]
 
+    def _send_and_receive_many(self, requests, attempts=None):
+        """Send and receive data with up to `window` requests in flight.
+
+        requests: list of (target, lun, netfn, cmdid, payload) tuples
+        attempts: optional list, set to the number of times each request
+                  was sent
+
+        The responses are matched to the requests by the IPMB sequence
+        number. If no response arrives within the timeout, the missing
+        requests are sent again, each up to `max_retransmits` times. The
+        sequence number of a request which was sent more than once isn't
+        reused until a timeout after its response, so late duplicates
+        can't be taken for the response of a newer request. Requests
+        answered with CC_NODE_BUSY are sent again after `busy_backoff`
+        seconds with a new sequence number, up to `busy_retries` times
+        like `Ipmi.send_message` does.
+
+        Returns the received data in the order of the requests.
+        """
+        rx_list = [None] * len(requests)
+        if attempts is None:
+            attempts = [0] * len(requests)
+        else:
+            attempts[:] = [0] * len(requests)
+        # rq_seq -> [index, header, tx_data, busy retries left,
+        #            retransmits left]
+        pending = {}
+        # rq_seq -> time until duplicates of the response may arrive
+        retired = {}
+        # [time to send, index, busy retries left] of busy requests
+        delayed = []
+        next_index = 0
+
+        def sequence_number_free():
+            now = time.monotonic()
+            for (rq_seq, until) in list(retired.items()):
+                if until <= now:
+                    del retired[rq_seq]
+            return len(pending) + len(retired) < 64
+
+        def send(index, busy_retries):
+            while True:
+                (header, tx_data) = self._encode_request(*requests[index])
+                if header.rq_seq not in pending and \
+                        header.rq_seq not in retired:
+                    break
+            pending[header.rq_seq] = [index, header, tx_data, busy_retries,
+                                      self.max_retransmits]
+            attempts[index] += 1
+            self._send_ipmi_msg(tx_data)
+
+        with self.transaction_lock:
+            while next_index < len(requests) or pending or delayed:
+                now = time.monotonic()
+                for entry in list(delayed):
+                    if entry[0] <= now and sequence_number_free():
+                        delayed.remove(entry)
+                        send(entry[1], entry[2])
+                while (next_index < len(requests)
+                        and len(pending) + len(delayed) < self.window
+                        and sequence_number_free()):
+                    send(next_index, self.busy_retries)
+                    next_index += 1
+
+                if not pending:
+                    # wait for a busy request or a free sequence number
+                    wakeups = [entry[0] for entry in delayed]
+                    wakeups.extend(retired.values())
+                    time.sleep(max(0, min(wakeups) - time.monotonic()))
+                    continue
+
+                try:
+                    rx_data = self._receive_ipmi_msg()
+                except socket.timeout:
+                    if any(entry[4] == 0 for entry in pending.values()):
+                        raise
+                    log().debug('retransmit %d requests', len(pending))
+                    for entry in pending.values():
+                        entry[4] -= 1
+                        attempts[entry[0]] += 1
+                        self._send_ipmi_msg(entry[2])
+                    continue
+
+                if array('B', rx_data)[5] == constants.CMDID_SEND_MESSAGE:
+                    rx_data = decode_bridged_message(rx_data)
+                    if not rx_data:
+                        # the forwarded reply is expected in another packet
+                        continue
+
+                rq_seq = array('B', rx_data)[4] >> 2
+                if rq_seq not in pending:
+                    log().debug('drop response with unknown sequence '
+                                'number %d', rq_seq)
+                    continue
+
+                (index, header, _, busy_retries, retransmits) = \
+                    pending[rq_seq]
+                if not rx_filter(header, rx_data):
+                    continue
+
+                del pending[rq_seq]
+                if retransmits < self.max_retransmits:
+                    retired[rq_seq] = time.monotonic() + self._timeout
+                if len(rx_data) > 6 and busy_retries > 0 and \
+                        array('B', rx_data)[6] == constants.CC_NODE_BUSY:
+                    delayed.append([time.monotonic() + self.busy_backoff,
+                                    index, busy_retries - 1])
+                    continue
+                rx_list[index] = rx_data[6:-1]
+
+        return rx_list
+
+    def send_and_receive_many(self, reqs, attempts=None):
+        """Interface function to send and receive several IPMI messages.
+
+        Keeps up to `window` requests outstanding in the session.
+
+        reqs: list of IPMI message requests
+        attempts: optional list, set to the number of times each request
+                  was sent, including retransmits and busy retries
+
+        Returns the list of IPMI message responses in the order of `reqs`.
+        """
+        requests = [(req.target, req.lun, req.netfn, req.cmdid,
+                     encode_message(req)) for req in reqs]
+        rx_list = self._send_and_receive_many(requests, attempts)
+
+        rsps = []
+        for req, rx_data in zip(reqs, rx_list):
+            rsp = create_message(req.netfn + 1, req.cmdid,
+                                 req.group_extension)
+            decode_message(rsp, rx_data)
+            rsps.append(rsp)
+        return rsps
+
     def send_and_receive_raw(self, target, lun, netfn, raw_bytes):
         """Interface function to send and receive raw message.
 
@@ -0,0 +1,325 @@
+# Copyright (c) 2018  Kontron Europe GmbH
+#
+# This library is free software; you can redistribute it and/or
+# modify it under the terms of the GNU Lesser General Public
+# License as published by the Free Software Foundation; either
+# version 2.1 of the License, or (at your option) any later version.
+#
+# This library is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# Lesser General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public
+# License along with this library; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301 USA
+
+import heapq
+import itertools
+import os
+import select
+import socket
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from queue import Queue, Empty
+from time import monotonic
+
+from ..logger import log
+from ..session import Session
+from .rmcp import RMCP_CLASS_IPMI
+
+NO_SESSION = b'\x00\x00\x00\x00'
+
+
+def session_key(pdu):
+    """Return the session ID bytes of a received RMCP datagram.
+
+    The key is the session ID field as it is on the wire, for IPMI v1.5
+    this is the session ID assigned by the BMC, for RMCP+ the remote
+    console session ID. Returns None for datagrams without a session.
+    """
+    if len(pdu) < 13 or bytearray(pdu[3:4])[0] != RMCP_CLASS_IPMI:
+        return None
+    if bytearray(pdu[4:5])[0] == Session.AUTH_TYPE_RMCP_PLUS:
+        key = bytes(pdu[6:10])
+    else:
+        key = bytes(pdu[9:13])
+    if key == NO_SESSION:
+        return None
+    return key
+
+
+class MultiplexerChannel(object):
+    """The part of the multiplexer used by a single session."""
+
+    def __init__(self, multiplexer, sock):
+        self.multiplexer = multiplexer
+        self.sock = sock
+        self.peer = None
+        self.key = None
+        self._rx = Queue()
+
+    def sendto(self, pdu, address):
+        self.sock.sendto(pdu, address)
+
+    def recv(self, timeout=None):
+        """Return the next datagram for this session.
+
+        Raises socket.timeout like a blocking socket would.
+        """
+        try:
+            return self._rx.get(timeout=timeout)
+        except Empty:
+            raise socket.timeout('timed out')
+
+    def put(self, pdu):
+        self._rx.put(pdu)
+
+    def establishing(self, host, port):
+        return self.multiplexer.establishing(self, host, port)
+
+    def bind_session(self, key):
+        self.multiplexer.bind_session(self, key)
+
+    def allocate_console_session_id(self):
+        return self.multiplexer.allocate_console_session_id(self)
+
+    def unbind_session(self):
+        self.multiplexer.unbind_session(self)
+
+    def close(self):
+        self.multiplexer.detach(self)
+
+
+class RmcpMultiplexer(object):
+    """Share a few UDP sockets between many RMCP sessions.
+
+    A single receive thread reads all sockets and dispatches the datagrams
+    to the sessions by the peer address and the session ID. Datagrams
+    without a known session ID (ASF pong, session setup) are passed to the
+    session currently establishing a session with that peer, or to the
+    only session attached to that peer. Session setups to the same peer
+    are serialized.
+
+    The keep alive messages of all sessions are scheduled by a single
+    timer thread and sent by a pool of `keep_alive_workers` threads, so
+    sessions of BMCs not answering don't delay the others.
+
+    Example:
+        mux = RmcpMultiplexer(shards=2)
+        interface = pyipmi.interfaces.create_interface('rmcp',
+                                                       multiplexer=mux)
+    """
+
+    def __init__(self, shards=1, bind_address='0.0.0.0', poll_interval=0.5,
+                 keep_alive_workers=16):
+        self._socks = []
+        for _ in range(shards):
+            sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+            sock.bind((bind_address, 0))
+            sock.setblocking(False)
+            self._socks.append(sock)
+        self._next_shard = itertools.cycle(self._socks)
+        self._lock = threading.Lock()
+        self._channels = set()
+        self._sessions = {}
+        self._establishing = {}
+        self._peer_locks = {}
+        self._peers = {}
+        self._poll_interval = poll_interval
+        self._stopped = threading.Event()
+        self._timers = []
+        self._timer_cond = threading.Condition()
+        self._timer_ids = itertools.count()
+        self._timer_thread = None
+        self._keep_alive_workers = keep_alive_workers
+        self._executor = None
+
+        self._rx_thread = threading.Thread(target=self._receive_loop)
+        self._rx_thread.daemon = True
+        self._rx_thread.start()
+
+    @property
+    def sockets(self):
+        return list(self._socks)
+
+    def attach(self):
+        """Attach a new session and return its channel."""
+        with self._lock:
+            channel = MultiplexerChannel(self, next(self._next_shard))
+            self._channels.add(channel)
+        return channel
+
+    def detach(self, channel):
+        with self._lock:
+            self._channels.discard(channel)
+            self._remove_session(channel)
+            self._set_peer(channel, None)
+
+    def close(self):
+        """Stop the threads and close the sockets."""
+        self._stopped.set()
+        with self._timer_cond:
+            self._timer_cond.notify()
+            timer_thread = self._timer_thread
+        self._rx_thread.join()
+        if timer_thread is not None:
+            timer_thread.join()
+            self._executor.shutdown(wait=True)
+        for sock in self._socks:
+            sock.close()
+
+    def _resolve(self, host, port):
+        return (socket.gethostbyname(host), port)
+
+    def _set_peer(self, channel, peer):
+        if channel.peer is not None:
+            channels = self._peers.get(channel.peer)
+            if channels is not None:
+                channels.discard(channel)
+                if not channels:
+                    del self._peers[channel.peer]
+        channel.peer = peer
+        if peer is not None:
+            self._peers.setdefault(peer, set()).add(channel)
+
+    def _remove_session(self, channel):
+        if channel.key is not None:
+            self._sessions.pop((channel.peer, channel.key), None)
+            channel.key = None
+
+    @contextmanager
+    def establishing(self, channel, host, port):
+        """Route the session-less datagrams of the peer to `channel`."""
+        peer = self._resolve(host, port)
+        with self._lock:
+            self._remove_session(channel)
+            self._set_peer(channel, peer)
+            peer_lock = self._peer_locks.setdefault(peer, threading.Lock())
+
+        with peer_lock:
+            with self._lock:
+                self._establishing[peer] = channel
+            try:
+                yield channel
+            finally:
+                with self._lock:
+                    del self._establishing[peer]
+
+    def bind_session(self, channel, key):
+        """Route the datagrams with session ID `key` to `channel`."""
+        with self._lock:
+            self._remove_session(channel)
+            channel.key = key
+            self._sessions[(channel.peer, key)] = channel
+
+    def unbind_session(self, channel):
+        with self._lock:
+            self._remove_session(channel)
+
+    def allocate_console_session_id(self, channel):
+        """Return a remote console session ID unused for the peer."""
+        with self._lock:
+            while True:
+                key = os.urandom(4)
+                if (key != NO_SESSION
+                        and (channel.peer, key) not in self._sessions):
+                    return key
+
+    def _find_channel(self, pdu, address):
+        key = session_key(pdu)
+        with self._lock:
+            if key is not None:
+                channel = self._sessions.get((address, key))
+                if channel is not None:
+                    return channel
+            channel = self._establishing.get(address)
+            if channel is not None:
+                return channel
+            channels = self._peers.get(address)
+            if channels is not None and len(channels) == 1:
+                return next(iter(channels))
+        return None
+
+    def _dispatch(self, pdu, address):
+        channel = self._find_channel(pdu, address)
+        if channel is None:
+            log().debug('drop datagram from %s:%d', *address)
+            return
+        channel.put(pdu)
+
+    def _receive_loop(self):
+        while not self._stopped.is_set():
+            try:
+                (readable, _, _) = select.select(self._socks, [], [],
+                                                 self._poll_interval)
+            except (OSError, ValueError):
+                break
+            for sock in readable:
+                while True:
+                    try:
+                        (pdu, address) = sock.recvfrom(4096)
+                    except (BlockingIOError, InterruptedError):
+                        break
+                    except OSError as e:
+                        log().debug('receive failed: %s', e)
+                        break
+                    self._dispatch(pdu, address)
+
+    def call_repeatedly(self, interval, func, *args):
+        """Call `func` every `interval` seconds from the keep alive
+        workers.
+
+        Same as `rmcp.call_repeatedly` but all sessions share the threads.
+        The next call is scheduled when the previous one returned.
+        Returns a function to stop the calls.
+        """
+        timer_id = next(self._timer_ids)
+        stopped = threading.Event()
+        entry = (interval, func, args, stopped)
+
+        with self._timer_cond:
+            heapq.heappush(self._timers,
+                           (monotonic() + interval, timer_id, entry))
+            if self._timer_thread is None:
+                self._executor = ThreadPoolExecutor(self._keep_alive_workers)
+                self._timer_thread = threading.Thread(target=self._timer_loop)
+                self._timer_thread.daemon = True
+                self._timer_thread.start()
+            self._timer_cond.notify()
+
+        return stopped.set
+
+    def _timer_loop(self):
+        while not self._stopped.is_set():
+            with self._timer_cond:
+                if not self._timers:
+                    self._timer_cond.wait(self._poll_interval)
+                    continue
+                (due, timer_id, entry) = self._timers[0]
+                delay = due - monotonic()
+                if delay > 0:
+                    self._timer_cond.wait(delay)
+                    continue
+                heapq.heappop(self._timers)
+
+            if entry[3].is_set():
+                continue
+            self._executor.submit(self._run_timer, timer_id, entry)
+
+    def _run_timer(self, timer_id, entry):
+        (interval, func, args, stopped) = entry
+        if stopped.is_set() or self._stopped.is_set():
+            return
+        try:
+            func(*args)
+        except socket.timeout:
+            pass
+        except Exception as e:
+            log().debug('keep alive failed: %s', e)
+
+        with self._timer_cond:
+            heapq.heappush(self._timers,
+                           (monotonic() + interval, timer_id, entry))
+            self._timer_cond.notify()
@@ -440,7 +440,8 @@ Options:
   -h               Show this help
   -v               Be verbose
   -V               Print version
-  -I <interface>   Set interface (available: rmcp, aardvark, ipmitool, ipmbdev)
+  -I <interface>   Set interface (available: rmcp, aardvark, ipmitool, ipmbdev,
+                   pool)
   -H <host>        Set RMCP host
   -U <user>        Set RMCP user
   -P <password>    Set RMCP password
@@ -455,9 +456,14 @@ Aardvark interface options:
 
 Ipmitool interface options:
   interface_type    Set the interface type to be used (lan, lanplus, serial)
+  coprocess=<on|off>  Keep ipmitool running and reuse its session
 
 Ipmbdev interface options:
   port=<path>       Specify path to Linux IPMB device (/dev/ipmb-0 by default)
+
+Pool interface options:
+  path=<path>       Socket of the session pool daemon started with
+                    'python -m pyipmi.pool' (/tmp/pyipmi-pool.sock by default)
 '''[1:])
         print('Commands:')
 
@@ -496,11 +502,20 @@ def parse_interface_options(interface_name, options):
         elif interface_name == 'ipmitool':
             if name == 'interface_type':
                 interface_options['interface_type'] = value
+            elif (name, value) == ('coprocess', 'on'):
+                interface_options['coprocess'] = True
+            elif (name, value) == ('coprocess', 'off'):
+                interface_options['coprocess'] = False
             else:
                 print('Warning: unknown option %s' % name)
         elif interface_name == 'ipmbdev':
             if name == 'port':
                 interface_options['port'] = value
+        elif interface_name == 'pool':
+            if name == 'path':
+                interface_options['path'] = value
+            else:
+                print('Warning: unknown option %s' % name)
 
     return interface_options
 
@@ -177,14 +177,16 @@ class GetAcpiPowerStateRsp(Message):
 class GetDeviceGuideReq(Message):
     __cmdid__ = constants.CMDID_GET_DEVICE_GUID
     __netfn__ = constants.NETFN_APP
-    __not_implemented__ = True
 
 
 @register_message_class
 class GetDeviceGuideRsp(Message):
     __cmdid__ = constants.CMDID_GET_DEVICE_GUID
     __netfn__ = constants.NETFN_APP | 1
-    __not_implemented__ = True
+    __fields__ = (
+        CompletionCode(),
+        ByteArray('device_guid', 16),
+    )
 
 
 @register_message_class
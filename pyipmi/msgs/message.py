@@ -17,10 +17,12 @@
 
 from __future__ import absolute_import
 
+import struct
+
 from array import array
 
 from . import constants
-from ..utils import ByteBuffer
+from ..utils import ByteBuffer, ByteReader
 from ..errors import (CompletionCodeError, MessageStatusCodeError, EncodingError, DecodingError,
                       DescriptionError)
 
@@ -73,7 +75,7 @@ class ByteArray(BaseField):
         if self.default is not None:
             return array('B', self.default)
         else:
-            return array('B', self.length * '\x00')
+            return array('B', [0] * self.length)
 
 
 class VariableByteArray(ByteArray):
@@ -207,8 +209,7 @@ class RemainingBytes(BaseField):
         data.extend(a)
 
     def decode(self, obj, data):
-        setattr(obj, self.name, array('B', data[:]))
-        del data.array[:]
+        setattr(obj, self.name, array('B', data.pop_string(len(data))))
 
     def create(self):
         return array('B')
@@ -393,7 +394,7 @@ class Message(object):
         if not hasattr(self, '__fields__'):
             return
 
-        data = ByteBuffer(data)
+        data = ByteReader(data)
         cc = None
         msc = None
         for field in self.__fields__:
@@ -421,6 +422,298 @@ class Message(object):
     group_extension = property(lambda s: s.__group_extension__)
 
 
-encode_message = lambda m: m._encode()
-decode_message = lambda m, d: m._decode(d)
+# Item kinds of a precompiled struct run.
+_KIND_INT = 0
+_KIND_INT_BYTES = 1
+_KIND_BITS = 2
+_KIND_BITS_BYTES = 3
+_KIND_ARRAY = 4
+
+_STRUCT_CODES = {1: 'B', 2: 'H', 4: 'I', 8: 'Q'}
+
+
+def _is_plain(field, cls, *methods):
+    """Return True if `field` uses the `methods` implementation of `cls`."""
+    if not isinstance(field, cls):
+        return False
+    for method in methods:
+        if getattr(type(field), method) is not getattr(cls, method):
+            return False
+    return True
+
+
+def _is_fixed_size(field):
+    return (_is_plain(field, UnsignedInt, 'encode', 'decode')
+            or _is_plain(field, Bitfield, 'encode', 'decode')
+            or _is_plain(field, ByteArray, 'encode', 'decode', '_length'))
+
+
+def _decode_fields(fields, obj, data, offset):
+    """Decode `fields` the interpreted way and return the new offset."""
+    buf = ByteReader(data, offset)
+    for field in fields:
+        field.decode(obj, buf)
+    return buf.offset
+
+
+def _encode_fields(fields, obj, out):
+    """Encode `fields` the interpreted way and append the result to `out`."""
+    buf = ByteBuffer()
+    for field in fields:
+        field.encode(obj, buf)
+    out.append(buf.tobytes())
+
+
+class _StructRun(object):
+    """A run of consecutive fixed-size fields handled by one struct.Struct."""
+
+    def __init__(self, fields):
+        self._fields = fields
+        self._items = []
+        fmt = '<'
+        for field in fields:
+            length = field.length
+            code = _STRUCT_CODES.get(length)
+            if isinstance(field, ByteArray):
+                kind = _KIND_ARRAY
+                code = '%ds' % length
+            elif isinstance(field, Bitfield):
+                kind = _KIND_BITS if code else _KIND_BITS_BYTES
+            else:
+                kind = _KIND_INT if code else _KIND_INT_BYTES
+            if code is None:
+                code = '%ds' % length
+            fmt += code
+            self._items.append((field.name, kind, length,
+                                (1 << (8 * length)) - 1))
+        self._struct = struct.Struct(fmt)
+        self.size = self._struct.size
+
+    def decode(self, obj, data, offset):
+        if offset + self.size > len(data):
+            # let the fields raise the very same error
+            return _decode_fields(self._fields, obj, data, offset)
+        values = self._struct.unpack_from(data, offset)
+        for (name, kind, _, _), value in zip(self._items, values):
+            if kind is _KIND_INT:
+                setattr(obj, name, value)
+            elif kind is _KIND_INT_BYTES:
+                setattr(obj, name, int.from_bytes(value, 'little'))
+            elif kind is _KIND_BITS:
+                getattr(obj, name)._value = value
+            elif kind is _KIND_BITS_BYTES:
+                getattr(obj, name)._value = int.from_bytes(value, 'little')
+            else:
+                setattr(obj, name, array('B', value))
+        return offset + self.size
+
+    def encode(self, obj, out):
+        values = []
+        for name, kind, length, mask in self._items:
+            value = getattr(obj, name)
+            if kind is _KIND_INT:
+                values.append(value & mask)
+            elif kind is _KIND_INT_BYTES:
+                values.append((value & mask).to_bytes(length, 'little'))
+            elif kind is _KIND_BITS:
+                values.append(value._value & mask)
+            elif kind is _KIND_BITS_BYTES:
+                values.append((value._value & mask).to_bytes(length,
+                                                              'little'))
+            else:
+                if len(value) != length:
+                    raise EncodingError('Array must be exaclty %d bytes long '
+                                        '(but is %d long)' %
+                                        (length, len(value)))
+                try:
+                    values.append(bytes(value))
+                except ValueError:
+                    values.append(bytes(b & 0xff for b in value))
+        out.append(self._struct.pack(*values))
+
+
+class _StatusCode(_StructRun):
+    """A completion or message status code which stops the decoding."""
+
+    def __init__(self, field, ok_value, error_cls):
+        _StructRun.__init__(self, (field,))
+        self._name = field.name
+        self._ok_value = ok_value
+        self._error_cls = error_cls
+
+    def decode(self, obj, data, offset):
+        if offset >= len(data):
+            raise DecodingError('Data too short for message')
+        code = data[offset]
+        setattr(obj, self._name, code)
+        if code != self._ok_value:
+            raise self._error_cls(code)
+        return offset + 1
+
+
+class _RemainingBytes(object):
+    def __init__(self, field):
+        self._name = field.name
+
+    def decode(self, obj, data, offset):
+        value = array('B')
+        value.frombytes(data[offset:])
+        setattr(obj, self._name, value)
+        return len(data)
+
+    def encode(self, obj, out):
+        value = array('B')
+        value.extend(getattr(obj, self._name))
+        out.append(value.tobytes())
+
+
+class _Optional(object):
+    def __init__(self, field, step):
+        self._name = field.name
+        self._step = step
+
+    def decode(self, obj, data, offset):
+        if offset < len(data):
+            return self._step.decode(obj, data, offset)
+        setattr(obj, self._name, None)
+        return offset
+
+    def encode(self, obj, out):
+        if getattr(obj, self._name) is not None:
+            self._step.encode(obj, out)
+
+
+class _Conditional(object):
+    def __init__(self, condition_fn, step):
+        self._condition_fn = condition_fn
+        self._step = step
+
+    def decode(self, obj, data, offset):
+        if self._condition_fn(obj):
+            return self._step.decode(obj, data, offset)
+        return offset
+
+    def encode(self, obj, out):
+        if self._condition_fn(obj):
+            self._step.encode(obj, out)
+
+
+class _Interpreted(object):
+    """Fallback for fields without a precompiled representation."""
+
+    def __init__(self, field):
+        self._fields = (field,)
+
+    def decode(self, obj, data, offset):
+        return _decode_fields(self._fields, obj, data, offset)
+
+    def encode(self, obj, out):
+        _encode_fields(self._fields, obj, out)
+
+
+def _compile_field(field):
+    """Return the codec step for a single field."""
+    if _is_plain(field, CompletionCode, 'encode', 'decode'):
+        return _StatusCode(field, constants.CC_OK, CompletionCodeError)
+    if _is_plain(field, MessageStatusCode, 'encode', 'decode'):
+        return _StatusCode(field, constants.MSC_OK, MessageStatusCodeError)
+    if _is_fixed_size(field):
+        return _StructRun((field,))
+    if _is_plain(field, RemainingBytes, 'encode', 'decode'):
+        return _RemainingBytes(field)
+    if type(field) is Optional:
+        return _Optional(field._field, _compile_field(field._field))
+    if type(field) is Conditional:
+        return _Conditional(field._condition_fn, _compile_field(field._field))
+    return _Interpreted(field)
+
+
+class MessageCodec(object):
+    """Precompiled encoder and decoder for the fields of a message class.
+
+    Consecutive fixed-size fields (UnsignedInt, Bitfield and ByteArray) are
+    merged into a single `struct.Struct`. Decoding works on offsets into a
+    memoryview of the data. Fields without a precompiled representation are
+    handled by their own encode() and decode() methods.
+    """
+
+    def __init__(self, fields):
+        self.steps = []
+        run = []
+        for field in fields:
+            if _is_fixed_size(field):
+                run.append(field)
+                continue
+            if run:
+                self.steps.append(_StructRun(run))
+                run = []
+            self.steps.append(_compile_field(field))
+        if run:
+            self.steps.append(_StructRun(run))
+
+    def encode(self, msg):
+        """Encode the message and return a bytestring."""
+        out = []
+        for step in self.steps:
+            step.encode(msg, out)
+        return b''.join(out)
+
+    def decode(self, msg, data):
+        """Decode the bytestring message."""
+        try:
+            data = memoryview(data)
+        except TypeError:
+            data = memoryview(array('B', data))
+        if data.format != 'B' or data.ndim != 1:
+            msg._decode(data.tobytes())
+            return
+
+        offset = 0
+        cc = None
+        msc = None
+        for step in self.steps:
+            try:
+                offset = step.decode(msg, data, offset)
+            except CompletionCodeError as e:
+                # stop decoding on completion code != 0
+                cc = e.cc
+                break
+            except MessageStatusCodeError as e:
+                msc = e.msc
+                break
+
+        if ((cc is None or cc == 0) and (msc is None or msc == 0)
+                and len(data) > offset):
+            raise DecodingError('Data has extra bytes: {0}'.format(
+                data[offset:].tobytes()))
+
+
+def compile_message_codec(cls):
+    """Return the precompiled codec for the message class `cls`."""
+    fields = getattr(cls, '__fields__', None)
+    if not isinstance(fields, (tuple, list)):
+        return None
+    return MessageCodec(fields)
+
+
+def _get_codec(msg):
+    # only use a codec compiled for exactly this class, subclasses may
+    # define their own fields
+    return type(msg).__dict__.get('__codec__')
+
+
+def encode_message(msg):
+    codec = _get_codec(msg)
+    if codec is None:
+        return msg._encode()
+    return codec.encode(msg)
+
+
+def decode_message(msg, data):
+    codec = _get_codec(msg)
+    if codec is None:
+        return msg._decode(data)
+    return codec.decode(msg, data)
+
+
 pack_message = lambda m: m._pack()
@@ -17,6 +17,7 @@
 
 from functools import partial
 from ..errors import DescriptionError
+from .message import compile_message_codec
 
 
 class MessageRegistry(object):
@@ -51,6 +52,9 @@ class MessageRegistry(object):
                                    % (msg_id[0], msg_id[1], msg_id[2],
                                       self.registry[msg_id]))
 
+        # precompile the field codec used by encode/decode_message
+        cls.__codec__ = compile_message_codec(cls)
+
         # register name
         self.registry[cls.__name__] = cls
         # register (netfn, cmdid, group_extension) tuple
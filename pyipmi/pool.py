@@ -0,0 +1,341 @@
+# Copyright (c) 2018  Kontron Europe GmbH
+#
+# This library is free software; you can redistribute it and/or
+# modify it under the terms of the GNU Lesser General Public
+# License as published by the Free Software Foundation; either
+# version 2.1 of the License, or (at your option) any later version.
+#
+# This library is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# Lesser General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public
+# License along with this library; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301 USA
+
+"""Pool of established RMCP sessions.
+
+Library use:
+
+    pool = SessionPool()
+    with pool.session('10.0.0.1', 'admin', 'secret') as ipmi:
+        ipmi.get_chassis_status()
+    pool.close()
+
+The pool can also be served on a Unix socket to other processes, which
+use it with the 'pool' interface, e.g. from the ipmitool script:
+
+    python -m pyipmi.pool /tmp/pyipmi-pool.sock
+    ipmitool.py -I pool -o path=/tmp/pyipmi-pool.sock -H 10.0.0.1 \\
+        -U admin -P secret chassis status
+"""
+
+import binascii
+import hashlib
+import json
+import os
+import socket
+import sys
+import threading
+import time
+from contextlib import contextmanager
+
+try:
+    import socketserver
+except ImportError:
+    import SocketServer as socketserver
+
+from . import create_connection, Target
+from .errors import IpmiTimeoutError
+from .interfaces import create_interface
+from .interfaces.pool import DEFAULT_POOL_PATH
+from .interfaces.rmcp import call_repeatedly
+from .logger import log
+from .session import Session
+
+BMC_ADDRESS = 0x20
+
+
+class _PooledSession(object):
+    def __init__(self, key, ipmi):
+        self.key = key
+        self.ipmi = ipmi
+        self.last_used = time.time()
+
+
+class SessionPool(object):
+    """Keep activated sessions for reuse.
+
+    Sessions are kept per (host, port, user, privilege level); the
+    password is part of the key as well, so a session is only handed out
+    to callers knowing its password.
+
+    `max_idle_time` sessions not used for this many seconds are closed,
+    it should be below the session timeout of the BMCs.
+    `validate_after` sessions idle for longer are checked with a
+    GetDeviceId request before they are handed out.
+    `max_sessions` is the maximum number of sessions per key, further
+    callers wait until a session is released.
+    """
+
+    def __init__(self, max_idle_time=30, validate_after=5, max_sessions=4,
+                 timeout=2.0, interface='rmcp', interface_options=None,
+                 reap_interval=None):
+        self.max_idle_time = max_idle_time
+        self.validate_after = validate_after
+        self.max_sessions = max_sessions
+        self.timeout = timeout
+        self.interface = interface
+        self.interface_options = interface_options or {}
+        self._cond = threading.Condition()
+        self._idle = {}
+        self._counts = {}
+        self._in_use = {}
+        self._closed = False
+        self._stop_reaper = None
+        if reap_interval is None:
+            reap_interval = max_idle_time / 2.0
+        if reap_interval:
+            self._stop_reaper = call_repeatedly(reap_interval,
+                                                self.evict_idle)
+
+    @staticmethod
+    def _key(host, port, username, password, privilege_level):
+        digest = hashlib.sha256(password.encode('utf-8')).digest()
+        return (host, port, username, privilege_level, digest)
+
+    def _create(self, host, port, username, password, privilege_level):
+        options = dict(self.interface_options)
+        options.setdefault('timeout', self.timeout)
+        options.setdefault('keep_alive_interval', 0)
+        interface = create_interface(self.interface, **options)
+        ipmi = create_connection(interface)
+        ipmi.session.set_session_type_rmcp(host, port)
+        ipmi.session.set_auth_type_user(username, password)
+        ipmi.session.privilege_level = privilege_level
+        try:
+            ipmi.session.establish()
+        except Exception:
+            self._close_ipmi(ipmi)
+            raise
+        return ipmi
+
+    def _close_ipmi(self, ipmi):
+        try:
+            if ipmi.session.activated:
+                ipmi.session.close()
+        except Exception as e:
+            log().debug('close session failed: %s', e)
+        if hasattr(ipmi.interface, 'close'):
+            ipmi.interface.close()
+
+    def _is_valid(self, entry):
+        if time.time() - entry.last_used < self.validate_after:
+            return True
+        # ask the BMC itself, not the bridged target of the last borrower
+        entry.ipmi.target = Target(BMC_ADDRESS)
+        try:
+            entry.ipmi.get_device_id()
+        except Exception as e:
+            log().debug('drop pooled session: %s', e)
+            return False
+        return True
+
+    def acquire(self, host, username='', password='', port=623,
+                privilege_level=Session.PRIV_LEVEL_ADMINISTRATOR,
+                target=BMC_ADDRESS, routing=None):
+        """Return an `Ipmi` object with an established session.
+
+        The object must be given back with `release`.
+        """
+        key = self._key(host, port, username, password, privilege_level)
+        while True:
+            entry = None
+            with self._cond:
+                while True:
+                    if self._closed:
+                        raise RuntimeError('session pool is closed')
+                    idle = self._idle.get(key)
+                    if idle:
+                        entry = idle.pop()
+                        break
+                    if self._counts.get(key, 0) < self.max_sessions:
+                        self._counts[key] = self._counts.get(key, 0) + 1
+                        break
+                    if not self._cond.wait(self.max_idle_time):
+                        raise IpmiTimeoutError('no free session for %s' %
+                                               host)
+
+            if entry is None:
+                try:
+                    ipmi = self._create(host, port, username, password,
+                                        privilege_level)
+                except Exception:
+                    self._forget(key)
+                    raise
+                entry = _PooledSession(key, ipmi)
+            elif not self._is_valid(entry):
+                self._close_ipmi(entry.ipmi)
+                self._forget(key)
+                continue
+
+            entry.ipmi.target = Target(target, routing)
+            with self._cond:
+                self._in_use[id(entry.ipmi)] = entry
+            return entry.ipmi
+
+    def _forget(self, key):
+        with self._cond:
+            self._counts[key] -= 1
+            if self._counts[key] == 0:
+                del self._counts[key]
+            self._cond.notify_all()
+
+    def release(self, ipmi, discard=False):
+        """Give a session back, `discard` closes it instead."""
+        with self._cond:
+            entry = self._in_use.pop(id(ipmi))
+            entry.last_used = time.time()
+            if not discard and not self._closed:
+                self._idle.setdefault(entry.key, []).append(entry)
+                self._cond.notify_all()
+                return
+        self._close_ipmi(ipmi)
+        self._forget(entry.key)
+
+    @contextmanager
+    def session(self, *args, **kwargs):
+        """Context manager around `acquire` and `release`.
+
+        Sessions that timed out are closed instead of being reused.
+        """
+        ipmi = self.acquire(*args, **kwargs)
+        try:
+            yield ipmi
+        except (IpmiTimeoutError, socket.timeout):
+            self.release(ipmi, discard=True)
+            raise
+        except BaseException:
+            self.release(ipmi)
+            raise
+        else:
+            self.release(ipmi)
+
+    def evict_idle(self):
+        """Close the sessions idle for more than `max_idle_time`."""
+        expired = []
+        now = time.time()
+        with self._cond:
+            for (key, entries) in list(self._idle.items()):
+                for entry in list(entries):
+                    if now - entry.last_used > self.max_idle_time:
+                        entries.remove(entry)
+                        expired.append(entry)
+                if not entries:
+                    del self._idle[key]
+        for entry in expired:
+            self._close_ipmi(entry.ipmi)
+            self._forget(entry.key)
+
+    def close(self):
+        """Close all idle sessions, sessions in use are closed on release."""
+        if self._stop_reaper:
+            self._stop_reaper()
+            self._stop_reaper = None
+        with self._cond:
+            self._closed = True
+            entries = [e for idle in self._idle.values() for e in idle]
+            self._idle = {}
+            self._cond.notify_all()
+        for entry in entries:
+            self._close_ipmi(entry.ipmi)
+            self._forget(entry.key)
+
+    def __len__(self):
+        with self._cond:
+            return sum(self._counts.values())
+
+
+def execute_request(pool, request):
+    """Execute a request of the pool protocol and return the reply.
+
+    Requests and replies are JSON objects, one per line. A request
+    contains the connection (host, port, username, password,
+    privilege_level, target, routing) and the message (lun, netfn, data
+    as hex string). The reply contains the response data or an error.
+    """
+    try:
+        routing = request.get('routing')
+        if routing:
+            routing = [tuple(route) for route in routing]
+        with pool.session(request['host'], request.get('username', ''),
+                          request.get('password', ''),
+                          request.get('port', 623),
+                          request.get('privilege_level',
+                                      Session.PRIV_LEVEL_ADMINISTRATOR),
+                          request.get('target', BMC_ADDRESS), routing) as ipmi:
+            data = ipmi.raw_command(request.get('lun', 0), request['netfn'],
+                                    binascii.unhexlify(request['data']))
+        return {'data': binascii.hexlify(data).decode('ascii')}
+    except (IpmiTimeoutError, socket.timeout) as e:
+        return {'error': str(e) or 'timeout', 'type': 'IpmiTimeoutError'}
+    except Exception as e:
+        return {'error': str(e), 'type': type(e).__name__}
+
+
+class _PoolRequestHandler(socketserver.StreamRequestHandler):
+    def handle(self):
+        for line in self.rfile:
+            try:
+                request = json.loads(line.decode('utf-8'))
+            except ValueError as e:
+                reply = {'error': str(e), 'type': 'ValueError'}
+            else:
+                reply = execute_request(self.server.pool, request)
+            self.wfile.write(json.dumps(reply).encode('utf-8') + b'\n')
+            self.wfile.flush()
+
+
+class PoolServer(socketserver.ThreadingMixIn,
+                 socketserver.UnixStreamServer):
+    """Serve a `SessionPool` on a Unix socket."""
+
+    daemon_threads = True
+
+    def __init__(self, pool, path=DEFAULT_POOL_PATH):
+        if os.path.exists(path):
+            os.unlink(path)
+        # the requests carry the passwords, don't let anybody else
+        # connect between creating the socket and changing its mode
+        umask = os.umask(0o177)
+        try:
+            socketserver.UnixStreamServer.__init__(self, path,
+                                                   _PoolRequestHandler)
+        finally:
+            os.umask(umask)
+        os.chmod(path, 0o600)
+        self.pool = pool
+        self.path = path
+
+    def server_close(self):
+        socketserver.UnixStreamServer.server_close(self)
+        if os.path.exists(self.path):
+            os.unlink(self.path)
+
+
+def main():
+    path = sys.argv[1] if len(sys.argv) > 1 else DEFAULT_POOL_PATH
+    pool = SessionPool()
+    server = PoolServer(pool, path)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        pool.close()
+
+
+if __name__ == '__main__':
+    main()
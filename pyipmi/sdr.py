@@ -20,12 +20,12 @@ from __future__ import division
 import math
 from . import errors
 
-from .errors import DecodingError
-from .utils import check_completion_code, ByteBuffer
+from .errors import CompletionCodeError, DecodingError
+from .utils import check_completion_code, ByteReader
 from .msgs import create_request_by_name
 
 from .helper import get_sdr_data_helper, clear_repository_helper
-from .helper import get_sdr_chunk_helper
+from .helper import get_sdr_chunk_helper, SdrReadSize
 from .state import State
 
 SDR_TYPE_FULL_SENSOR_RECORD = 0x01
@@ -54,10 +54,26 @@ L_CUBE = 9
 L_SQRT = 10
 L_CUBERT = 11
 
+LINEARIZATION_FUNCTIONS = {
+    L_LN: math.log,
+    L_LOG: lambda x: math.log(x, 10),
+    L_LOG2: lambda x: math.log(x, 2),
+    L_E: math.exp,
+    L_EXP10: lambda x: math.pow(10, x),
+    L_EXP2: lambda x: math.pow(2, x),
+    L_1_X: lambda x: 1.0 / x,
+    L_SQR: lambda x: math.pow(x, 2),
+    L_CUBE: lambda x: math.pow(x, 3),
+    L_SQRT: math.sqrt,
+    L_CUBERT: lambda x: math.pow(x, 1.0/3),
+    L_LINEAR: lambda x: x,
+}
+
 
 class Sdr(object):
     def __init__(self):
-        pass
+        self.sdr_cache = None
+        self._sdr_read_sizes = {}
 
     def get_sdr_repository_info(self):
         return SdrRepositoryInfo(
@@ -79,14 +95,22 @@ class Sdr(object):
         req.bytes_to_read = length
 
         rsp = get_sdr_chunk_helper(self.send_message, req,
-                                   self.reserve_device_sdr_repository)
+                                   self.reserve_sdr_repository)
 
         return (rsp.next_record_id, rsp.record_data)
 
+    def _get_sdr_read_size(self, repository):
+        """Return the learned SDR read size of the current target."""
+        key = (repository, str(self.target))
+        if key not in self._sdr_read_sizes:
+            self._sdr_read_sizes[key] = SdrReadSize()
+        return self._sdr_read_sizes[key]
+
     def get_repository_sdr(self, record_id, reservation_id=None):
         (next_id, record_data) = get_sdr_data_helper(
                 self.reserve_sdr_repository, self._get_sdr_chunk,
-                record_id, reservation_id)
+                record_id, reservation_id,
+                self._get_sdr_read_size('repository'))
         return SdrCommon.from_data(record_data, next_id)
 
     def sdr_repository_entries(self):
@@ -94,7 +118,21 @@ class Sdr(object):
 
         The Generator starts with ID=0x0000 and ends when ID=0xffff
         is returned.
+
+        If an `sdr_cache` is set the records are taken from the cache as
+        long as the addition and erase timestamps of the repository did
+        not change.
         """
+        if self.sdr_cache is None:
+            return self._sdr_repository_entries()
+
+        info = self.get_sdr_repository_info()
+        stamp = (info.sdr_version, info.record_count,
+                 info.most_recent_addition, info.most_recent_erase)
+        return self._cached_sdr_entries('repository', stamp,
+                                        self._sdr_repository_entries)
+
+    def _sdr_repository_entries(self):
         reservation_id = self.reserve_sdr_repository()
         record_id = 0
 
@@ -109,6 +147,20 @@ class Sdr(object):
         """Return the complete SDR list."""
         return list(self.sdr_repository_entries())
 
+    def _cached_sdr_entries(self, repository, stamp, fetch_fn):
+        identity = self._cache_identity()
+        records = self.sdr_cache.load(identity, repository, stamp)
+        if records is not None:
+            for (next_id, data) in records:
+                yield SdrCommon.from_data(data, next_id)
+            return
+
+        records = []
+        for record in fetch_fn():
+            records.append((record.next_id, record.data))
+            yield record
+        self.sdr_cache.store(identity, repository, stamp, records)
+
     def partial_add_sdr(self, reservation_id, record_id,
                         offset, progress, data):
 
@@ -161,6 +213,7 @@ class SdrRepositoryInfo(State):
         self.record_count = rsp.record_count
         self.free_space = rsp.free_space
         self.most_recent_addition = rsp.most_recent_addition
+        self.most_recent_erase = rsp.most_recent_erase
         self.support_get_allocation_info = rsp.support.get_allocation_info
         self.support_reserve = rsp.support.reserve
         self.support_partial_add = rsp.support.partial_add
@@ -204,7 +257,7 @@ class SdrCommon(object):
         return s
 
     def _common_header(self, data):
-        buffer = ByteBuffer(data[:])
+        buffer = ByteReader(data)
         try:
             self.id = buffer.pop_unsigned_int(2)
             self.version = buffer.pop_unsigned_int(1)
@@ -215,7 +268,9 @@ class SdrCommon(object):
 
     def _common_record_key(self, buffer):
         self.owner_id = buffer.pop_unsigned_int(1)
-        self.owner_lun = buffer.pop_unsigned_int(1) & 0x3
+        owner_lun = buffer.pop_unsigned_int(1)
+        self.owner_lun = owner_lun & 0x3
+        self.owner_channel = owner_lun >> 4
         self.number = buffer.pop_unsigned_int(1)
 
     def _entity(self, buffer):
@@ -260,6 +315,9 @@ class SdrFullSensorRecord(SdrCommon):
     DATA_FMT_2S_COMPLEMENT = 2
     DATA_FMT_NONE = 3
 
+    _conversion_table = None
+    _conversion_key = None
+
     def __init__(self, data=None, next_id=None):
         super(SdrFullSensorRecord, self).__init__(data, next_id)
 
@@ -271,9 +329,7 @@ class SdrFullSensorRecord(SdrCommon):
                    ' '.join(['%02x' % b for b in self.data]))
         return s
 
-    def convert_sensor_raw_to_value(self, raw):
-        if raw is None:
-            return None
+    def _convert_raw(self, raw):
         fmt = self.analog_data_format
         if (fmt == self.DATA_FMT_1S_COMPLEMENT):
             if raw & 0x80:
@@ -285,6 +341,45 @@ class SdrFullSensorRecord(SdrCommon):
 
         return self.l((self.m * raw + (self.b * 10**self.k1)) * 10**self.k2)
 
+    def _get_conversion_table(self):
+        """Return the values of all 256 raw readings.
+
+        The table is built on first use and again whenever the conversion
+        factors change. Readings without a valid value are None.
+        """
+        key = (self.analog_data_format, self.m, self.b, self.k1, self.k2,
+               self.linearization)
+        if key != self._conversion_key:
+            table = []
+            for raw in range(256):
+                try:
+                    table.append(self._convert_raw(raw))
+                except (ValueError, ZeroDivisionError, OverflowError):
+                    table.append(None)
+            self._conversion_table = table
+            self._conversion_key = key
+        return self._conversion_table
+
+    def convert_sensor_raw_to_value(self, raw):
+        if raw is None:
+            return None
+        if 0 <= raw <= 0xff:
+            return self._get_conversion_table()[raw]
+        return self._convert_raw(raw)
+
+    def convert_many(self, raws):
+        """Return the values of a sequence of raw readings."""
+        table = self._get_conversion_table()
+        values = []
+        for raw in raws:
+            if raw is None:
+                values.append(None)
+            elif 0 <= raw <= 0xff:
+                values.append(table[raw])
+            else:
+                values.append(self._convert_raw(raw))
+        return values
+
     def convert_sensor_value_to_raw(self, value):
         linearization = self.linearization & 0x7f
 
@@ -311,20 +406,7 @@ class SdrFullSensorRecord(SdrCommon):
     @property
     def l(self):
         try:
-            return {
-                L_LN: math.log,
-                L_LOG: lambda x: math.log(x, 10),
-                L_LOG2: lambda x: math.log(x, 2),
-                L_E: math.exp,
-                L_EXP10: lambda x: math.pow(10, x),
-                L_EXP2: lambda x: math.pow(2, x),
-                L_1_X: lambda x: 1.0 / x,
-                L_SQR: lambda x: math.pow(x, 2),
-                L_CUBE: lambda x: math.pow(x, 3),
-                L_SQRT: math.sqrt,
-                L_CUBERT: lambda x: math.pow(x, 1.0/3),
-                L_LINEAR: lambda x: x,
-            }[self.linearization & 0x7f]
+            return LINEARIZATION_FUNCTIONS[self.linearization & 0x7f]
         except KeyError:
             raise errors.DecodingError('unknown linearization %d' %
                                        (self.linearization & 0x7f))
@@ -383,7 +465,7 @@ class SdrFullSensorRecord(SdrCommon):
             pass
 
     def _from_data(self, data):
-        buffer = ByteBuffer(data[5:])
+        buffer = ByteReader(data, 5)
         # record key bytes
         self._common_record_key(buffer.pop_slice(3))
         # record body bytes
@@ -496,7 +578,7 @@ class SdrCompactSensorRecord(SdrCommon):
         return s
 
     def _from_data(self, data):
-        buffer = ByteBuffer(data[5:])
+        buffer = ByteReader(data, 5)
 
         # record key bytes
         self._common_record_key(buffer.pop_slice(3))
@@ -533,7 +615,7 @@ class SdrEventOnlySensorRecord(SdrCommon):
         return 'Not supported yet.'
 
     def _from_data(self, data):
-        buffer = ByteBuffer(data[5:])
+        buffer = ByteReader(data, 5)
 
         # record key bytes
         self._common_record_key(buffer.pop_slice(3))
@@ -563,7 +645,7 @@ class SdrFruDeviceLocator(SdrCommon):
         return s
 
     def _from_data(self, data):
-        buffer = ByteBuffer(data[5:])
+        buffer = ByteReader(data, 5)
         self.device_access_address = buffer.pop_unsigned_int(1) >> 1
         self.fru_device_id = buffer.pop_unsigned_int(1)
         self.logical_physical = buffer.pop_unsigned_int(1)
@@ -591,7 +673,7 @@ class SdrManagementControllerDeviceLocator(SdrCommon):
         return s
 
     def _from_data(self, data):
-        buffer = ByteBuffer(data[5:])
+        buffer = ByteReader(data, 5)
         self.device_slave_address = buffer.pop_unsigned_int(1) >> 1
         self.channel_number = buffer.pop_unsigned_int(1) & 0xf
         self.power_state_notification = buffer.pop_unsigned_int(1)
@@ -612,7 +694,7 @@ class SdrManagementControllerConfirmationRecord(SdrCommon):
                 data, next_id)
 
     def _from_data(self, data):
-        buffer = ByteBuffer(data[5:])
+        buffer = ByteReader(data, 5)
         self.device_slave_address = buffer.pop_unsigned_int(1) >> 1
         self.device_id = buffer.pop_unsigned_int(1)
         self.channel_number = buffer.pop_unsigned_int(1)
@@ -635,7 +717,7 @@ class SdrOEMSensorRecord(SdrCommon):
         return 'Not supported yet.'
 
     def _from_data(self, data):
-        buffer = ByteBuffer(data[5:])
+        buffer = ByteReader(data, 5)
 
         # record key bytes
         self._common_record_key(buffer.pop_slice(3))
@@ -15,22 +15,76 @@
 # License along with this library; if not, write to the Free Software
 # Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301 USA
 
+import json
 from array import array
 
 from .errors import CompletionCodeError, DecodingError
-from .utils import check_completion_code, ByteBuffer
+from .utils import check_completion_code, ByteReader, ByteWriter
 from .msgs import create_request_by_name
 from .msgs import constants
 from .event import EVENT_ASSERTION, EVENT_DEASSERTION
 
-from .helper import clear_repository_helper
+from .helper import clear_repository_helper, run_steps
 from .state import State
 
 
+START_SEL_RECORD_ID = 0
+END_SEL_RECORD_ID = 0xffff
+
+
+def sel_entry_steps(record_id, reservation, max_req_len, key):
+    """The steps of reading a SEL entry.
+
+    Yields ('send', req). The length accepted by the BMC is kept in
+    `max_req_len[key]` for the next entries. Returns the entry and the
+    next record ID.
+    """
+    ENTIRE_RECORD = 0xff
+    req = create_request_by_name('GetSelEntry')
+    req.reservation_id = reservation
+    req.record_id = record_id
+    req.offset = 0
+    length = max_req_len.get(key, ENTIRE_RECORD)
+
+    record_data = ByteWriter(16)
+
+    while True:
+        req.length = length
+        if (length != 0xff
+                and (req.offset + req.length) > 16):
+            req.length = 16 - req.offset
+
+        rsp = yield ('send', req)
+        if rsp.completion_code == constants.CC_CANT_RET_NUM_REQ_BYTES \
+                and length > 1:
+            if length == 0xff:
+                length = 16
+            else:
+                length -= 1
+            max_req_len[key] = length
+            continue
+        else:
+            check_completion_code(rsp.completion_code)
+
+        record_data.extend(rsp.record_data)
+        req.offset = len(record_data)
+
+        if len(record_data) >= 16:
+            break
+
+    return (SelEntry(record_data.tobytes()), rsp.next_record_id)
+
+
 class Sel(object):
+    def __init__(self):
+        # the GetSelEntry length accepted by each target
+        self.max_req_len = {}
+
+    def get_sel_info(self):
+        return SelInfo(self.send_message_with_name('GetSelInfo'))
+
     def get_sel_entries_count(self):
-        info = SelInfo(self.send_message_with_name('GetSelInfo'))
-        return info.entries
+        return self.get_sel_info().entries
 
     def get_sel_reservation_id(self):
         rsp = self.send_message_with_name('ReserveSel')
@@ -73,43 +127,12 @@ class Sel(object):
             return sel_entry
 
     def get_sel_entry(self, record_id, reservation=0):
-        ENTIRE_RECORD = 0xff
-        req = create_request_by_name('GetSelEntry')
-        req.reservation_id = reservation
-        req.record_id = record_id
-        req.offset = 0
-        self.max_req_len = ENTIRE_RECORD
-
-        record_data = ByteBuffer()
-
-        while True:
-            req.length = self.max_req_len
-            if (self.max_req_len != 0xff
-                    and (req.offset + req.length) > 16):
-                req.length = 16 - req.offset
-
-            rsp = self.send_message(req)
-            if rsp.completion_code == constants.CC_CANT_RET_NUM_REQ_BYTES:
-                if self.max_req_len == 0xff:
-                    self.max_req_len = 16
-                else:
-                    self.max_req_len -= 1
-                continue
-            else:
-                check_completion_code(rsp.completion_code)
-
-            record_data.extend(rsp.record_data)
-            req.offset = len(record_data)
-
-            if len(record_data) >= 16:
-                break
-
-        return (SelEntry(record_data), rsp.next_record_id)
+        return run_steps(sel_entry_steps(record_id, reservation,
+                                         self.max_req_len, str(self.target)),
+                         send=self.send_message)
 
     def sel_entries(self):
         """Generator which returns all SEL entries."""
-        START_SEL_RECORD_ID = 0
-        END_SEL_RECORD_ID = 0xffff
         if self.get_sel_entries_count() == 0:
             return
 
@@ -126,6 +149,103 @@ class Sel(object):
         """Return all SEL entries as a list."""
         return list(self.sel_entries())
 
+    def _sel_entries_from(self, record_id, reservation_id):
+        while record_id != END_SEL_RECORD_ID:
+            (sel_entry, record_id) = self.get_sel_entry(record_id,
+                                                        reservation_id)
+            yield (sel_entry, record_id)
+
+    def tail_sel_entries(self, cursor):
+        """Generator which returns the SEL entries added since `cursor`.
+
+        Only GetSelInfo is sent if the SEL did not change since the last
+        call. Otherwise the last seen entry is read again to find the next
+        record ID and only the following entries are read. If the SEL was
+        cleared or the last seen entry is gone, all entries are returned.
+
+        The `cursor` (a `SelCursor`) is updated with every returned entry.
+        """
+        info = self.get_sel_info()
+        if info.most_recent_erase != cursor.most_recent_erase:
+            cursor.record_id = None
+            cursor.most_recent_addition = None
+            cursor.most_recent_erase = info.most_recent_erase
+        elif (info.most_recent_addition == cursor.most_recent_addition
+                and cursor.record_id is not None):
+            return
+
+        if info.entries == 0:
+            cursor.update(info, None)
+            return
+
+        reservation_id = self.get_sel_reservation_id()
+        record_id = START_SEL_RECORD_ID
+        if cursor.record_id is not None:
+            try:
+                (_, record_id) = self.get_sel_entry(cursor.record_id,
+                                                    reservation_id)
+            except CompletionCodeError as e:
+                if e.cc not in (constants.CC_REQ_DATA_NOT_PRESENT,
+                                constants.CC_ILL_SENSOR_OR_RECORD,
+                                constants.CC_PARAM_OUT_OF_RANGE):
+                    raise
+                record_id = START_SEL_RECORD_ID
+
+        for (sel_entry, _) in self._sel_entries_from(record_id,
+                                                     reservation_id):
+            cursor.record_id = sel_entry.record_id
+            yield sel_entry
+        cursor.update(info, cursor.record_id)
+
+    def get_new_sel_entries(self, cursor):
+        """Return the SEL entries added since `cursor` as a list."""
+        return list(self.tail_sel_entries(cursor))
+
+
+class SelCursor(object):
+    """Position of `Sel.tail_sel_entries` in the SEL.
+
+    The cursor can be saved to a file, so that a restarted process
+    continues after the last entry it has seen.
+    """
+
+    def __init__(self, record_id=None, most_recent_addition=None,
+                 most_recent_erase=None):
+        self.record_id = record_id
+        self.most_recent_addition = most_recent_addition
+        self.most_recent_erase = most_recent_erase
+
+    def update(self, info, record_id):
+        self.record_id = record_id
+        self.most_recent_addition = info.most_recent_addition
+        self.most_recent_erase = info.most_recent_erase
+
+    def to_dict(self):
+        return {
+            'record_id': self.record_id,
+            'most_recent_addition': self.most_recent_addition,
+            'most_recent_erase': self.most_recent_erase,
+        }
+
+    @classmethod
+    def from_dict(cls, values):
+        return cls(values.get('record_id'),
+                   values.get('most_recent_addition'),
+                   values.get('most_recent_erase'))
+
+    def save(self, path):
+        with open(path, 'w') as f:
+            json.dump(self.to_dict(), f)
+
+    @classmethod
+    def load(cls, path):
+        """Return the saved cursor or a new one if there is none."""
+        try:
+            with open(path) as f:
+                return cls.from_dict(json.load(f))
+        except (IOError, OSError, ValueError):
+            return cls()
+
 
 class SelInfo(State):
 
@@ -186,8 +306,7 @@ class SelEntry(State):
 
         self.data = data
 
-        # pop will change data, therefore copy it
-        buffer = ByteBuffer(data)
+        buffer = ByteReader(data)
 
         self.record_id = buffer.pop_unsigned_int(2)
         self.type = buffer.pop_unsigned_int(1)
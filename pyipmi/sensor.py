@@ -20,6 +20,7 @@ from .utils import check_completion_code
 from .msgs import create_request_by_name
 
 from .helper import get_sdr_data_helper, get_sdr_chunk_helper
+from .state import State
 
 from . import sdr
 
@@ -96,6 +97,9 @@ SENSOR_TYPE_OEM_KONTRON_RESET = 0xcf
 
 
 class Sensor(object):
+    def get_device_sdr_info(self):
+        return DeviceSdrInfo(self.send_message_with_name('GetDeviceSdrInfo'))
+
     def reserve_device_sdr_repository(self):
         rsp = self.send_message_with_name('ReserveDeviceSdrRepository')
         return rsp.reservation_id
@@ -122,7 +126,8 @@ class Sensor(object):
         (next_id, record_data) = \
             get_sdr_data_helper(self.reserve_device_sdr_repository,
                                 self._get_device_sdr_chunk,
-                                record_id, reservation_id)
+                                record_id, reservation_id,
+                                self._get_sdr_read_size('device'))
 
         return sdr.SdrCommon.from_data(record_data, next_id)
 
@@ -131,7 +136,20 @@ class Sensor(object):
 
         Starting with ID=0x0000 and
         end when ID=0xffff is returned.
+
+        If an `sdr_cache` is set the records are taken from the cache as
+        long as the sensor population of the device did not change.
         """
+        if self.sdr_cache is None:
+            return self._device_sdr_entries()
+
+        info = self.get_device_sdr_info()
+        stamp = (info.number_of_sensors, info.dynamic_population,
+                 info.sensor_population_change)
+        return self._cached_sdr_entries('device', stamp,
+                                        self._device_sdr_entries)
+
+    def _device_sdr_entries(self):
         reservation_id = self.reserve_device_sdr_repository()
         record_id = 0
 
@@ -223,3 +241,14 @@ class Sensor(object):
         req.event_data = [0] if event_data is None else event_data
         rsp = self.send_message(req)
         check_completion_code(rsp.completion_code)
+
+
+class DeviceSdrInfo(State):
+    def _from_response(self, rsp):
+        self.number_of_sensors = rsp.number_of_sensors
+        self.dynamic_population = bool(rsp.flags.dynamic_population)
+        self.lun_has_sensors = (bool(rsp.flags.lun0_has_sensors),
+                                bool(rsp.flags.lun1_has_sensors),
+                                bool(rsp.flags.lun2_has_sensors),
+                                bool(rsp.flags.lun3_has_sensors))
+        self.sensor_population_change = rsp.sensor_population_change
@@ -0,0 +1,304 @@
+# Copyright (c) 2018  Kontron Europe GmbH
+#
+# This library is free software; you can redistribute it and/or
+# modify it under the terms of the GNU Lesser General Public
+# License as published by the Free Software Foundation; either
+# version 2.1 of the License, or (at your option) any later version.
+#
+# This library is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# Lesser General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public
+# License along with this library; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301 USA
+
+"""Simulated sensor readings and SEL events for the emulator.
+
+The readings of the sensors described by the SDRs follow a waveform. By
+default the readings of threshold based full sensor records ramp up and
+down across the lowest upper (or highest lower) threshold, with some
+noise. Every threshold crossing adds the matching event to the SEL:
+
+    engine = SensorEngine(sdr_list, period=(10, 60))
+    (raw, states) = engine.reading(4)
+    engine.update()
+    events = engine.sel_list
+"""
+
+import random
+import struct
+import time
+from collections import OrderedDict
+
+from .sdr import SDR_TYPE_FULL_SENSOR_RECORD, SDR_TYPE_COMPACT_SENSOR_RECORD
+from .sensor import EVENT_READING_TYPE_CODE_THRESHOLD
+
+SEL_TYPE_SYSTEM_EVENT = 0x02
+EVM_REV_IPMI_2_0 = 0x04
+# event data 1: trigger reading in byte 2, trigger threshold in byte 3
+EVENT_DATA_THRESHOLD_TRIGGER = 0x50
+LAST_SEL_RECORD_ID = 0xfffe
+
+# (name, state bit, assertion event offset, upper threshold)
+THRESHOLDS = (
+    ('lnc', 0, 0, False),
+    ('lcr', 1, 2, False),
+    ('lnr', 2, 4, False),
+    ('unc', 3, 7, True),
+    ('ucr', 4, 9, True),
+    ('unr', 5, 11, True),
+)
+
+
+class Constant(object):
+    """A constant reading."""
+
+    def __init__(self, value):
+        self.value = value
+
+    def __call__(self, t):
+        return self.value
+
+
+class Ramp(object):
+    """Readings going from `low` to `high` and back within `period`
+    seconds. `phase` (0..1) shifts the start within the period."""
+
+    def __init__(self, low, high, period, phase=0.0):
+        self.low = low
+        self.high = high
+        self.period = period
+        self.phase = phase
+
+    def __call__(self, t):
+        x = (t / self.period + self.phase) % 1.0
+        x = 2 * x if x < 0.5 else 2 * (1 - x)
+        return self.low + (self.high - self.low) * x
+
+
+class Noise(object):
+    """Adds uniform noise of up to `amplitude` to a waveform."""
+
+    def __init__(self, waveform, amplitude, seed=None):
+        self.waveform = waveform
+        self.amplitude = amplitude
+        self.random = random.Random(seed)
+
+    def __call__(self, t):
+        return self.waveform(t) + self.random.uniform(-self.amplitude,
+                                                      self.amplitude)
+
+
+class SimulatedSensor(object):
+    """A sensor of the `SensorEngine`.
+
+    The waveform gives the reading as signed value for sensors with a
+    signed analog data format. Threshold states are only kept for full
+    sensor records of threshold based sensors.
+    """
+
+    def __init__(self, sdr, number, waveform):
+        self.sdr = sdr
+        self.number = number
+        self.waveform = waveform
+        self.thresholds = []
+        self.asserted = 0
+        self.signed_format = 0
+
+        if (sdr.type == SDR_TYPE_FULL_SENSOR_RECORD
+                and sdr.event_reading_type_code ==
+                EVENT_READING_TYPE_CODE_THRESHOLD):
+            self.signed_format = sdr.analog_data_format
+            readable = sdr.discrete_reading_mask & 0x3f
+            for (name, bit, offset, upper) in THRESHOLDS:
+                if readable & (1 << bit):
+                    self.thresholds.append(
+                        (name, bit, offset, upper,
+                         self.to_value(sdr.threshold[name])))
+
+    @property
+    def generator_id(self):
+        sdr = self.sdr
+        return sdr.owner_id | (sdr.owner_channel << 4 | sdr.owner_lun) << 8
+
+    def to_value(self, raw):
+        if raw & 0x80:
+            if self.signed_format == 1:
+                return raw - 0xff
+            if self.signed_format == 2:
+                return raw - 0x100
+        return raw
+
+    def to_raw(self, value):
+        if self.signed_format in (1, 2):
+            value = min(max(value, -127), 127)
+            if value < 0:
+                value += 0xff if self.signed_format == 1 else 0x100
+            return value
+        return min(max(value, 0), 0xff)
+
+    def raw_thresholds(self):
+        """Return the readable thresholds as dict of raw values."""
+        return dict((name, self.sdr.threshold[name])
+                    for (name, _, _, _, _) in self.thresholds)
+
+    def evaluate(self, t):
+        """Return the `(raw, states, events)` at time `t`.
+
+        `events` lists the `(offset, deassertion, value, threshold)` of the
+        threshold crossings since the last evaluation.
+        """
+        value = int(round(self.waveform(t)))
+        events = []
+        hysteresis = getattr(self.sdr, 'hysteresis', None) or {}
+        for (name, bit, offset, upper, threshold) in self.thresholds:
+            mask = 1 << bit
+            if upper:
+                crossed = value >= threshold
+                cleared = value < threshold - hysteresis.get(
+                    'negative_going', 0)
+            else:
+                crossed = value <= threshold
+                cleared = value > threshold + hysteresis.get(
+                    'positive_going', 0)
+
+            if crossed and not self.asserted & mask:
+                self.asserted |= mask
+                events.append((offset, False, value, threshold))
+            elif cleared and self.asserted & mask:
+                self.asserted &= ~mask
+                events.append((offset, True, value, threshold))
+        return (self.to_raw(value), self.asserted, events)
+
+
+class SensorEngine(object):
+    """Simulate the sensors of a BMC described by its SDRs.
+
+    `sdr_list` maps the record IDs to SDRs as in `pyipmi.emulation`. The
+    engine keeps its own copy of `sel_list` and adds the events to it,
+    keeping at most `max_sel_entries` entries.
+
+    The default waveforms ramp with a random period in the `period`
+    range of seconds and add `noise` raw counts of noise. `waveforms`
+    maps sensor numbers to waveforms overriding the default.
+    """
+
+    def __init__(self, sdr_list, sel_list=None, period=(60, 300), noise=1,
+                 waveforms=None, seed=None, max_sel_entries=1024,
+                 clock=time.monotonic):
+        self.sel_list = OrderedDict(sel_list or ())
+        self.max_sel_entries = max_sel_entries
+        self.most_recent_addition = 0
+        self.clock = clock
+        self.random = random.Random(seed)
+        self.sensors = OrderedDict()
+        waveforms = waveforms or {}
+
+        for sdr in sdr_list.values():
+            if sdr.type not in (SDR_TYPE_FULL_SENSOR_RECORD,
+                                SDR_TYPE_COMPACT_SENSOR_RECORD):
+                continue
+            count = 1
+            if sdr.type == SDR_TYPE_COMPACT_SENSOR_RECORD:
+                count = max(1, sdr.record_sharing & 0xf)
+            for number in range(sdr.number, sdr.number + count):
+                if number in self.sensors:
+                    continue
+                sensor = SimulatedSensor(sdr, number, Constant(0))
+                sensor.waveform = waveforms.get(number) or \
+                    self._default_waveform(sensor, period, noise)
+                self.sensors[number] = sensor
+
+        self._next_record_id = max(list(self.sel_list) + [0]) + 1
+        self._start = clock()
+
+    def _default_waveform(self, sensor, period, noise):
+        sdr = sensor.sdr
+        if sdr.type != SDR_TYPE_FULL_SENSOR_RECORD:
+            return Constant(0)
+
+        values = dict((name, value)
+                      for (name, _, _, _, value) in sensor.thresholds)
+        if 'nominal_reading' in sdr.analog_characteristic:
+            base = sensor.to_value(sdr.nominal_reading)
+        else:
+            base = sensor.to_value(sdr.sensor_minimum_reading)
+            if sdr.sensor_maximum_reading > sdr.sensor_minimum_reading:
+                base = (base + sensor.to_value(sdr.sensor_maximum_reading)) \
+                    // 2
+        hysteresis = max(sdr.hysteresis.values())
+
+        upper = [values[name] for name in ('unc', 'ucr', 'unr')
+                 if name in values]
+        lower = [values[name] for name in ('lnc', 'lcr', 'lnr')
+                 if name in values]
+        # ramp from the base to just beyond the nearest threshold and back
+        if upper:
+            start = min(base, min(upper) - hysteresis - 2)
+            turn = min(upper) + hysteresis + 2
+        elif lower:
+            start = max(base, max(lower) + hysteresis + 2)
+            turn = max(lower) - hysteresis - 2
+        else:
+            start = turn = base
+
+        waveform = Ramp(start, turn, self.random.uniform(*period),
+                        self.random.random())
+        if noise:
+            waveform = Noise(waveform, noise, self.random.random())
+        return waveform
+
+    def _add_event(self, sensor, offset, deassertion, value, threshold):
+        record_id = self._next_record_id
+        self._next_record_id += 1
+        if self._next_record_id > LAST_SEL_RECORD_ID:
+            self._next_record_id = 1
+
+        timestamp = int(time.time())
+        event_dir_type = EVENT_READING_TYPE_CODE_THRESHOLD
+        if deassertion:
+            event_dir_type |= 0x80
+        record = struct.pack('<HBIHBBBBBBB', record_id, SEL_TYPE_SYSTEM_EVENT,
+                             timestamp, sensor.generator_id, EVM_REV_IPMI_2_0,
+                             sensor.sdr.sensor_type_code, sensor.number,
+                             event_dir_type,
+                             EVENT_DATA_THRESHOLD_TRIGGER | offset,
+                             sensor.to_raw(value), sensor.to_raw(threshold))
+        self.sel_list.pop(record_id, None)
+        self.sel_list[record_id] = record
+        while len(self.sel_list) > self.max_sel_entries:
+            self.sel_list.popitem(last=False)
+        # keep the addition stamp changing for every event, SEL readers
+        # compare it to find out if there are new entries
+        self.most_recent_addition = max(timestamp,
+                                        self.most_recent_addition + 1)
+
+    def _evaluate(self, sensor, t):
+        (raw, states, events) = sensor.evaluate(t)
+        sdr = sensor.sdr
+        for (offset, deassertion, value, threshold) in events:
+            mask = sdr.deassertion_mask if deassertion else sdr.assertion_mask
+            if mask & (1 << offset):
+                self._add_event(sensor, offset, deassertion, value, threshold)
+        return (raw, states)
+
+    def reading(self, number):
+        """Return the `(raw, states)` of the sensor.
+
+        Raises KeyError for unknown sensors.
+        """
+        sensor = self.sensors[number]
+        return self._evaluate(sensor, self.clock() - self._start)
+
+    def thresholds(self, number):
+        """Return the readable raw thresholds of the sensor."""
+        return self.sensors[number].raw_thresholds()
+
+    def update(self):
+        """Evaluate all sensors, adding the events of threshold crossings
+        to the SEL."""
+        t = self.clock() - self._start
+        for sensor in self.sensors.values():
+            self._evaluate(sensor, t)
@@ -32,6 +32,7 @@ class Session(object):
     PRIV_LEVEL_OEM = 5
 
     session_id = None
+    privilege_level = PRIV_LEVEL_ADMINISTRATOR
     _interface = None
     _auth_type = AUTH_TYPE_NONE
     _auth_username = None
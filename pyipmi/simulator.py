@@ -0,0 +1,459 @@
+# Copyright (c) 2018  Kontron Europe GmbH
+#
+# This library is free software; you can redistribute it and/or
+# modify it under the terms of the GNU Lesser General Public
+# License as published by the Free Software Foundation; either
+# version 2.1 of the License, or (at your option) any later version.
+#
+# This library is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# Lesser General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public
+# License along with this library; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301 USA
+
+"""Simulate a fleet of BMCs in one process.
+
+Every virtual BMC is served by the asyncio emulator (see
+`pyipmi.emulation`) on an address of its own, all in one event loop:
+
+    simulator = FleetSimulator()
+    template = BmcTemplate(sdr='blade.sdr', fru={0: 'blade.fru'})
+    simulator.add_bmcs(1000, template, host='127.0.0.1', port=10000,
+                       faults=Faults(latency=0.005, loss=0.01))
+    pyipmi.aio.run(simulator.serve())
+
+Every virtual BMC has a socket of its own. The soft limit of open files
+is raised up to the hard limit when the BMCs are started, more BMCs than
+the hard limit allows (see `ulimit -Hn`) can't be simulated by one
+process.
+
+`simulator.endpoints()` returns the `pyipmi.fleet.Endpoint` of every
+virtual BMC.
+"""
+
+import argparse
+import asyncio
+import ipaddress
+import logging
+import os
+import random
+import time
+from collections import OrderedDict
+
+import yaml
+
+try:
+    import resource
+except ImportError:
+    # not available on Windows
+    resource = None
+
+import pyipmi
+from . import aio, emulation
+from .fleet import Endpoint
+from .logger import log
+from .msgs import create_request_by_name
+from .sensorsim import SensorEngine
+
+
+class BmcData(object):
+    """The SDRs, SEL entries and FRU data of a virtual BMC.
+
+    `sdr_list` maps the record IDs to `SdrCommon` records, `sel_list`
+    maps the record IDs to the 16 byte SEL records and `fru_data` maps
+    the FRU IDs to the FRU inventory data.
+    """
+
+    def __init__(self, sdr_list=None, sel_list=None, fru_data=None):
+        self.sdr_list = sdr_list if sdr_list is not None else OrderedDict()
+        self.sel_list = sel_list if sel_list is not None else OrderedDict()
+        self.fru_data = fru_data if fru_data is not None else {}
+
+    @classmethod
+    def from_files(cls, sdr=None, sel=None, fru=None):
+        """Load the data from SDR and SEL dump files and FRU files,
+        `fru` maps the FRU IDs to the filenames."""
+        data = cls()
+        if sdr is not None:
+            emulation.load_sdr_dump(sdr, data.sdr_list)
+        if sel is not None:
+            emulation.load_sel_dump(sel, data.sel_list)
+        for (fru_id, filename) in (fru or {}).items():
+            with open(filename, 'rb') as f:
+                data.fru_data[int(fru_id)] = f.read()
+        return data
+
+    def copy(self):
+        return BmcData(OrderedDict(self.sdr_list), OrderedDict(self.sel_list),
+                       dict(self.fru_data))
+
+
+class BmcTemplate(object):
+    """Creates the `BmcData` of many virtual BMCs from the same files.
+
+    The files are loaded once. Without `customize` all BMCs share the
+    loaded data, which is never modified by the emulator. Otherwise
+    `customize` is called with the index of the BMC and a copy of the
+    data, e.g. to give every BMC its own FRU serial number.
+    """
+
+    def __init__(self, sdr=None, sel=None, fru=None, customize=None):
+        self.data = BmcData.from_files(sdr, sel, fru)
+        self.customize = customize
+
+    def create(self, index):
+        if self.customize is None:
+            return self.data
+        data = self.data.copy()
+        self.customize(index, data)
+        return data
+
+
+class Faults(object):
+    """The faults injected by a virtual BMC.
+
+    Each response is delayed by `latency` plus up to `jitter` seconds and
+    a request is lost with the probability `loss`. `completion_codes`
+    maps request names (e.g. 'GetSensorReading') to a
+    `(completion_code, probability)` pair, the request is then answered
+    with the completion code with the given probability.
+    """
+
+    def __init__(self, latency=0.0, jitter=0.0, loss=0.0,
+                 completion_codes=None, seed=None):
+        self.latency = latency
+        self.jitter = jitter
+        self.loss = loss
+        self.completion_codes = {}
+        for (name, (cc, probability)) in (completion_codes or {}).items():
+            msg_type = type(create_request_by_name(name))
+            self.completion_codes[msg_type] = (cc, probability)
+        self.random = random.Random(seed)
+
+    def lost(self):
+        return self.loss > 0 and self.random.random() < self.loss
+
+    def delay(self):
+        delay = self.latency
+        if self.jitter:
+            delay += self.random.uniform(0, self.jitter)
+        return delay
+
+    def __call__(self, req):
+        """Return the completion code to inject for the request or None."""
+        try:
+            (cc, probability) = self.completion_codes[type(req)]
+        except KeyError:
+            return None
+        if self.random.random() < probability:
+            return cc
+        return None
+
+
+class VirtualBmc(object):
+    """A BMC of the simulated fleet.
+
+    `sensors` are the keyword arguments of the `SensorEngine` simulating
+    the sensors of the BMC, or None to not simulate them.
+    """
+
+    def __init__(self, host, port, data=None, faults=None, sensors=None):
+        self.host = host
+        self.port = port
+        self.data = data if data is not None else BmcData()
+        self.faults = faults
+        self.sensors = sensors
+        self.transport = None
+        self.protocol = None
+
+    def endpoint(self, username='admin', password='admin', **kwargs):
+        return Endpoint(self.host, username, password, port=self.port,
+                        **kwargs)
+
+    def __str__(self):
+        return '%s:%d' % (self.host, self.port)
+
+
+class VirtualBmcProtocol(emulation.EmulatorProtocol):
+    """The emulator protocol serving the data of a `VirtualBmc` and
+    injecting its faults."""
+
+    def __init__(self, config, bmc, **kwargs):
+        if bmc.sensors is not None:
+            kwargs['sensors'] = SensorEngine(bmc.data.sdr_list,
+                                             bmc.data.sel_list, **bmc.sensors)
+        emulation.EmulatorProtocol.__init__(self, config, **kwargs)
+        self.bmc = bmc
+        self.lost = 0
+        if bmc.faults is not None and bmc.faults.completion_codes:
+            # cached responses would bypass the injected completion codes
+            self.response_cache = None
+
+    def create_context(self, addr):
+        context = emulation.EmulatorProtocol.create_context(self, addr)
+        context.sdr_list = self.bmc.data.sdr_list
+        if self.sensors is None:
+            context.sel_list = self.bmc.data.sel_list
+        context.fru_data = self.bmc.data.fru_data
+        if self.bmc.faults is not None and self.bmc.faults.completion_codes:
+            context.fault_injector = self.bmc.faults
+        return context
+
+    def datagram_received(self, pdu, addr):
+        if self.bmc.faults is not None and self.bmc.faults.lost():
+            self.lost += 1
+            return
+        emulation.EmulatorProtocol.datagram_received(self, pdu, addr)
+
+    def send_response(self, context, pdu):
+        delay = self.bmc.faults.delay() if self.bmc.faults else 0
+        if delay > 0:
+            asyncio.get_event_loop().call_later(
+                delay, self.transport.sendto, pdu, context.addr)
+        else:
+            self.transport.sendto(pdu, context.addr)
+
+
+# the files opened besides the sockets of the BMCs
+RESERVED_FILES = 64
+
+
+def _raise_open_files_limit(sockets):
+    """Raise the soft limit of open files for `sockets` more sockets."""
+    if resource is None:
+        return
+    (soft, hard) = resource.getrlimit(resource.RLIMIT_NOFILE)
+    needed = sockets + RESERVED_FILES
+    if soft == resource.RLIM_INFINITY or needed <= soft:
+        return
+    if hard != resource.RLIM_INFINITY and needed > hard:
+        log().warning('{} BMCs need about {} open files, the limit is {}'
+                      .format(sockets, needed, hard))
+        needed = hard
+    resource.setrlimit(resource.RLIMIT_NOFILE, (needed, hard))
+
+
+class FleetSimulator(object):
+    """Serve many `VirtualBmc` from one event loop.
+
+    The BMCs are either on distinct ports of one address or on distinct
+    loopback addresses (all of 127.0.0.0/8 is routed to the loopback
+    interface on Linux) with the same port. Each BMC uses one socket,
+    see the module documentation for the limit of open files. `workers`
+    and `receive_buffer_size` are used for the emulator of every BMC.
+    """
+
+    def __init__(self, workers=1, receive_buffer_size=256 * 1024):
+        self.bmcs = []
+        self.workers = workers
+        self.receive_buffer_size = receive_buffer_size
+        self._last_time = None
+        self._last_handled = 0
+
+    def add_bmc(self, host, port, data=None, faults=None, sensors=None):
+        bmc = VirtualBmc(host, port, data, faults, sensors)
+        self.bmcs.append(bmc)
+        return bmc
+
+    def add_bmcs(self, count, template=None, host='127.0.0.1',
+                 port=emulation.UDP_PORT, alias=False, faults=None,
+                 sensors=None):
+        """Add `count` BMCs with the data created by `template`.
+
+        With `alias` the BMCs get consecutive addresses starting with
+        `host`, otherwise consecutive ports starting with `port`. A port
+        of 0 lets the system choose the ports. `faults` is a `Faults` or
+        a function returning the `Faults` of the BMC with the given index.
+        `sensors` are the `SensorEngine` arguments of every BMC.
+        """
+        bmcs = []
+        for index in range(count):
+            if alias:
+                bmc_host = str(ipaddress.ip_address(host) + index)
+                bmc_port = port
+            else:
+                bmc_host = host
+                bmc_port = port + index if port else 0
+            data = template.create(index) if template else None
+            bmc_faults = faults
+            if faults is not None and not isinstance(faults, Faults):
+                bmc_faults = faults(index)
+            bmcs.append(self.add_bmc(bmc_host, bmc_port, data, bmc_faults,
+                                     sensors))
+        return bmcs
+
+    def endpoints(self, username='admin', password='admin', **kwargs):
+        return [bmc.endpoint(username, password, **kwargs)
+                for bmc in self.bmcs]
+
+    async def start(self):
+        _raise_open_files_limit(len(self.bmcs))
+        for bmc in self.bmcs:
+            if bmc.transport is not None:
+                continue
+            (bmc.transport, bmc.protocol) = await emulation.start_server(
+                None, bmc.host, bmc.port,
+                receive_buffer_size=self.receive_buffer_size,
+                protocol_factory=VirtualBmcProtocol, bmc=bmc,
+                workers=self.workers)
+            bmc.port = bmc.transport.get_extra_info('sockname')[1]
+        log().info('simulating {} BMCs'.format(len(self.bmcs)))
+
+    def stop(self):
+        for bmc in self.bmcs:
+            if bmc.transport is not None:
+                bmc.transport.close()
+                bmc.transport = None
+
+    def statistics(self):
+        """Return the summed counters of all BMCs as dict."""
+        totals = dict(received=0, handled=0, dropped=0, errors=0, lost=0,
+                      connections=0)
+        for bmc in self.bmcs:
+            if bmc.protocol is None:
+                continue
+            stats = bmc.protocol.statistics
+            totals['received'] += stats.received
+            totals['handled'] += stats.handled
+            totals['dropped'] += stats.dropped
+            totals['errors'] += stats.errors
+            totals['lost'] += bmc.protocol.lost
+            totals['connections'] += len(bmc.protocol.connections)
+        return totals
+
+    def rate(self):
+        """Return the handled requests per second since the last call."""
+        now = time.monotonic()
+        handled = self.statistics()['handled']
+        rate = 0
+        if self._last_time is not None and now > self._last_time:
+            rate = (handled - self._last_handled) / (now - self._last_time)
+        self._last_time = now
+        self._last_handled = handled
+        return rate
+
+    async def serve(self, report_interval=10):
+        """Run the simulator until cancelled, logging the throughput
+        every `report_interval` seconds."""
+        await self.start()
+        self.rate()
+        try:
+            while True:
+                await asyncio.sleep(report_interval)
+                for bmc in self.bmcs:
+                    bmc.protocol.expire_connections()
+                stats = self.statistics()
+                log().info('{:.0f} requests/s, {connections} connections, '
+                           '{received} received, {lost} lost, {dropped} '
+                           'dropped, {errors} errors'.format(self.rate(),
+                                                             **stats))
+        finally:
+            self.stop()
+
+
+def _create_faults(group):
+    keys = ('latency', 'jitter', 'loss', 'completion_codes', 'seed')
+    if not any(key in group for key in keys):
+        return None
+    return Faults(**dict((key, group[key]) for key in keys if key in group))
+
+
+def _sensor_options(group):
+    sensors = group.get('sensors')
+    if sensors is True:
+        return {}
+    return sensors or None
+
+
+def create_simulator(config, base_dir='.'):
+    """Create a `FleetSimulator` from a config dict.
+
+        templates:
+          blade:
+            sdr: blade.sdr
+            sel: blade.sel
+            fru: {0: blade.fru}
+        groups:
+          - template: blade
+            count: 1000
+            host: 127.0.0.1
+            port: 10000
+            latency: 0.005
+            loss: 0.01
+            completion_codes: {GetSensorReading: [0xc3, 0.05]}
+            sensors: {period: [10, 60]}
+
+    Relative filenames are relative to `base_dir`. A group with `alias`
+    places the BMCs on consecutive addresses instead of ports.
+    """
+    def path(filename):
+        if filename is None:
+            return None
+        return os.path.join(base_dir, filename)
+
+    templates = {}
+    for (name, files) in (config.get('templates') or {}).items():
+        fru = dict((fru_id, path(filename))
+                   for (fru_id, filename) in (files.get('fru') or {}).items())
+        templates[name] = BmcTemplate(path(files.get('sdr')),
+                                      path(files.get('sel')), fru)
+
+    simulator = FleetSimulator(workers=config.get('workers', 1))
+    port = emulation.UDP_PORT
+    for group in config.get('groups') or []:
+        count = group.get('count', 1)
+        port = group.get('port', port)
+        template = templates[group['template']] if 'template' in group \
+            else None
+        simulator.add_bmcs(count, template, group.get('host', '127.0.0.1'),
+                           port, group.get('alias', False),
+                           _create_faults(group), _sensor_options(group))
+        if not group.get('alias', False):
+            port += count
+    return simulator
+
+
+def main(args=None):
+    parser = argparse.ArgumentParser(description="IPMI fleet simulation.")
+    parser.add_argument("-c", "--config", type=str, dest="config",
+                        help="Config file", required=True)
+    parser.add_argument("-e", "--endpoints", type=str, dest="endpoints",
+                        help="write the 'host port' of every BMC to this file")
+    parser.add_argument("-r", "--report-interval", type=float,
+                        dest="report_interval",
+                        help="seconds between throughput reports", default=10)
+    parser.add_argument(
+        "-v", action="store_true", dest="verbose", help="be more verbose"
+    )
+
+    args = parser.parse_args(args)
+
+    handler = logging.StreamHandler()
+    level = logging.DEBUG if args.verbose else logging.INFO
+    handler.setLevel(level)
+    pyipmi.logger.set_log_level(level)
+    pyipmi.logger.add_log_handler(handler)
+
+    with open(args.config, 'r') as stream:
+        config = yaml.safe_load(stream)
+    simulator = create_simulator(config, os.path.dirname(args.config))
+
+    async def run():
+        await simulator.start()
+        if args.endpoints:
+            with open(args.endpoints, 'w') as f:
+                for bmc in simulator.bmcs:
+                    f.write('%s %d\n' % (bmc.host, bmc.port))
+        await simulator.serve(args.report_interval)
+
+    try:
+        aio.run(run())
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,162 @@
+# Copyright (c) 2018  Kontron Europe GmbH
+#
+# This library is free software; you can redistribute it and/or
+# modify it under the terms of the GNU Lesser General Public
+# License as published by the Free Software Foundation; either
+# version 2.1 of the License, or (at your option) any later version.
+#
+# This library is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# Lesser General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public
+# License along with this library; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301 USA
+
+from . import Target
+from .msgs import constants, create_request_by_name
+from .sdr import SDR_TYPE_FULL_SENSOR_RECORD, SDR_TYPE_COMPACT_SENSOR_RECORD
+
+
+def get_sensor_sdr_list(ipmi):
+    """Return the SDR list the sensors of the target are described in."""
+    device_id = ipmi.get_device_id()
+    if device_id.supports_function('sdr_repository'):
+        return ipmi.get_repository_sdr_list()
+    return ipmi.get_device_sdr_list()
+
+
+class SweepResult(object):
+    """The readings of one sweep, one list per column.
+
+    `numbers` the sensor numbers
+    `records` the SDR describing the sensor
+    `raw` the raw readings or None if not available
+    `values` the converted readings (only for full sensor records)
+    `states` the assertion states or None
+    `completion_codes` the completion code of each reading
+    """
+
+    def __init__(self, numbers, records):
+        self.numbers = numbers
+        self.records = records
+        self.raw = []
+        self.values = []
+        self.states = []
+        self.completion_codes = []
+
+    def __len__(self):
+        return len(self.numbers)
+
+    def __iter__(self):
+        """Iterate over (number, raw, value, states) tuples."""
+        return zip(self.numbers, self.raw, self.values, self.states)
+
+
+class SensorSweeper(object):
+    """Read all sensors of a target with as few round trips as possible.
+
+    The plan (sensor number, LUN, owner and conversion) is built once
+    from the SDR list. Every call of `sweep` then sends all
+    GetSensorReading requests with `Ipmi.send_many`, so interfaces
+    supporting pipelining keep several requests in flight.
+
+    Sensors owned by other controllers are read by bridging from the
+    current target. Sensors owned by system software are skipped.
+
+    Example:
+        sweeper = SensorSweeper(ipmi)
+        for (number, raw, value, states) in sweeper.sweep():
+            ...
+    """
+
+    SENSOR_RECORD_TYPES = (SDR_TYPE_FULL_SENSOR_RECORD,
+                           SDR_TYPE_COMPACT_SENSOR_RECORD)
+
+    def __init__(self, ipmi, sdrs=None):
+        self.ipmi = ipmi
+        if sdrs is None:
+            sdrs = get_sensor_sdr_list(ipmi)
+
+        self.numbers = []
+        self.luns = []
+        self.records = []
+        self.targets = []
+        targets = {}
+
+        for sdr in sdrs:
+            if sdr.type not in self.SENSOR_RECORD_TYPES:
+                continue
+            if sdr.owner_id & 0x1:
+                continue
+            key = (sdr.owner_id, sdr.owner_channel)
+            if key not in targets:
+                targets[key] = self._owner_target(*key)
+
+            for number in self._sensor_numbers(sdr):
+                self.numbers.append(number)
+                self.luns.append(sdr.owner_lun)
+                self.records.append(sdr)
+                self.targets.append(targets[key])
+
+    def __len__(self):
+        return len(self.numbers)
+
+    @staticmethod
+    def _sensor_numbers(sdr):
+        count = 1
+        if sdr.type == SDR_TYPE_COMPACT_SENSOR_RECORD:
+            count = max(1, sdr.record_sharing & 0xf)
+        return range(sdr.number, sdr.number + count)
+
+    def _owner_target(self, owner_id, channel):
+        target = self.ipmi.target
+        if owner_id == target.ipmb_address:
+            return target
+
+        if target.routing:
+            routing = [(r.rq_sa, r.rs_sa, r.channel) for r in target.routing]
+        else:
+            slave_address = getattr(self.ipmi.interface, 'slave_address',
+                                    0x81)
+            routing = [(slave_address, target.ipmb_address, None)]
+        (rq_sa, rs_sa, _) = routing[-1]
+        routing[-1] = (rq_sa, rs_sa, channel)
+        routing.append((target.ipmb_address, owner_id, None))
+        return Target(owner_id, routing)
+
+    def _create_requests(self):
+        reqs = []
+        for (number, lun) in zip(self.numbers, self.luns):
+            req = create_request_by_name('GetSensorReading')
+            req.sensor_number = number
+            req.lun = lun
+            reqs.append(req)
+        return reqs
+
+    def sweep(self):
+        """Read all sensors of the plan and return a `SweepResult`."""
+        rsps = self.ipmi.send_many(self._create_requests(), self.targets)
+
+        result = SweepResult(self.numbers, self.records)
+        for (sdr, rsp) in zip(self.records, rsps):
+            raw = None
+            states = None
+            if rsp.completion_code == constants.CC_OK:
+                if not rsp.config.initial_update_in_progress:
+                    raw = rsp.sensor_reading
+                if rsp.states1 is not None:
+                    states = rsp.states1
+                    if rsp.states2 is not None:
+                        states |= (rsp.states2 << 8)
+
+            value = None
+            if raw is not None and sdr.type == SDR_TYPE_FULL_SENSOR_RECORD:
+                value = sdr.convert_sensor_raw_to_value(raw)
+
+            result.raw.append(raw)
+            result.values.append(value)
+            result.states.append(states)
+            result.completion_codes.append(rsp.completion_code)
+        return result
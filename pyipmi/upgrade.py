@@ -0,0 +1,258 @@
+# Copyright (c) 2018  Kontron Europe GmbH
+#
+# This library is free software; you can redistribute it and/or
+# modify it under the terms of the GNU Lesser General Public
+# License as published by the Free Software Foundation; either
+# version 2.1 of the License, or (at your option) any later version.
+#
+# This library is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# Lesser General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public
+# License along with this library; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301 USA
+
+"""Run HPM.1 upgrades on many targets concurrently.
+
+    targets = [Target(addr, [(0x81, 0x20, 0), (0x20, addr, None)])
+               for addr in (0x82, 0x84, 0x86)]
+    orchestrator = UpgradeOrchestrator(ipmi, 'firmware.hpm', component=1,
+                                       per_bus=2, state_file='upgrade.json')
+    for job in orchestrator.run(targets):
+        print(job)
+"""
+
+import json
+import os
+import tempfile
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+
+from . import Ipmi
+from .errors import HpmError
+from .hpm import UpgradeImage
+from .logger import log
+
+STAGE_PENDING = 'pending'
+STAGE_PREPARE = 'prepare'
+STAGE_UPLOAD = 'upload'
+STAGE_ACTIVATE = 'activate'
+STAGE_DONE = 'done'
+STAGE_FAILED = 'failed'
+
+
+def target_key(target):
+    """Return a string identifying the target, used in the state file."""
+    key = '0x%02x' % target.ipmb_address
+    if target.routing:
+        key += ' ' + ','.join('%s:%s:%s' % (r.rq_sa, r.rs_sa, r.channel)
+                              for r in target.routing)
+    return key
+
+
+def target_bus(target):
+    """Return the IPMB bus the target is attached to.
+
+    The bus is identified by the routing up to the last bridge, targets
+    without routing are not on a shared bus and None is returned.
+    """
+    if not target.routing:
+        return None
+    return tuple((r.rq_sa, r.rs_sa, r.channel) for r in target.routing[:-1])
+
+
+@contextmanager
+def _unlimited():
+    yield
+
+
+class UpgradeJob(object):
+    """The upgrade of a single target.
+
+    `stage` is the current stage, `error` the exception in case the stage
+    is `STAGE_FAILED`. `uploaded` and `total` give the progress of the
+    firmware upload, `statistics` are the `UploadStatistics`.
+    """
+
+    def __init__(self, target, key=None):
+        self.target = target
+        self.key = key or target_key(target)
+        self.stage = STAGE_PENDING
+        self.failed_stage = None
+        self.error = None
+        self.uploaded = 0
+        self.total = 0
+        self.statistics = None
+
+    @property
+    def ok(self):
+        return self.stage == STAGE_DONE
+
+    def __str__(self):
+        if self.stage == STAGE_FAILED:
+            return '%s: failed in %s: %s' % (self.key, self.failed_stage,
+                                             self.error)
+        if self.stage == STAGE_UPLOAD and self.total:
+            return '%s: %s %d%%' % (self.key, self.stage,
+                                    100 * self.uploaded // self.total)
+        return '%s: %s' % (self.key, self.stage)
+
+
+class UpgradeOrchestrator(object):
+    """Run the HPM.1 upgrade stages on many targets at once.
+
+    All targets are reached through the interface and session of `ipmi`
+    (e.g. the shelf manager) and share one parsed `image`, given as
+    `UpgradeImage` or filename. An interface serves one request (or one
+    pipelined batch of requests) at a time, e.g. `Rmcp` holds its
+    `transaction_lock` for every round trip, so the workers only overlap
+    while waiting on each other. `connect` is called with the target to
+    get an `Ipmi` object with a session of its own instead, its session
+    is closed when the upgrade of the target is finished.
+
+    `max_workers` limits the number of targets upgraded at once.
+    `per_bus` limits the number of concurrent firmware uploads on one
+    IPMB bus (see `target_bus`), the other stages and the uploads to
+    targets on no shared bus are not limited.
+    `progress` is called with the `UpgradeJob` whenever its stage or
+    upload progress changes, from the worker threads.
+    `state_file` keeps the stage reached by every target. When run
+    again, finished targets are skipped and targets with a complete
+    upload only get activated.
+    Further keyword arguments are passed to `Hpm.upload_binary`.
+    """
+
+    def __init__(self, ipmi, image, component, max_workers=8, per_bus=2,
+                 progress=None, state_file=None, connect=None,
+                 **upload_args):
+        self.ipmi = ipmi
+        self.image = image
+        self.component = component
+        self.max_workers = max_workers
+        self.per_bus = per_bus
+        self.progress = progress
+        self.state_file = state_file
+        self.connect = connect
+        self.upload_args = upload_args
+        self._lock = threading.Lock()
+        self._buses = {}
+        self._state = self._load_state()
+
+    def _load_state(self):
+        if self.state_file is None or not os.path.exists(self.state_file):
+            return {}
+        with open(self.state_file) as f:
+            return json.load(f)
+
+    def _save_state(self):
+        directory = os.path.dirname(os.path.abspath(self.state_file))
+        (fd, path) = tempfile.mkstemp(dir=directory)
+        with os.fdopen(fd, 'w') as f:
+            json.dump(self._state, f, indent=1, sort_keys=True)
+        os.replace(path, self.state_file)
+
+    def _set_stage(self, job, stage):
+        with self._lock:
+            job.stage = stage
+            self._state[job.key] = stage
+            if self.state_file is not None:
+                self._save_state()
+        self._report(job)
+
+    def _report(self, job):
+        if self.progress is not None:
+            self.progress(job)
+
+    def _bus_semaphore(self, target):
+        bus = target_bus(target)
+        if bus is None:
+            return _unlimited()
+        with self._lock:
+            if bus not in self._buses:
+                self._buses[bus] = threading.BoundedSemaphore(self.per_bus)
+            return self._buses[bus]
+
+    def _connection(self, target):
+        """Return an `Ipmi` object for the target, sharing the session
+        unless `connect` is set."""
+        if self.connect is not None:
+            return self.connect(target)
+        ipmi = Ipmi()
+        ipmi.interface = self.ipmi.interface
+        ipmi.session = self.ipmi.session
+        ipmi.requester = self.ipmi.requester
+        ipmi.target = target
+        return ipmi
+
+    def _upload_progress(self, job):
+        def progress(uploaded, total):
+            job.uploaded = uploaded
+            job.total = total
+            self._report(job)
+        return progress
+
+    def _upgrade(self, job, image):
+        ipmi = None
+        resume_activation = self._state.get(job.key) == STAGE_ACTIVATE
+
+        try:
+            ipmi = self._connection(job.target)
+            if not resume_activation:
+                self._set_stage(job, STAGE_PREPARE)
+                ipmi.abort_firmware_upgrade()
+                if self.component not in image.header.components:
+                    raise HpmError('component=%d not in image' %
+                                   self.component)
+                ipmi.preparation_stage(image)
+
+                self._set_stage(job, STAGE_UPLOAD)
+                upload_args = dict(self.upload_args)
+                upload_args['progress'] = self._upload_progress(job)
+                with self._bus_semaphore(job.target):
+                    job.statistics = ipmi.upgrade_stage(image, self.component,
+                                                        **upload_args)
+
+            self._set_stage(job, STAGE_ACTIVATE)
+            ipmi.activation_stage(image, self.component)
+            self._set_stage(job, STAGE_DONE)
+        except Exception as e:
+            log().warning('upgrade of %s failed in %s: %s', job.key,
+                          job.stage, e)
+            job.failed_stage = job.stage
+            job.error = e
+            with self._lock:
+                job.stage = STAGE_FAILED
+            self._report(job)
+        finally:
+            if self.connect is not None and ipmi is not None:
+                ipmi.session.close()
+        return job
+
+    def run(self, targets):
+        """Upgrade the targets and return the `UpgradeJob` of each target
+        in the order of `targets`.
+
+        Targets marked as done in the state file are skipped.
+        """
+        jobs = [UpgradeJob(target) for target in targets]
+        pending = []
+        for job in jobs:
+            if self._state.get(job.key) == STAGE_DONE:
+                job.stage = STAGE_DONE
+            else:
+                pending.append(job)
+
+        image = self.image
+        if not isinstance(image, UpgradeImage):
+            image = UpgradeImage(image)
+        try:
+            with ThreadPoolExecutor(self.max_workers) as executor:
+                list(executor.map(lambda job: self._upgrade(job, image),
+                                  pending))
+        finally:
+            if image is not self.image:
+                image.close()
+        return jobs
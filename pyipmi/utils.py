@@ -71,16 +71,15 @@ class ByteBuffer(object):
             self.array = array('B')
 
     def push_unsigned_int(self, value, length):
-        for i in range(length):
-            self.array.append((value >> (8*i) & 0xff))
+        value &= (1 << (8 * length)) - 1
+        py3_array_frombytes(self.array, value.to_bytes(length, 'little'))
 
     def pop_unsigned_int(self, length):
-        value = 0
-        for i in range(length):
-            try:
-                value |= self.array.pop(0) << (8*i)
-            except IndexError:
-                raise DecodingError('Data too short for message')
+        if len(self.array) < length:
+            del self.array[:]
+            raise DecodingError('Data too short for message')
+        value = int.from_bytes(self.array[0:length], 'little')
+        del self.array[0:length]
         return value
 
     def push_string(self, value):
@@ -128,6 +127,138 @@ class ByteBuffer(object):
         return self.array[idx]
 
 
+def byte_view(data):
+    """Return a flat memoryview of unsigned bytes for `data`.
+
+    Buffers like bytes, bytearray and array('B') are not copied. Other
+    sequences of integers (lists, tuples) are converted first.
+    """
+    if isinstance(data, ByteReader):
+        return data.view
+    if isinstance(data, (ByteBuffer, ByteWriter)):
+        data = data.tobytes()
+    try:
+        view = memoryview(data)
+    except TypeError:
+        view = memoryview(bytes(bytearray(data)))
+    if view.ndim != 1 or view.format != 'B':
+        view = memoryview(view.tobytes())
+    return view
+
+
+class ByteReader(object):
+    """Read cursor over a byte buffer.
+
+    Unlike `ByteBuffer` nothing is deleted from the front of the buffer.
+    Reads only move the cursor and slices share the underlying memory.
+    """
+
+    def __init__(self, data, offset=0):
+        self._view = byte_view(data)
+        self.offset = offset
+
+    @property
+    def view(self):
+        """Return a memoryview of the unread bytes."""
+        return self._view[self.offset:]
+
+    def skip(self, length):
+        if self.offset + length > len(self._view):
+            raise DecodingError('Data too short for message')
+        self.offset += length
+
+    def pop_unsigned_int(self, length):
+        end = self.offset + length
+        if end > len(self._view):
+            self.offset = len(self._view)
+            raise DecodingError('Data too short for message')
+        value = int.from_bytes(self._view[self.offset:end], 'little')
+        self.offset = end
+        return value
+
+    def pop_string(self, length):
+        end = min(self.offset + length, len(self._view))
+        string = self._view[self.offset:end].tobytes()
+        self.offset = end
+        return string
+
+    def pop_slice(self, length):
+        end = self.offset + length
+        if end > len(self._view):
+            raise DecodingError('Data too short for message')
+        c = ByteReader(self._view[self.offset:end])
+        self.offset = end
+        return c
+
+    def tobytes(self):
+        return self._view[self.offset:].tobytes()
+
+    tostring = tobytes
+
+    def __len__(self):
+        return len(self._view) - self.offset
+
+    def __getitem__(self, idx):
+        return self._view[self.offset:][idx]
+
+
+class ByteWriter(object):
+    """Growable write buffer.
+
+    The storage is preallocated with `size` bytes and grows by doubling,
+    so appending does not reallocate for every pushed value.
+    """
+
+    def __init__(self, size=64):
+        self._buf = bytearray(size)
+        self._length = 0
+
+    def _reserve(self, length):
+        end = self._length + length
+        if end > len(self._buf):
+            grow = max(end, 2 * len(self._buf)) - len(self._buf)
+            self._buf.extend(bytes(grow))
+        return end
+
+    def _write(self, data):
+        end = self._reserve(len(data))
+        self._buf[self._length:end] = data
+        self._length = end
+
+    def push_unsigned_int(self, value, length):
+        value &= (1 << (8 * length)) - 1
+        self._write(value.to_bytes(length, 'little'))
+
+    def push_string(self, value):
+        if _PY3 and isinstance(value, str):
+            # Encode Unicode to UTF-8
+            value = value.encode()
+        self._write(value)
+
+    def extend(self, data):
+        self._write(byte_view(data))
+
+    def append_array(self, a):
+        self.extend(a)
+
+    def tobytes(self):
+        return memoryview(self._buf)[:self._length].tobytes()
+
+    tostring = tobytes
+
+    def __len__(self):
+        return self._length
+
+    def __getitem__(self, idx):
+        if isinstance(idx, slice):
+            return bytearray(memoryview(self._buf)[:self._length][idx])
+        if idx < 0:
+            idx += self._length
+        if not 0 <= idx < self._length:
+            raise IndexError('ByteWriter index out of range')
+        return self._buf[idx]
+
+
 BCD_MAP = ['0', '1', '2', '3', '4', '5', '6', '7', '8', '9', ' ', '-', '.']
 
 
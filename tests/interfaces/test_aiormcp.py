@@ -0,0 +1,339 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import asyncio
+import hashlib
+import hmac
+import os
+
+from nose.tools import eq_, ok_, raises
+
+from pyipmi import Target, aio
+from pyipmi.errors import IpmiConnectionError, IpmiTimeoutError
+from pyipmi.session import Session
+from pyipmi.interfaces import create_interface
+from pyipmi.interfaces.aiormcp import AsyncRmcp, AsyncRmcpEndpoint
+from pyipmi.interfaces.rmcp import (AsfMsg, AsfPong, IpmiMsg, Ipmi20Msg,
+                                    RmcpMsg, OpenSessionRsp, RAKP2Message,
+                                    RAKP4Message, RMCP_CLASS_ASF,
+                                    RMCP_CLASS_IPMI)
+from pyipmi.interfaces.ipmb import (IpmbHeaderReq, IpmbHeaderRsp,
+                                    encode_ipmb_msg)
+from pyipmi.msgs import (constants, create_message, create_request_by_name,
+                         create_response_message, decode_message,
+                         encode_message)
+
+
+class FakeBmc(object):
+    """Datagram transport answering the requests of an AsyncRmcp."""
+
+    def __init__(self, interface, ipmi_2_0=False, hold=0):
+        self.interface = interface
+        self.ipmi_2_0 = ipmi_2_0
+        self.hold = hold
+        self.held = []
+        self.requests = []
+        self.session = None
+        self.password = b'admin'
+
+    def close(self):
+        pass
+
+    def _reply(self, class_of_msg, sdu):
+        pdu = RmcpMsg(class_of_msg).pack(sdu, 0xff)
+        asyncio.get_event_loop().call_soon(
+                self.interface._datagram_received, pdu)
+
+    def sendto(self, pdu):
+        rmcp = RmcpMsg()
+        sdu = rmcp.unpack(pdu)
+        if rmcp.class_of_msg == RMCP_CLASS_ASF:
+            pong = AsfMsg()
+            pong.asf_type = AsfMsg.ASF_TYPE_PRESENCE_PONG
+            pong.data = AsfPong().pack()
+            self._reply(RMCP_CLASS_ASF, pong.pack())
+        elif sdu[0] == Session.AUTH_TYPE_RMCP_PLUS:
+            payload_type = sdu[1] & 0x3f
+            data = Ipmi20Msg(self.session).unpack(sdu)
+            if payload_type == constants.PAYLOAD_TYPE_IPMI:
+                self._ipmi_request(data)
+            else:
+                self._rakp(payload_type, data)
+        else:
+            self._ipmi_request(IpmiMsg().unpack(sdu))
+
+    def _ipmi_request(self, tx_data):
+        req_header = IpmbHeaderReq(data=tx_data)
+        req = create_message(req_header.netfn, req_header.cmdid, None)
+        decode_message(req, tx_data[6:-1])
+        self.requests.append(req)
+
+        rsp = create_response_message(req)
+        if req.cmdid == constants.CMDID_GET_CHANNEL_AUTHENTICATION_CAPABILITIES:
+            rsp.support.straight = 1
+            rsp.support.ipmi_2_0 = int(self.ipmi_2_0)
+        elif req.cmdid == constants.CMDID_GET_SESSION_CHALLENGE:
+            rsp.temporary_session_id = 0x11223344
+        elif req.cmdid == constants.CMDID_ACTIVATE_SESSION:
+            rsp.session_id = 0x55667788
+        elif req.cmdid == constants.CMDID_GET_SENSOR_READING:
+            rsp.sensor_reading = req.sensor_number + 100
+            rsp.config.initial_update_in_progress = 0
+
+        rsp_header = IpmbHeaderRsp()
+        rsp_header.from_req_header(req_header)
+        rsp_header.netfn = req_header.netfn + 1
+        rx_data = encode_ipmb_msg(rsp_header, encode_message(rsp))
+        if self.session is not None:
+            sdu = Ipmi20Msg(self.session).pack(rx_data,
+                                               constants.PAYLOAD_TYPE_IPMI)
+        else:
+            sdu = IpmiMsg().pack(rx_data)
+
+        self.held.append(sdu)
+        if len(self.held) >= self.hold:
+            # answer the collected requests in reverse order
+            for sdu in reversed(self.held):
+                self._reply(RMCP_CLASS_IPMI, sdu)
+            self.held = []
+
+    def _rakp(self, payload_type, data):
+        if payload_type == constants.PAYLOAD_TYPE_OPEN_SESSION_REQUEST:
+            self.console_session_id = data[4:8]
+            rsp = OpenSessionRsp()
+            rsp.message_tag = data[0]
+            rsp.message_status_code = constants.MSC_OK
+            rsp.console_session_id = self.console_session_id
+            rsp.managed_system_session_id = b'\x01\x02\x03\x04'
+            rsp_type = constants.PAYLOAD_TYPE_OPEN_SESSION_RESPONSE
+        elif payload_type == constants.PAYLOAD_TYPE_RAKP_MESSAGE_1:
+            self.r_m = data[8:24]
+            self.role = data[24:25]
+            self.ulength = data[27:28]
+            self.uname = data[28:28 + data[27]]
+            self.r_c = os.urandom(16)
+            self.guid = os.urandom(16)
+            rsp = RAKP2Message(constants.AUTH_ALGO_RAKP_HMAC_SHA1)
+            rsp.message_tag = data[0]
+            rsp.message_status_code = constants.MSC_OK
+            rsp.console_session_id = self.console_session_id
+            rsp.managed_system_random_number = self.r_c
+            rsp.managed_system_guid = self.guid
+            rsp.ke_auth_code = hmac.new(
+                    self.password,
+                    self.console_session_id + b'\x01\x02\x03\x04'
+                    + self.r_m + self.r_c + self.guid + self.role
+                    + self.ulength + self.uname, hashlib.sha1).digest()
+            rsp_type = constants.PAYLOAD_TYPE_RAKP_MESSAGE_2
+        else:
+            sik = hmac.new(self.password, self.r_m + self.r_c + self.role
+                           + self.ulength + self.uname, hashlib.sha1).digest()
+            rsp = RAKP4Message(constants.AUTH_ALGO_RAKP_HMAC_SHA1)
+            rsp.message_tag = data[0]
+            rsp.message_status_code = constants.MSC_OK
+            rsp.console_session_id = self.console_session_id
+            rsp.integrity_check_value = hmac.new(
+                    sik, self.r_m + b'\x01\x02\x03\x04' + self.guid,
+                    hashlib.sha1).digest()[:12]
+            rsp_type = constants.PAYLOAD_TYPE_RAKP_MESSAGE_4
+            self._activate(sik)
+
+        self._reply(RMCP_CLASS_IPMI,
+                    Ipmi20Msg().pack(encode_message(rsp), rsp_type))
+
+    def _activate(self, sik):
+        # activated on the next request sent by the console
+        session = Session()
+        session.auth_type = Session.AUTH_TYPE_RMCP_PLUS
+        session.sid = b'\x01\x02\x03\x04'
+        session.activated = True
+        session.is_encrypted = True
+        session.is_authenticated = True
+        session.generate_additional_encryption_keys(sik)
+        asyncio.get_event_loop().call_soon(setattr, self, 'session', session)
+
+
+def create_rmcp(**kwargs):
+    rmcp = AsyncRmcp(keep_alive_interval=0, **kwargs)
+    bmc = FakeBmc(rmcp)
+    rmcp._transport = bmc
+    return (rmcp, bmc)
+
+
+def sensor_reading_req(number):
+    req = create_request_by_name('GetSensorReading')
+    req.target = Target(0x20)
+    req.sensor_number = number
+    return req
+
+
+def test_create_interface():
+    intf = create_interface('aiormcp', window=8)
+    ok_(isinstance(intf, AsyncRmcp))
+    eq_(intf.window, 8)
+
+
+@raises(ValueError)
+def test_window_out_of_range():
+    AsyncRmcp(window=64)
+
+
+def test_send_and_receive_out_of_order():
+    (rmcp, bmc) = create_rmcp(window=3)
+    bmc.hold = 3
+
+    async def run():
+        return await asyncio.gather(
+            *[rmcp.send_and_receive(sensor_reading_req(n)) for n in range(3)])
+
+    rsps = aio.run(run())
+    eq_([rsp.sensor_reading for rsp in rsps], [100, 101, 102])
+    eq_(rmcp._pending, {})
+
+
+def test_send_and_receive_window():
+    (rmcp, bmc) = create_rmcp(window=2)
+    in_flight = []
+    sendto = bmc.sendto
+
+    def counting_sendto(pdu):
+        in_flight.append(len(rmcp._pending))
+        sendto(pdu)
+
+    bmc.sendto = counting_sendto
+
+    async def run():
+        return await asyncio.gather(
+            *[rmcp.send_and_receive(sensor_reading_req(n)) for n in range(6)])
+
+    rsps = aio.run(run())
+    eq_(len(rsps), 6)
+    eq_(max(in_flight), 2)
+
+
+@raises(IpmiTimeoutError)
+def test_send_and_receive_timeout():
+    (rmcp, bmc) = create_rmcp(timeout=0.01)
+    bmc.hold = 2
+
+    try:
+        aio.run(rmcp.send_and_receive(sensor_reading_req(1)))
+    finally:
+        eq_(rmcp._pending, {})
+
+
+def test_establish_session_ipmi_1_5():
+    (rmcp, bmc) = create_rmcp()
+    session = Session()
+    session.set_auth_type_user('admin', 'admin')
+
+    aio.run(rmcp.establish_session(session))
+    ok_(session.activated)
+    eq_(session.sid, 0x55667788)
+    eq_([req.cmdid for req in bmc.requests],
+        [constants.CMDID_GET_CHANNEL_AUTHENTICATION_CAPABILITIES,
+         constants.CMDID_GET_SESSION_CHALLENGE,
+         constants.CMDID_ACTIVATE_SESSION,
+         constants.CMDID_SET_SESSION_PRIVILEGE_LEVEL])
+
+
+def test_establish_session_rmcp_plus():
+    (rmcp, bmc) = create_rmcp()
+    bmc.ipmi_2_0 = True
+    session = Session()
+    session.set_auth_type_user('admin', 'admin')
+
+    async def run():
+        await rmcp.establish_session(session)
+        return await rmcp.send_and_receive(sensor_reading_req(7))
+
+    rsp = aio.run(run())
+    ok_(session.activated)
+    eq_(session.sid, b'\x01\x02\x03\x04')
+    eq_(rsp.sensor_reading, 107)
+
+
+class _PongProtocol(asyncio.DatagramProtocol):
+    """A BMC answering the ASF pings."""
+
+    def __init__(self):
+        self.pings = []
+
+    def connection_made(self, transport):
+        self.transport = transport
+
+    def datagram_received(self, data, addr):
+        self.pings.append(addr)
+        pong = AsfMsg()
+        pong.asf_type = AsfMsg.ASF_TYPE_PRESENCE_PONG
+        pong.data = AsfPong().pack()
+        self.transport.sendto(RmcpMsg(RMCP_CLASS_ASF).pack(pong.pack(), 0xff),
+                              addr)
+
+
+def test_endpoint_shared_by_sessions():
+    endpoint = AsyncRmcpEndpoint(local_addr=('127.0.0.1', 0))
+
+    async def run():
+        loop = asyncio.get_event_loop()
+        bmcs = []
+        for _ in range(3):
+            (transport, bmc) = await loop.create_datagram_endpoint(
+                _PongProtocol, local_addr=('127.0.0.1', 0))
+            bmcs.append((transport, bmc))
+
+        rmcps = [AsyncRmcp(endpoint=endpoint) for _ in bmcs]
+        try:
+            for (rmcp, (transport, _)) in zip(rmcps, bmcs):
+                await rmcp.open(*transport.get_extra_info('sockname'))
+            await asyncio.gather(*[rmcp.ping() for rmcp in rmcps])
+        finally:
+            for rmcp in rmcps:
+                rmcp.close()
+            endpoint.close()
+            for (transport, _) in bmcs:
+                transport.close()
+        return [bmc.pings for (_, bmc) in bmcs]
+
+    pings = aio.run(run())
+    eq_([len(p) for p in pings], [1, 1, 1])
+    # all sessions sent from the same socket
+    eq_(len(set(p[0] for p in pings)), 1)
+    eq_(endpoint._sessions, {})
+
+
+@raises(IpmiConnectionError)
+def test_endpoint_one_session_per_address():
+    endpoint = AsyncRmcpEndpoint(local_addr=('127.0.0.1', 0))
+
+    async def run():
+        try:
+            await AsyncRmcp(endpoint=endpoint).open('127.0.0.1', 10623)
+            await AsyncRmcp(endpoint=endpoint).open('127.0.0.1', 10623)
+        finally:
+            endpoint.close()
+
+    aio.run(run())
+
+
+def test_keep_alive_continues_after_error():
+    (rmcp, bmc) = create_rmcp()
+    errors = [ValueError('bad response'), IpmiTimeoutError()]
+    calls = []
+
+    async def get_device_id():
+        calls.append(1)
+        if errors:
+            raise errors.pop(0)
+
+    rmcp._get_device_id = get_device_id
+
+    async def run():
+        task = asyncio.ensure_future(rmcp._keep_alive())
+        while len(calls) < 3:
+            await asyncio.sleep(0)
+        ok_(not task.done())
+        task.cancel()
+
+    aio.run(run())
+    eq_(len(calls), 3)
@@ -1,8 +1,13 @@
 #!/usr/bin/env python
 # -*- coding: utf-8 -*-
 
+import os
+import shutil
+import sys
+import tempfile
+
 from mock import MagicMock
-from nose.tools import eq_, raises
+from nose.tools import eq_, ok_, raises
 
 from pyipmi.errors import IpmiTimeoutError, IpmiConnectionError
 from pyipmi.interfaces import Ipmitool
@@ -196,3 +201,181 @@ class TestIpmitool:
         test_str = b'Error: Unable to establish IPMI v1.5 / RMCP session'
         cc, rsp = self._interface._parse_output(test_str)
         eq_(rsp, None)
+
+    def test_send_and_receive_raw_many(self):
+        batches = []
+
+        def run_ipmitool(cmd):
+            path = cmd.split(' exec ')[1].split()[0]
+            with open(path) as f:
+                batches.append((cmd, f.read()))
+            return (b' 01 02\n__pyipmi_0__\n__pyipmi_1__\n',
+                    b'Unable to send RAW command (channel=0x0 netfn=0x6 '
+                    b'lun=0x0 cmd=0x2 rsp=0xcc): Invalid data\n', 1)
+
+        self._interface._run_ipmitool_with_stderr = run_ipmitool
+        rsps = self._interface.send_and_receive_raw_many([
+            (Target(0x20), 0, 0x6, b'\x01'),
+            (Target(0x72), 0, 0x6, b'\x01'),
+            (Target(0x20), 0, 0x6, b'\x02'),
+            (Target(0x72), 0, 0x6, b'\x02'),
+        ])
+        eq_(rsps, [b'\x00\x01\x02', b'\x00\x01\x02', b'\xcc', b'\xcc'])
+
+        eq_(len(batches), 2)
+        (cmd, content) = batches[0]
+        eq_(cmd.split(' exec ')[0],
+            'ipmitool -I lan -H 10.0.1.1 -p 623 -U "admin" '
+            '-P "secret" -t 0x20 -l 0')
+        ok_('2>&1' not in cmd)
+        eq_(content, 'raw 0x06 0x01\necho __pyipmi_0__\n'
+                     'raw 0x06 0x02\necho __pyipmi_1__\n')
+        ok_(not os.path.exists(cmd.split(' exec ')[1].split()[0]))
+
+    def test_send_and_receive_raw_many_errors_on_stderr(self):
+        # the errors on stderr arrive before any buffered stdout
+        mock = MagicMock()
+        mock.return_value = (
+            b'\n__pyipmi_0__\n__pyipmi_1__\n 01\n__pyipmi_2__\n'
+            b'__pyipmi_3__\n',
+            b'Unable to send RAW command (channel=0x0 netfn=0x6 '
+            b'lun=0x0 cmd=0x2 rsp=0xc1): Invalid command\n'
+            b'Unable to send RAW command (channel=0x0 netfn=0x6 '
+            b'lun=0x0 cmd=0x2 rsp=0xcc): Invalid data\n', 1)
+        self._interface._run_ipmitool_with_stderr = mock
+        rsps = self._interface.send_and_receive_raw_many([
+            (Target(0x20), 0, 0x6, b'\x02'),
+            (Target(0x20), 0, 0x6, b'\x02'),
+            (Target(0x20), 0, 0x6, b'\x01'),
+            (Target(0x20), 0, 0x6, b'\x02'),
+        ])
+        eq_(rsps, [b'\x00', b'\xc1', b'\x00\x01', b'\xcc'])
+
+    @raises(IpmiTimeoutError)
+    def test_send_and_receive_raw_many_timeout(self):
+        mock = MagicMock()
+        mock.return_value = (
+            b'\n__pyipmi_0__\n__pyipmi_1__\n',
+            b'Unable to send RAW command '
+            b'(channel=0x0 netfn=0x6 lun=0x0 cmd=0x1)\n', 1)
+        self._interface._run_ipmitool_with_stderr = mock
+        self._interface.send_and_receive_raw_many([
+            (Target(0x20), 0, 0x6, b'\x02'),
+            (Target(0x20), 0, 0x6, b'\x01')])
+
+    @raises(IpmiConnectionError)
+    def test_send_and_receive_raw_many_no_session(self):
+        mock = MagicMock()
+        mock.return_value = (b'', b'Error: Unable to establish LAN session\n',
+                             1)
+        self._interface._run_ipmitool_with_stderr = mock
+        self._interface.send_and_receive_raw_many([
+            (Target(0x20), 0, 0x6, b'\x01')])
+
+
+FAKE_IPMITOOL_SHELL = r'''
+import sys
+
+sys.stdout.write('ipmitool> ')
+sys.stdout.flush()
+for line in iter(sys.stdin.readline, ''):
+    args = line.split()
+    if args[0] == 'exit':
+        break
+    elif args[0] == 'echo':
+        sys.stdout.write(' '.join(args[1:]) + '\n')
+    elif args[1:] == ['0x06', '0x02']:
+        sys.stderr.write('Segmentation fault\n')
+        sys.exit(139)
+    elif args[1:] == ['0x06', '0x03']:
+        sys.stderr.write('Unable to send RAW command (channel=0x0 '
+                         'netfn=0x6 lun=0x0 cmd=0x3 rsp=0xc1): '
+                         'Invalid command\n')
+    elif args[1:] == ['0x06', '0x05']:
+        sys.stderr.write('Unable to send RAW command (channel=0x0 '
+                         'netfn=0x6 lun=0x0 cmd=0x5)\n')
+    elif args[1:] == ['0x06', '0x06']:
+        sys.stderr.write('Error: something unexpected\n')
+    else:
+        sys.stdout.write(' %s\n' % ' '.join(a[2:] for a in args[2:]))
+    sys.stdout.write('ipmitool> ')
+    sys.stdout.flush()
+'''
+
+
+class TestIpmitoolCoprocess:
+
+    def setup(self):
+        self.directory = tempfile.mkdtemp()
+        script = os.path.join(self.directory, 'ipmitool.py')
+        with open(script, 'w') as f:
+            f.write(FAKE_IPMITOOL_SHELL)
+
+        self._interface = Ipmitool(interface_type='lan', coprocess=True,
+                                   coprocess_timeout=5)
+        self._interface.IPMITOOL_PATH = '%s %s' % (sys.executable, script)
+        self.session = Session()
+        self.session.interface = self._interface
+        self.session.set_session_type_rmcp('10.0.1.1')
+        self.session.set_auth_type_user('admin', 'secret')
+        self._interface.establish_session(self.session)
+
+    def teardown(self):
+        self._interface.close_session()
+        shutil.rmtree(self.directory)
+
+    def test_build_coprocess_cmd(self):
+        self._interface.IPMITOOL_PATH = 'ipmitool'
+        eq_(self._interface._build_coprocess_cmd(Target(0x20), 0),
+            'ipmitool -I lan -H 10.0.1.1 -p 623 -U "admin" -P "secret" '
+            '-t 0x20 -l 0 shell')
+
+    def test_send_and_receive_raw(self):
+        target = Target(0x20)
+        for _ in range(3):
+            data = self._interface.send_and_receive_raw(target, 0, 0x6,
+                                                        b'\x01\xab')
+            eq_(data, b'\x00\x01\xab')
+        eq_(len(self._interface._coprocesses), 1)
+
+        data = self._interface.send_and_receive_raw(Target(0x72), 0, 0x6,
+                                                    b'\x01')
+        eq_(data, b'\x00\x01')
+        eq_(len(self._interface._coprocesses), 2)
+
+    def test_send_and_receive_raw_completion_code(self):
+        data = self._interface.send_and_receive_raw(Target(0x20), 0, 0x6,
+                                                    b'\x03')
+        eq_(data, b'\xc1')
+
+    @raises(IpmiTimeoutError)
+    def test_send_and_receive_raw_timeout(self):
+        self._interface.send_and_receive_raw(Target(0x20), 0, 0x6, b'\x05')
+
+    @raises(RuntimeError)
+    def test_send_and_receive_raw_error(self):
+        self._interface.send_and_receive_raw(Target(0x20), 0, 0x6, b'\x06')
+
+    def test_coprocess_crash(self):
+        target = Target(0x20)
+        self._interface.send_and_receive_raw(target, 0, 0x6, b'\x01')
+        coprocess = self._interface._get_coprocess(target, 0)
+        coprocess._send = MagicMock(wraps=coprocess._send)
+        try:
+            self._interface.send_and_receive_raw(target, 0, 0x6, b'\x02')
+        except IpmiConnectionError as e:
+            ok_('rc=139' in str(e))
+            ok_('Segmentation fault' in str(e))
+        else:
+            ok_(False)
+        # the command isn't sent again
+        eq_(coprocess._send.call_count, 1)
+
+    def test_coprocess_restart(self):
+        target = Target(0x20)
+        self._interface.send_and_receive_raw(target, 0, 0x6, b'\x01')
+        coprocess = self._interface._get_coprocess(target, 0)
+        coprocess._child.kill()
+        coprocess._child.wait()
+        data = self._interface.send_and_receive_raw(target, 0, 0x6, b'\x04')
+        eq_(data, b'\x00\x04')
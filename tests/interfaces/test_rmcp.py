@@ -2,14 +2,19 @@
 # -*- coding: utf-8 -*-
 
 import array
+import socket
+import time
 
 from mock import MagicMock
-from nose.tools import eq_
+from nose.tools import eq_, ok_, raises
 from pyipmi import Target
 
 from pyipmi.session import Session
 from pyipmi.interfaces.rmcp import (AsfMsg, AsfPing, AsfPong, IpmiMsg,
                                     Rmcp, RmcpMsg)
+from pyipmi.interfaces.ipmb import (IpmbHeaderReq, IpmbHeaderRsp,
+                                    encode_ipmb_msg)
+from pyipmi.msgs import create_request_by_name
 from pyipmi.utils import py3_array_tobytes
 
 
@@ -150,3 +155,225 @@ class TestRmcp:
 
     def test_send_and_receive(self):
         pass
+
+    def test_send_and_receive_many_out_of_order(self):
+        rmcp = Rmcp(window=4)
+        sent = []
+
+        def fake_receive():
+            # answer the outstanding requests in reverse order
+            tx_data = sent.pop()
+            req_header = IpmbHeaderReq(data=tx_data)
+            rsp_header = IpmbHeaderRsp()
+            rsp_header.from_req_header(req_header)
+            rsp_header.netfn = req_header.netfn + 1
+            # completion code and sensor reading echoing the sequence
+            payload = bytes(bytearray([0, req_header.rq_seq, 0xc0]))
+            return encode_ipmb_msg(rsp_header, payload)
+
+        rmcp._send_ipmi_msg = MagicMock(side_effect=sent.append)
+        rmcp._receive_ipmi_msg = MagicMock(side_effect=fake_receive)
+
+        reqs = []
+        for number in range(3):
+            req = create_request_by_name('GetSensorReading')
+            req.target = Target(0x20)
+            req.sensor_number = number
+            reqs.append(req)
+
+        rsps = rmcp.send_and_receive_many(reqs)
+        eq_(rmcp._send_ipmi_msg.call_count, 3)
+        eq_([rsp.sensor_reading for rsp in rsps], [1, 2, 3])
+
+    def test_send_and_receive_many_window(self):
+        rmcp = Rmcp(window=2)
+        sent = []
+        in_flight = []
+
+        def fake_send(tx_data):
+            sent.append(tx_data)
+            in_flight.append(len(sent))
+
+        def fake_receive():
+            tx_data = sent.pop(0)
+            req_header = IpmbHeaderReq(data=tx_data)
+            rsp_header = IpmbHeaderRsp()
+            rsp_header.from_req_header(req_header)
+            rsp_header.netfn = req_header.netfn + 1
+            return encode_ipmb_msg(rsp_header, b'\x00\x10\xc0')
+
+        rmcp._send_ipmi_msg = MagicMock(side_effect=fake_send)
+        rmcp._receive_ipmi_msg = MagicMock(side_effect=fake_receive)
+
+        reqs = []
+        for number in range(5):
+            req = create_request_by_name('GetSensorReading')
+            req.target = Target(0x20)
+            req.sensor_number = number
+            reqs.append(req)
+
+        rsps = rmcp.send_and_receive_many(reqs)
+        eq_(len(rsps), 5)
+        eq_(max(in_flight), 2)
+
+    def create_pipelined(self, answer, window=4):
+        """Return an Rmcp answering the sent requests with `answer(header)`,
+        which returns the response payload or None to drop the request."""
+        rmcp = Rmcp(window=window)
+        sent = []
+        queued = []
+
+        def fake_send(tx_data):
+            sent.append(tx_data)
+            req_header = IpmbHeaderReq(data=tx_data)
+            payload = answer(req_header)
+            if payload is None:
+                return
+            rsp_header = IpmbHeaderRsp()
+            rsp_header.from_req_header(req_header)
+            rsp_header.netfn = req_header.netfn + 1
+            queued.append(encode_ipmb_msg(rsp_header, payload))
+
+        def fake_receive():
+            if not queued:
+                raise socket.timeout('timed out')
+            return queued.pop(0)
+
+        rmcp._send_ipmi_msg = MagicMock(side_effect=fake_send)
+        rmcp._receive_ipmi_msg = MagicMock(side_effect=fake_receive)
+        return (rmcp, sent)
+
+    @staticmethod
+    def sensor_reading_requests(count):
+        reqs = []
+        for number in range(count):
+            req = create_request_by_name('GetSensorReading')
+            req.target = Target(0x20)
+            req.sensor_number = number
+            reqs.append(req)
+        return reqs
+
+    def test_send_and_receive_many_retransmits_lost(self):
+        lost = set([2])
+
+        def answer(header):
+            if header.rq_seq in lost:
+                lost.remove(header.rq_seq)
+                return None
+            return bytes(bytearray([0, header.rq_seq, 0xc0]))
+
+        (rmcp, sent) = self.create_pipelined(answer)
+        rsps = rmcp.send_and_receive_many(self.sensor_reading_requests(3))
+        eq_([rsp.sensor_reading for rsp in rsps], [1, 2, 3])
+        eq_(len(sent), 4)
+
+    @raises(socket.timeout)
+    def test_send_and_receive_many_gives_up(self):
+        (rmcp, sent) = self.create_pipelined(lambda header: None)
+        try:
+            rmcp.send_and_receive_many(self.sensor_reading_requests(2))
+        finally:
+            eq_(len(sent), 2 * (1 + Rmcp.max_retransmits))
+
+    def test_send_and_receive_many_retries_busy(self):
+        busy = [1]
+
+        def answer(header):
+            if busy:
+                busy.pop()
+                return b'\xc0'
+            return bytes(bytearray([0, header.rq_seq, 0xc0]))
+
+        (rmcp, sent) = self.create_pipelined(answer)
+        rsps = rmcp.send_and_receive_many(self.sensor_reading_requests(2))
+        eq_([rsp.completion_code for rsp in rsps], [0, 0])
+        eq_(len(sent), 3)
+
+    def test_send_and_receive_many_retransmits_per_request(self):
+        # every request is lost max_retransmits times
+        losses = {}
+
+        def answer(header):
+            losses[header.rq_seq] = losses.get(header.rq_seq, 0) + 1
+            if losses[header.rq_seq] <= Rmcp.max_retransmits:
+                return None
+            return bytes(bytearray([0, header.rq_seq, 0xc0]))
+
+        (rmcp, sent) = self.create_pipelined(answer, window=1)
+        rsps = rmcp.send_and_receive_many(self.sensor_reading_requests(3))
+        eq_([rsp.sensor_reading for rsp in rsps], [1, 2, 3])
+        eq_(len(sent), 3 * (1 + Rmcp.max_retransmits))
+
+    def test_send_and_receive_many_no_reuse_of_retransmitted_seq(self):
+        rmcp = Rmcp(window=Rmcp.MAX_WINDOW)
+        queued = []
+        # rq_seq -> late response to the first transmission
+        late = {}
+        first = set()
+
+        def fake_send(tx_data):
+            req_header = IpmbHeaderReq(data=tx_data)
+            sensor_number = bytearray(tx_data)[6]
+            rsp_header = IpmbHeaderRsp()
+            rsp_header.from_req_header(req_header)
+            rsp_header.netfn = req_header.netfn + 1
+            rsp = encode_ipmb_msg(rsp_header,
+                                  bytes(bytearray([0, sensor_number, 0xc0])))
+            if sensor_number < Rmcp.MAX_WINDOW and sensor_number not in first:
+                # the first transmissions are answered late
+                first.add(sensor_number)
+                late[req_header.rq_seq] = rsp
+                return
+            if req_header.rq_seq in late and \
+                    sensor_number >= Rmcp.MAX_WINDOW:
+                queued.append(late.pop(req_header.rq_seq))
+            queued.append(rsp)
+
+        def fake_receive():
+            if not queued:
+                raise socket.timeout('timed out')
+            return queued.pop(0)
+
+        rmcp._send_ipmi_msg = MagicMock(side_effect=fake_send)
+        rmcp._receive_ipmi_msg = MagicMock(side_effect=fake_receive)
+
+        rsps = rmcp.send_and_receive_many(self.sensor_reading_requests(100))
+        eq_([rsp.sensor_reading for rsp in rsps], list(range(100)))
+
+    def test_send_and_receive_many_busy_backoff(self):
+        busy = [1]
+        sent_at = []
+
+        def answer(header):
+            sent_at.append(time.monotonic())
+            if busy:
+                busy.pop()
+                return b'\xc0'
+            return bytes(bytearray([0, header.rq_seq, 0xc0]))
+
+        (rmcp, sent) = self.create_pipelined(answer)
+        rmcp.busy_backoff = 0.05
+        rsps = rmcp.send_and_receive_many(self.sensor_reading_requests(1))
+        eq_(rsps[0].completion_code, 0)
+        eq_(len(sent), 2)
+        ok_(sent_at[1] - sent_at[0] >= 0.05)
+
+    def test_send_and_receive_many_attempts(self):
+        lost = set([2])
+        busy = [1]
+
+        def answer(header):
+            if header.rq_seq in lost:
+                lost.remove(header.rq_seq)
+                return None
+            if header.rq_seq == 3 and busy:
+                busy.pop()
+                return b'\xc0'
+            return bytes(bytearray([0, header.rq_seq, 0xc0]))
+
+        (rmcp, sent) = self.create_pipelined(answer)
+        rmcp.busy_backoff = 0
+        attempts = []
+        rmcp.send_and_receive_many(self.sensor_reading_requests(3), attempts)
+        eq_(attempts, [1, 2, 2])
+        eq_(len(sent), 5)
@@ -0,0 +1,180 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import socket
+import struct
+import threading
+import time
+
+from nose.tools import eq_, ok_, raises
+
+from pyipmi import Target
+from pyipmi.session import Session
+from pyipmi.interfaces.rmcp import Rmcp, RmcpMsg, RMCP_CLASS_IPMI
+from pyipmi.interfaces.rmcpmux import RmcpMultiplexer, session_key
+from pyipmi.interfaces.ipmb import (IpmbHeaderReq, IpmbHeaderRsp,
+                                    encode_ipmb_msg)
+from pyipmi.msgs import create_request_by_name
+
+PEER = ('127.0.0.1', 623)
+
+
+def ipmi_1_5_pdu(session_id, data=b''):
+    sdu = b'\x00\x00\x00\x00\x00' + session_id + bytes(bytearray([len(data)]))
+    return RmcpMsg(RMCP_CLASS_IPMI).pack(sdu + data, 0xff)
+
+
+def test_session_key():
+    eq_(session_key(ipmi_1_5_pdu(b'\x01\x02\x03\x04')), b'\x01\x02\x03\x04')
+    eq_(session_key(ipmi_1_5_pdu(b'\x00\x00\x00\x00')), None)
+    rmcp_plus = RmcpMsg(RMCP_CLASS_IPMI).pack(
+            b'\x06\xc0\xa1\xa2\xa3\xa4\x00\x00\x00\x00\x00\x00', 0xff)
+    eq_(session_key(rmcp_plus), b'\xa1\xa2\xa3\xa4')
+    eq_(session_key(b'\x06\x00\xff\x06\x00\x00\x11\xbe\x40\x00\x00\x10'),
+        None)
+
+
+class TestDispatch:
+    def setup(self):
+        self.mux = RmcpMultiplexer(poll_interval=0.01)
+        self.a = self.mux.attach()
+        self.b = self.mux.attach()
+
+    def teardown(self):
+        self.mux.close()
+
+    def test_dispatch_by_session_id(self):
+        for (channel, key) in ((self.a, b'\x00\x00\x00\x01'),
+                               (self.b, b'\x00\x00\x00\x02')):
+            with channel.establishing(*PEER):
+                channel.bind_session(key)
+
+        self.mux._dispatch(ipmi_1_5_pdu(b'\x00\x00\x00\x02'), PEER)
+        self.mux._dispatch(ipmi_1_5_pdu(b'\x00\x00\x00\x01'), PEER)
+        eq_(session_key(self.a.recv(0)), b'\x00\x00\x00\x01')
+        eq_(session_key(self.b.recv(0)), b'\x00\x00\x00\x02')
+
+    def test_dispatch_to_establishing_session(self):
+        with self.a.establishing(*PEER):
+            self.a.bind_session(b'\x00\x00\x00\x01')
+        with self.b.establishing(*PEER):
+            self.mux._dispatch(ipmi_1_5_pdu(b'\x00\x00\x00\x00'), PEER)
+            self.mux._dispatch(ipmi_1_5_pdu(b'\x00\x00\x00\x07'), PEER)
+            eq_(self.b.recv(0), ipmi_1_5_pdu(b'\x00\x00\x00\x00'))
+            eq_(self.b.recv(0), ipmi_1_5_pdu(b'\x00\x00\x00\x07'))
+
+    @raises(socket.timeout)
+    def test_drop_ambiguous(self):
+        for channel in (self.a, self.b):
+            with channel.establishing(*PEER):
+                pass
+        self.mux._dispatch(ipmi_1_5_pdu(b'\x00\x00\x00\x00'), PEER)
+        self.a.recv(0.01)
+
+    def test_detach(self):
+        with self.a.establishing(*PEER):
+            self.a.bind_session(b'\x00\x00\x00\x01')
+        self.a.close()
+        eq_(self.mux._sessions, {})
+        eq_(self.mux._peers, {})
+
+
+def test_call_repeatedly():
+    mux = RmcpMultiplexer(poll_interval=0.01)
+    calls = []
+    stop_a = mux.call_repeatedly(0.01, calls.append, 'a')
+    stop_b = mux.call_repeatedly(0.01, calls.append, 'b')
+    time.sleep(0.2)
+    stop_a()
+    stop_b()
+    mux.close()
+    ok_(calls.count('a') > 2)
+    ok_(calls.count('b') > 2)
+
+
+def test_slow_timer_does_not_delay_others():
+    mux = RmcpMultiplexer(poll_interval=0.01)
+    release = threading.Event()
+    calls = []
+    stop_slow = mux.call_repeatedly(0.01, release.wait, 1)
+    stop_fast = mux.call_repeatedly(0.01, calls.append, 'a')
+    time.sleep(0.2)
+    ok_(calls.count('a') > 2)
+    stop_slow()
+    stop_fast()
+    release.set()
+    mux.close()
+    ok_(not mux._timer_thread.is_alive())
+
+
+class FakeBmc(object):
+    """UDP responder echoing the session ID and the sensor number."""
+
+    def __init__(self):
+        self.sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self.sock.bind(('127.0.0.1', 0))
+        self.sock.settimeout(0.1)
+        self.address = self.sock.getsockname()
+        self.stopped = threading.Event()
+        self.thread = threading.Thread(target=self.run)
+        self.thread.daemon = True
+        self.thread.start()
+
+    def run(self):
+        while not self.stopped.is_set():
+            try:
+                (pdu, address) = self.sock.recvfrom(1024)
+            except socket.timeout:
+                continue
+            sdu = pdu[4:]
+            tx_data = sdu[10:]
+            req_header = IpmbHeaderReq(data=tx_data)
+            rsp_header = IpmbHeaderRsp()
+            rsp_header.from_req_header(req_header)
+            rsp_header.netfn = req_header.netfn + 1
+            rx_data = encode_ipmb_msg(rsp_header,
+                                      b'\x00' + tx_data[6:7] + b'\xc0')
+            self.sock.sendto(ipmi_1_5_pdu(sdu[5:9], rx_data), address)
+
+    def close(self):
+        self.stopped.set()
+        self.thread.join()
+        self.sock.close()
+
+
+def test_sessions_share_socket():
+    bmc = FakeBmc()
+    mux = RmcpMultiplexer(poll_interval=0.01)
+    interfaces = []
+    for sid in range(1, 5):
+        rmcp = Rmcp(multiplexer=mux, timeout=1.0)
+        rmcp.host, rmcp.port = bmc.address
+        session = Session()
+        session.sid = sid
+        session.activated = True
+        rmcp._session = session
+        with rmcp._channel.establishing(*bmc.address):
+            rmcp._channel.bind_session(struct.pack('<I', sid))
+        interfaces.append(rmcp)
+
+    results = {}
+
+    def poll(rmcp, number):
+        req = create_request_by_name('GetSensorReading')
+        req.target = Target(0x20)
+        req.sensor_number = number
+        results[number] = rmcp.send_and_receive(req).sensor_reading
+
+    threads = [threading.Thread(target=poll, args=(rmcp, 10 + n))
+               for (n, rmcp) in enumerate(interfaces)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    for rmcp in interfaces:
+        ok_(rmcp._sock is None)
+        rmcp.close()
+    mux.close()
+    bmc.close()
+    eq_(results, {10: 10, 11: 11, 12: 12, 13: 13})
@@ -1,12 +1,15 @@
 #!/usr/bin/env python
 # -*- coding: utf-8 -*-
 
-from nose.tools import eq_
+from nose.tools import eq_, raises, assert_raises
 
 from array import array
-from pyipmi.utils import ByteBuffer
+from pyipmi.errors import DecodingError
+from pyipmi.utils import ByteBuffer, is_string
 from pyipmi.msgs.message import (Bitfield, Message, UnsignedInt,
-                                 RemainingBytes, String)
+                                 RemainingBytes, String, encode_message,
+                                 decode_message)
+from pyipmi.msgs.sdr import GetSdrRepositoryInfoRsp
 
 
 class TestMessage(object):
@@ -82,3 +85,56 @@ def test_message():
     eq_(msg.lun, 0)
     eq_(msg.netfn, 1)
     eq_(msg.cmdid, 2)
+
+
+def _registered_message_classes():
+    from pyipmi.msgs.registry import DEFAULT_REGISTRY
+    for key, cls in DEFAULT_REGISTRY.registry.items():
+        if is_string(key):
+            yield cls
+
+
+def test_codec_encode_matches_interpreted():
+    for cls in _registered_message_classes():
+        try:
+            expected = cls()._encode()
+        except Exception:
+            continue
+        eq_(encode_message(cls()), expected, cls.__name__)
+
+
+def test_codec_decode_matches_interpreted():
+    for cls in _registered_message_classes():
+        try:
+            length = len(cls()._encode())
+        except Exception:
+            continue
+        data = b'\x00' + bytes(bytearray(range(1, length)))
+
+        m1 = cls()
+        m2 = cls()
+        try:
+            m1._decode(data)
+        except DecodingError:
+            assert_raises(DecodingError, decode_message, m2, data)
+            continue
+        decode_message(m2, data)
+        eq_(encode_message(m2), m1._encode(), cls.__name__)
+
+
+def test_codec_completion_code_stops_decoding():
+    rsp = GetSdrRepositoryInfoRsp()
+    decode_message(rsp, b'\xc1')
+    eq_(rsp.completion_code, 0xc1)
+
+
+@raises(DecodingError)
+def test_codec_decode_extra_bytes():
+    rsp = GetSdrRepositoryInfoRsp()
+    decode_message(rsp, b'\x00' * 16)
+
+
+@raises(DecodingError)
+def test_codec_decode_too_short():
+    rsp = GetSdrRepositoryInfoRsp()
+    decode_message(rsp, b'\x00\x51')
@@ -0,0 +1,179 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import asyncio
+import os
+
+from nose.tools import eq_, ok_
+
+import pyipmi.aio
+from pyipmi import Target
+from pyipmi.errors import CompletionCodeError
+from pyipmi.fru import get_fru_inventory_from_file
+from pyipmi.msgs import constants, create_response_message
+
+
+class FakeAsyncInterface(object):
+    """Asynchronous interface answering from a handler function."""
+
+    def __init__(self, handler):
+        self.handler = handler
+        self.requests = []
+
+    async def send_and_receive(self, req):
+        self.requests.append(req)
+        await asyncio.sleep(0)
+        rsp = create_response_message(req)
+        self.handler(req, rsp)
+        return rsp
+
+
+def create_connection(handler):
+    ipmi = pyipmi.aio.create_connection(FakeAsyncInterface(handler))
+    ipmi.target = Target(0x20)
+    return ipmi
+
+
+def test_get_sensor_reading():
+    def handler(req, rsp):
+        rsp.sensor_reading = req.sensor_number * 2
+        rsp.config.initial_update_in_progress = 0
+        rsp.states1 = 0x01
+        rsp.states2 = 0x02
+
+    ipmi = create_connection(handler)
+    eq_(pyipmi.aio.run(ipmi.get_sensor_reading(8)), (16, 0x0201))
+    eq_(ipmi.interface.requests[0].target.ipmb_address, 0x20)
+
+
+def test_hooks():
+    busy = [CompletionCodeError(constants.CC_NODE_BUSY)]
+
+    def handler(req, rsp):
+        if busy:
+            raise busy.pop()
+
+    ipmi = create_connection(handler)
+    events = []
+    ipmi.add_hook(events.append)
+    pyipmi.aio.run(ipmi.get_device_id())
+    eq_([(e.name, e.attempts, e.completion_code) for e in events],
+        [('GetDeviceId', 2, 0)])
+
+
+def test_send_many():
+    def handler(req, rsp):
+        rsp.sensor_reading = req.sensor_number
+
+    ipmi = create_connection(handler)
+    reqs = []
+    for number in range(5):
+        req = pyipmi.msgs.create_request_by_name('GetSensorReading')
+        req.sensor_number = number
+        reqs.append(req)
+
+    rsps = pyipmi.aio.run(ipmi.send_many(reqs))
+    eq_([rsp.sensor_reading for rsp in rsps], [0, 1, 2, 3, 4])
+
+
+def test_get_fru_inventory():
+    path = os.path.dirname(os.path.abspath(__file__))
+    fru_file = os.path.join(path, 'fru_bin', 'kontron_am4010.bin')
+    with open(fru_file, 'rb') as f:
+        fru_data = f.read()
+
+    def handler(req, rsp):
+        if req.cmdid == constants.CMDID_GET_FRU_INVENTORY_AREA_INFO:
+            rsp.area_size = len(fru_data)
+        else:
+            rsp.data = fru_data[req.offset:req.offset + req.count]
+            rsp.count = len(rsp.data)
+
+    ipmi = create_connection(handler)
+    fru = pyipmi.aio.run(ipmi.get_fru_inventory())
+    expected = get_fru_inventory_from_file(fru_file)
+    eq_(fru.product_info_area.name.value,
+        expected.product_info_area.name.value)
+
+
+def test_get_repository_sdr_list():
+    records = [
+        b'\x00\x00\x51\x11\x0e' + b'\x00' * 10 + b'\xc3abc',
+        b'\x01\x00\x51\x11\x0e' + b'\x00' * 10 + b'\xc3xyz',
+    ]
+
+    def handler(req, rsp):
+        if req.cmdid == constants.CMDID_RESERVE_SDR_REPOSITORY:
+            rsp.reservation_id = 1
+            return
+        rsp.next_record_id = req.record_id + 1
+        if rsp.next_record_id == len(records):
+            rsp.next_record_id = 0xffff
+        data = records[req.record_id]
+        rsp.record_data = data[req.offset:req.offset + req.bytes_to_read]
+
+    ipmi = create_connection(handler)
+    sdrs = pyipmi.aio.run(ipmi.get_repository_sdr_list())
+    eq_([sdr.device_id_string for sdr in sdrs], [b'abc', b'xyz'])
+    eq_(sdrs[-1].next_id, 0xffff)
+
+
+def test_read_fru_data_learns_read_size():
+    fru_data = bytes(range(200))
+
+    def handler(req, rsp):
+        if req.count > 20:
+            rsp.completion_code = constants.CC_CANT_RET_NUM_REQ_BYTES
+            return
+        rsp.data = fru_data[req.offset:req.offset + req.count]
+        rsp.count = len(rsp.data)
+
+    ipmi = create_connection(handler)
+    eq_(pyipmi.aio.run(ipmi.read_fru_data(0, 100)), fru_data[:100])
+    size = ipmi._get_fru_read_size(0).size
+    ok_(size <= 20)
+
+    del ipmi.interface.requests[:]
+    eq_(pyipmi.aio.run(ipmi.read_fru_data(100, 100)), fru_data[100:])
+    ok_(all(req.count <= 20 for req in ipmi.interface.requests))
+
+
+def test_get_sdr_list_uses_reservation_id():
+    record = b'\x00\x00\x51\x11\x0e' + b'\x00' * 10 + b'\xc3abc'
+
+    def handler(req, rsp):
+        if req.cmdid == constants.CMDID_RESERVE_DEVICE_SDR_REPOSITORY:
+            rsp.reservation_id = 1
+            return
+        if req.bytes_to_read > 8:
+            rsp.completion_code = constants.CC_CANT_RET_NUM_REQ_BYTES
+            return
+        rsp.next_record_id = 0xffff
+        rsp.record_data = record[req.offset:req.offset + req.bytes_to_read]
+
+    ipmi = create_connection(handler)
+    sdrs = pyipmi.aio.run(ipmi.get_device_sdr_list(reservation_id=7))
+    eq_([sdr.device_id_string for sdr in sdrs], [b'abc'])
+    eq_(set(req.reservation_id for req in ipmi.interface.requests), set([7]))
+    ok_(ipmi._get_sdr_read_size('device').size <= 8)
+
+
+def test_get_sel_entry_length_per_target():
+    entry = bytes(range(16))
+
+    def handler(req, rsp):
+        if req.target.ipmb_address == 0x72 and req.length > 8:
+            rsp.completion_code = constants.CC_CANT_RET_NUM_REQ_BYTES
+            return
+        rsp.next_record_id = 0xffff
+        rsp.record_data = entry[req.offset:req.offset + req.length]
+
+    ipmi = create_connection(handler)
+    ipmi.target = Target(0x72)
+    pyipmi.aio.run(ipmi.get_sel_entry(0))
+    eq_(ipmi.max_req_len, {str(Target(0x72)): 8})
+
+    ipmi.target = Target(0x20)
+    del ipmi.interface.requests[:]
+    pyipmi.aio.run(ipmi.get_sel_entry(0))
+    eq_([req.length for req in ipmi.interface.requests], [0xff])
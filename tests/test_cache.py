@@ -0,0 +1,202 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import os
+import shutil
+import tempfile
+
+from nose.tools import eq_, ok_
+
+import pyipmi
+from pyipmi import Target
+from pyipmi.cache import FruCache, SdrCache
+from pyipmi.msgs import constants, create_response_message
+
+
+class FakeInterface(object):
+    """Interface answering the SDR commands of a BMC."""
+
+    def __init__(self):
+        self.records = [
+            b'\x00\x00\x51\x11\x0e' + b'\x00' * 10 + b'\xc3abc',
+            b'\x01\x00\x51\x11\x0e' + b'\x00' * 10 + b'\xc3xyz',
+        ]
+        self.most_recent_addition = 0x1000
+        self.requests = []
+
+    def send_and_receive(self, req):
+        self.requests.append(req.cmdid)
+        rsp = create_response_message(req)
+        if req.cmdid == constants.CMDID_GET_DEVICE_ID:
+            rsp.device_id = 0x12
+            rsp.manufacturer_id = 0x3a98
+        elif req.cmdid == constants.CMDID_GET_DEVICE_GUID:
+            rsp.device_guid = bytearray(range(16))
+        elif req.cmdid == constants.CMDID_GET_SDR_REPOSITORY_INFO:
+            rsp.record_count = len(self.records)
+            rsp.most_recent_addition = self.most_recent_addition
+        elif req.cmdid == constants.CMDID_GET_DEVICE_SDR_INFO:
+            rsp.number_of_sensors = len(self.records)
+        elif req.cmdid in (constants.CMDID_RESERVE_SDR_REPOSITORY,
+                           constants.CMDID_RESERVE_DEVICE_SDR_REPOSITORY):
+            rsp.reservation_id = 1
+        elif req.cmdid in (constants.CMDID_GET_SDR,
+                           constants.CMDID_GET_DEVICE_SDR):
+            rsp.next_record_id = req.record_id + 1
+            if rsp.next_record_id == len(self.records):
+                rsp.next_record_id = 0xffff
+            data = self.records[req.record_id]
+            rsp.record_data = data[req.offset:req.offset + req.bytes_to_read]
+        return rsp
+
+    def get_sdr_requests(self):
+        return (self.requests.count(constants.CMDID_GET_SDR)
+                + self.requests.count(constants.CMDID_GET_DEVICE_SDR))
+
+
+class TestSdrCache(object):
+    def setup(self):
+        self.directory = tempfile.mkdtemp()
+        self.interface = FakeInterface()
+
+    def teardown(self):
+        shutil.rmtree(self.directory)
+
+    def create_ipmi(self):
+        ipmi = pyipmi.create_connection(self.interface)
+        ipmi.target = Target(0x20)
+        ipmi.sdr_cache = SdrCache(self.directory)
+        return ipmi
+
+    def test_hit(self):
+        sdrs = self.create_ipmi().get_repository_sdr_list()
+        ok_(self.interface.get_sdr_requests() > 0)
+        self.interface.requests = []
+
+        cached = self.create_ipmi().get_repository_sdr_list()
+        eq_(self.interface.get_sdr_requests(), 0)
+        eq_([s.device_id_string for s in cached],
+            [s.device_id_string for s in sdrs])
+        eq_(cached[-1].next_id, 0xffff)
+
+    def test_addition_invalidates(self):
+        self.create_ipmi().get_repository_sdr_list()
+        self.interface.records[1] = self.interface.records[1][:-3] + b'new'
+        self.interface.most_recent_addition += 1
+        self.interface.requests = []
+
+        sdrs = self.create_ipmi().get_repository_sdr_list()
+        ok_(self.interface.get_sdr_requests() > 0)
+        eq_(sdrs[1].device_id_string, b'new')
+
+    def test_incomplete_enumeration_not_stored(self):
+        entries = self.create_ipmi().sdr_repository_entries()
+        next(entries)
+        entries.close()
+        self.interface.requests = []
+
+        self.create_ipmi().get_repository_sdr_list()
+        ok_(self.interface.get_sdr_requests() > 0)
+
+    def test_device_sdr(self):
+        self.create_ipmi().get_repository_sdr_list()
+        self.interface.requests = []
+
+        sdrs = self.create_ipmi().get_device_sdr_list()
+        ok_(self.interface.requests.count(constants.CMDID_GET_DEVICE_SDR) > 0)
+        self.interface.requests = []
+
+        eq_(len(self.create_ipmi().get_device_sdr_list()), len(sdrs))
+        eq_(len(self.create_ipmi().get_repository_sdr_list()), len(sdrs))
+        eq_(self.interface.get_sdr_requests(), 0)
+
+
+class FakeFruInterface(object):
+    """Interface answering the FRU commands of a BMC."""
+
+    def __init__(self, data):
+        self.data = bytearray(data)
+        self.reads = []
+        self.device_id = 0
+
+    def send_and_receive(self, req):
+        rsp = create_response_message(req)
+        if req.cmdid == constants.CMDID_GET_DEVICE_ID:
+            rsp.device_id = self.device_id
+        elif req.cmdid == constants.CMDID_GET_FRU_INVENTORY_AREA_INFO:
+            rsp.area_size = len(self.data)
+        elif req.cmdid == constants.CMDID_READ_FRU_DATA:
+            self.reads.append((req.offset, req.count))
+            rsp.data = self.data[req.offset:req.offset + req.count]
+            rsp.count = len(rsp.data)
+        return rsp
+
+
+class TestFruCache(object):
+    def setup(self):
+        self.directory = tempfile.mkdtemp()
+        path = os.path.dirname(os.path.abspath(__file__))
+        with open(os.path.join(path, 'fru_bin/kontron_am4010.bin'),
+                  'rb') as f:
+            self.interface = FakeFruInterface(f.read())
+
+    def teardown(self):
+        shutil.rmtree(self.directory)
+
+    def create_ipmi(self):
+        ipmi = pyipmi.create_connection(self.interface)
+        ipmi.target = Target(0x20)
+        ipmi.fru_cache = FruCache(self.directory)
+        return ipmi
+
+    def read_bytes(self):
+        return sum(count for (_, count) in self.interface.reads)
+
+    def test_refresh_reads_headers_only(self):
+        fru = self.create_ipmi().get_fru_inventory()
+        eq_(self.read_bytes(), len(self.interface.data))
+        self.interface.reads = []
+
+        cached = self.create_ipmi().get_fru_inventory()
+        # internal use area (256 bytes) and the headers
+        ok_(self.read_bytes() < 300)
+        eq_(cached.raw, fru.raw)
+        eq_(str(cached.product_info_area.serial_number),
+            str(fru.product_info_area.serial_number))
+
+    def test_changed_area_is_read(self):
+        fru = self.create_ipmi().get_fru_inventory()
+        offset = fru.common_header.product_info_area_offset
+        length = self.interface.data[offset + 1] * 8
+        # change a byte of the product area and fix the checksum
+        self.interface.data[offset + 10] ^= 0x01
+        self.interface.data[offset + length - 1] = \
+            (-sum(self.interface.data[offset:offset + length - 1])) & 0xff
+        self.interface.reads = []
+
+        cached = self.create_ipmi().get_fru_inventory()
+        ok_(any(o == offset and c > 2 for (o, c) in self.interface.reads))
+        eq_(cached.raw, bytes(self.interface.data))
+
+    def test_identity_includes_port_and_device_id(self):
+        self.interface.host = '127.0.0.1'
+        self.interface.port = 10000
+        self.create_ipmi().get_fru_inventory()
+
+        self.interface.port = 10001
+        self.interface.reads = []
+        self.create_ipmi().get_fru_inventory()
+        eq_(self.read_bytes(), len(self.interface.data))
+
+        self.interface.device_id = 0x42
+        self.interface.reads = []
+        self.create_ipmi().get_fru_inventory()
+        eq_(self.read_bytes(), len(self.interface.data))
+
+    def test_changed_layout_reads_all(self):
+        self.create_ipmi().get_fru_inventory()
+        self.interface.data = self.interface.data[:2048]
+        self.interface.reads = []
+
+        self.create_ipmi().get_fru_inventory()
+        eq_(self.read_bytes(), 2048)
@@ -0,0 +1,139 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import asyncio
+import logging
+import threading
+
+from nose.tools import eq_, ok_
+
+import pyipmi
+import pyipmi.aio
+import pyipmi.interfaces
+from pyipmi import emulation
+
+
+class EmulatorThread(object):
+    """Run the asyncio emulator in an event loop of its own thread."""
+
+    def __init__(self, **kwargs):
+        self.loop = asyncio.new_event_loop()
+        self.started = threading.Event()
+        self.thread = threading.Thread(target=self._run, args=(kwargs,))
+        self.thread.daemon = True
+        self.thread.start()
+        self.started.wait(5)
+
+    def _run(self, kwargs):
+        asyncio.set_event_loop(self.loop)
+        (self.transport, self.protocol) = self.loop.run_until_complete(
+            emulation.start_server(port=0, **kwargs))
+        self.port = self.transport.get_extra_info('sockname')[1]
+        self.started.set()
+        self.loop.run_forever()
+
+    def stop(self):
+        async def stop():
+            self.transport.close()
+            # let the worker tasks handle their cancellation
+            await asyncio.sleep(0.01)
+        asyncio.run_coroutine_threadsafe(stop(), self.loop).result(5)
+        self.loop.call_soon_threadsafe(self.loop.stop)
+        self.thread.join(5)
+
+
+def create_connection(port):
+    interface = pyipmi.interfaces.create_interface(
+        'rmcp', slave_address=0x81, host_target_address=0x20,
+        keep_alive_interval=0)
+    ipmi = pyipmi.create_connection(interface)
+    ipmi.session.set_session_type_rmcp('127.0.0.1', port)
+    ipmi.session.set_auth_type_user('admin', 'admin')
+    ipmi.target = pyipmi.Target(0x20)
+    return ipmi
+
+
+def test_asyncio_emulator_session():
+    emulator = EmulatorThread()
+    try:
+        ipmi = create_connection(emulator.port)
+        ipmi.session.establish()
+        eq_(len(emulator.protocol.connections), 1)
+
+        for _ in range(3):
+            ipmi.get_device_id()
+        ok_(emulator.protocol.response_cache)
+
+        ipmi.session.close()
+        stats = emulator.protocol.statistics
+        eq_(stats.handled, stats.received)
+        eq_(stats.errors, 0)
+        eq_(emulator.protocol.connections, {})
+    finally:
+        emulator.stop()
+
+
+class RecordingHandler(logging.Handler):
+    def __init__(self):
+        logging.Handler.__init__(self, logging.DEBUG)
+        self.messages = []
+
+    def emit(self, record):
+        if record.module == 'emulation':
+            self.messages.append(record.getMessage())
+
+
+def test_asyncio_emulator_logs_cached_responses():
+    handler = RecordingHandler()
+    logger = pyipmi.logger.log()
+    level = logger.level
+    logger.addHandler(handler)
+    logger.setLevel(logging.DEBUG)
+    emulator = EmulatorThread()
+    try:
+        ipmi = create_connection(emulator.port)
+        ipmi.session.establish()
+        del handler.messages[:]
+        for _ in range(3):
+            ipmi.get_device_id()
+        ok_(emulator.protocol.response_cache)
+        ipmi.session.close()
+    finally:
+        emulator.stop()
+        logger.removeHandler(handler)
+        logger.setLevel(level)
+
+    for direction in ('RX', 'TX'):
+        messages = [m for m in handler.messages
+                    if m.startswith('IPMI %s: ' % direction)
+                    and 'GetDeviceId' in m]
+        eq_(len(messages), 3)
+        eq_(len(set(m.split(': ')[1] for m in messages)), 1)
+
+
+def test_asyncio_emulator_drops_when_full():
+    protocol = emulation.EmulatorProtocol(max_pending=2)
+
+    async def receive():
+        protocol._ready = asyncio.Queue()
+        for _ in range(3):
+            protocol.datagram_received(b'', ('127.0.0.1', 1000))
+
+    pyipmi.aio.run(receive())
+    eq_(protocol.statistics.received, 3)
+    eq_(protocol.statistics.dropped, 1)
+    eq_(len(protocol.connections[('127.0.0.1', 1000)].pending), 2)
+
+
+def test_asyncio_emulator_hpm_upload():
+    emulator = EmulatorThread()
+    try:
+        ipmi = create_connection(emulator.port)
+        ipmi.session.establish()
+        stats = ipmi.upload_binary(bytes(bytearray(1000)), window=4)
+        eq_(stats.blocks, 8)
+        ipmi.finish_upload_and_wait(0, 1000)
+        ipmi.session.close()
+        eq_(emulator.protocol.statistics.errors, 0)
+    finally:
+        emulator.stop()
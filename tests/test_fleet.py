@@ -0,0 +1,88 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import socket
+import threading
+import time
+
+from nose.tools import eq_, ok_
+
+import pyipmi
+from pyipmi import Target
+from pyipmi.errors import CompletionCodeError, IpmiTimeoutError
+from pyipmi.fleet import Endpoint, Fleet
+from pyipmi.msgs import constants, create_response_message
+
+
+class FakeInterface(object):
+    def __init__(self, behavior):
+        self.behavior = behavior
+
+    def send_and_receive(self, req):
+        if self.behavior == 'timeout':
+            raise socket.timeout('timed out')
+        rsp = create_response_message(req)
+        if self.behavior == 'error':
+            rsp.completion_code = constants.CC_INSUFFICIENT_PRIVILEGES
+        rsp.current_power_state.power_on = 1
+        return rsp
+
+
+class FakeFleet(Fleet):
+    def __init__(self, *args, **kwargs):
+        Fleet.__init__(self, *args, **kwargs)
+        self.lock = threading.Lock()
+        self.connects = {}
+        self.running = 0
+        self.max_running = 0
+
+    def connect(self, endpoint):
+        with self.lock:
+            self.connects[endpoint.host] = \
+                self.connects.get(endpoint.host, 0) + 1
+            self.running += 1
+            self.max_running = max(self.max_running, self.running)
+        ipmi = pyipmi.create_connection(FakeInterface(endpoint.host))
+        ipmi.target = Target(endpoint.target)
+        return ipmi
+
+    def disconnect(self, ipmi):
+        with self.lock:
+            self.running -= 1
+
+
+def get_power_on(ipmi):
+    time.sleep(0.01)
+    return ipmi.get_chassis_status().power_on
+
+
+def test_map():
+    hosts = ['ok%d' % n for n in range(20)] + ['timeout', 'error']
+    fleet = FakeFleet([Endpoint(host) for host in hosts], max_workers=4,
+                      retries=2)
+    results = dict((r.endpoint.host, r) for r in fleet.map(get_power_on))
+
+    eq_(len(results), len(hosts))
+    ok_(fleet.max_running <= 4)
+    ok_(results['ok3'].ok)
+    eq_(results['ok3'].value, True)
+
+    ok_(isinstance(results['timeout'].error, IpmiTimeoutError))
+    eq_(results['timeout'].attempts, 3)
+    eq_(fleet.connects['timeout'], 3)
+
+    ok_(isinstance(results['error'].error, CompletionCodeError))
+    eq_(results['error'].attempts, 1)
+
+
+def test_budget():
+    fleet = FakeFleet([Endpoint('timeout')], retries=5, timeout=1.0,
+                      budget=0.5)
+    (result,) = fleet.run(get_power_on)
+    eq_(result.attempts, 1)
+
+
+def test_run_keeps_order():
+    endpoints = [Endpoint('ok%d' % n) for n in range(10)]
+    results = FakeFleet(endpoints, max_workers=3).run(get_power_on)
+    eq_([r.endpoint for r in results], endpoints)
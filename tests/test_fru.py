@@ -1,10 +1,14 @@
 #!/usr/bin/env python
 # -*- coding: utf-8 -*-
 import os
+import socket
 
 import nose
-from nose.tools import eq_, ok_
+from nose.tools import eq_, ok_, raises
 
+import pyipmi
+from pyipmi.errors import IpmiTimeoutError, RetryError
+from pyipmi.msgs import constants, create_response_message
 from pyipmi.fru import (FruData, FruPicmgPowerModuleCapabilityRecord,
                         InventoryCommonHeader, get_fru_inventory_from_file)
 
@@ -74,3 +78,166 @@ def test_multirecord_with_power_module_capability_record():
     record = fru.multirecord_area.records[0]
     ok_(isinstance(record, FruPicmgPowerModuleCapabilityRecord))
     eq_(record.maximum_current_output, 42.0)
+
+
+def test_fru_inventory_lazy_areas():
+    path = os.path.dirname(os.path.abspath(__file__))
+    fru_file = os.path.join(path, 'fru_bin/kontron_am4010.bin')
+    if not os.path.isfile(fru_file):
+        raise nose.SkipTest("FRU file '%s' is missing." % (fru_file))
+    fru = get_fru_inventory_from_file(fru_file)
+    eq_(fru._areas, {})
+
+    board_area = fru.board_info_area
+    eq_(list(fru._areas.keys()), ['board_info_area'])
+    ok_(fru.board_info_area is board_area)
+    eq_(board_area.manufacturer._value, None)
+    eq_(board_area.manufacturer.value, 'Kontron')
+    eq_(board_area.manufacturer.raw, b'Kontron')
+
+
+class FakeFruInterface(object):
+    def __init__(self, data, max_count):
+        self.data = bytearray(data)
+        self.max_count = max_count
+        self.reads = []
+
+    def send_and_receive(self, req):
+        rsp = create_response_message(req)
+        if req.cmdid == constants.CMDID_GET_FRU_INVENTORY_AREA_INFO:
+            rsp.area_size = len(self.data)
+        elif req.cmdid == constants.CMDID_READ_FRU_DATA:
+            self.reads.append(req.count)
+            if req.count > self.max_count:
+                rsp.completion_code = constants.CC_CANT_RET_NUM_REQ_BYTES
+                return rsp
+            rsp.data = self.data[req.offset:req.offset + req.count]
+            rsp.count = len(rsp.data)
+        return rsp
+
+
+class FakePipeliningFruInterface(FakeFruInterface):
+    def __init__(self, *args):
+        FakeFruInterface.__init__(self, *args)
+        self.batches = []
+
+    def send_and_receive_many(self, reqs):
+        self.batches.append(len(reqs))
+        return [self.send_and_receive(req) for req in reqs]
+
+
+def create_fru_ipmi(interface):
+    ipmi = pyipmi.create_connection(interface)
+    ipmi.target = pyipmi.Target(0x20)
+    return ipmi
+
+
+def test_read_fru_data_learns_size():
+    data = bytes(bytearray(range(256))) * 8
+    interface = FakeFruInterface(data, 100)
+    ipmi = create_fru_ipmi(interface)
+
+    eq_(ipmi.read_fru_data(), data)
+    eq_(interface.reads[:3], [32, 32, 64])
+    ok_(128 in interface.reads)
+    read_size = ipmi._get_fru_read_size(0)
+    ok_(read_size.settled)
+    eq_(read_size.size, 96)
+
+    interface.reads = []
+    eq_(ipmi.read_fru_data(), data)
+    eq_(len(interface.reads), 22)
+    eq_(max(interface.reads), 96)
+
+
+def test_read_fru_data_target_without_address():
+    data = bytes(bytearray(range(256)))
+    ipmi = pyipmi.create_connection(FakeFruInterface(data, 100))
+    ipmi.target = pyipmi.Target()
+
+    eq_(ipmi.read_fru_data(), data)
+
+
+def test_read_fru_data_pipelined():
+    data = bytes(bytearray(range(256))) * 8
+    interface = FakePipeliningFruInterface(data, 255)
+    ipmi = create_fru_ipmi(interface)
+
+    eq_(ipmi.read_fru_data(), data)
+    eq_(ipmi._get_fru_read_size(0).size, 255)
+    ok_(len(interface.batches) == 1)
+
+    eq_(ipmi.read_fru_data(offset=10, count=1000), data[10:1010])
+    eq_(interface.batches[-1], 4)
+
+
+class FakeUnreachableFruInterface(FakeFruInterface):
+    def send_and_receive(self, req):
+        if req.cmdid == constants.CMDID_READ_FRU_DATA:
+            self.reads.append(req.count)
+            raise IpmiTimeoutError()
+        return FakeFruInterface.send_and_receive(self, req)
+
+
+@raises(IpmiTimeoutError)
+def test_read_fru_data_unreachable():
+    interface = FakeUnreachableFruInterface(bytes(64), 255)
+    ipmi = create_fru_ipmi(interface)
+    try:
+        ipmi.read_fru_data(0, 64)
+    finally:
+        eq_(interface.reads, [32])
+        eq_(ipmi._get_fru_read_size(0).size, 32)
+
+
+def test_read_fru_data_after_failure():
+    data = bytes(bytearray(range(64)))
+    interface = FakeFruInterface(data, 1)
+    ipmi = create_fru_ipmi(interface)
+    eq_(ipmi.read_fru_data(0, 4), data[:4])
+    eq_(ipmi._get_fru_read_size(0).size, 1)
+
+    interface.max_count = 0
+    try:
+        ipmi.read_fru_data(0, 4)
+    except RetryError:
+        pass
+    eq_(ipmi._get_fru_read_size(0).size, 1)
+    interface.max_count = 1
+    interface.reads = []
+    eq_(ipmi.read_fru_data(0, 4), data[:4])
+    eq_(interface.reads, [1, 1, 1, 1])
+
+
+class FakeDroppingFruInterface(FakePipeliningFruInterface):
+    """Doesn't answer reads bigger than `max_count`, like Rmcp raising
+    socket.timeout."""
+
+    def __init__(self, *args):
+        FakePipeliningFruInterface.__init__(self, *args)
+        self.drop_batches = False
+
+    def send_and_receive(self, req):
+        if req.cmdid == constants.CMDID_READ_FRU_DATA \
+                and req.count > self.max_count:
+            self.reads.append(req.count)
+            raise socket.timeout('timed out')
+        return FakeFruInterface.send_and_receive(self, req)
+
+    def send_and_receive_many(self, reqs):
+        if self.drop_batches:
+            raise socket.timeout('timed out')
+        return FakePipeliningFruInterface.send_and_receive_many(self, reqs)
+
+
+def test_read_fru_data_probe_socket_timeout():
+    data = bytes(bytearray(range(256))) * 2
+    interface = FakeDroppingFruInterface(data, 32)
+    ipmi = create_fru_ipmi(interface)
+    eq_(ipmi.read_fru_data(), data)
+    ok_(64 in interface.reads)
+    eq_(ipmi._get_fru_read_size(0).size, 32)
+    ok_(ipmi._get_fru_read_size(0).settled)
+
+    interface.drop_batches = True
+    eq_(ipmi.read_fru_data(), data)
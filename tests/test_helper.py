@@ -2,10 +2,14 @@
 # -*- coding: utf-8 -*-
 
 from mock import MagicMock, call
-from nose.tools import eq_
+from nose.tools import eq_, raises
 
-from pyipmi.helper import clear_repository_helper
-from pyipmi.msgs.constants import (REPOSITORY_ERASURE_COMPLETED,
+from pyipmi.errors import CompletionCodeError, RetryError
+from pyipmi.helper import (clear_repository_helper, get_sdr_data_helper,
+                           SdrReadSize)
+from pyipmi.msgs.constants import (CC_CANT_RET_NUM_REQ_BYTES,
+                                   CC_REQ_DATA_FIELD_EXCEED,
+                                   REPOSITORY_ERASURE_COMPLETED,
                                    REPOSITORY_ERASURE_IN_PROGRESS,
                                    REPOSITORY_INITIATE_ERASE,
                                    REPOSITORY_GET_ERASE_STATUS)
@@ -31,3 +35,88 @@ def test_clear_repository_helper():
     ]
     clear_fn.assert_has_calls(clear_calls)
     eq_(clear_fn.call_count, 3)
+
+
+class FakeSdrDevice(object):
+    """Returns SDR chunks up to `max_length` bytes."""
+
+    def __init__(self, max_length, record_length=60,
+                 cc=CC_CANT_RET_NUM_REQ_BYTES):
+        self.max_length = max_length
+        self.cc = cc
+        self.record = (b'\x01\x00\x51\x01' + bytearray([record_length - 5])
+                       + bytearray(range(record_length - 5)))
+        self.reads = []
+
+    def get(self, reservation_id, record_id, offset, length):
+        self.reads.append((offset, length))
+        if length == 0xff:
+            length = len(self.record)
+        if length > self.max_length:
+            raise CompletionCodeError(self.cc)
+        return (0xffff, bytes(self.record[offset:offset + length]))
+
+
+def test_get_sdr_data_helper_entire_record():
+    device = FakeSdrDevice(max_length=0xff)
+    (next_id, data) = get_sdr_data_helper(None, device.get, 1, 0)
+    eq_(next_id, 0xffff)
+    eq_(data, bytes(device.record))
+    eq_(device.reads, [(0, 0xff)])
+
+
+def test_get_sdr_data_helper_learns_read_size():
+    device = FakeSdrDevice(max_length=30)
+    read_size = SdrReadSize()
+
+    (_, data) = get_sdr_data_helper(None, device.get, 1, 0, read_size)
+    eq_(data, bytes(device.record))
+    eq_(read_size.size, 24)
+
+    device.reads = []
+    (_, data) = get_sdr_data_helper(None, device.get, 1, 0, read_size)
+    eq_(data, bytes(device.record))
+    eq_(device.reads, [(0, 24), (24, 24), (48, 12)])
+
+
+def test_get_sdr_data_helper_short_record():
+    device = FakeSdrDevice(max_length=30, record_length=20)
+    read_size = SdrReadSize(27)
+    read_size.combined = False
+
+    (_, data) = get_sdr_data_helper(None, device.get, 1, 0, read_size)
+    eq_(data, bytes(device.record))
+    eq_(device.reads, [(0, 5), (5, 15)])
+
+
+def test_get_sdr_data_helper_other_length_error():
+    device = FakeSdrDevice(max_length=30, cc=CC_REQ_DATA_FIELD_EXCEED)
+    (_, data) = get_sdr_data_helper(None, device.get, 1, 0)
+    eq_(data, bytes(device.record))
+    eq_(device.reads[:2], [(0, 0xff), (0, 5)])
+
+
+@raises(RetryError)
+def test_sdr_read_size_reduce_keeps_size():
+    read_size = SdrReadSize(3)
+    read_size.reduce(3)
+    eq_(read_size.size, 1)
+    try:
+        read_size.reduce(1)
+    finally:
+        eq_(read_size.size, 1)
+
+
+def test_sdr_read_size_grows_again():
+    device = FakeSdrDevice(max_length=30)
+    read_size = SdrReadSize()
+    for _ in range(10):
+        (_, data) = get_sdr_data_helper(None, device.get, 1, 0, read_size)
+        eq_(data, bytes(device.record))
+    eq_(read_size.size, 28)
+    eq_(read_size.good, 28)
+
+    # a failed probe goes back to the size that worked
+    read_size.size = 40
+    read_size.reduce(40)
+    eq_(read_size.size, 28)
@@ -2,10 +2,14 @@
 # -*- coding: utf-8 -*-
 
 import os
+import socket
 
 import nose
 from nose.tools import eq_, ok_
 
+import pyipmi
+from pyipmi.errors import IpmiTimeoutError
+from pyipmi.msgs import constants, create_response_message
 from pyipmi.hpm import (ComponentProperty, ComponentPropertyDescriptionString,
                         ComponentPropertyGeneral,
                         ComponentPropertyCurrentVersion,
@@ -97,3 +101,136 @@ def test_upgrade_image():
     image = UpgradeImage(hpm_file)
     ok_(isinstance(image.actions[0], UpgradeActionRecordPrepare))
     ok_(isinstance(image.actions[1], UpgradeActionRecordUploadForUpgrade))
+
+
+def test_upgrade_image_firmware_blocks():
+    path = os.path.dirname(os.path.abspath(__file__))
+    hpm_file = os.path.join(path, 'hpm_bin/firmware.hpm')
+    with open(hpm_file, 'rb') as f:
+        file_data = f.read()
+
+    with UpgradeImage(hpm_file) as image:
+        ok_(image.checksum_valid)
+        eq_(image.checksum.data, file_data[-16:])
+
+        action = image.actions[1]
+        blocks = list(action.firmware_blocks(22))
+        ok_(all(len(block) == 22 for block in blocks[:-1]))
+        firmware = b''.join(bytes(block) for block in blocks)
+        eq_(len(firmware), action.firmware_length)
+        eq_(firmware, bytes(action.firmware_image_data))
+        ok_(firmware in file_data)
+        del blocks
+    eq_(image._mmap, None)
+
+
+class FakeUploadInterface(object):
+    max_request_data_size = 66
+
+    def __init__(self, max_block=None, timeouts=0, drop_above=None):
+        self.max_block = max_block
+        self.timeouts = timeouts
+        # blocks bigger than this are dropped, like Rmcp timing out
+        self.drop_above = drop_above
+        self.blocks = []
+        self.batches = []
+
+    def send_and_receive(self, req):
+        rsp = create_response_message(req)
+        if self.timeouts:
+            self.timeouts -= 1
+            raise IpmiTimeoutError()
+        if self.drop_above and len(req.data) > self.drop_above:
+            raise socket.timeout('timed out')
+        if self.max_block and len(req.data) > self.max_block:
+            rsp.completion_code = constants.CC_REQ_DATA_INV_LENGTH
+            return rsp
+        self.blocks.append((req.number, bytes(bytearray(req.data))))
+        return rsp
+
+    def send_and_receive_many(self, reqs):
+        self.batches.append(len(reqs))
+        return [self.send_and_receive(req) for req in reqs]
+
+
+def create_upload_ipmi(interface):
+    ipmi = pyipmi.create_connection(interface)
+    ipmi.target = pyipmi.Target(0x20)
+    return ipmi
+
+
+def test_upload_binary_block_size():
+    binary = bytes(bytearray(range(200)))
+    interface = FakeUploadInterface(max_block=40)
+    progress = []
+    stats = create_upload_ipmi(interface).upload_binary(
+        binary, progress=lambda done, total: progress.append(done))
+
+    eq_(stats.block_size, 32)
+    eq_(stats.bytes, 200)
+    eq_(stats.blocks, 7)
+    eq_([n for (n, _) in interface.blocks], list(range(7)))
+    eq_(b''.join(d for (_, d) in interface.blocks), binary)
+    eq_(progress[-1], 200)
+
+
+def test_upload_binary_bridged_target():
+    interface = FakeUploadInterface()
+    ipmi = create_upload_ipmi(interface)
+    ipmi.target = pyipmi.Target(0x72, [(0x81, 0x20, 0), (0x20, 0x72, None)])
+    stats = ipmi.upload_binary(b'\x00' * 100)
+    eq_(stats.block_size, 22)
+
+
+def test_upload_binary_timeout_resends_block():
+    binary = bytes(bytearray(range(100)))
+    interface = FakeUploadInterface(timeouts=2)
+    stats = create_upload_ipmi(interface).upload_binary(binary,
+                                                        block_size=22)
+    eq_(stats.retries, 2)
+    eq_(b''.join(d for (_, d) in interface.blocks), binary)
+
+
+def test_upload_binary_socket_timeout_reduces_block_size():
+    binary = bytes(bytearray(range(100)))
+    interface = FakeUploadInterface(drop_above=22)
+    stats = create_upload_ipmi(interface).upload_binary(binary)
+    eq_(stats.block_size, 22)
+    eq_(b''.join(d for (_, d) in interface.blocks), binary)
+
+
+def test_upload_binary_window_socket_timeout():
+    binary = bytes(bytearray(range(100)))
+    interface = FakeUploadInterface(drop_above=22)
+    stats = create_upload_ipmi(interface).upload_binary(binary, window=4)
+    eq_(stats.block_size, 22)
+    eq_(b''.join(d for (_, d) in interface.blocks), binary)
+
+
+def test_upload_binary_window():
+    binary = bytes(bytearray(range(256))) * 2
+    interface = FakeUploadInterface()
+    stats = create_upload_ipmi(interface).upload_binary(binary, window=4)
+    eq_(interface.batches, [4, 4])
+    eq_(stats.blocks, 8)
+    eq_(b''.join(d for (_, d) in interface.blocks), binary)
+
+
+def test_upload_binary_window_fallback():
+    binary = bytes(bytearray(range(256)))
+    interface = FakeUploadInterface()
+    ipmi = create_upload_ipmi(interface)
+    send_many = ipmi.send_many
+
+    def failing_send_many(reqs):
+        rsps = send_many(reqs)
+        rsps[2].completion_code = constants.CC_NODE_BUSY
+        return rsps
+    ipmi.send_many = failing_send_many
+
+    stats = ipmi.upload_binary(binary, window=4)
+    eq_(interface.batches, [4])
+    eq_(stats.retries, 1)
+    eq_([n for (n, _) in interface.blocks], [0, 1, 2, 3, 2, 3])
+    eq_(b''.join(d for (_, d) in interface.blocks[:2] + interface.blocks[4:]),
+        binary)
@@ -0,0 +1,129 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+from nose.tools import eq_, ok_, raises
+from mock import MagicMock
+
+from pyipmi import interfaces, create_connection
+from pyipmi.errors import CompletionCodeError, IpmiTimeoutError, RetryError
+from pyipmi.instrumentation import (HistogramCollector, Histogram,
+                                    prometheus_text)
+from pyipmi.msgs.bmc import GetDeviceIdReq, GetDeviceIdRsp
+from pyipmi.msgs.constants import CC_NODE_BUSY
+
+
+def create_ipmi(side_effect):
+    interface = interfaces.create_interface('mock')
+    interface.send_and_receive = MagicMock(side_effect=side_effect)
+    ipmi = create_connection(interface)
+    ipmi.target = None
+    return ipmi
+
+
+def test_hook_gets_request_event():
+    rsp = GetDeviceIdRsp()
+    rsp.completion_code = 0
+    ipmi = create_ipmi((CompletionCodeError(CC_NODE_BUSY), rsp, rsp))
+    events = []
+    ipmi.add_hook(events.append)
+
+    eq_(ipmi.send_message(GetDeviceIdReq()), rsp)
+    (event,) = events
+    eq_(event.name, 'GetDeviceId')
+    eq_(event.netfn, 6)
+    eq_(event.cmdid, 1)
+    eq_(event.attempts, 2)
+    eq_(event.completion_code, 0)
+    eq_(event.error, None)
+    eq_(event.request_bytes, 0)
+    ok_(event.response_bytes > 0)
+    ok_(event.duration >= 0)
+
+    ipmi.remove_hook(events.append)
+    ipmi.send_message(GetDeviceIdReq())
+    eq_(len(events), 1)
+
+
+@raises(RetryError)
+def test_hook_gets_retry_error():
+    cc = CompletionCodeError(CC_NODE_BUSY)
+    ipmi = create_ipmi((cc, cc, cc))
+    events = []
+    ipmi.add_hook(events.append)
+    try:
+        ipmi.send_message(GetDeviceIdReq())
+    finally:
+        eq_(events[0].attempts, 3)
+        eq_(events[0].completion_code, CC_NODE_BUSY)
+        ok_(isinstance(events[0].error, RetryError))
+
+
+def test_hook_gets_pipelined_attempts():
+    def send_and_receive_many(reqs, attempts):
+        attempts[:] = [1, 3]
+        rsps = [GetDeviceIdRsp(), GetDeviceIdRsp()]
+        for rsp in rsps:
+            rsp.completion_code = 0
+        return rsps
+
+    interface = interfaces.create_interface('mock')
+    interface.send_and_receive_many = send_and_receive_many
+    ipmi = create_connection(interface)
+    ipmi.target = None
+    events = []
+    ipmi.add_hook(events.append)
+
+    ipmi.send_many([GetDeviceIdReq(), GetDeviceIdReq()])
+    eq_([event.attempts for event in events], [1, 3])
+
+
+def test_failing_hook_is_ignored():
+    rsp = GetDeviceIdRsp()
+    rsp.completion_code = 0
+    ipmi = create_ipmi((rsp,))
+    ipmi.add_hook(MagicMock(side_effect=ValueError))
+    eq_(ipmi.send_message(GetDeviceIdReq()), rsp)
+
+
+def test_histogram():
+    histogram = Histogram((0.1, 1.0))
+    for value in (0.05, 0.1, 0.5, 2.0):
+        histogram.observe(value)
+    eq_(histogram.counts, [2, 1, 1])
+    eq_(list(histogram.cumulative_counts()), [2, 3, 4])
+    eq_(histogram.count, 4)
+
+
+def test_collector_prometheus_text():
+    rsp = GetDeviceIdRsp()
+    rsp.completion_code = 0
+    busy = CompletionCodeError(CC_NODE_BUSY)
+    ipmi = create_ipmi((busy, rsp, IpmiTimeoutError()))
+    collector = HistogramCollector(buckets=(1.0, 10.0))
+    ipmi.add_hook(collector)
+
+    ipmi.send_message(GetDeviceIdReq())
+    try:
+        ipmi.send_message(GetDeviceIdReq())
+    except IpmiTimeoutError:
+        pass
+
+    eq_(collector.durations['GetDeviceId'].count, 2)
+    eq_(collector.requests, {('GetDeviceId', 0): 1})
+    eq_(collector.retries, {'GetDeviceId': 1})
+    eq_(collector.errors, {('GetDeviceId', 'IpmiTimeoutError'): 1})
+
+    lines = prometheus_text(collector).splitlines()
+    ok_('# TYPE pyipmi_request_duration_seconds histogram' in lines)
+    ok_('pyipmi_request_duration_seconds_bucket'
+        '{command="GetDeviceId",le="+Inf"} 2' in lines)
+    ok_('pyipmi_request_duration_seconds_count{command="GetDeviceId"} 2'
+        in lines)
+    ok_('pyipmi_requests_total'
+        '{command="GetDeviceId",completion_code="0x00"} 1' in lines)
+    ok_('pyipmi_request_retries_total{command="GetDeviceId"} 1' in lines)
+    ok_('pyipmi_request_errors_total'
+        '{command="GetDeviceId",error="IpmiTimeoutError"} 1' in lines)
+
+    collector.reset()
+    eq_(collector.durations, {})
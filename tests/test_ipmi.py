@@ -25,6 +25,11 @@ def test_target():
     eq_(target.routing, None)
 
 
+def test_target_str():
+    eq_(str(Target()), 'Target: IPMB: None\n')
+    eq_(str(Target(0xa0)), 'Target: IPMB: 0xa0\n')
+
+
 def test_target_routing():
     target = Target(routing=[(0x82, 0x20, 0)])
     eq_(len(target.routing), 1)
@@ -153,3 +158,32 @@ def test_ipmi_send_message_with_name_and_kwargs():
     ok_(isinstance(req, GetSensorReadingReq))
     eq_(req.sensor_number, 5)
     eq_(req.lun, 2)
+
+
+def test_ipmi_send_many_without_pipelining():
+    interface = interfaces.create_interface('mock')
+    mock = MagicMock(side_effect=lambda req: req.sensor_number)
+    interface.send_and_receive = mock
+    ipmi = create_connection(interface)
+    ipmi.target = Target(0x20)
+
+    reqs = [GetSensorReadingReq(), GetSensorReadingReq()]
+    reqs[0].sensor_number = 4
+    reqs[1].sensor_number = 5
+    eq_(ipmi.send_many(reqs), [4, 5])
+    eq_(mock.call_count, 2)
+
+
+def test_ipmi_send_many_with_pipelining():
+    interface = interfaces.create_interface('mock')
+    mock = MagicMock(side_effect=lambda reqs: [r.sensor_number for r in reqs])
+    interface.send_and_receive_many = mock
+    ipmi = create_connection(interface)
+    ipmi.target = Target(0x20)
+
+    reqs = [GetSensorReadingReq(), GetSensorReadingReq()]
+    reqs[0].sensor_number = 4
+    reqs[1].sensor_number = 5
+    eq_(ipmi.send_many(iter(reqs)), [4, 5])
+    eq_(mock.call_count, 1)
+    eq_(reqs[1].target.ipmb_address, 0x20)
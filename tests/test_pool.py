@@ -0,0 +1,191 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import os
+import shutil
+import socket
+import tempfile
+import threading
+import time
+
+from nose.tools import eq_, ok_, raises
+
+import pyipmi
+from pyipmi.errors import IpmiTimeoutError
+from pyipmi.interfaces.pool import Pool
+from pyipmi.msgs import create_response_message
+from pyipmi.pool import SessionPool, PoolServer
+
+
+class FakeInterface(object):
+    def __init__(self, host):
+        self.host = host
+        self.requests = 0
+        self.closed = False
+        self.fail = False
+        self.targets = []
+
+    def establish_session(self, session):
+        pass
+
+    def close_session(self):
+        self.closed = True
+
+    def send_and_receive(self, req):
+        self.requests += 1
+        self.targets.append(req.target)
+        if self.fail or self.host == 'timeout':
+            raise socket.timeout('timed out')
+        rsp = create_response_message(req)
+        rsp.device_id = 0x12
+        return rsp
+
+    def send_and_receive_raw(self, target, lun, netfn, raw_bytes):
+        if self.host == 'timeout':
+            raise socket.timeout('timed out')
+        return bytes(bytearray([0, target.ipmb_address, netfn])) + raw_bytes
+
+
+class FakeSessionPool(SessionPool):
+    def __init__(self, **kwargs):
+        kwargs.setdefault('reap_interval', 0)
+        SessionPool.__init__(self, **kwargs)
+        self.created = []
+
+    def _create(self, host, port, username, password, privilege_level):
+        ipmi = pyipmi.create_connection(FakeInterface(host))
+        ipmi.session.set_session_type_rmcp(host, port)
+        ipmi.session.set_auth_type_user(username, password)
+        ipmi.session.privilege_level = privilege_level
+        ipmi.session.establish()
+        ipmi.session.activated = True
+        self.created.append(ipmi)
+        return ipmi
+
+
+def test_reuse():
+    pool = FakeSessionPool()
+    with pool.session('bmc', 'admin', 'secret') as ipmi:
+        first = ipmi
+    with pool.session('bmc', 'admin', 'secret') as ipmi:
+        ok_(ipmi is first)
+    with pool.session('bmc', 'admin', 'other') as ipmi:
+        ok_(ipmi is not first)
+    with pool.session('bmc', 'admin', 'secret', privilege_level=2) as ipmi:
+        ok_(ipmi is not first)
+    eq_(len(pool.created), 3)
+
+
+def test_concurrent_acquire_limited():
+    pool = FakeSessionPool(max_sessions=2)
+    a = pool.acquire('bmc')
+    b = pool.acquire('bmc')
+    ok_(a is not b)
+
+    acquired = []
+    thread = threading.Thread(target=lambda: acquired.append(
+        pool.acquire('bmc')))
+    thread.start()
+    time.sleep(0.05)
+    eq_(acquired, [])
+    pool.release(a)
+    thread.join(1)
+    eq_(acquired, [a])
+    eq_(len(pool), 2)
+
+
+def test_validate_stale_session():
+    pool = FakeSessionPool(validate_after=0)
+    ipmi = pool.acquire('bmc')
+    pool.release(ipmi)
+    ipmi.interface.fail = True
+    other = pool.acquire('bmc')
+    ok_(other is not ipmi)
+    ok_(ipmi.interface.closed)
+    eq_(len(pool), 1)
+
+
+def test_validate_talks_to_bmc():
+    pool = FakeSessionPool(validate_after=0)
+    ipmi = pool.acquire('bmc', target=0x72, routing=[(0x81, 0x20, 0),
+                                                     (0x20, 0x72, None)])
+    pool.release(ipmi)
+    other = pool.acquire('bmc')
+    ok_(other is ipmi)
+    eq_(ipmi.interface.targets[-1].ipmb_address, 0x20)
+    eq_(ipmi.interface.targets[-1].routing, None)
+
+
+def test_discard_on_timeout():
+    pool = FakeSessionPool()
+    try:
+        with pool.session('timeout') as ipmi:
+            ipmi.get_device_id()
+    except socket.timeout:
+        pass
+    ok_(ipmi.interface.closed)
+    eq_(len(pool), 0)
+
+
+def test_evict_idle_and_close():
+    pool = FakeSessionPool(max_idle_time=0.1)
+    pool.release(pool.acquire('a'))
+    time.sleep(0.2)
+    pool.release(pool.acquire('b'))
+    pool.evict_idle()
+    (a, b) = pool.created
+    ok_(a.interface.closed)
+    ok_(not b.interface.closed)
+    pool.close()
+    ok_(b.interface.closed)
+    eq_(len(pool), 0)
+
+
+@raises(IpmiTimeoutError)
+def test_pool_interface_timeout():
+    directory = tempfile.mkdtemp()
+    path = os.path.join(directory, 'pool.sock')
+    pool = FakeSessionPool()
+    server = PoolServer(pool, path)
+    thread = threading.Thread(target=server.serve_forever)
+    thread.start()
+    try:
+        ipmi = pyipmi.create_connection(Pool(path))
+        ipmi.session.set_session_type_rmcp('timeout')
+        ipmi.session.set_auth_type_user('admin', 'secret')
+        ipmi.session.establish()
+        ipmi.target = pyipmi.Target(0x20)
+        ipmi.get_device_id()
+    finally:
+        ipmi.interface.close()
+        server.shutdown()
+        server.server_close()
+        thread.join()
+        shutil.rmtree(directory)
+
+
+def test_pool_interface():
+    directory = tempfile.mkdtemp()
+    path = os.path.join(directory, 'pool.sock')
+    pool = FakeSessionPool()
+    server = PoolServer(pool, path)
+    thread = threading.Thread(target=server.serve_forever)
+    thread.start()
+    try:
+        for _ in range(2):
+            ipmi = pyipmi.create_connection(Pool(path))
+            ipmi.session.set_session_type_rmcp('bmc')
+            ipmi.session.set_auth_type_user('admin', 'secret')
+            ipmi.session.establish()
+            ipmi.target = pyipmi.Target(0x72, [(0x81, 0x20, 0),
+                                               (0x20, 0x72, None)])
+            eq_(ipmi.raw_command(0, 0x06, b'\x01'), b'\x00\x72\x06\x01')
+            ipmi.session.close()
+            ipmi.interface.close()
+        eq_(len(pool.created), 1)
+    finally:
+        server.shutdown()
+        server.server_close()
+        thread.join()
+        pool.close()
+        shutil.rmtree(directory)
@@ -1,9 +1,12 @@
 #!/usr/bin/env python
 # -*- coding: utf-8 -*-
 
+from mock import MagicMock
 from nose.tools import eq_, ok_, raises
 
+import pyipmi
 from pyipmi.errors import DecodingError
+from pyipmi.msgs import constants, create_response_by_name
 from pyipmi.sdr import (SdrCommon, SdrFullSensorRecord, SdrCompactSensorRecord,
                         SdrEventOnlySensorRecord, SdrFruDeviceLocator,
                         SdrManagementControllerDeviceLocator,
@@ -162,6 +165,30 @@ class TestSdrFullSensorRecord():
         eq_(sdr.convert_sensor_raw_to_value(128), -128)
         eq_(sdr.convert_sensor_raw_to_value(255), -1)
 
+    def test_convert_many(self):
+        sdr = SdrFullSensorRecord()
+        sdr.analog_data_format = sdr.DATA_FMT_UNSIGNED
+        sdr.m = 2
+        sdr.b = 1
+        sdr.k1 = 1
+        sdr.k2 = -1
+        sdr.linearization = 0
+        raws = [0, 1, None, 255]
+        eq_(sdr.convert_many(raws),
+            [sdr.convert_sensor_raw_to_value(raw) for raw in raws])
+        eq_(sdr.convert_many([0, 5]), [1.0, 2.0])
+
+    def test_convert_invalid_value(self):
+        sdr = SdrFullSensorRecord()
+        sdr.analog_data_format = sdr.DATA_FMT_UNSIGNED
+        sdr.m = 1
+        sdr.b = 0
+        sdr.k1 = 0
+        sdr.k2 = 0
+        sdr.linearization = 7
+        eq_(sdr.convert_sensor_raw_to_value(0), None)
+        eq_(sdr.convert_sensor_raw_to_value(4), 0.25)
+
     def test_decocde(self):
         data = [0x17, 0x00, 0x51, 0x01, 0x35, 0x17, 0x00, 0x51,
                 0x01, 0x35, 0x17, 0x00, 0x51, 0x01, 0x35, 0x32,
@@ -277,3 +304,21 @@ def test_unknown_record_type():
     data = [0x01, 0x0, 0x51, 0x0a, 0x0]
     sdr = SdrCommon.from_data(data, 0xffff)
     ok_(isinstance(sdr, SdrUnknownSensorRecord))
+
+
+def test_get_sdr_chunk_reserves_sdr_repository():
+    canceled = create_response_by_name('GetSdr')
+    canceled.completion_code = constants.CC_RES_CANCELED
+    rsp = create_response_by_name('GetSdr')
+    rsp.next_record_id = 2
+    rsp.record_data = [1, 2, 3]
+
+    ipmi = pyipmi.create_connection(MagicMock())
+    ipmi.send_message = MagicMock(side_effect=[canceled, rsp])
+    ipmi.reserve_sdr_repository = MagicMock(return_value=0x1234)
+    ipmi.reserve_device_sdr_repository = MagicMock()
+
+    eq_(ipmi._get_sdr_chunk(0x11, 1, 0, 3), (2, [1, 2, 3]))
+    eq_(ipmi.reserve_sdr_repository.call_count, 1)
+    ok_(not ipmi.reserve_device_sdr_repository.called)
+    eq_(ipmi.send_message.call_args[0][0].reservation_id, 0x1234)
@@ -1,12 +1,17 @@
 #!/usr/bin/env python
 # -*- coding: utf-8 -*-
 
+import os
+import shutil
+import tempfile
+
 from nose.tools import eq_, ok_
 from mock import MagicMock
 
-from pyipmi import interfaces, create_connection
+from pyipmi import interfaces, create_connection, Target
+from pyipmi.msgs import constants, create_response_message
 from pyipmi.msgs.registry import create_response_by_name, create_request_by_name
-from pyipmi.sel import SelEntry, SelInfo
+from pyipmi.sel import SelEntry, SelInfo, SelCursor
 
 
 class TestSel(object):
@@ -35,6 +40,124 @@ class TestSel(object):
         eq_(len(entries), 2)
 
 
+class FakeSelInterface(object):
+    """Interface with a SEL of record IDs 10, 20, 30, ..."""
+
+    def __init__(self, count):
+        self.record_ids = []
+        self.last_record_id = 0
+        self.most_recent_addition = 0
+        self.most_recent_erase = 0
+        self.requests = []
+        # the longest GetSelEntry read per IPMB address
+        self.max_lengths = {}
+        for _ in range(count):
+            self.add()
+
+    def add(self):
+        self.last_record_id += 10
+        self.record_ids.append(self.last_record_id)
+        self.most_recent_addition += 1
+
+    def clear(self):
+        self.record_ids = []
+        self.most_recent_erase += 1
+
+    def send_and_receive(self, req):
+        self.requests.append(req.cmdid)
+        rsp = create_response_message(req)
+        if req.cmdid == constants.CMDID_GET_SEL_INFO:
+            rsp.entries = len(self.record_ids)
+            rsp.most_recent_addition = self.most_recent_addition
+            rsp.most_recent_erase = self.most_recent_erase
+        elif req.cmdid == constants.CMDID_GET_SEL_ENTRY:
+            if req.record_id == 0:
+                index = 0
+            elif req.record_id in self.record_ids:
+                index = self.record_ids.index(req.record_id)
+            else:
+                rsp.completion_code = constants.CC_REQ_DATA_NOT_PRESENT
+                return rsp
+            if index + 1 < len(self.record_ids):
+                rsp.next_record_id = self.record_ids[index + 1]
+            else:
+                rsp.next_record_id = 0xffff
+            max_length = self.max_lengths.get(req.target.ipmb_address)
+            if max_length is not None and req.length > max_length:
+                rsp.completion_code = constants.CC_CANT_RET_NUM_REQ_BYTES
+                return rsp
+            record_id = self.record_ids[index]
+            data = [record_id & 0xff, record_id >> 8,
+                    SelEntry.TYPE_SYSTEM_EVENT] + [0] * 13
+            if req.length != 0xff:
+                data = data[req.offset:req.offset + req.length]
+            rsp.record_data = data
+        return rsp
+
+
+class TestSelTail(object):
+    def setup(self):
+        self.interface = FakeSelInterface(3)
+        self.ipmi = create_connection(self.interface)
+        self.ipmi.target = Target(0x20)
+
+    def tail(self, cursor):
+        self.interface.requests = []
+        return [e.record_id for e in self.ipmi.tail_sel_entries(cursor)]
+
+    def test_tail(self):
+        cursor = SelCursor()
+        eq_(self.tail(cursor), [10, 20, 30])
+        eq_(cursor.record_id, 30)
+
+        eq_(self.tail(cursor), [])
+        eq_(self.interface.requests, [constants.CMDID_GET_SEL_INFO])
+
+        self.interface.add()
+        self.interface.add()
+        eq_(self.tail(cursor), [40, 50])
+        eq_(self.interface.requests.count(constants.CMDID_GET_SEL_ENTRY), 3)
+
+    def test_tail_after_clear(self):
+        cursor = SelCursor()
+        self.tail(cursor)
+        self.interface.clear()
+        eq_(self.tail(cursor), [])
+        self.interface.add()
+        eq_(self.tail(cursor), [40])
+
+    def test_tail_last_entry_deleted(self):
+        cursor = SelCursor()
+        self.tail(cursor)
+        self.interface.record_ids.remove(30)
+        self.interface.add()
+        eq_(self.tail(cursor), [10, 20, 40])
+
+    def test_read_length_per_target(self):
+        self.interface.max_lengths[0x72] = 8
+        self.ipmi.target = Target(0x72)
+        eq_([e.record_id for e in self.ipmi.get_sel_entries()], [10, 20, 30])
+        eq_(self.ipmi.max_req_len, {str(Target(0x72)): 8})
+
+        self.ipmi.target = Target(0x20)
+        eq_([e.record_id for e in self.ipmi.get_sel_entries()], [10, 20, 30])
+        eq_(self.ipmi.max_req_len, {str(Target(0x72)): 8})
+
+    def test_cursor_persistence(self):
+        directory = tempfile.mkdtemp()
+        try:
+            path = os.path.join(directory, 'cursor.json')
+            eq_(SelCursor.load(path).record_id, None)
+            cursor = SelCursor()
+            self.tail(cursor)
+            cursor.save(path)
+
+            self.interface.add()
+            eq_(self.tail(SelCursor.load(path)), [40])
+        finally:
+            shutil.rmtree(directory)
+
+
 class TestSelInfo(object):
     rsp = create_response_by_name('GetSelInfo')
     rsp.version = 1
@@ -0,0 +1,126 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+from collections import OrderedDict
+
+from nose.tools import eq_, ok_
+
+from pyipmi import emulation
+from pyipmi.msgs import constants, create_request_by_name
+from pyipmi.sdr import SdrCommon
+from pyipmi.sel import SelEntry
+from pyipmi.sensorsim import Constant, Ramp, SensorEngine
+
+
+def full_sensor_record(record_id, number, unc, ucr, hysteresis=0):
+    data = bytearray(48)
+    data[0:5] = (record_id & 0xff, record_id >> 8, 0x51, 0x01, 43)
+    data[5] = 0x20                  # owner id
+    data[7] = number
+    data[11] = 0x48                 # thresholds readable
+    data[12] = 0x01                 # temperature
+    data[13] = 0x01                 # threshold based
+    data[14] = 0x80                 # assert unc going high
+    data[15] = 0x02                 # assert ucr going high
+    data[16] = 0x80                 # deassert unc going high
+    data[18] = 0x18                 # unc and ucr readable
+    data[24] = 1                    # M
+    data[34] = 0xff                 # sensor maximum reading
+    data[37] = ucr
+    data[38] = unc
+    data[42] = hysteresis
+    data[43] = hysteresis
+    return SdrCommon.from_data(bytes(data))
+
+
+class FakeClock(object):
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+def create_engine(**kwargs):
+    sdrs = OrderedDict()
+    sdrs[1] = full_sensor_record(1, 4, unc=100, ucr=110, hysteresis=2)
+    sdrs[2] = full_sensor_record(2, 5, unc=100, ucr=110)
+    clock = FakeClock()
+    engine = SensorEngine(sdrs, clock=clock, **kwargs)
+    return (engine, clock)
+
+
+def test_threshold_crossing_events():
+    (engine, clock) = create_engine(
+        waveforms={4: Ramp(90, 112, 100.0), 5: Constant(50)})
+
+    eq_(engine.reading(4), (90, 0))
+    clock.now = 25.0
+    eq_(engine.reading(4), (101, 0x08))
+    clock.now = 50.0
+    eq_(engine.reading(4), (112, 0x18))
+    clock.now = 75.0
+    eq_(engine.reading(4), (101, 0x08))
+    clock.now = 80.0
+    # within the hysteresis of unc
+    eq_(engine.reading(4), (99, 0x08))
+    clock.now = 90.0
+    engine.update()
+    eq_(engine.reading(5), (50, 0))
+
+    entries = [SelEntry(data) for data in engine.sel_list.values()]
+    eq_([(e.sensor_number, e.event_direction, e.event_data[0] & 0xf)
+         for e in entries], [(4, 0, 7), (4, 0, 9), (4, 1, 7)])
+    eq_([e.record_id for e in entries], [1, 2, 3])
+    eq_(entries[0].event_data[1:], [101, 100])
+    eq_(entries[0].generator_id, 0x20)
+    eq_(engine.thresholds(4), {'unc': 100, 'ucr': 110})
+
+
+def test_default_waveform_crosses_threshold():
+    (engine, clock) = create_engine(period=(10, 10), noise=0, seed=1)
+    readings = set()
+    for step in range(11):
+        clock.now = step
+        readings.add(engine.reading(5)[0])
+    ok_(min(readings) < 100 <= max(readings) < 110)
+    ok_(len(engine.sel_list) >= 1)
+
+
+def test_sel_is_limited():
+    (engine, clock) = create_engine(
+        waveforms={4: Ramp(90, 112, 2.0), 5: Constant(50)},
+        max_sel_entries=4)
+    for step in range(20):
+        clock.now = step * 0.5
+        engine.update()
+    eq_(len(engine.sel_list), 4)
+    eq_(list(engine.sel_list), sorted(engine.sel_list))
+
+
+def test_emulator_handlers():
+    (engine, clock) = create_engine(
+        waveforms={4: Ramp(90, 112, 100.0), 5: Constant(50)})
+    context = emulation.ConnectionContext(None, None, None)
+    context.sensors = engine
+    context.sel_list = engine.sel_list
+
+    def request(name, **fields):
+        req = create_request_by_name(name)
+        for (field, value) in fields.items():
+            setattr(req, field, value)
+        return emulation.handle_ipmi_request_msg(context, req)
+
+    clock.now = 50.0
+    rsp = request('GetSensorReading', sensor_number=4)
+    eq_((rsp.sensor_reading, rsp.states1), (112, 0x18))
+    rsp = request('GetSensorReading', sensor_number=6)
+    eq_(rsp.completion_code, constants.CC_REQ_DATA_NOT_PRESENT)
+
+    rsp = request('GetSensorThresholds', sensor_number=4)
+    eq_((rsp.readable_mask.unc, rsp.readable_mask.lnc), (1, 0))
+    eq_((rsp.threshold.unc, rsp.threshold.ucr), (100, 110))
+
+    rsp = request('GetSelInfo')
+    eq_(rsp.entries, 2)
+    ok_(rsp.most_recent_addition > 0)
@@ -0,0 +1,122 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import asyncio
+import os
+import threading
+
+from mock import patch
+
+from nose.tools import eq_, ok_
+
+from pyipmi.errors import CompletionCodeError
+from pyipmi.fleet import Fleet
+from pyipmi.msgs import constants
+from pyipmi import simulator as simulator_module
+from pyipmi.simulator import (BmcTemplate, Faults, FleetSimulator,
+                              create_simulator)
+
+FRU_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                        'fru_bin/kontron_am4010.bin')
+
+
+class SimulatorThread(object):
+    """Run the simulator in an event loop of its own thread."""
+
+    def __init__(self, simulator):
+        self.simulator = simulator
+        self.loop = asyncio.new_event_loop()
+        self.started = threading.Event()
+        self.thread = threading.Thread(target=self._run)
+        self.thread.daemon = True
+        self.thread.start()
+        self.started.wait(5)
+
+    def _run(self):
+        asyncio.set_event_loop(self.loop)
+        self.loop.run_until_complete(self.simulator.start())
+        self.started.set()
+        self.loop.run_forever()
+
+    def stop(self):
+        async def stop():
+            self.simulator.stop()
+            # let the worker tasks handle their cancellation
+            await asyncio.sleep(0.01)
+        asyncio.run_coroutine_threadsafe(stop(), self.loop).result(5)
+        self.loop.call_soon_threadsafe(self.loop.stop)
+        self.thread.join(5)
+
+
+def test_fleet_of_virtual_bmcs():
+    def customize(index, data):
+        data.fru_data[1] = bytes(bytearray([index] * 8))
+
+    simulator = FleetSimulator()
+    simulator.add_bmcs(3, BmcTemplate(fru={0: FRU_FILE},
+                                      customize=customize), port=0)
+    runner = SimulatorThread(simulator)
+    try:
+        eq_(len(set(bmc.port for bmc in simulator.bmcs)), 3)
+        fleet = Fleet(simulator.endpoints(), max_workers=3)
+        results = list(fleet.map(lambda ipmi: (
+            ipmi.get_fru_inventory(0).board_info_area.product_name.value,
+            ipmi.read_fru_data(fru_id=1))))
+        ok_(all(result.ok for result in results))
+        eq_(sorted(result.value for result in results),
+            [('AM4010', bytes(bytearray([index] * 8))) for index in range(3)])
+        eq_(simulator.statistics()['errors'], 0)
+    finally:
+        runner.stop()
+
+
+def test_completion_code_faults():
+    simulator = FleetSimulator()
+    simulator.add_bmcs(1, port=0, faults=Faults(
+        completion_codes={'GetDeviceId': (constants.CC_NODE_BUSY, 1.0)}))
+    runner = SimulatorThread(simulator)
+    try:
+        (result,) = list(Fleet(simulator.endpoints()).map(
+            lambda ipmi: ipmi.get_device_id()))
+        ok_(isinstance(result.error, CompletionCodeError))
+        eq_(result.error.cc, constants.CC_NODE_BUSY)
+    finally:
+        runner.stop()
+
+
+def test_create_simulator():
+    config = {
+        'templates': {'blade': {'fru': {0: 'fru_bin/kontron_am4010.bin'}}},
+        'groups': [
+            {'template': 'blade', 'count': 2, 'port': 10000},
+            {'count': 2, 'host': '127.0.1.1', 'port': 623, 'alias': True,
+             'loss': 0.5},
+        ],
+    }
+    tests_dir = os.path.dirname(os.path.dirname(FRU_FILE))
+    simulator = create_simulator(config, tests_dir)
+    eq_([str(bmc) for bmc in simulator.bmcs],
+        ['127.0.0.1:10000', '127.0.0.1:10001', '127.0.1.1:623',
+         '127.0.1.2:623'])
+    ok_(simulator.bmcs[0].data is simulator.bmcs[1].data)
+    eq_(simulator.bmcs[0].faults, None)
+    eq_(simulator.bmcs[2].faults.loss, 0.5)
+
+
+def test_open_files_limit_is_raised():
+    with patch.object(simulator_module, 'resource') as resource:
+        resource.RLIM_INFINITY = -1
+        resource.getrlimit.return_value = (1024, 4096)
+        simulator_module._raise_open_files_limit(2000)
+        resource.setrlimit.assert_called_once_with(
+            resource.RLIMIT_NOFILE, (2000 + simulator_module.RESERVED_FILES,
+                                     4096))
+
+        resource.setrlimit.reset_mock()
+        simulator_module._raise_open_files_limit(10000)
+        resource.setrlimit.assert_called_once_with(
+            resource.RLIMIT_NOFILE, (4096, 4096))
+
+        resource.setrlimit.reset_mock()
+        simulator_module._raise_open_files_limit(10)
+        ok_(not resource.setrlimit.called)
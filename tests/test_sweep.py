@@ -0,0 +1,91 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+from nose.tools import eq_
+
+import pyipmi
+from pyipmi import Target
+from pyipmi.msgs import constants, create_response_message
+from pyipmi.sdr import SdrCommon
+from pyipmi.sweep import SensorSweeper
+
+
+def full_sensor_record(number, owner_id=0x20, owner_lun=0):
+    # M=2, B=0, K1=0, K2=0, unsigned, linear
+    return SdrCommon.from_data(bytearray(
+        [0x01, 0x00, 0x51, 0x01, 0x33, owner_id, owner_lun, number]
+        + [0] * 12 + [0x00, 0x00, 0x00, 0x00, 0x02, 0x00, 0x00, 0x00,
+                      0x00, 0x00, 0x00] + [0] * 16 + [0xc2, 0x41, 0x42]))
+
+
+def compact_sensor_record(number, share_count):
+    return SdrCommon.from_data(bytearray(
+        [0x02, 0x00, 0x51, 0x02, 0x1c, 0x20, 0x00, number]
+        + [0] * 15 + [share_count, 0x00] + [0] * 6 + [0xc1, 0x43]))
+
+
+class FakeInterface(object):
+    def __init__(self):
+        self.targets = []
+
+    def send_and_receive(self, req):
+        self.targets.append(req.target)
+        rsp = create_response_message(req)
+        if req.sensor_number == 9:
+            rsp.completion_code = constants.CC_ILL_SENSOR_OR_RECORD
+            return rsp
+        rsp.sensor_reading = req.sensor_number + 10
+        rsp.states1 = 0x01
+        return rsp
+
+
+class FakePipeliningInterface(FakeInterface):
+    def __init__(self):
+        FakeInterface.__init__(self)
+        self.batches = []
+
+    def send_and_receive_many(self, reqs):
+        self.batches.append(len(reqs))
+        return [self.send_and_receive(req) for req in reqs]
+
+
+def create_ipmi(interface):
+    ipmi = pyipmi.create_connection(interface)
+    ipmi.target = Target(0x20)
+    return ipmi
+
+
+def test_sweep():
+    interface = FakePipeliningInterface()
+    sdrs = [full_sensor_record(1), compact_sensor_record(4, 2),
+            full_sensor_record(9)]
+    sweeper = SensorSweeper(create_ipmi(interface), sdrs)
+    eq_(len(sweeper), 4)
+
+    result = sweeper.sweep()
+    eq_(interface.batches, [4])
+    eq_(result.numbers, [1, 4, 5, 9])
+    eq_(result.raw, [11, 14, 15, None])
+    eq_(result.values, [22.0, None, None, None])
+    eq_(result.states, [1, 1, 1, None])
+    eq_(result.completion_codes[-1], constants.CC_ILL_SENSOR_OR_RECORD)
+    eq_(list(result)[0], (1, 11, 22.0, 1))
+
+
+def test_sweep_without_pipelining():
+    interface = FakeInterface()
+    sweeper = SensorSweeper(create_ipmi(interface), [full_sensor_record(2)])
+    eq_(sweeper.sweep().values, [24.0])
+
+
+def test_sweep_bridged_owner():
+    interface = FakeInterface()
+    sdrs = [full_sensor_record(1), full_sensor_record(2, 0x82, 0x70)]
+    sweeper = SensorSweeper(create_ipmi(interface), sdrs)
+    sweeper.sweep()
+
+    (local, bridged) = interface.targets
+    eq_(local.ipmb_address, 0x20)
+    eq_(bridged.ipmb_address, 0x82)
+    eq_([(r.rq_sa, r.rs_sa, r.channel) for r in bridged.routing],
+        [(0x81, 0x20, 7), (0x20, 0x82, None)])
@@ -0,0 +1,150 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import os
+import shutil
+import tempfile
+import threading
+import time
+
+from mock import MagicMock
+from nose.tools import eq_, ok_
+
+from pyipmi import Target
+from pyipmi.errors import HpmError
+from pyipmi.upgrade import (UpgradeOrchestrator, target_bus, STAGE_DONE,
+                            STAGE_FAILED, STAGE_UPLOAD, STAGE_ACTIVATE)
+
+HPM_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                        'hpm_bin/firmware.hpm')
+
+
+def blade(address, channel=0):
+    return Target(address, [(0x81, 0x20, channel), (0x20, address, None)])
+
+
+class FakeHpm(object):
+    def __init__(self, orchestrator, target):
+        self.orchestrator = orchestrator
+        self.target = target
+
+    def abort_firmware_upgrade(self):
+        pass
+
+    def preparation_stage(self, image):
+        pass
+
+    def upgrade_stage(self, image, component, progress=None):
+        bus = target_bus(self.target)
+        o = self.orchestrator
+        with o.lock:
+            o.uploads[bus] = o.uploads.get(bus, 0) + 1
+            o.max_uploads[bus] = max(o.max_uploads.get(bus, 0),
+                                     o.uploads[bus])
+        time.sleep(0.02)
+        progress(50, 100)
+        progress(100, 100)
+        with o.lock:
+            o.uploads[bus] -= 1
+        if self.target.ipmb_address in o.fail_upload:
+            raise HpmError('upload failed')
+
+    def activation_stage(self, image, component):
+        self.orchestrator.activated.append(self.target.ipmb_address)
+
+
+class FakeOrchestrator(UpgradeOrchestrator):
+    def __init__(self, *args, **kwargs):
+        UpgradeOrchestrator.__init__(self, None, *args, **kwargs)
+        self.lock = threading.Lock()
+        self.uploads = {}
+        self.max_uploads = {}
+        self.activated = []
+        self.fail_upload = ()
+
+    def _connection(self, target):
+        return FakeHpm(self, target)
+
+
+def test_per_bus_limit():
+    targets = [blade(0x82 + 2 * n, n % 2) for n in range(8)]
+    progress = []
+    orchestrator = FakeOrchestrator(HPM_FILE, 1, max_workers=8, per_bus=2,
+                                    progress=lambda job: progress.append(
+                                        (job.key, job.stage, job.uploaded)))
+    jobs = orchestrator.run(targets)
+
+    ok_(all(job.ok for job in jobs))
+    eq_([job.target for job in jobs], targets)
+    eq_(sorted(orchestrator.max_uploads.values()), [2, 2])
+    ok_((jobs[0].key, STAGE_UPLOAD, 100) in progress)
+
+
+def test_no_limit_without_bus():
+    targets = [Target(0x82 + 2 * n) for n in range(4)]
+    orchestrator = FakeOrchestrator(HPM_FILE, 1, max_workers=4, per_bus=1)
+    jobs = orchestrator.run(targets)
+
+    ok_(all(job.ok for job in jobs))
+    ok_(orchestrator.max_uploads[None] > 1)
+
+
+def test_connect_per_target():
+    sessions = {}
+
+    def connect(target):
+        ipmi = MagicMock()
+        sessions[target.ipmb_address] = ipmi.session
+        return ipmi
+
+    orchestrator = UpgradeOrchestrator(None, HPM_FILE, 1, connect=connect)
+    jobs = orchestrator.run([blade(0x82), blade(0x84)])
+
+    ok_(all(job.ok for job in jobs))
+    eq_(sorted(sessions), [0x82, 0x84])
+    for session in sessions.values():
+        eq_(session.close.call_count, 1)
+
+
+def test_resume():
+    directory = tempfile.mkdtemp()
+    try:
+        state_file = os.path.join(directory, 'state.json')
+        targets = [blade(0x82), blade(0x84)]
+
+        orchestrator = FakeOrchestrator(HPM_FILE, 1, state_file=state_file)
+        orchestrator.fail_upload = (0x84,)
+        (ok, failed) = orchestrator.run(targets)
+        eq_(ok.stage, STAGE_DONE)
+        eq_(failed.stage, STAGE_FAILED)
+        eq_(failed.failed_stage, STAGE_UPLOAD)
+        ok_(isinstance(failed.error, HpmError))
+
+        orchestrator = FakeOrchestrator(HPM_FILE, 1, state_file=state_file)
+        jobs = orchestrator.run(targets)
+        ok_(all(job.ok for job in jobs))
+        eq_(orchestrator.activated, [0x84])
+        eq_(list(orchestrator.max_uploads.values()), [1])
+    finally:
+        shutil.rmtree(directory)
+
+
+def test_resume_activation():
+    directory = tempfile.mkdtemp()
+    try:
+        state_file = os.path.join(directory, 'state.json')
+        orchestrator = FakeOrchestrator(HPM_FILE, 1, state_file=state_file)
+        orchestrator._state = {'0x82 129:32:0,32:130:None': STAGE_ACTIVATE}
+        (job,) = orchestrator.run([blade(0x82)])
+        ok_(job.ok)
+        eq_(orchestrator.uploads, {})
+        eq_(orchestrator.activated, [0x82])
+    finally:
+        shutil.rmtree(directory)
+
+
+def test_component_not_in_image():
+    orchestrator = FakeOrchestrator(HPM_FILE, 5)
+    (job,) = orchestrator.run([blade(0x82)])
+    eq_(job.stage, STAGE_FAILED)
+    ok_(isinstance(job.error, HpmError))
@@ -4,7 +4,7 @@
 from array import array
 from nose.tools import eq_, raises
 
-from pyipmi.utils import ByteBuffer, chunks
+from pyipmi.utils import ByteBuffer, ByteReader, ByteWriter, chunks
 from pyipmi.errors import DecodingError
 
 
@@ -110,6 +110,72 @@ def test_bytebuffer_pop_slice_error():
     buf.pop_slice(5)
 
 
+def test_bytereader_pop_unsigned_int():
+    buf = ByteReader(b'\x01\x00\x01\x00\x00\x01')
+    eq_(buf.pop_unsigned_int(1), 1)
+    eq_(buf.pop_unsigned_int(2), 0x100)
+    eq_(buf.pop_unsigned_int(3), 0x10000)
+    eq_(len(buf), 0)
+
+
+@raises(DecodingError)
+def test_bytereader_pop_unsigned_int_error():
+    buf = ByteReader((0, 0))
+    buf.pop_unsigned_int(3)
+
+
+def test_bytereader_offset():
+    buf = ByteReader(b'\x30\x31\x32\x33', 1)
+    eq_(len(buf), 3)
+    eq_(buf[0], 0x31)
+    eq_(buf.pop_string(2), b'12')
+    eq_(buf.tobytes(), b'3')
+
+
+def test_bytereader_pop_slice():
+    data = bytearray(b'\x30\x31\x32\x33')
+    buf = ByteReader(data)
+    cut = buf.pop_slice(2)
+    eq_(buf.tobytes(), b'23')
+    eq_(cut.tobytes(), b'01')
+    # slices share the memory of the buffer
+    data[0] = 0x39
+    eq_(cut.tobytes(), b'91')
+
+
+@raises(DecodingError)
+def test_bytereader_pop_slice_error():
+    buf = ByteReader(b'\x30\x31\x32\x33')
+    buf.pop_slice(5)
+
+
+def test_bytewriter():
+    buf = ByteWriter(2)
+    buf.push_unsigned_int(0x0201, 2)
+    buf.push_unsigned_int(0x03, 1)
+    buf.push_string(b'\x04\x05')
+    buf.extend([6, 7])
+    eq_(len(buf), 7)
+    eq_(buf[2], 3)
+    eq_(buf.tobytes(), b'\x01\x02\x03\x04\x05\x06\x07')
+
+
+def test_bytewriter_getitem():
+    buf = ByteWriter(8)
+    buf.extend([1, 2, 3])
+    eq_(buf[-1], 3)
+    eq_(buf[1:], bytearray([2, 3]))
+    eq_(buf[::-1], bytearray([3, 2, 1]))
+    eq_(buf[:10], bytearray([1, 2, 3]))
+
+
+@raises(IndexError)
+def test_bytewriter_getitem_beyond_length():
+    buf = ByteWriter(8)
+    buf.extend([1, 2, 3])
+    buf[3]
+
+
 def test_chunks():
     data = [0, 1, 2, 3, 4, 5, 6, 7, 8, 9]
     result = list()